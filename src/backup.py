@@ -0,0 +1,192 @@
+# src/backup.py
+# Respaldos en caliente de la base del bot con la API de backup en línea de SQLite
+# (sqlite3.Connection.backup): se copian BACKUP_PAGES_PER_STEP páginas por paso y entre pasos se suelta
+# el lock de lectura durante BACKUP_STEP_SLEEP_SECONDS, así los escritores nunca esperan más que un
+# paso. Si otro proceso escribe durante la copia, SQLite la reinicia sola y la instantánea final es
+# siempre consistente (nunca una copia "a medias" como al copiar el archivo). Cada instantánea se
+# escribe primero como .partial, se verifica con PRAGMA integrity_check y recién entonces toma su
+# nombre definitivo; se conservan las BACKUP_KEEP más recientes. El job lo agenda bot.py:
+#   python -m src.backup --dest-dir backups --keep 7
+#   python -m src.backup --verify backups/bot_lotto_data-20261019-120000.db
+
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+# --- Constantes de respaldo ---
+BACKUP_DIR = 'backups'
+BACKUP_KEEP = 7
+BACKUP_PAGES_PER_STEP = 256 # 1 MiB con páginas de 4 KiB
+BACKUP_STEP_SLEEP_SECONDS = 0.005
+BACKUP_INTERVAL_SECONDS = 6 * 3600
+# Cada escritura de otra conexión reinicia la copia; con escrituras continuas podría no terminar nunca.
+# Pasados estos reinicios se copia todo en un solo paso (bloquea a los escritores lo que dure la copia).
+BACKUP_MAX_RESTARTS = 20
+_TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S'
+
+_backup_stats = {'runs': 0, 'failures': 0, 'last': None, 'last_error': None}
+_backup_lock = threading.Lock() # Un respaldo a la vez por proceso
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _snapshot_pattern(stem: str) -> re.Pattern:
+    return re.compile(rf"^{re.escape(stem)}-(\d{{8}}-\d{{6}})(?:-(\d+))?\.db$")
+
+def list_backups(dest_dir: str = BACKUP_DIR, source: str = db.DATABASE_NAME) -> list[str]:
+    """Instantáneas de `source` en `dest_dir`, de la más antigua a la más nueva."""
+    stem = os.path.splitext(os.path.basename(source))[0]
+    if not os.path.isdir(dest_dir):
+        return []
+    pattern = _snapshot_pattern(stem)
+    matches = (pattern.match(name) for name in os.listdir(dest_dir))
+    # Por fecha y sufijo numérico: "-1.db" ordenaría antes que ".db" como texto
+    ordered = sorted((m.group(1), int(m.group(2) or 0), m.group(0)) for m in matches if m)
+    return [os.path.join(dest_dir, name) for _, _, name in ordered]
+
+def rotate_backups(dest_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP, source: str = db.DATABASE_NAME) -> list[str]:
+    """Borra las instantáneas más antiguas hasta dejar `keep`. Retorna las rutas borradas."""
+    removed = []
+    for path in list_backups(dest_dir, source)[:-keep] if keep > 0 else []:
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError as e:
+            logger.error(f"BACKUP: No se pudo borrar la instantánea vieja {path}: {e}")
+    return removed
+
+def verify_backup(path: str) -> str:
+    """PRAGMA integrity_check de una instantánea: 'ok' o la primera falla que reporta SQLite."""
+    conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+def backup_database(dest_dir: str = BACKUP_DIR, source: str = db.DATABASE_NAME, keep: int = BACKUP_KEEP,
+                    pages_per_step: int = BACKUP_PAGES_PER_STEP, step_sleep: float = BACKUP_STEP_SLEEP_SECONDS) -> dict:
+    """
+    Copia `source` a una instantánea nueva en `dest_dir`, la verifica y rota las viejas.
+    Retorna {'path', 'ok', 'integrity', 'pages', 'bytes', 'steps', 'restarts', 'single_step_fallback',
+    'duration_seconds', 'throughput_mb_s', 'max_step_seconds', 'verify_seconds', 'rotated'}. Si la verificación falla,
+    la instantánea se descarta ('path' None, 'ok' False) y las anteriores se conservan.
+    """
+    with _backup_lock:
+        os.makedirs(dest_dir, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(source))[0]
+        base = os.path.join(dest_dir, f"{stem}-{datetime.now(timezone.utc).strftime(_TIMESTAMP_FORMAT)}")
+        path, suffix = f"{base}.db", 1
+        while os.path.exists(path): # Dos respaldos en el mismo segundo
+            path, suffix = f"{base}-{suffix}.db", suffix + 1
+        partial = path + '.partial'
+        progress = {'steps': 0, 'restarts': 0, 'remaining': None, 'max_step_seconds': 0.0, 'last': None}
+
+        def on_progress(status, remaining, total):
+            now = time.perf_counter()
+            if progress['last'] is not None: # Lo que duró el paso (sin la pausa): el lock de lectura tomado
+                progress['max_step_seconds'] = max(progress['max_step_seconds'], now - progress['last'] - step_sleep)
+            if progress['remaining'] is not None and remaining > progress['remaining']:
+                progress['restarts'] += 1 # Otra conexión escribió: SQLite reinició la copia
+                if progress['restarts'] > BACKUP_MAX_RESTARTS:
+                    raise _TooManyRestarts()
+            progress.update(steps=progress['steps'] + 1, remaining=remaining, last=now)
+
+        started = time.perf_counter()
+        source_conn = db.get_db_connection(source)
+        target_conn = sqlite3.connect(partial)
+        single_step_fallback = False
+        try:
+            try:
+                source_conn.backup(target_conn, pages=pages_per_step, progress=on_progress, sleep=step_sleep)
+            except _TooManyRestarts:
+                logger.warning(f"BACKUP: {BACKUP_MAX_RESTARTS} reinicios por escrituras concurrentes; copiando en un solo paso.")
+                single_step_fallback = True
+                step_started = time.perf_counter()
+                source_conn.backup(target_conn, pages=-1)
+                progress['max_step_seconds'] = max(progress['max_step_seconds'], time.perf_counter() - step_started)
+            page_count = target_conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = target_conn.execute("PRAGMA page_size").fetchone()[0]
+        except sqlite3.Error:
+            target_conn.close()
+            os.remove(partial)
+            raise
+        finally:
+            source_conn.close()
+        target_conn.close()
+        duration = time.perf_counter() - started
+
+        verify_started = time.perf_counter()
+        integrity = verify_backup(partial)
+        verify_seconds = time.perf_counter() - verify_started
+        ok = integrity == 'ok'
+        if ok:
+            os.replace(partial, path)
+            rotated = rotate_backups(dest_dir, keep, source)
+        else:
+            os.remove(partial)
+            path, rotated = None, []
+        size = page_count * page_size
+        return {'path': path, 'ok': ok, 'integrity': integrity, 'pages': page_count, 'bytes': size,
+                'steps': progress['steps'], 'restarts': progress['restarts'], 'single_step_fallback': single_step_fallback,
+                'duration_seconds': duration,
+                'throughput_mb_s': size / 1024 / 1024 / duration if duration > 0 else None,
+                'max_step_seconds': progress['max_step_seconds'], 'verify_seconds': verify_seconds, 'rotated': rotated}
+
+
+def run_scheduled_backup(dest_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP, **kwargs) -> dict | None:
+    """Respaldo del job: registra el resultado en get_backup_stats() y nunca lanza."""
+    try:
+        result = backup_database(dest_dir, keep=keep, **kwargs)
+    except Exception as e:
+        with _backup_lock:
+            _backup_stats['runs'] += 1
+            _backup_stats['failures'] += 1
+            _backup_stats['last_error'] = str(e)
+        logger.error(f"BACKUP: Falló el respaldo de la base de datos: {e}", exc_info=True)
+        return None
+    with _backup_lock:
+        _backup_stats['runs'] += 1
+        _backup_stats['last'] = result
+        if not result['ok']:
+            _backup_stats['failures'] += 1
+            _backup_stats['last_error'] = f"integrity_check: {result['integrity']}"
+    if result['ok']:
+        logger.info(f"BACKUP: Instantánea {result['path']} ({result['bytes'] / 1024 / 1024:.1f} MiB) en "
+                    f"{result['duration_seconds']:.2f}s ({result['throughput_mb_s']:.1f} MiB/s, {result['steps']} pasos, "
+                    f"{result['restarts']} reinicios); {len(result['rotated'])} instantánea(s) vieja(s) borrada(s).")
+    else:
+        logger.error(f"BACKUP: La instantánea no pasó integrity_check ({result['integrity']}). Se descartó.")
+    return result
+
+def get_backup_stats() -> dict:
+    """Respaldos hechos por este proceso, fallos y el resultado del último."""
+    with _backup_lock:
+        return dict(_backup_stats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Respaldo en caliente de la base de datos del bot.")
+    parser.add_argument('--source', default=db.DATABASE_NAME)
+    parser.add_argument('--dest-dir', default=BACKUP_DIR)
+    parser.add_argument('--keep', type=int, default=BACKUP_KEEP)
+    parser.add_argument('--pages', type=int, default=BACKUP_PAGES_PER_STEP, help="Páginas por paso")
+    parser.add_argument('--sleep', type=float, default=BACKUP_STEP_SLEEP_SECONDS, help="Pausa entre pasos (s)")
+    parser.add_argument('--verify', metavar='PATH', help="Solo verificar una instantánea existente")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    if args.verify:
+        print(json.dumps({'path': args.verify, 'integrity': verify_backup(args.verify)}, indent=2))
+    else:
+        print(json.dumps(backup_database(args.dest_dir, args.source, args.keep, args.pages, args.sleep), indent=2))
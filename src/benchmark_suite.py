@@ -0,0 +1,339 @@
+# src/benchmark_suite.py
+# Suite de benchmarks reproducible (semilla fija, base de datos temporal) de los caminos calientes:
+#   db        CRUD de src.db sobre tablas con tamaños realistas
+#   ton_api   búsqueda de pagos de ton_api.find_transaction sobre páginas sintéticas de transacciones
+#   payouts   simulation_engine.calculate_and_save_simulated_payouts (cálculo y liquidación)
+#   buy_flow  compra completa /comprar_boleto -> wallet -> verificar pago a través del Dispatcher,
+#             contra un Bot API y un toncenter falsos (src/fake_services.py)
+#   logging   latencia de loguear en el hilo del handler: handler síncrono vs. pipeline en cola
+# Emite JSON con los metadatos de la corrida (commit, versiones) para comparar entre commits:
+#   python -m src.benchmark_suite --only db,payouts --scale 0.5 --output bench.json
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from . import db
+from . import leaderboard
+from . import round_manager
+from . import ton_api
+from .draw_engine import draw_winning_numbers
+from .round_manager import ROUND_STATUS_DRAWING, ROUND_STATUS_FINISHED, ROUND_TYPE_SCHEDULED, ROUND_TYPE_USER_CREATED
+
+logger = logging.getLogger(__name__)
+
+# Tamaños de tabla con scale=1.0 (una instancia con algunos meses de uso)
+DB_BENCH_USERS = 20_000
+DB_BENCH_ROUNDS = 3_000
+DB_BENCH_PARTICIPANTS_PER_ROUND = 10
+DB_BENCH_PAYMENTS = 60_000
+DB_BENCH_ITERATIONS = 1_000
+TON_API_PAGE_SIZES = (30, 100, 1_000) # 30 es el límite que usa ton_api.get_address_transactions
+TON_API_ITERATIONS = 2_000
+PAYOUT_BENCH_ROUNDS = 300
+BUY_FLOW_USERS = 100
+
+
+def summarize_latencies(latencies: list[float], elapsed: float | None = None) -> dict:
+    """Resumen de latencias (segundos): llamadas, operaciones por segundo, media y percentiles en ms."""
+    samples = sorted(latencies)
+    if not samples:
+        return {'calls': 0, 'ops_per_second': None, 'mean_ms': None, 'p50_ms': None, 'p95_ms': None,
+                'p99_ms': None, 'max_ms': None}
+    total = elapsed if elapsed is not None else sum(samples)
+
+    def percentile(p):
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 4)
+
+    return {'calls': len(samples), 'ops_per_second': len(samples) / total if total > 0 else None,
+            'mean_ms': round(sum(samples) / len(samples) * 1000, 4), 'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95), 'p99_ms': percentile(0.99), 'max_ms': round(samples[-1] * 1000, 4)}
+
+
+def _time_calls(function, arguments) -> dict:
+    latencies = []
+    for args in arguments:
+        started = time.perf_counter()
+        function(*args)
+        latencies.append(time.perf_counter() - started)
+    return summarize_latencies(latencies)
+
+
+@contextmanager
+def temporary_database():
+    """Base de datos nueva en un directorio temporal (cwd) con las cachés en memoria vacías."""
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            db.init_db()
+            round_manager.invalidate_round_cache()
+            leaderboard.reset_recent_winners()
+            yield tmp_dir
+        finally:
+            round_manager.invalidate_round_cache()
+            leaderboard.reset_recent_winners()
+            db.clear_user_cache()
+            os.chdir(previous_cwd)
+
+
+def _scaled(value: int, scale: float, minimum: int = 1) -> int:
+    return max(minimum, int(value * scale))
+
+
+# --- db: CRUD sobre tablas pobladas ---
+def _seed_database(rng: random.Random, users: int, rounds: int, participants_per_round: int, payments: int) -> dict:
+    """Puebla la base en bloque (executemany): usuarios, rondas terminadas con participantes y ganador, pagos."""
+    base_time = datetime.now(timezone.utc) - timedelta(days=90)
+    user_ids = [str(1_000_000 + n) for n in range(users)]
+    conn = db.get_db_connection()
+    try:
+        conn.executemany("INSERT INTO users (telegram_id, username, first_name, ton_wallet) VALUES (?, ?, ?, ?)",
+                         [(uid, f"user{n}", f"Nombre{n}", f"EQ{n:046d}") for n, uid in enumerate(user_ids)])
+        round_rows, participant_rows, result_rows = [], [], []
+        for n in range(1, rounds + 1):
+            start = (base_time + timedelta(minutes=40 * n)).isoformat()
+            round_rows.append((n, start, start, ROUND_STATUS_FINISHED, ROUND_TYPE_SCHEDULED, 1.0))
+            members = rng.sample(user_ids, min(participants_per_round, users))
+            participant_rows.extend((n, uid, number, 1, start, 1) for number, uid in enumerate(members, start=1))
+            result_rows.append((n, 1, 0, members[0], "8.00 unidades", 8.0, 8_000_000_000))
+        conn.executemany("""INSERT INTO rounds (id, start_time, end_time, status, round_type, ticket_price_simulated)
+                            VALUES (?, ?, ?, ?, ?, ?)""", round_rows)
+        conn.executemany("""INSERT INTO round_participants (round_id, telegram_id, assigned_number, paid_real,
+                            purchase_time, ticket_count) VALUES (?, ?, ?, ?, ?, ?)""", participant_rows)
+        conn.executemany("""INSERT INTO draw_results (round_id, drawn_number, draw_order, winner_telegram_id,
+                            prize_amount_simulated, prize_amount_real, prize_amount_nano) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                         result_rows)
+        payment_hashes = [f"seed{n:060d}" for n in range(payments)]
+        conn.executemany("""INSERT INTO ton_transactions (telegram_id, user_ton_wallet, bot_ton_wallet, transaction_hash,
+                            value_nano, comment, transaction_time, lottery_round_id_assoc) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                         [(uid, f"EQ{int(uid):046d}", 'bot', tx_hash, 1_000_000_000, f"L1U{uid}",
+                           (base_time + timedelta(seconds=130 * n)).isoformat(), rng.randint(1, rounds))
+                          for n, (tx_hash, uid) in enumerate(zip(payment_hashes, (rng.choice(user_ids) for _ in payment_hashes)))])
+        conn.commit()
+    finally:
+        conn.close()
+    db.init_db() # winner_stats se llena desde draw_results (misma migración que una base existente)
+    return {'user_ids': user_ids, 'payment_hashes': payment_hashes}
+
+
+def benchmark_db_crud(scale: float = 1.0, iterations: int | None = None, seed: int = 0) -> dict:
+    """Latencia por llamada de las funciones de src.db usadas por el bot y la webapp."""
+    rng = random.Random(seed)
+    iterations = iterations or _scaled(DB_BENCH_ITERATIONS, scale, 20)
+    sizes = {'users': _scaled(DB_BENCH_USERS, scale, 50), 'rounds': _scaled(DB_BENCH_ROUNDS, scale, 10),
+             'participants_per_round': DB_BENCH_PARTICIPANTS_PER_ROUND, 'payments': _scaled(DB_BENCH_PAYMENTS, scale, 50)}
+    with temporary_database():
+        started = time.perf_counter()
+        seeded = _seed_database(rng, sizes['users'], sizes['rounds'], sizes['participants_per_round'], sizes['payments'])
+        seed_seconds = time.perf_counter() - started
+        user_ids, hashes = seeded['user_ids'], seeded['payment_hashes']
+        some_users = [rng.choice(user_ids) for _ in range(iterations)]
+        some_rounds = [rng.randint(1, sizes['rounds']) for _ in range(iterations)]
+
+        operations = {}
+        operations['get_or_create_user_existing'] = _time_calls(
+            db.get_or_create_user, [(uid, f"user{uid}", "Nombre") for uid in some_users])
+        operations['get_or_create_user_new'] = _time_calls(
+            db.get_or_create_user, [(str(5_000_000 + n), f"new{n}", "Nuevo") for n in range(iterations)])
+        operations['update_user_ton_wallet'] = _time_calls(
+            db.update_user_ton_wallet, [(uid, f"UQ{n:046d}") for n, uid in enumerate(some_users)])
+        operations['get_user_ton_wallet'] = _time_calls(db.get_user_ton_wallet, [(uid,) for uid in some_users])
+        operations['check_transaction_hit'] = _time_calls(
+            db.check_transaction, [(rng.choice(hashes),) for _ in range(iterations)])
+        operations['check_transaction_miss'] = _time_calls(
+            db.check_transaction, [(f"missing{n:057d}",) for n in range(iterations)])
+        operations['add_ton_transaction'] = _time_calls(
+            db.add_ton_transaction, [(uid, f"EQ{n:046d}", 'bot', f"bench{n:059d}", 1_000_000_000, f"C{n}", some_rounds[n])
+                                     for n, uid in enumerate(some_users)])
+        operations['get_user_ton_payments_page'] = _time_calls(db.get_user_ton_payments_page, [(uid,) for uid in some_users])
+        operations['get_round_by_id'] = _time_calls(db.get_round_by_id, [(rid,) for rid in some_rounds])
+        operations['get_round_entry_totals'] = _time_calls(db.get_round_entry_totals, [(rid,) for rid in some_rounds])
+        new_rounds = []
+        operations['create_new_round'] = _time_calls(
+            lambda: new_rounds.append(db.create_new_round(ROUND_TYPE_SCHEDULED, None)), [() for _ in range(max(1, iterations // 10))])
+        operations['add_tickets_to_round'] = _time_calls(
+            db.add_tickets_to_round, [(new_rounds[n % len(new_rounds)], str(5_000_000 + n), 1, iterations)
+                                      for n in range(iterations)])
+        operations['get_open_rounds'] = _time_calls(db.get_open_rounds, [() for _ in range(max(1, iterations // 10))])
+        operations['get_draw_winners_page'] = _time_calls(
+            db.get_draw_winners_page, [(20, rng.randint(1, sizes['rounds']) if n % 2 else None) for n in range(iterations)])
+        operations['get_winner_leaderboard'] = _time_calls(db.get_winner_leaderboard, [(10,) for _ in range(iterations)])
+    return {'sizes': sizes, 'iterations': iterations, 'seed_seconds': seed_seconds, 'operations': operations}
+
+
+# --- ton_api: búsqueda del pago en una página de transacciones ---
+def _synthetic_page(rng: random.Random, size: int) -> list[dict]:
+    from .fake_services import synthetic_transaction, synthetic_wallet
+    return [synthetic_transaction(synthetic_wallet(rng.randrange(10_000)), rng.randint(1, 5) * 1_000_000_000,
+                                  f"L{rng.randrange(1000)}U{rng.randrange(10**6)}T{n}", n)
+            for n in range(size)]
+
+
+def benchmark_find_transaction(scale: float = 1.0, iterations: int | None = None, seed: int = 0) -> dict:
+    """
+    find_transaction sobre páginas de getTransactions ya descargadas (sin red): el pago buscado al final
+    de la página (se registra), ausente (recorre la página entera) y ya verificado (consulta la DB y sigue).
+    """
+    from .fake_services import synthetic_transaction, synthetic_wallet
+
+    rng = random.Random(seed)
+    iterations = iterations or _scaled(TON_API_ITERATIONS, scale, 20)
+    user_wallet = synthetic_wallet(-1)
+    current_page = []
+    real_get_transactions = ton_api.get_address_transactions
+    ton_api.get_address_transactions = lambda address=None, limit=30: current_page
+    results = {}
+    try:
+        with temporary_database():
+            for size in TON_API_PAGE_SIZES:
+                page = _synthetic_page(rng, size - 1)
+                scenarios = {}
+
+                latencies, matched = [], 0
+                for n in range(iterations):
+                    comment = f"L1U42T{size}-{n}"
+                    current_page[:] = [synthetic_transaction(user_wallet, 1_000_000_000, comment, 10**9 + n)] + page
+                    current_page.reverse() # El pago buscado queda al final: peor caso con coincidencia
+                    started = time.perf_counter()
+                    matched += ton_api.find_transaction(user_wallet, '1000000000', comment, telegram_id='42')
+                    latencies.append(time.perf_counter() - started)
+                scenarios['match_last'] = {**summarize_latencies(latencies), 'matched': matched}
+
+                current_page[:] = page
+                latencies = []
+                for _ in range(iterations):
+                    started = time.perf_counter()
+                    ton_api.find_transaction(user_wallet, '1000000000', 'no-existe', telegram_id='42')
+                    latencies.append(time.perf_counter() - started)
+                scenarios['no_match'] = summarize_latencies(latencies)
+
+                # Un pago ya registrado repetido en la página: cada coincidencia cuesta un check_transaction
+                current_page[:] = page + [synthetic_transaction(user_wallet, 1_000_000_000, f"L1U42T{size}-0", 10**9)] * 5
+                latencies = []
+                for _ in range(iterations):
+                    started = time.perf_counter()
+                    ton_api.find_transaction(user_wallet, '1000000000', f"L1U42T{size}-0", telegram_id='42')
+                    latencies.append(time.perf_counter() - started)
+                scenarios['already_verified'] = summarize_latencies(latencies)
+                results[str(size)] = scenarios
+    finally:
+        ton_api.get_address_transactions = real_get_transactions
+    return {'iterations': iterations, 'page_sizes': results}
+
+
+# --- payouts: cálculo y liquidación de rondas ---
+def benchmark_payouts(scale: float = 1.0, rounds: int | None = None, seed: int = 0) -> dict:
+    """calculate_and_save_simulated_payouts sobre rondas llenas en 'drawing' (mitad con creador)."""
+    from .round_state_machine import transition
+    from .simulation_engine import calculate_and_save_simulated_payouts
+
+    rng = random.Random(seed)
+    rounds = rounds or _scaled(PAYOUT_BENCH_ROUNDS, scale, 5)
+    participants_per_round = round_manager.MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW
+    with temporary_database():
+        prepared = []
+        for n in range(rounds):
+            creator = str(2_000_000 + n) if n % 2 else None
+            round_type = ROUND_TYPE_USER_CREATED if creator else ROUND_TYPE_SCHEDULED
+            round_id = db.create_new_round(round_type, creator)
+            for number in range(1, participants_per_round + 1):
+                telegram_id = str(1_000_000 + rng.randrange(10_000 * participants_per_round))
+                db.get_or_create_user(telegram_id, None, None)
+                db.add_participant_to_round(round_id, telegram_id, number)
+            transition(round_id, 'waiting_to_start', ROUND_STATUS_DRAWING)
+            participants = db.get_participants_in_round(round_id)
+            drawn = draw_winning_numbers(len(participants), db.iter_round_assigned_numbers(round_id), rng)
+            prepared.append((round_id, drawn, participants, round_type, creator))
+
+        async def settle_all():
+            latencies, settled = [], 0
+            for round_id, drawn, participants, round_type, creator in prepared:
+                started = time.perf_counter()
+                _, _, ok, _ = await calculate_and_save_simulated_payouts(round_id, drawn, participants, round_type, creator)
+                latencies.append(time.perf_counter() - started)
+                settled += ok
+            return latencies, settled
+
+        latencies, settled = asyncio.run(settle_all())
+    return {'rounds': rounds, 'participants_per_round': participants_per_round, 'settled': settled,
+            'latency': summarize_latencies(latencies)}
+
+
+# --- buy_flow: la compra completa a través del Dispatcher ---
+def benchmark_buy_flow(scale: float = 1.0, users: int | None = None, seed: int = 0) -> dict:
+    """Compras completas secuenciales (un usuario tras otro, pago visible al instante) contra los servidores falsos."""
+    from .load_generator import run_load_test # Para compras concurrentes, python -m src.load_generator
+
+    users = users or _scaled(BUY_FLOW_USERS, scale, 3)
+    return run_load_test(users=users, concurrency=1, payment_delay=(0.0, 0.0), think_seconds=(0.0, 0.0),
+                         max_verify_attempts=1, reader_threads=0, seed=seed)
+
+
+# --- logging: costo del logging para el hilo que loguea (el event loop del bot) ---
+def benchmark_log_pipeline(scale: float = 1.0, records: int | None = None, seed: int = 0) -> dict:
+    """Logging síncrono vs. en cola (src/log_pipeline.py) sobre los registros de un pago verificado."""
+    from .log_pipeline import LOG_BENCH_RECORDS, benchmark_logging
+
+    return benchmark_logging(records or _scaled(LOG_BENCH_RECORDS, scale, 50))
+
+
+BENCHMARKS = {
+    'db': benchmark_db_crud,
+    'ton_api': benchmark_find_transaction,
+    'payouts': benchmark_payouts,
+    'buy_flow': benchmark_buy_flow,
+    'logging': benchmark_log_pipeline,
+}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(names: list[str] | None = None, scale: float = 1.0, seed: int = 0) -> dict:
+    """Corre los benchmarks pedidos (todos por defecto) y retorna {'meta', 'results'}."""
+    names = names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Benchmarks desconocidos: {', '.join(unknown)}")
+    results = {}
+    for name in names:
+        started = time.perf_counter()
+        results[name] = BENCHMARKS[name](scale=scale, seed=seed)
+        results[name]['elapsed_seconds'] = time.perf_counter() - started
+        logger.info(f"BENCH: {name} terminado en {results[name]['elapsed_seconds']:.1f} s.")
+    meta = {'commit': _git_commit(), 'timestamp': datetime.now(timezone.utc).isoformat(), 'scale': scale, 'seed': seed,
+            'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'platform': platform.platform()}
+    return {'meta': meta, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks de DB, búsqueda de pagos, liquidación y flujo de compra.")
+    parser.add_argument('--only', default='', help=f"Lista separada por comas ({', '.join(BENCHMARKS)}); por defecto todos")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplica tamaños de tabla e iteraciones")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Archivo JSON de salida (por defecto, stdout)")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    report = run_suite([name.strip() for name in args.only.split(',') if name.strip()] or None, args.scale, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
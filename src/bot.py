@@ -3,7 +3,6 @@ import asyncio
 import logging # Importamos logging al inicio
 import json
 import os # Para leer variables de entorno para intervalos de jobs
-import random # Para el sorteo en la lógica adaptada
 from datetime import datetime, timedelta, timezone # Para la lógica de tiempos en jobs
 import functools # Para pasar argumentos a los jobs de aioschedule
 from aiogram.client.default import DefaultBotProperties
@@ -37,6 +36,30 @@ import src.db
 
 from src.payment_manager import PaymentManager # Corregido a importación absoluta
 from src.handlers import register_all_handlers    # Corregido a importación absoluta
+from src.leader_election import LeaderElector, DEFAULT_LEASE_TTL_SECONDS
+from src.loop_monitor import LoopMonitor, DEFAULT_SLOW_CALLBACK_SECONDS, DEFAULT_REPORT_INTERVAL_SECONDS
+from src.log_pipeline import setup_logging, stop_logging, log_fields
+from src.tracing import (
+    traced,
+    configure_tracing,
+    stop_exporter,
+    bot_request_span_middleware,
+    DEFAULT_TRACE_EXPORT_PATH,
+    TRACE_EXPORT_MAX_BYTES as DEFAULT_TRACE_EXPORT_MAX_BYTES,
+)
+from src.backup import (
+    run_scheduled_backup,
+    BACKUP_DIR as DEFAULT_BACKUP_DIR,
+    BACKUP_KEEP as DEFAULT_BACKUP_KEEP,
+    BACKUP_INTERVAL_SECONDS as DEFAULT_BACKUP_INTERVAL_SECONDS,
+)
+from src.retention import (
+    run_retention,
+    ARCHIVE_DATABASE_NAME as DEFAULT_ARCHIVE_DATABASE_NAME,
+    RETENTION_DAYS as DEFAULT_RETENTION_DAYS,
+    RETENTION_INTERVAL_SECONDS as DEFAULT_RETENTION_INTERVAL_SECONDS,
+)
+from src.payout_ledger import ton_to_nano # Precio de la ronda (TON) -> nanoTON para el libro de pagos
 
 # Funciones y constantes de round_manager
 # Si round_manager.py está en src/, también necesita importación absoluta
@@ -46,6 +69,8 @@ try:
         get_available_rounds as rm_get_available_rounds,
         update_round_status_manager as rm_update_round_status_manager,
         count_round_participants as rm_count_round_participants,
+        add_round_filled_listener as rm_add_round_filled_listener,
+        record_fill_to_draw_latency as rm_record_fill_to_draw_latency,
         MIN_PARTICIPANTS_FOR_TIMED_DRAW,
         MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW, # Aunque el sorteo simulado ahora se basa en MIN_PARTICIPANTS_FOR_TIMED_DRAW
         ROUND_STATUS_WAITING_TO_START,
@@ -55,6 +80,7 @@ try:
         ROUND_STATUS_CANCELLED,
         ROUND_TYPE_SCHEDULED,
     )
+    from src.round_state_machine import transition as rsm_transition # CAS de estados de ronda
 except ImportError:
      logger.warning("No se pudo importar round_manager. La lógica de gestión de rondas simuladas no estará disponible.")
      # Define placeholders o maneja la ausencia de round_manager si es opcional
@@ -63,6 +89,9 @@ except ImportError:
      def rm_get_available_rounds(): logger.error("round_manager.get_available_rounds no disponible."); return []
      def rm_update_round_status_manager(*args, **kwargs): logger.error("round_manager.update_round_status_manager no disponible."); return False
      def rm_count_round_participants(*args, **kwargs): logger.error("round_manager.count_round_participants no disponible."); return 0
+     def rsm_transition(*args, **kwargs): logger.error("round_state_machine.transition no disponible."); return False
+     def rm_add_round_filled_listener(*args, **kwargs): logger.error("round_manager.add_round_filled_listener no disponible.")
+     def rm_record_fill_to_draw_latency(*args, **kwargs): pass
      # Definir constantes si no se importaron
      MIN_PARTICIPANTS_FOR_TIMED_DRAW = 2
      MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW = 10
@@ -77,156 +106,233 @@ except ImportError:
 # Importar el motor de simulación
 # Asegúrate de que este archivo y función existan si los usas
 try:
-    from src.simulation_engine import calculate_and_save_simulated_payouts # Corregido a importación absoluta
+    from src.simulation_engine import draw_and_settle_round # Sorteo + liquidación sin cargar participantes
 except ImportError:
-    logger.warning("No se pudo importar simulation_engine.calculate_and_save_simulated_payouts. La lógica de sorteo simulado no estará disponible.")
-    async def calculate_and_save_simulated_payouts(*args, **kwargs):
-        logger.error("simulation_engine.calculate_and_save_simulated_payouts no está implementada o no se pudo importar.")
-        return [], [] # Retorna listas vacías si la función no existe
+    logger.warning("No se pudo importar simulation_engine.draw_and_settle_round. La lógica de sorteo simulado no estará disponible.")
+    async def draw_and_settle_round(round_id, *args, **kwargs):
+        logger.error("simulation_engine.draw_and_settle_round no está implementada o no se pudo importar.")
+        # Ronda no liquidada: el cierre no anuncia nada
+        return {'participants_count': MIN_PARTICIPANTS_FOR_TIMED_DRAW, 'drawn_numbers': [], 'winners_messages': [],
+                'commissions_messages': ["Error: La lógica de cálculo de pagos simulados no está disponible."],
+                'settled': False, 'results': []}
 
 
 # Necesitarás `aioschedule`. Instálalo con: pip install aioschedule
 import aioschedule
 
+# Lease del scheduler: solo la réplica líder ejecuta los jobs (se crea en on_startup)
+leader_elector: LeaderElector | None = None
+loop_monitor: LoopMonitor | None = None
+
+
+# --- Notificaciones a los participantes de una ronda ---
+# Telegram limita a ~30 mensajes/s por bot: se envía por tandas con una pausa entre ellas.
+NOTIFICATION_CHUNK_SIZE = 25
+NOTIFICATION_CHUNK_PAUSE_SECONDS = 1.0
+# Líneas de ganadores en el resumen común (los ganadores reciben además su aviso personal)
+MAX_WINNER_LINES_IN_SUMMARY = 20
+
+# --- Recuperación de rondas en 'drawing' ---
+# La liquidación es atómica y compare-and-swap, así que reintentarla es seguro. Si tras los reintentos
+# no se confirma, la ronda se cancela (drawing -> cancelled) y se avisa. Cualquier réplica puede llevar
+# una ronda a 'drawing' (job del líder o sorteo inmediato), así que solo se da por cortado un cierre que
+# ya superó el peor caso de uno vivo: todos los intentos con sus pausas, presupuestando
+# DRAWING_SETTLE_MAX_SECONDS por sorteo + liquidación (50.000 boletos se liquidan en segundos, ver
+# test_large_rounds). Esas rondas las retoman job_check_expired_rounds y la réplica que toma el lease.
+DRAWING_SETTLE_ATTEMPTS = 3
+DRAWING_SETTLE_RETRY_SECONDS = 5.0
+DRAWING_SETTLE_MAX_SECONDS = 60
+DRAWING_STALE_SECONDS = DRAWING_SETTLE_ATTEMPTS * (DRAWING_SETTLE_MAX_SECONDS + DRAWING_SETTLE_RETRY_SECONDS)
+
+async def _send_notification(bot_instance: Bot, telegram_id: str, text: str, round_id: int) -> bool:
+    try:
+        await bot_instance.send_message(telegram_id, text, parse_mode=ParseMode.HTML)
+        return True
+    except Exception as e:
+        logger.error(f"JOB: Error enviando notificación a {telegram_id} para ronda {round_id}: {e}")
+        return False
+
+@traced()
+async def broadcast_to_round_participants(bot_instance: Bot, round_id: int, text: str,
+                                          chunk_size: int = NOTIFICATION_CHUNK_SIZE,
+                                          pause_seconds: float = NOTIFICATION_CHUNK_PAUSE_SECONDS) -> int:
+    """
+    Envía `text` a todos los participantes de la ronda recorriéndolos por páginas
+    (db.iter_round_participants) y mandando tandas de `chunk_size` en paralelo.
+    La memoria no depende del tamaño de la ronda. Retorna cuántos mensajes se entregaron.
+    """
+    delivered = 0
+    chunk = []
+    async def flush():
+        nonlocal delivered
+        results = await asyncio.gather(*(_send_notification(bot_instance, tid, text, round_id) for tid in chunk))
+        delivered += sum(results)
+        chunk.clear()
+
+    for p_data in src.db.iter_round_participants(round_id):
+        if p_data.get('telegram_id'):
+            chunk.append(p_data['telegram_id'])
+        if len(chunk) >= chunk_size:
+            await flush()
+            await asyncio.sleep(pause_seconds)
+    if chunk:
+        await flush()
+    return delivered
+
 
 # --- LÓGICA DE CIERRE DE RONDA SIMULADA (llamada por el job) ---
-async def execute_simulated_round_closure(round_id: int, bot_instance: Bot):
+@traced()
+async def execute_simulated_round_closure(round_id: int, bot_instance: Bot, round_data: dict | None = None):
     """
     Coordina el sorteo simulado, cálculo de premios/comisiones (simulados) y notificaciones.
+    Solo debe llamarla la tarea que ganó la transición a 'drawing' (round_state_machine.transition),
+    así que no vuelve a comprobar el estado: la exclusividad la da ese compare-and-swap.
+    `round_data` es la fila de la ronda que ya tiene el llamador; si no se pasa, se lee de la DB.
+    Sorteo y liquidación no cargan a los participantes (simulation_engine.draw_and_settle_round),
+    y las notificaciones salen por tandas, así que también sirve para rondas de miles de boletos.
     """
     logger.info(f"JOB: Iniciando cierre simulado para ronda {round_id}.")
 
-    # Asegúrate de que las funciones de db y round_manager se llamen con el prefijo del módulo si es necesario
-    target_round_data = src.db.get_round_by_id(round_id) # Ejemplo de llamada con prefijo
+    target_round_data = round_data if round_data is not None else src.db.get_round_by_id(round_id)
     if not target_round_data:
+        # Sin fila no hay nada que cancelar; si fue un error de lectura, la ronda sigue en 'drawing' y la retoma el job
         logger.error(f"JOB: No se encontraron datos para ronda {round_id}. No se puede cerrar.")
         return
-        
-    # Asegurarse de que target_round_data es un diccionario o acceder por índice si es tupla
-    # Asumimos dict basado en db.py actualizado, pero comprobamos por seguridad
-    if isinstance(target_round_data, tuple): # Si es una tupla, adaptamos el acceso
-         if len(target_round_data) < 8:
-             logger.error(f"JOB: Datos de ronda incompletos para ronda {round_id}. No se puede cerrar.")
-             return
-         r_id, _, _, r_status, r_type, r_creator_id, _, _ = target_round_data
-    else: # Si es un diccionario (esperado)
-         r_id = target_round_data.get('id')
-         r_status = target_round_data.get('status')
-         r_type = target_round_data.get('round_type')
-         r_creator_id = target_round_data.get('creator_telegram_id')
-         if r_id is None or r_status is None or r_type is None:
-              logger.error(f"JOB: Datos esenciales faltantes para ronda: {target_round_data}. Saltando.")
-              return
 
-
-    if r_status != ROUND_STATUS_DRAWING:
-        logger.warning(f"JOB: Ronda {round_id} no está en estado '{ROUND_STATUS_DRAWING}' (actual: '{r_status}'). Saltando cierre para evitar doble procesamiento.")
+    r_type = target_round_data.get('round_type')
+    if r_type is None:
+        logger.error(f"JOB: Datos esenciales faltantes para ronda: {target_round_data}. Cancelando ronda.")
+        await _cancel_drawing_round(round_id, bot_instance, "no se pudo realizar el sorteo")
         return
 
-    all_participants_data = src.db.get_participants_in_round(round_id) # Ejemplo de llamada con prefijo
-    
+    # Sortear y liquidar (resultados + comisiones + 'finished') en una sola transacción
+    outcome = await _draw_and_settle_with_retries(round_id, target_round_data)
+    if outcome is None:
+        return # Otra tarea cerró la ronda mientras se reintentaba
+
     # Validar si hay suficientes participantes para un sorteo significativo
-    if not all_participants_data or len(all_participants_data) < MIN_PARTICIPANTS_FOR_TIMED_DRAW:
-        logger.warning(f"JOB: Ronda {round_id} con < {MIN_PARTICIPANTS_FOR_TIMED_DRAW} participantes ({len(all_participants_data)}). Cancelando ronda.")
-        src.round_manager.update_round_status_manager(round_id, ROUND_STATUS_CANCELLED) # Ejemplo de llamada con prefijo
+    participants_count = outcome['participants_count']
+    if participants_count is not None and participants_count < MIN_PARTICIPANTS_FOR_TIMED_DRAW:
+        logger.warning(f"JOB: Ronda {round_id} con < {MIN_PARTICIPANTS_FOR_TIMED_DRAW} participantes ({participants_count}). Cancelando ronda.")
         # Notificar cancelación a los pocos que haya
-        for p_data in all_participants_data:
-            try:
-                # p_data es un diccionario si db.py usa row_factory = sqlite3.Row
-                p_telegram_id = p_data.get('telegram_id') if isinstance(p_data, dict) else p_data[0]
-                if p_telegram_id:
-                     await bot_instance.send_message(p_telegram_id, f"⚠️ La ronda ID <code>{round_id}</code> ha sido cancelada (participantes insuficientes al momento del sorteo).", parse_mode=ParseMode.HTML) # Usar ParseMode
-            except Exception as e: logger.error(f"JOB: Error enviando msg cancelación a {p_telegram_id} para ronda {round_id}: {e}")
+        await _cancel_drawing_round(round_id, bot_instance, "participantes insuficientes al momento del sorteo")
         return
 
-    # Realizar el sorteo
-    available_numbers = [p.get('assigned_number') if isinstance(p, dict) else p[2] for p in all_participants_data if (p.get('assigned_number') if isinstance(p, dict) else p[2]) is not None] # p[2] es assigned_number
-    if not available_numbers:
-        logger.error(f"JOB: No hay números asignados para sortear en ronda {round_id}. Cancelando.")
-        src.round_manager.update_round_status_manager(round_id, ROUND_STATUS_CANCELLED) # Ejemplo de llamada con prefijo
+    # Si la liquidación no se confirmó no se guardó ni un resultado a medias: se cancela en lugar de dejarla en 'drawing'
+    if not outcome['settled']:
+        logger.error(f"JOB: Ronda {round_id} no se pudo liquidar tras {DRAWING_SETTLE_ATTEMPTS} intentos. Cancelando ronda.")
+        await _cancel_drawing_round(round_id, bot_instance, "no se pudo completar el sorteo")
         return
+    # La ronda ya quedó en 'finished' dentro de la misma transacción de la liquidación
+    logger.info(f"JOB: Ronda {round_id} marcada como '{ROUND_STATUS_FINISHED}'. Números sorteados: {outcome['drawn_numbers']}.")
+    if target_round_data.get('filled_time'): # Ronda cerrada por llenarse: latencia último boleto -> liquidación
+        try:
+            filled_dt = datetime.fromisoformat(target_round_data['filled_time'])
+            rm_record_fill_to_draw_latency(round_id, (datetime.now(timezone.utc) - filled_dt).total_seconds())
+        except ValueError:
+            logger.warning(f"JOB: filled_time inválido para ronda {round_id}: {target_round_data['filled_time']}")
+
+    # Un único resumen por participante: números, ganadores, comisiones y cierre
+    drawn_numbers = outcome['drawn_numbers']
+    winners_messages = outcome['winners_messages']
+    winners_lines = winners_messages[:MAX_WINNER_LINES_IN_SUMMARY]
+    if len(winners_messages) > MAX_WINNER_LINES_IN_SUMMARY:
+        winners_lines.append(f"... y {len(winners_messages) - MAX_WINNER_LINES_IN_SUMMARY} ganadores más.")
+    numeros_texto = ", ".join(f"<b>{n}</b>" for n in drawn_numbers[:MAX_WINNER_LINES_IN_SUMMARY])
+    summary_parts = [
+        f"🎉 ¡Sorteo de la Ronda ID <code>{round_id}</code> realizado!\n"
+        f"{'Números Ganadores' if len(drawn_numbers) > 1 else 'El Número Ganador'} (simulado): {numeros_texto}",
+    ]
+    if winners_lines:
+        summary_parts.append("🏆 <b>Resultados del Sorteo Simulado:</b>\n" + "\n".join(winners_lines))
+    if outcome['commissions_messages']:
+        summary_parts.append("💸 <b>Comisiones Simuladas:</b>\n" + "\n".join(outcome['commissions_messages']))
+    summary_parts.append(f"✅ Ronda de simulación ID <code>{round_id}</code> ha finalizado.")
+
+    # Aviso personal a cada ganador con su premio (resultados estructurados de la liquidación)
+    for result in outcome['results']:
+        if result.get('winner_telegram_id'):
+            await _send_notification(
+                bot_instance, result['winner_telegram_id'],
+                f"🥳 ¡Ganaste el premio {result['draw_order'] + 1} de la Ronda ID <code>{round_id}</code> con el número <b>{result['drawn_number']}</b>!\n"
+                f"Premio (simulado): {result['prize_amount_simulated']}", round_id)
+
+    delivered = await broadcast_to_round_participants(bot_instance, round_id, "\n\n".join(summary_parts))
+    logger.info(f"JOB: Resumen de la ronda {round_id} entregado a {delivered}/{participants_count} participantes.")
+
+
+async def _draw_and_settle_with_retries(round_id: int, round_data: dict) -> dict | None:
+    """
+    draw_and_settle_round con hasta DRAWING_SETTLE_ATTEMPTS intentos. Retorna el último resultado
+    (settled=False si ninguno se confirmó; participants_count=None si todos fallaron) o None si entretanto otra tarea sacó la ronda de 'drawing'.
+    """
+    creator_id = round_data.get('creator_telegram_id')
+    outcome = {'participants_count': None, 'drawn_numbers': [], 'winners_messages': [],
+               'commissions_messages': ["Error ejecutando el sorteo."], 'settled': False, 'results': []}
+    for attempt in range(1, DRAWING_SETTLE_ATTEMPTS + 1):
+        try:
+            outcome = await draw_and_settle_round(
+                round_id, round_data['round_type'], str(creator_id) if creator_id else None,
+                ticket_price_nano=ton_to_nano(round_data.get('ticket_price_simulated') or 1.0)
+            )
+            if outcome['settled'] or outcome['participants_count'] < MIN_PARTICIPANTS_FOR_TIMED_DRAW:
+                return outcome
+            logger.error(f"JOB: Liquidación de la ronda {round_id} no confirmada (intento {attempt}/{DRAWING_SETTLE_ATTEMPTS}).")
+        except Exception as e:
+            logger.error(f"JOB: Error ejecutando el sorteo y la liquidación de la ronda {round_id} (intento {attempt}/{DRAWING_SETTLE_ATTEMPTS}): {e}", exc_info=True)
+        if attempt < DRAWING_SETTLE_ATTEMPTS:
+            await asyncio.sleep(DRAWING_SETTLE_RETRY_SECONDS)
+            current = src.db.get_round_by_id(round_id)
+            if current and current.get('status') != ROUND_STATUS_DRAWING:
+                logger.info(f"JOB: Ronda {round_id} ya está en '{current.get('status')}' (otra tarea la cerró). Sin reintentos.")
+                return None
+    return outcome
 
-    drawn_winner_number = random.choice(available_numbers)
-    logger.info(f"JOB: Número sorteado para ronda {round_id}: {drawn_winner_number}.")
 
-    msg_numero_sorteado = f"🎉 ¡Sorteo de la Ronda ID <code>{round_id}</code> realizado!\nEl Número Ganador (simulado) es: <b>{drawn_winner_number}</b>"
-    for p_data in all_participants_data:
-        try:
-            p_telegram_id = p_data.get('telegram_id') if isinstance(p_data, dict) else p_data[0] # Acceso por clave o índice
-            if p_telegram_id:
-                 await bot_instance.send_message(p_telegram_id, msg_numero_sorteado, parse_mode=ParseMode.HTML) # Usar ParseMode
-        except Exception as e: logger.error(f"JOB: Error enviando msg # sorteado a {p_telegram_id} para ronda {round_id}: {e}")
+async def _cancel_drawing_round(round_id: int, bot_instance: Bot, reason: str) -> bool:
+    """Compare-and-swap drawing -> cancelled y aviso a los participantes. False si otra tarea ya cerró la ronda."""
+    if not rsm_transition(round_id, ROUND_STATUS_DRAWING, ROUND_STATUS_CANCELLED):
+        return False # No notificar dos veces
+    await broadcast_to_round_participants(bot_instance, round_id, f"⚠️ La ronda ID <code>{round_id}</code> ha sido cancelada ({reason}).")
+    return True
 
-    # Llamar al motor de simulación para calcular premios y comisiones
-    # Esta función debe estar definida en src/simulation_engine.py y ser async
-    try:
-        # Asegúrate de que calculate_and_save_simulated_payouts también se llame con prefijo si es necesario
-        # Comprobamos si calculate_and_save_simulated_payouts fue importada correctamente
-        if 'calculate_and_save_simulated_payouts' in globals() and asyncio.iscoroutinefunction(calculate_and_save_simulated_payouts):
-             winners_messages, commissions_messages = await calculate_and_save_simulated_payouts(
-                 round_id, [drawn_winner_number], all_participants_data, r_type, str(r_creator_id) if r_creator_id else None
-             )
-        else:
-             logger.error("JOB: simulation_engine.calculate_and_save_simulated_payouts no está disponible o no es una función async.")
-             winners_messages, commissions_messages = [], ["Error: La lógica de cálculo de pagos simulados no está disponible."]
 
-    except Exception as e:
-         logger.error(f"JOB: Error ejecutando calculate_and_save_simulated_payouts para ronda {round_id}: {e}", exc_info=True)
-         winners_messages, commissions_messages = [], ["Error ejecutando cálculo de pagos simulados."]
-
-
-    # Enviar mensajes de ganadores
-    if winners_messages:
-        full_winners_message = f"🏆 <b>Resultados del Sorteo Simulado (Ronda ID <code>{round_id}</code>):</b>\n\n" + "\n".join(winners_messages)
-        for p_data in all_participants_data:
-            try:
-                 p_telegram_id = p_data.get('telegram_id') if isinstance(p_data, dict) else p_data[0] # Acceso por clave o índice
-                 if p_telegram_id:
-                      await bot_instance.send_message(p_telegram_id, full_winners_message, parse_mode=ParseMode.HTML) # Usar ParseMode
-            except Exception as e: logger.error(f"JOB: Error enviando msg ganadores a {p_telegram_id} para ronda {round_id}: {e}")
-    # No enviar mensaje "No ganador" si hubo messages de ganadores
-    # else:
-    #     no_winner_msg = f"🥺 El número sorteado <b>{drawn_winner_number}</b> no tuvo un ganador asignado en la ronda {round_id}."
-    #     for p_data in all_participants_data:
-    #         try:
-    #              p_telegram_id = p_data.get('telegram_id') if isinstance(p_data, dict) else p_data[0] # Acceso por clave o índice
-    #              if p_telegram_id:
-    #                  await bot_instance.send_message(p_telegram_id, no_winner_msg, parse_mode=ParseMode.HTML) # Usar ParseMode
-    #         except Exception as e: logger.error(f"JOB: Error enviando msg no ganador a {p_telegram_id} para ronda {round_id}: {e}")
-
-
-    # Enviar mensajes de comisiones
-    if commissions_messages:
-        full_commissions_message = f"💸 <b>Comisiones Simuladas (Ronda ID <code>{round_id}</code>):</b>\n" + "\n".join(commissions_messages)
-        # Se envían a todos los participantes, quizás solo deberían ir al creador o admin?
-        # Dejamos como estaba el código original para enviar a todos los participantes.
-        for p_data in all_participants_data:
-            try:
-                 p_telegram_id = p_data.get('telegram_id') if isinstance(p_data, dict) else p_data[0] # Acceso por clave o índice
-                 if p_telegram_id:
-                     await bot_instance.send_message(p_telegram_id, full_commissions_message, parse_mode=ParseMode.HTML) # Usar ParseMode
-            except Exception as e: logger.error(f"JOB: Error enviando msg comisiones a {p_telegram_id} para ronda {round_id}: {e}")
-
-
-    # Marcar la ronda como finalizada
-    # Comprobamos si rm_update_round_status_manager fue importada correctamente
-    if 'rm_update_round_status_manager' in globals() and callable(rm_update_round_status_manager):
-        if rm_update_round_status_manager(round_id, ROUND_STATUS_FINISHED): # Llamada directa si se importó, o placeholder si no
-            logger.info(f"JOB: Ronda {round_id} marcada como '{ROUND_STATUS_FINISHED}'.")
-            final_msg = f"✅ Ronda de simulación ID <code>{round_id}</code> ha finalizado."
-            for p_data in all_participants_data:
-                try:
-                     p_telegram_id = p_data.get('telegram_id') if isinstance(p_data, dict) else p_data[0] # Acceso por clave o índice
-                     if p_telegram_id:
-                         await bot_instance.send_message(p_telegram_id, final_msg, parse_mode=ParseMode.HTML) # Usar ParseMode
-                except Exception as e: logger.error(f"JOB: Error enviando msg final a {p_data[0]} para ronda {round_id}: {e}")
-        else:
-             logger.error(f"JOB: Falló la actualización final del estado de ronda {round_id} a '{ROUND_STATUS_FINISHED}'.")
-    else:
-         logger.error(f"JOB: round_manager.update_round_status_manager no está disponible.")
+async def recover_stale_drawing_rounds(bot_instance: Bot) -> int:
+    """
+    Retoma el cierre de las rondas que llevan más de DRAWING_STALE_SECONDS en 'drawing'. Cada una se
+    reclama con compare-and-swap sobre drawing_since, así que dos réplicas no la cierran a la vez.
+    Retorna cuántas se retomaron.
+    """
+    stale_before = (datetime.now(timezone.utc) - timedelta(seconds=DRAWING_STALE_SECONDS)).isoformat()
+    resumed = []
+    for round_data in src.db.get_stale_drawing_rounds(stale_before):
+        if not src.db.claim_stale_drawing_round(round_data['id'], stale_before):
+            continue
+        logger.warning(f"JOB: Ronda {round_data['id']} atascada en '{ROUND_STATUS_DRAWING}' desde {round_data.get('drawing_since') or '(desconocido)'}. Retomando su cierre.")
+        resumed.append(execute_simulated_round_closure(round_data['id'], bot_instance, round_data=round_data))
+    await asyncio.gather(*resumed)
+    return len(resumed)
+
+
+async def trigger_immediate_draw(round_id: int, bot_instance: Bot) -> bool:
+    """
+    Cierre inmediato de una ronda que acaba de llenarse (la dispara la admisión del último boleto,
+    ver round_manager.add_round_filled_listener). La transición a 'drawing' es compare-and-swap:
+    si el job u otra réplica ya la tomó, esta llamada no hace nada. Retorna True si esta tarea sorteó.
+    """
+    round_data = src.db.get_round_by_id(round_id)
+    if not round_data or round_data.get('status') not in (ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_WAITING_FOR_PAYMENTS):
+        logger.info(f"JOB: Ronda {round_id} llena pero ya no está abierta. Nada que sortear.")
+        return False
+    if not rsm_transition(round_id, round_data['status'], ROUND_STATUS_DRAWING):
+        return False
+    logger.info(f"JOB: Ronda {round_id} llena. Sorteo inmediato.")
+    await execute_simulated_round_closure(round_id, bot_instance, round_data=round_data)
+    return True
 
 
 # --- Definición de los Jobs para Aiogram ---
+@traced()
 async def job_check_expired_rounds(bot_instance_for_job: Bot):
     logger.info("JOB: Iniciando `job_check_expired_rounds`...")
     
@@ -255,13 +361,18 @@ async def job_check_expired_rounds(bot_instance_for_job: Bot):
     logger.debug(f"JOB: Tiempo límite para sorteo: {time_limit_for_draw_utc.isoformat()}")
     logger.debug(f"JOB: Tiempo límite para cancelación: {time_limit_for_cancellation_utc.isoformat()}")
 
+    # Rondas cuyo cierre se cortó: sin esto quedarían en 'drawing' para siempre
+    try:
+        await recover_stale_drawing_rounds(bot_instance_for_job)
+    except Exception as e:
+        logger.error(f"JOB: Error retomando rondas atascadas en '{ROUND_STATUS_DRAWING}': {e}", exc_info=True)
+
 
     # Obtener rondas que están esperando inicio o pagos, y no están marcadas como eliminadas
     # Usar src.db.get_rounds_by_status
-    rounds_to_check = src.db.get_rounds_by_status( # Ejemplo de llamada con prefijo
-        [ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_WAITING_FOR_PAYMENTS], 
-        check_deleted=True # Checkea si deleted == 0
-    )
+    # Mismo filtro que get_rounds_by_status([waiting_to_start, waiting_for_payments], check_deleted=True),
+    # servido por la caché de rondas de round_manager (caduca a los pocos segundos)
+    rounds_to_check = rm_get_available_rounds()
     logger.debug(f"JOB: Se encontraron {len(rounds_to_check)} rondas para verificar.")
 
 
@@ -311,47 +422,42 @@ async def job_check_expired_rounds(bot_instance_for_job: Bot):
             logger.debug(f"JOB: Ronda {round_id} tiene {current_participants_count} participantes.")
 
 
+            # Una ronda llena (filled_time) se sortea ya: cubre las que llenó otro proceso (webapp)
+            # o cuyo disparo inmediato se perdió. La transición CAS evita sortearla dos veces.
+            is_full = isinstance(ronda_data, dict) and ronda_data.get('filled_time') is not None
+
             # Lógica de Sorteo por Tiempo
-            # Solo si está en estado de espera y ha pasado el tiempo mínimo para sorteo
-            if current_status in [ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_WAITING_FOR_PAYMENTS] and start_time_dt < time_limit_for_draw_utc:
+            # Solo si está en estado de espera y ha pasado el tiempo mínimo para sorteo (o si ya está llena)
+            if current_status in [ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_WAITING_FOR_PAYMENTS] and (start_time_dt < time_limit_for_draw_utc or is_full):
                 # Comprobamos si MIN_PARTICIPANTS_FOR_TIMED_DRAW está definido globalmente (viene de la importación o placeholder)
                 if 'MIN_PARTICIPANTS_FOR_TIMED_DRAW' in globals() and current_participants_count >= MIN_PARTICIPANTS_FOR_TIMED_DRAW:
                     logger.info(f"JOB: Ronda {round_id} ({current_participants_count} part.) elegible para sorteo por tiempo. Actualizando estado a '{ROUND_STATUS_DRAWING}'.")
-                    # Actualizar estado a DRAWING ANTES de ejecutar el cierre para evitar re-procesamiento
-                    # Comprobamos si rm_update_round_status_manager fue importada correctamente
-                    if 'rm_update_round_status_manager' in globals() and callable(rm_update_round_status_manager):
-                         if rm_update_round_status_manager(round_id, ROUND_STATUS_DRAWING): # Llamada directa si se importó, o placeholder si no
+                    # Pasar a DRAWING con compare-and-swap ANTES del cierre: solo la tarea que gana la transición sortea
+                    if 'rsm_transition' in globals() and callable(rsm_transition):
+                         if rsm_transition(round_id, current_status, ROUND_STATUS_DRAWING):
                              logger.info(f"JOB: Estado de ronda {round_id} cambiado a '{ROUND_STATUS_DRAWING}'. Procediendo a cierre.")
                              # Ejecutar el cierre de ronda (sorteo simulado, payouts, notificaciones)
                              # Usamos create_task para no bloquear el job si el cierre es largo
-                             asyncio.create_task(execute_simulated_round_closure(round_id, bot_instance_for_job))
+                             asyncio.create_task(execute_simulated_round_closure(round_id, bot_instance_for_job, round_data=ronda_data))
                          else:
-                             logger.error(f"JOB: No se pudo actualizar estado de ronda {round_id} a drawing para sorteo por tiempo.")
+                             logger.info(f"JOB: Ronda {round_id} ya no está en '{current_status}' (otra tarea la procesó). Saltando sorteo.")
                     else:
-                         logger.error(f"JOB: round_manager.update_round_status_manager no está disponible para actualizar a drawing.")
+                         logger.error(f"JOB: round_state_machine.transition no está disponible para actualizar a drawing.")
                 # Lógica de Cancelación por Tiempo y Pocos Participantes
                 # Solo si está en estado de espera y ha pasado el tiempo máximo para cancelación
                 # Comprobamos si MIN_PARTICIPANTS_FOR_TIMED_DRAW está definido globalmente
                 elif 'MIN_PARTICIPANTS_FOR_TIMED_DRAW' in globals() and current_participants_count < MIN_PARTICIPANTS_FOR_TIMED_DRAW and current_status in [ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_WAITING_FOR_PAYMENTS] and start_time_dt < time_limit_for_cancellation_utc:
                     logger.info(f"JOB: Ronda {round_id} ({current_participants_count} part.) elegible para cancelación por tiempo.")
-                    # Comprobamos si rm_update_round_status_manager fue importada correctamente
-                    if 'rm_update_round_status_manager' in globals() and callable(rm_update_round_status_manager):
-                         if rm_update_round_status_manager(round_id, ROUND_STATUS_CANCELLED): # Llamada directa si se importó, o placeholder si no
+                    # Compare-and-swap: si otra tarea ya movió la ronda, no se cancela ni se notifica dos veces
+                    if 'rsm_transition' in globals() and callable(rsm_transition):
+                         if rsm_transition(round_id, current_status, ROUND_STATUS_CANCELLED):
                              logger.info(f"JOB: Estado de ronda {round_id} cambiado a '{ROUND_STATUS_CANCELLED}'. Notificando participantes.")
-                             # Usar src.db.get_participants_in_round
-                             participants_to_notify = src.db.get_participants_in_round(round_id) # Ejemplo de llamada con prefijo
                              cancel_msg = f"⚠️ La ronda ID <code>{round_id}</code> ha sido cancelada (pocos participantes / tiempo excedido)."
-                             for p_data in participants_to_notify:
-                                 try:
-                                     # p_data es un diccionario if db.py uses row_factory = sqlite3.Row
-                                     p_telegram_id = p_data.get('telegram_id') if isinstance(p_data, dict) else p_data[0]
-                                     if p_telegram_id:
-                                         await bot_instance_for_job.send_message(p_telegram_id, cancel_msg, parse_mode=ParseMode.HTML)
-                                 except Exception as e: logger.error(f"JOB: Error enviando msg cancelación a {p_telegram_id} para ronda {round_id}: {e}")
+                             await broadcast_to_round_participants(bot_instance_for_job, round_id, cancel_msg)
                          else:
-                             logger.error(f"JOB: No se pudo actualizar estado de ronda {round_id} a cancelled.")
+                             logger.info(f"JOB: Ronda {round_id} ya no está en '{current_status}' (otra tarea la procesó). Saltando cancelación.")
                     else:
-                         logger.error(f"JOB: round_manager.update_round_status_manager no está disponible para actualizar a cancelled.")
+                         logger.error(f"JOB: round_state_machine.transition no está disponible para actualizar a cancelled.")
                 # If not eligible for draw or cancellation by time
                 # else:
                      # logger.debug(f"JOB: Ronda {round_id} not eligible for draw/cancellation by time yet.")
@@ -365,6 +471,7 @@ async def job_check_expired_rounds(bot_instance_for_job: Bot):
     logger.info("JOB: `job_check_expired_rounds` finished.")
 
 
+@traced()
 async def job_create_scheduled_round(bot_instance_for_job: Bot):
     logger.info("JOB: Iniciando `job_create_scheduled_round`...")
     
@@ -440,6 +547,22 @@ async def job_create_scheduled_round(bot_instance_for_job: Bot):
     logger.info("JOB: `job_create_scheduled_round` finished.")
 
 
+@traced()
+async def job_backup_database(dest_dir: str = DEFAULT_BACKUP_DIR, keep: int = DEFAULT_BACKUP_KEEP):
+    """Online snapshot of the DB (src/backup.py) in a worker thread: the event loop keeps serving updates."""
+    logger.info("JOB: Iniciando `job_backup_database`...")
+    await asyncio.to_thread(run_scheduled_backup, dest_dir, keep)
+    logger.info("JOB: `job_backup_database` finished.")
+
+
+@traced()
+async def job_archive_old_rounds(days: float = DEFAULT_RETENTION_DAYS, archive_path: str = DEFAULT_ARCHIVE_DATABASE_NAME):
+    """Moves old finished/cancelled rounds to the archive DB in small batches (src/retention.py), in a worker thread."""
+    logger.info("JOB: Iniciando `job_archive_old_rounds`...")
+    await asyncio.to_thread(run_retention, days, archive_path)
+    logger.info("JOB: `job_archive_old_rounds` finished.")
+
+
 # --- Funciones de Arranque y Apagado ---
 # Corrected type annotation for bot_instance
 async def on_startup(dispatcher: Dispatcher, bot_instance: Bot, pm_instance: PaymentManager):
@@ -508,14 +631,83 @@ async def on_startup(dispatcher: Dispatcher, bot_instance: Bot, pm_instance: Pay
                 config = json.load(f)
                 CHECK_EXPIRED_INTERVAL_SECONDS = int(config.get('JOB_CHECK_EXPIRED_INTERVAL_SECONDS', 60))
                 CREATE_SCHEDULED_INTERVAL_SECONDS = int(config.get('JOB_CREATE_SCHEDULED_INTERVAL_SECONDS', 300))
+                LEADER_LEASE_TTL_SECONDS = float(config.get('LEADER_LEASE_TTL_SECONDS', DEFAULT_LEASE_TTL_SECONDS))
+                LEADER_HEARTBEAT_INTERVAL_SECONDS = config.get('LEADER_HEARTBEAT_INTERVAL_SECONDS') # None -> TTL/3
+                LOOP_MONITOR_ENABLED = bool(config.get('LOOP_MONITOR_ENABLED', True))
+                LOOP_MONITOR_DEBUG = bool(config.get('LOOP_MONITOR_DEBUG', False)) # Captura la pila de los callbacks lentos
+                LOOP_SLOW_CALLBACK_SECONDS = float(config.get('LOOP_SLOW_CALLBACK_MS', DEFAULT_SLOW_CALLBACK_SECONDS * 1000)) / 1000
+                LOOP_MONITOR_REPORT_INTERVAL_SECONDS = float(config.get('LOOP_MONITOR_REPORT_INTERVAL_SECONDS', DEFAULT_REPORT_INTERVAL_SECONDS))
+                BACKUP_ENABLED = bool(config.get('BACKUP_ENABLED', True))
+                BACKUP_INTERVAL_SECONDS = int(config.get('BACKUP_INTERVAL_SECONDS', DEFAULT_BACKUP_INTERVAL_SECONDS))
+                BACKUP_SETTINGS = {'dest_dir': config.get('BACKUP_DIR', DEFAULT_BACKUP_DIR),
+                                   'keep': int(config.get('BACKUP_KEEP', DEFAULT_BACKUP_KEEP))}
+                RETENTION_ENABLED = bool(config.get('RETENTION_ENABLED', True))
+                RETENTION_INTERVAL_SECONDS = int(config.get('RETENTION_INTERVAL_SECONDS', DEFAULT_RETENTION_INTERVAL_SECONDS))
+                RETENTION_SETTINGS = {'days': float(config.get('RETENTION_DAYS', DEFAULT_RETENTION_DAYS)),
+                                      'archive_path': config.get('ARCHIVE_DATABASE_NAME', DEFAULT_ARCHIVE_DATABASE_NAME)}
         except (FileNotFoundError, json.JSONDecodeError, ValueError):
             logger.warning(f"Could not load/read '{CONFIG_FILE_PATH}' or job intervals. Using default values.")
             CHECK_EXPIRED_INTERVAL_SECONDS = 60
             CREATE_SCHEDULED_INTERVAL_SECONDS = 300
+            LEADER_LEASE_TTL_SECONDS = DEFAULT_LEASE_TTL_SECONDS
+            LEADER_HEARTBEAT_INTERVAL_SECONDS = None
+            LOOP_MONITOR_ENABLED, LOOP_MONITOR_DEBUG = True, False
+            LOOP_SLOW_CALLBACK_SECONDS, LOOP_MONITOR_REPORT_INTERVAL_SECONDS = DEFAULT_SLOW_CALLBACK_SECONDS, DEFAULT_REPORT_INTERVAL_SECONDS
+            BACKUP_ENABLED, BACKUP_INTERVAL_SECONDS = True, DEFAULT_BACKUP_INTERVAL_SECONDS
+            BACKUP_SETTINGS = {'dest_dir': DEFAULT_BACKUP_DIR, 'keep': DEFAULT_BACKUP_KEEP}
+            RETENTION_ENABLED, RETENTION_INTERVAL_SECONDS = True, DEFAULT_RETENTION_INTERVAL_SECONDS
+            RETENTION_SETTINGS = {'days': DEFAULT_RETENTION_DAYS, 'archive_path': DEFAULT_ARCHIVE_DATABASE_NAME}
     except Exception as e:
          logger.error(f"Unexpected error trying to read job intervals from config: {e}")
          CHECK_EXPIRED_INTERVAL_SECONDS = 60
          CREATE_SCHEDULED_INTERVAL_SECONDS = 300
+         LEADER_LEASE_TTL_SECONDS = DEFAULT_LEASE_TTL_SECONDS
+         LEADER_HEARTBEAT_INTERVAL_SECONDS = None
+         LOOP_MONITOR_ENABLED, LOOP_MONITOR_DEBUG = True, False
+         LOOP_SLOW_CALLBACK_SECONDS, LOOP_MONITOR_REPORT_INTERVAL_SECONDS = DEFAULT_SLOW_CALLBACK_SECONDS, DEFAULT_REPORT_INTERVAL_SECONDS
+         BACKUP_ENABLED, BACKUP_INTERVAL_SECONDS = True, DEFAULT_BACKUP_INTERVAL_SECONDS
+         BACKUP_SETTINGS = {'dest_dir': DEFAULT_BACKUP_DIR, 'keep': DEFAULT_BACKUP_KEEP}
+         RETENTION_ENABLED, RETENTION_INTERVAL_SECONDS = True, DEFAULT_RETENTION_INTERVAL_SECONDS
+         RETENTION_SETTINGS = {'days': DEFAULT_RETENTION_DAYS, 'archive_path': DEFAULT_ARCHIVE_DATABASE_NAME}
+
+    # --- Event loop monitor: lag metrics and, in debug mode, stacks of the callbacks that block the loop ---
+    global loop_monitor
+    if LOOP_MONITOR_ENABLED:
+        try:
+            loop_monitor = LoopMonitor(slow_callback_seconds=LOOP_SLOW_CALLBACK_SECONDS, debug=LOOP_MONITOR_DEBUG,
+                                       report_interval_seconds=LOOP_MONITOR_REPORT_INTERVAL_SECONDS)
+            asyncio.create_task(loop_monitor.run())
+        except ValueError as e:
+            logger.error(f"Invalid event loop monitor configuration ({e}). Loop monitor disabled.")
+
+    # --- Leader election: every replica serves Telegram updates, only the lease holder runs the jobs ---
+    global leader_elector
+    try:
+        leader_elector = LeaderElector(
+            ttl_seconds=LEADER_LEASE_TTL_SECONDS,
+            heartbeat_interval_seconds=float(LEADER_HEARTBEAT_INTERVAL_SECONDS) if LEADER_HEARTBEAT_INTERVAL_SECONDS else None,
+        )
+    except ValueError as e:
+        logger.error(f"Invalid leader lease configuration ({e}). Using default lease values.")
+        leader_elector = LeaderElector()
+    event_loop = asyncio.get_running_loop()
+
+    # A new leader sweeps the rounds stuck in 'drawing' right away instead of waiting for the next
+    # job_check_expired_rounds. Followers also move rounds to 'drawing' (immediate draw), so it uses the
+    # same DRAWING_STALE_SECONDS threshold: only closures older than a live one's worst case are resumed.
+    def on_leadership_acquired():
+        event_loop.call_soon_threadsafe(lambda: event_loop.create_task(recover_stale_drawing_rounds(bot_instance)))
+    leader_elector.add_acquired_listener(on_leadership_acquired)
+    leader_elector.heartbeat() # First attempt right away so a single replica doesn't wait a full interval
+    asyncio.create_task(leader_elector.run())
+    logger.info(f"Leader election started for replica {leader_elector.holder_id} (leader: {leader_elector.is_leader}).")
+
+    # --- Immediate draw: the admission that sells the last ticket closes the round right away ---
+    # Any replica may fire it (the drawing transition is compare-and-swap). add_participant can run
+    # outside the event loop thread, so the task is scheduled thread-safely.
+    def on_round_filled(round_id: int):
+        event_loop.call_soon_threadsafe(lambda: event_loop.create_task(trigger_immediate_draw(round_id, bot_instance)))
+    rm_add_round_filled_listener(on_round_filled)
 
 
     logger.info(f"Configurando job 'check_expired_rounds' cada {CHECK_EXPIRED_INTERVAL_SECONDS} segundos.")
@@ -525,15 +717,27 @@ async def on_startup(dispatcher: Dispatcher, bot_instance: Bot, pm_instance: Pay
     logger.info(f"Configurando job 'create_scheduled_round' cada {CREATE_SCHEDULED_INTERVAL_SECONDS} segundos.")
     # Pass bot_instance_for_job to functools.partial
     aioschedule.every(CREATE_SCHEDULED_INTERVAL_SECONDS).seconds.do(functools.partial(job_create_scheduled_round, bot_instance_for_job=bot_instance))
+
+    # Online DB backups (leader only, like every scheduled job): rotating snapshots verified with integrity_check
+    if BACKUP_ENABLED:
+        logger.info(f"Configurando job 'backup_database' cada {BACKUP_INTERVAL_SECONDS} segundos en '{BACKUP_SETTINGS['dest_dir']}' (conserva {BACKUP_SETTINGS['keep']}).")
+        aioschedule.every(BACKUP_INTERVAL_SECONDS).seconds.do(functools.partial(job_backup_database, **BACKUP_SETTINGS))
+
+    # Retention (leader only): old finished/cancelled rounds go to the archive DB, then incremental VACUUM
+    if RETENTION_ENABLED:
+        logger.info(f"Configurando job 'archive_old_rounds' cada {RETENTION_INTERVAL_SECONDS} segundos (rondas de más de {RETENTION_SETTINGS['days']} días -> '{RETENTION_SETTINGS['archive_path']}').")
+        aioschedule.every(RETENTION_INTERVAL_SECONDS).seconds.do(functools.partial(job_archive_old_rounds, **RETENTION_SETTINGS))
     
     # Create and launch the scheduler task
     async def scheduler():
         logger.info("Scheduler (aioschedule) started. Executing initial jobs after a short wait...")
         # Execute jobs once at startup with a small delay
         await asyncio.sleep(5) # Wait 5 seconds before the first execution
-        
-        # Execute job_check_expired_rounds only if the function is available
-        if 'job_check_expired_rounds' in globals() and asyncio.iscoroutinefunction(job_check_expired_rounds):
+
+        # Execute job_check_expired_rounds only if the function is available (and only on the leader replica)
+        if not leader_elector.is_leader:
+             logger.info(f"Replica {leader_elector.holder_id} is not the scheduler leader. Skipping initial job_check_expired_rounds execution.")
+        elif 'job_check_expired_rounds' in globals() and asyncio.iscoroutinefunction(job_check_expired_rounds):
              logger.info("Executing job_check_expired_rounds for the first time...")
              asyncio.create_task(job_check_expired_rounds(bot_instance_for_job=bot_instance)) # Pass bot_instance
         else:
@@ -541,8 +745,10 @@ async def on_startup(dispatcher: Dispatcher, bot_instance: Bot, pm_instance: Pay
 
         await asyncio.sleep(5) # Small delay
 
-        # Execute job_create_scheduled_round only if the function is available
-        if 'job_create_scheduled_round' in globals() and asyncio.iscoroutinefunction(job_create_scheduled_round):
+        # Execute job_create_scheduled_round only if the function is available (and only on the leader replica)
+        if not leader_elector.is_leader:
+             logger.info(f"Replica {leader_elector.holder_id} is not the scheduler leader. Skipping initial job_create_scheduled_round execution.")
+        elif 'job_create_scheduled_round' in globals() and asyncio.iscoroutinefunction(job_create_scheduled_round):
              logger.info("Executing job_create_scheduled_round for the first time...")
              asyncio.create_task(job_create_scheduled_round(bot_instance_for_job=bot_instance)) # Pass bot_instance
         else:
@@ -550,7 +756,9 @@ async def on_startup(dispatcher: Dispatcher, bot_instance: Bot, pm_instance: Pay
 
 
         while True:
-            await aioschedule.run_pending()
+            # Followers keep their jobs pending; they run as soon as this replica takes over the lease
+            if leader_elector.is_leader:
+                await aioschedule.run_pending()
             await asyncio.sleep(1) # Wait 1 second between scheduler checks
 
     asyncio.create_task(scheduler()) # Launch the scheduler as a background task
@@ -561,6 +769,15 @@ async def on_startup(dispatcher: Dispatcher, bot_instance: Bot, pm_instance: Pay
 async def on_shutdown(dispatcher: Dispatcher):
     logger.info("Apagando bot (Aiogram)...")
     
+    # Release the scheduler lease so another replica takes over without waiting for the TTL
+    if leader_elector is not None:
+        leader_elector.stop(release=True)
+        logger.info("Leader election stopped.")
+
+    if loop_monitor is not None:
+        loop_monitor.log_top_offenders() # Last report before exiting
+        loop_monitor.stop()
+
     # Stop aioschedule tasks
     if hasattr(aioschedule, 'clear') and callable(getattr(aioschedule, 'clear')):
         aioschedule.clear() 
@@ -599,6 +816,19 @@ async def main():
             config = json.load(f)
             BOT_TOKEN = config.get('BOT_TOKEN')
             # BOT_USERNAME = config.get('BOT_USERNAME') # If you need it
+            # Optional: serve the webapp from this process and event loop (webapp/async_app.py)
+            WEBAPP_ASYNC_ENABLED = bool(config.get('WEBAPP_ASYNC_ENABLED', False))
+            WEBAPP_ASYNC_HOST = config.get('WEBAPP_ASYNC_HOST', '0.0.0.0')
+            WEBAPP_ASYNC_PORT = int(config.get('WEBAPP_ASYNC_PORT', 8080))
+            # Logging through a queue: records are formatted and written by a listener thread, off the event loop
+            LOG_QUEUE_ENABLED = bool(config.get('LOG_QUEUE_ENABLED', True))
+            LOG_LEVEL = config.get('LOG_LEVEL', 'INFO')
+            LOG_STRUCTURED = bool(config.get('LOG_STRUCTURED', True))
+            LOG_SAMPLING = config.get('LOG_SAMPLING') or {}
+            # Tracing spans (src/tracing.py): handlers, Bot API calls, ton_api and db; optional JSONL export
+            TRACING_ENABLED = bool(config.get('TRACING_ENABLED', False))
+            TRACE_EXPORT_PATH = config.get('TRACE_EXPORT_PATH', DEFAULT_TRACE_EXPORT_PATH) or None
+            TRACE_EXPORT_MAX_BYTES = int(config.get('TRACE_EXPORT_MAX_MB', DEFAULT_TRACE_EXPORT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024
     except FileNotFoundError:
         logger.critical(f"FATAL ERROR: {CONFIG_FILE_PATH} not found.")
         return # Do not proceed if config fails
@@ -613,11 +843,21 @@ async def main():
         logger.critical("FATAL ERROR: BOT_TOKEN is empty in config.json.")
         return # Do not proceed if token is empty
 
+    if LOG_QUEUE_ENABLED:
+        try:
+            setup_logging(LOG_LEVEL, structured=LOG_STRUCTURED, sampling=LOG_SAMPLING)
+            logger.info("Queue-based logging started.", extra=log_fields(level=LOG_LEVEL, structured=LOG_STRUCTURED,
+                                                                         sampling=json.dumps(LOG_SAMPLING)))
+        except (ValueError, TypeError) as e:
+            logger.error(f"Invalid logging configuration ({e}). Keeping synchronous logging.")
+
 
     # --- Initialize bot and dispatcher (CREATE INSTANCES HERE) ---
     storage = MemoryStorage()
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     dp = Dispatcher(storage=storage)
+    configure_tracing(TRACING_ENABLED, TRACE_EXPORT_PATH, TRACE_EXPORT_MAX_BYTES)
+    bot.session.middleware(bot_request_span_middleware) # One span per Bot API request (replies and notifications)
 
     # --- Instantiate PaymentManager ---
     # PaymentManager no longer needs db_instance if db.py manages its connection
@@ -632,6 +872,15 @@ async def main():
     # Call the startup function, passing dp, bot, and pm_instance
     await on_startup(dp, bot, pm_instance)
 
+    # Async webapp: shares the round cache, event bus and HTTP cache with the bot (no Flask process needed)
+    webapp_runner = None
+    if WEBAPP_ASYNC_ENABLED:
+        try:
+            from webapp.async_app import start_async_webapp
+            webapp_runner = await start_async_webapp(WEBAPP_ASYNC_HOST, WEBAPP_ASYNC_PORT)
+        except Exception as e:
+            logger.error(f"Could not start the async webapp on {WEBAPP_ASYNC_HOST}:{WEBAPP_ASYNC_PORT}: {e}", exc_info=True)
+
     # Initiate polling
     # In Aiogram v3.x, dp.start_polling() is used
     try:
@@ -647,8 +896,13 @@ async def main():
     except Exception as e:
         logger.critical(f"Error during bot polling: {e}", exc_info=True)
     finally:
+        if webapp_runner is not None:
+            await webapp_runner.cleanup()
+            logger.info("Async webapp stopped.")
         # Call the shutdown function
         await on_shutdown(dp)
+        stop_exporter() # Write the spans still in the queue
+        stop_logging() # Flush the records still in the queue
 
 
 if __name__ == '__main__':
@@ -4,8 +4,14 @@ import sqlite3
 import logging
 import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timezone # Aseguramos timezone para consistencia
 
+from .log_pipeline import log_fields # Campos estructurados (clave=valor) de los registros
+from .tracing import traced # Un span por llamada en las funciones del camino de compra y sorteo
+
 logger = logging.getLogger(__name__)
 
 # DATABASE_NAME será idealmente cargado desde config.json en bot.py y pasado aquí,
@@ -13,13 +19,118 @@ logger = logging.getLogger(__name__)
 # Por ahora, lo definimos aquí, pero bot.py se asegurará de usar este nombre.
 DATABASE_NAME = 'bot_lotto_data.db' # Asegúrate que coincida con tu config.json
 
+# Versiones en memoria de datos que otros módulos cachean (p. ej. ('payments', telegram_id)):
+# cada escritura sube la versión y las cachés comparan la que guardaron con la actual.
+# Solo cuentan las escrituras de este proceso (otro proceso no sube estas versiones).
+DATA_VERSION_ROUNDS = 'rounds'   # Rondas y sus participantes (estado, boletos, altas y bajas)
+DATA_VERSION_WINNERS = 'winners' # Resultados de sorteos (draw_results)
+_data_versions = {}
+_data_versions_lock = threading.Lock()
+
+def _bump_data_version(key) -> None:
+    with _data_versions_lock:
+        _data_versions[key] = _data_versions.get(key, 0) + 1
+
+def get_data_version(key) -> int:
+    """Versión actual de `key` en este proceso (0 si nunca cambió)."""
+    with _data_versions_lock:
+        return _data_versions.get(key, 0)
+
 def get_db_connection(db_name: str = DATABASE_NAME):
     """Establece y devuelve una conexión a la base de datos SQLite."""
     # check_same_thread=False es importante para Aiogram si se usa SQLite en un entorno async
-    conn = sqlite3.connect(db_name, check_same_thread=False)
+    factory = _LockTimingConnection if _lock_wait_tracking['enabled'] else sqlite3.Connection
+    conn = sqlite3.connect(db_name, check_same_thread=False, factory=factory)
     conn.row_factory = sqlite3.Row # Para acceder a las columnas por nombre
     return conn
 
+# --- Medición de esperas por el lock de escritura (pruebas de carga) ---
+# SQLite admite un solo escritor: quien abre una transacción de escritura (BEGIN IMMEDIATE o el primer
+# INSERT/UPDATE/DELETE) o hace COMMIT espera hasta que los demás sueltan el lock. Con la medición activa
+# (enable_lock_wait_tracking) se cronometran esas sentencias; las que superan LOCK_WAIT_THRESHOLD_SECONDS
+# cuentan como espera, y los "database is locked" (se agotó el timeout de sqlite3) como error.
+# Apagada por defecto: get_db_connection usa la conexión estándar, sin coste.
+LOCK_WAIT_THRESHOLD_SECONDS = 0.005
+LOCK_WAIT_SAMPLES = 10_000
+_WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'BEGIN IMMEDIATE', 'BEGIN EXCLUSIVE')
+_lock_wait_tracking = {'enabled': False}
+_lock_wait_samples = []
+_lock_wait_stats = {'acquisitions': 0, 'waits': 0, 'locked_errors': 0, 'total_wait_seconds': 0.0}
+_lock_wait_lock = threading.Lock()
+
+def enable_lock_wait_tracking(enabled: bool = True) -> None:
+    """Activa (o apaga) la medición en las conexiones que se abran a partir de ahora."""
+    _lock_wait_tracking['enabled'] = enabled
+
+def reset_lock_wait_stats() -> None:
+    with _lock_wait_lock:
+        _lock_wait_samples.clear()
+        _lock_wait_stats.update(acquisitions=0, waits=0, locked_errors=0, total_wait_seconds=0.0)
+
+def get_lock_wait_stats() -> dict:
+    """Adquisiciones del lock de escritura medidas, esperas (> umbral), errores 'locked' y percentiles en ms."""
+    with _lock_wait_lock:
+        samples = sorted(_lock_wait_samples)
+        stats = dict(_lock_wait_stats)
+    def percentile(p):
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3) if samples else None
+    return {**stats, 'threshold_ms': LOCK_WAIT_THRESHOLD_SECONDS * 1000, 'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95), 'p99_ms': percentile(0.99), 'max_ms': percentile(1.0)}
+
+def _record_lock_acquisition(seconds: float, locked: bool) -> None:
+    with _lock_wait_lock:
+        _lock_wait_stats['acquisitions'] += 1
+        _lock_wait_stats['locked_errors'] += locked
+        if seconds > LOCK_WAIT_THRESHOLD_SECONDS:
+            _lock_wait_stats['waits'] += 1
+            _lock_wait_stats['total_wait_seconds'] += seconds
+        if len(_lock_wait_samples) < LOCK_WAIT_SAMPLES:
+            _lock_wait_samples.append(seconds)
+
+def _timed_lock_acquisition(run, sql: str, in_transaction: bool):
+    """Ejecuta `run()` cronometrándolo si `sql` abre una transacción de escritura."""
+    if in_transaction or not sql.lstrip()[:15].upper().startswith(_WRITE_PREFIXES):
+        return run()
+    started = time.perf_counter()
+    try:
+        result = run()
+    except sqlite3.OperationalError as e:
+        _record_lock_acquisition(time.perf_counter() - started, 'locked' in str(e))
+        raise
+    _record_lock_acquisition(time.perf_counter() - started, False)
+    return result
+
+class _LockTimingCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return _timed_lock_acquisition(lambda: super(_LockTimingCursor, self).execute(sql, parameters),
+                                       sql, self.connection.in_transaction)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _timed_lock_acquisition(lambda: super(_LockTimingCursor, self).executemany(sql, seq_of_parameters),
+                                       sql, self.connection.in_transaction)
+
+class _LockTimingConnection(sqlite3.Connection):
+    def cursor(self, factory=_LockTimingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        if not self.in_transaction:
+            return super().commit()
+        # COMMIT necesita el lock exclusivo: espera a que terminen los lectores (journal por defecto)
+        started = time.perf_counter()
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            _record_lock_acquisition(time.perf_counter() - started, 'locked' in str(e))
+            raise
+        _record_lock_acquisition(time.perf_counter() - started, False)
+
 def generate_simulated_smart_contract_address(round_id: int) -> str:
     """Genera una dirección simulada para el Smart Contract."""
     data_to_hash = f"sim_contract_round_{round_id}-{datetime.now().timestamp()}"
@@ -33,17 +144,21 @@ def _add_column_if_not_exists(cursor: sqlite3.Cursor, table_name: str, column_na
     except sqlite3.OperationalError:
         try:
             cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
-            logger.info(f"Columna '{column_name}' añadida a la tabla '{table_name}'.")
+            logger.info("Columna '%s' añadida a la tabla '%s'.", column_name, table_name)
         except sqlite3.OperationalError as e_alter: # Podría fallar si la tabla está bloqueada o por otra razón
             logger.error(f"Error al intentar añadir columna '{column_name}' a '{table_name}': {e_alter}")
 
 
 def init_db(db_name: str = DATABASE_NAME):
     """Inicializa la base de datos: crea tablas y añade columnas si faltan."""
+    clear_user_cache() # Los usuarios vistos antes pertenecen a otra base de datos (o a una recién creada)
     conn = None
     try:
         conn = get_db_connection(db_name)
         cursor = conn.cursor()
+        # Solo surte efecto en una base nueva (antes de crear la primera tabla): permite que src.retention
+        # devuelva las páginas liberadas con PRAGMA incremental_vacuum sin un VACUUM completo
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
 
         # Tabla 'users': Mantiene telegram_id, username, y ahora ton_wallet
         cursor.execute('''
@@ -71,6 +186,8 @@ def init_db(db_name: str = DATABASE_NAME):
                 deleted BOOLEAN DEFAULT 0,
                 simulated_contract_address TEXT,
                 ticket_price_simulated REAL DEFAULT 1.0, -- Precio del boleto para esta ronda simulada
+                filled_time TEXT,        -- Momento (ISO8601 UTC) en que se vendió el último boleto; dispara el sorteo inmediato
+                drawing_since TEXT,      -- Momento (ISO8601 UTC) en que pasó a 'drawing' o se retomó su cierre
                 FOREIGN KEY (creator_telegram_id) REFERENCES users(telegram_id)
             )
         ''')
@@ -78,7 +195,7 @@ def init_db(db_name: str = DATABASE_NAME):
         cols_rounds = {
             "round_type": "TEXT NOT NULL DEFAULT 'scheduled'", "creator_telegram_id": "TEXT",
             "deleted": "BOOLEAN DEFAULT 0", "simulated_contract_address": "TEXT",
-            "ticket_price_simulated": "REAL DEFAULT 1.0"
+            "ticket_price_simulated": "REAL DEFAULT 1.0", "filled_time": "TEXT", "drawing_since": "TEXT"
         }
         for col, col_type in cols_rounds.items():
             _add_column_if_not_exists(cursor, "rounds", col, col_type)
@@ -95,12 +212,16 @@ def init_db(db_name: str = DATABASE_NAME):
                 assigned_number INTEGER,
                 paid_real BOOLEAN DEFAULT 0, -- Para el flujo de simulación, esto significa que se unió
                 purchase_time TEXT,       -- Hora de "compra" del boleto simulado (ISO8601 UTC)
+                ticket_count INTEGER NOT NULL DEFAULT 1, -- Boletos del usuario en la ronda (peso en el sorteo)
                 FOREIGN KEY (round_id) REFERENCES rounds(id),
                 FOREIGN KEY (telegram_id) REFERENCES users(telegram_id),
                 UNIQUE(round_id, telegram_id)
             )
         ''')
         _add_column_if_not_exists(cursor, "round_participants", "purchase_time", "TEXT")
+        _add_column_if_not_exists(cursor, "round_participants", "ticket_count", "INTEGER NOT NULL DEFAULT 1")
+        # Índice número asignado -> participante: sorteo y notificaciones de rondas grandes sin cargar la ronda entera
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_round_participants_number ON round_participants(round_id, assigned_number)")
         # Columna 'paid_simulated' se puede eliminar si ya no se usa, 'paid_real' toma su lugar en el contexto de simulación.
 
 
@@ -114,6 +235,7 @@ def init_db(db_name: str = DATABASE_NAME):
                 winner_telegram_id TEXT,
                 prize_amount_simulated TEXT, -- "100.00 unidades"
                 prize_amount_real REAL,      -- 100.00
+                prize_amount_nano INTEGER,   -- Monto exacto en nanoTON (payout_ledger)
                 FOREIGN KEY (round_id) REFERENCES rounds(id),
                 FOREIGN KEY (winner_telegram_id) REFERENCES users(telegram_id),
                 UNIQUE(round_id, draw_order)
@@ -129,15 +251,42 @@ def init_db(db_name: str = DATABASE_NAME):
                 creator_telegram_id TEXT,   -- NULL para bot o gas_fee
                 amount_simulated TEXT,
                 amount_real REAL,
+                amount_nano INTEGER,        -- Monto exacto en nanoTON (payout_ledger)
                 transaction_id TEXT,        -- Placeholder para futuro, podría ser un hash interno
                 FOREIGN KEY (round_id) REFERENCES rounds(id),
                 FOREIGN KEY (creator_telegram_id) REFERENCES users(telegram_id),
                 UNIQUE(round_id, creator_type, creator_telegram_id) -- Asegurar unicidad
             )
         ''')
+        _add_column_if_not_exists(cursor, "draw_results", "prize_amount_nano", "INTEGER")
         # Migraciones para 'creator_commission'
+        _add_column_if_not_exists(cursor, "creator_commission", "amount_nano", "INTEGER")
         # (la estructura UNIQUE cambió, puede ser complejo migrar sin borrar/recrear si hay datos)
 
+        # Tabla 'winner_stats': ranking histórico de ganadores (premios y monto total por usuario).
+        # settle_round la actualiza en la misma transacción que guarda los resultados: /api/winners/top
+        # lee el ranking por índice sin agregar draw_results.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS winner_stats (
+                telegram_id TEXT PRIMARY KEY,
+                wins INTEGER NOT NULL DEFAULT 0,
+                total_prize_nano INTEGER NOT NULL DEFAULT 0,
+                last_round_id INTEGER,
+                last_win_time TEXT,
+                FOREIGN KEY (telegram_id) REFERENCES users(telegram_id)
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_winner_stats_rank ON winner_stats(total_prize_nano, wins, telegram_id)")
+        # Migración: una base con sorteos anteriores al ranking lo llena una sola vez desde draw_results
+        if cursor.execute("SELECT 1 FROM winner_stats LIMIT 1").fetchone() is None:
+            cursor.execute('''
+                INSERT INTO winner_stats (telegram_id, wins, total_prize_nano, last_round_id)
+                SELECT winner_telegram_id, COUNT(*),
+                       SUM(COALESCE(prize_amount_nano, CAST(ROUND(COALESCE(prize_amount_real, 0) * 1000000000) AS INTEGER))),
+                       MAX(round_id)
+                FROM draw_results WHERE winner_telegram_id IS NOT NULL GROUP BY winner_telegram_id
+            ''')
+
 
         # --- NUEVAS TABLAS PARA PAGOS TON REALES ---
         # Tabla 'ton_transactions': Transacciones TON verificadas para compra de boletos
@@ -157,6 +306,8 @@ def init_db(db_name: str = DATABASE_NAME):
             -- FOREIGN KEY (lottery_round_id_assoc) REFERENCES rounds(id) -- Deshabilitamos FK aquí si rounds puede ser eliminada lógicamente
         )''')
         _add_column_if_not_exists(cursor, "ton_transactions", "lottery_round_id_assoc", "INTEGER")
+        # Historial de pagos por usuario paginado por (transaction_time, id): cada página es un rango del índice
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ton_transactions_user_time ON ton_transactions(telegram_id, transaction_time, id)")
         # Aseguramos que telegram_id pueda ser NULL temporalmente si la asociación no es inmediata
         # (Esto puede requerir una migración ALTER TABLE si la columna ya existía como NOT NULL)
         try:
@@ -170,7 +321,35 @@ def init_db(db_name: str = DATABASE_NAME):
              logger.warning(f"Columna 'telegram_id' en 'ton_transactions' es NOT NULL. Considera ALTER TABLE para permitir NULL si la asociación no es inmediata. Error: {e_op}")
 
 
-        logger.info(f"Base de datos '{db_name}' inicializada y tablas verificadas/actualizadas.")
+        # Tablas 'stats_daily' / 'stats_hourly': contadores por (bucket UTC, round_type) que las escrituras
+        # del juego suman en su misma transacción (_add_to_rollups). /stats lee solo estas filas.
+        for rollup_table, _ in STATS_ROLLUP_TABLES.values():
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {rollup_table} (
+                    bucket TEXT NOT NULL,         -- '2026-10-19' (día) o '2026-10-19T11' (hora), UTC
+                    round_type TEXT NOT NULL,     -- '' para pagos no asociados a una ronda
+                    {', '.join(f"{column} INTEGER NOT NULL DEFAULT 0" for column in STATS_COUNTERS)},
+                    PRIMARY KEY (bucket, round_type)
+                )
+            ''')
+        # Migración: una base con historial anterior a los rollups los llena una sola vez
+        if cursor.execute("SELECT 1 FROM stats_daily LIMIT 1").fetchone() is None:
+            _backfill_rollups(cursor)
+            conn.commit()
+
+
+        # Tabla 'scheduler_leases': Lease con heartbeat para elegir qué réplica del bot ejecuta los jobs
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduler_leases (
+                lease_name TEXT PRIMARY KEY,  -- e.g., 'scheduler'
+                holder_id TEXT NOT NULL,      -- Identificador de la réplica que tiene el lease
+                expires_at REAL NOT NULL,     -- Epoch (segundos) en que el lease caduca si no se renueva
+                term INTEGER NOT NULL DEFAULT 1 -- Se incrementa cada vez que el lease cambia de dueño
+            )
+        ''')
+
+
+        logger.info("Base de datos '%s' inicializada y tablas verificadas/actualizadas.", db_name)
 
     except sqlite3.Error as e:
         logger.error(f"Error al inicializar/actualizar la base de datos '{db_name}': {e}", exc_info=True)
@@ -178,50 +357,157 @@ def init_db(db_name: str = DATABASE_NAME):
         if conn:
             conn.close()
 
+# --- Rollups de estadísticas (stats_daily / stats_hourly) ---
+# Cada escritura del juego suma sus contadores al bucket del día y de la hora (UTC) de su marca de
+# tiempo, en su misma transacción: ronda creada (create_new_round), terminada o cancelada (transiciones
+# y settle_round, con premios y comisiones), participante y boletos (admisión) y pago verificado
+# (add_ton_transaction). Las consultas de /stats leen un rango de buckets por clave primaria: su costo
+# depende de la ventana pedida, no del historial (ni de lo que src.retention ya movió al archivo).
+STATS_COUNTERS = ('rounds_created', 'rounds_finished', 'rounds_cancelled', 'participants', 'tickets_sold',
+                  'payments', 'payments_nano', 'prizes_nano', 'commissions_nano')
+STATS_ROLLUP_TABLES = {'day': ('stats_daily', 10), 'hour': ('stats_hourly', 13)} # Tabla y largo del bucket en el ISO8601
+_ROUND_END_COUNTERS = {'finished': 'rounds_finished', 'cancelled': 'rounds_cancelled'}
+
+def _add_to_rollups(cursor: sqlite3.Cursor, round_type: str | None, at_iso: str, **deltas: int) -> None:
+    """Suma `deltas` a los buckets de `at_iso` (marca ISO8601 UTC) para `round_type`. No hace commit."""
+    columns = ', '.join(deltas)
+    updates = ', '.join(f"{column} = {column} + excluded.{column}" for column in deltas)
+    for table, bucket_length in STATS_ROLLUP_TABLES.values():
+        # Con cursor.connection: el rowcount del cursor del llamador sigue siendo el de su propia sentencia
+        cursor.connection.execute(
+            f"""INSERT INTO {table} (bucket, round_type, {columns}) VALUES (?, ?, {', '.join('?' for _ in deltas)})
+                ON CONFLICT(bucket, round_type) DO UPDATE SET {updates}""",
+            (at_iso[:bucket_length], round_type or '', *deltas.values())
+        )
+
+def _add_round_end_to_rollups(cursor: sqlite3.Cursor, round_type: str, status: str, at_iso: str, **deltas: int) -> None:
+    """Cuenta una ronda que llegó a 'finished' o 'cancelled' (otros estados no tienen contador)."""
+    if status in _ROUND_END_COUNTERS:
+        _add_to_rollups(cursor, round_type, at_iso, **{_ROUND_END_COUNTERS[status]: 1}, **deltas)
+
+def _backfill_rollups(cursor: sqlite3.Cursor) -> None:
+    """Llena los rollups desde las tablas del juego (un recorrido completo, una sola vez por base)."""
+    prize_nano = "COALESCE(d.prize_amount_nano, CAST(ROUND(COALESCE(d.prize_amount_real, 0) * 1000000000) AS INTEGER))"
+    commission_nano = "COALESCE(c.amount_nano, CAST(ROUND(COALESCE(c.amount_real, 0) * 1000000000) AS INTEGER))"
+    sources = ( # (columnas, marca de tiempo, tipo de ronda, valores, FROM ... WHERE)
+        (('rounds_created',), 'r.start_time', 'r.round_type', 'COUNT(*)', "rounds r WHERE r.start_time IS NOT NULL"),
+        (('rounds_finished',), 'r.end_time', 'r.round_type', 'COUNT(*)', "rounds r WHERE r.status = 'finished' AND r.end_time IS NOT NULL"),
+        (('rounds_cancelled',), 'r.end_time', 'r.round_type', 'COUNT(*)', "rounds r WHERE r.status = 'cancelled' AND r.end_time IS NOT NULL"),
+        (('participants', 'tickets_sold'), 'p.purchase_time', 'r.round_type', 'COUNT(*), SUM(p.ticket_count)',
+         "round_participants p JOIN rounds r ON r.id = p.round_id WHERE p.purchase_time IS NOT NULL"),
+        (('payments', 'payments_nano'), 't.transaction_time', "COALESCE(r.round_type, '')", 'COUNT(*), SUM(t.value_nano)',
+         "ton_transactions t LEFT JOIN rounds r ON r.id = t.lottery_round_id_assoc WHERE t.transaction_time IS NOT NULL"),
+        (('prizes_nano',), 'r.end_time', 'r.round_type', f"SUM({prize_nano})",
+         "draw_results d JOIN rounds r ON r.id = d.round_id WHERE r.end_time IS NOT NULL"),
+        (('commissions_nano',), 'r.end_time', 'r.round_type', f"SUM({commission_nano})",
+         "creator_commission c JOIN rounds r ON r.id = c.round_id WHERE r.end_time IS NOT NULL"),
+    )
+    for table, bucket_length in STATS_ROLLUP_TABLES.values():
+        for columns, timestamp, round_type, values, source in sources:
+            cursor.execute(
+                f"""INSERT INTO {table} (bucket, round_type, {', '.join(columns)})
+                    SELECT substr({timestamp}, 1, {bucket_length}), {round_type}, {values} FROM {source} GROUP BY 1, 2
+                    ON CONFLICT(bucket, round_type) DO UPDATE SET
+                    {', '.join(f"{column} = {column} + excluded.{column}" for column in columns)}"""
+            )
+
+def get_stats_totals(period: str = 'day', since_bucket: str | None = None) -> dict[str, dict]:
+    """
+    Suma de los rollups de `period` ('day' u 'hour') desde `since_bucket` inclusive ('2026-10-19' /
+    '2026-10-19T11'), por round_type ('' = pagos sin ronda). Retorna {round_type: {contador: valor}}.
+    """
+    table, _ = STATS_ROLLUP_TABLES[period]
+    conn = None
+    try:
+        conn = get_db_connection()
+        rows = conn.execute(
+            f"""SELECT round_type, {', '.join(f"SUM({column}) AS {column}" for column in STATS_COUNTERS)}
+                FROM {table} WHERE bucket >= ? GROUP BY round_type""",
+            (since_bucket or '',)
+        ).fetchall()
+        return {row['round_type']: {column: row[column] for column in STATS_COUNTERS} for row in rows}
+    except sqlite3.Error as e:
+        logger.error(f"Error leyendo rollups de estadísticas ({period} desde {since_bucket}): {e}", exc_info=True)
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+
 # --- Funciones de Usuario (Generales y TON) ---
-def get_or_create_user(telegram_id: str, username: str | None, first_name: str | None) -> None:
+# Caché LRU telegram_id -> (username, first_name, escrito_en) con lo último que este proceso dejó en la
+# DB: casi todos los mensajes traen un usuario sin cambios, que así no cuesta ningún viaje a la DB.
+# Un nombre distinto del guardado es un fallo (se escribe), también al volver a un nombre anterior.
+# Otra réplica puede renombrar al usuario sin pasar por esta caché: cada entrada caduca a los
+# USER_CACHE_TTL_SECONDS, así la DB nunca queda con un nombre viejo por más de ese tiempo.
+USER_CACHE_MAX_SIZE = 10_000
+USER_CACHE_TTL_SECONDS = 300
+_user_cache = OrderedDict()
+_user_cache_stats = {'hits': 0, 'misses': 0}
+_user_cache_lock = threading.Lock()
+
+def clear_user_cache() -> None:
+    with _user_cache_lock:
+        _user_cache.clear()
+
+def get_user_cache_stats() -> dict:
+    """Aciertos y fallos de la caché de get_or_create_user (un acierto no toca la DB)."""
+    with _user_cache_lock:
+        lookups = _user_cache_stats['hits'] + _user_cache_stats['misses']
+        return {**_user_cache_stats, 'hit_rate': _user_cache_stats['hits'] / lookups if lookups else 0.0,
+                'size': len(_user_cache)}
+
+@traced()
+def get_or_create_user(telegram_id: str, username: str | None, first_name: str | None = None) -> None:
+    """
+    Crea el usuario o actualiza username/first_name si cambiaron, en un solo INSERT ... ON CONFLICT.
+    Un valor vacío o None no borra el que ya había. Si este proceso escribió esos mismos datos hace
+    menos de USER_CACHE_TTL_SECONDS (caché LRU de USER_CACHE_MAX_SIZE entradas) no se consulta la DB.
+    """
+    db_username = username if username is not None else ""
+    db_first_name = first_name if first_name is not None else ""
+    cache_key = str(telegram_id)
+    with _user_cache_lock:
+        cached = _user_cache.get(cache_key)
+        # Un valor vacío no escribiría nada: coincide con cualquier valor guardado
+        if (cached is not None and time.monotonic() - cached[2] <= USER_CACHE_TTL_SECONDS
+                and db_username in ('', cached[0]) and db_first_name in ('', cached[1])):
+            _user_cache.move_to_end(cache_key)
+            _user_cache_stats['hits'] += 1
+            return
+        _user_cache_stats['misses'] += 1
+
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT telegram_id, username, first_name FROM users WHERE telegram_id = ?", (telegram_id,))
-        user_row = cursor.fetchone()
-        
-        db_username = username if username is not None else ""
-        db_first_name = first_name if first_name is not None else ""
-
-        if user_row is None:
-            cursor.execute("INSERT INTO users (telegram_id, username, first_name) VALUES (?, ?, ?)",
-                           (telegram_id, db_username, db_first_name))
-            conn.commit()
-            logger.info(f"Usuario creado: ID {telegram_id}, @{db_username}, Nombre: {db_first_name}")
-        else:
-            # Actualizar username o first_name si han cambiado o eran nulos y ahora tienen valor
-            needs_update = False
-            update_query = "UPDATE users SET "
-            params = []
-            if db_username and user_row["username"] != db_username:
-                update_query += "username = ?, "
-                params.append(db_username)
-                needs_update = True
-            if db_first_name and user_row["first_name"] != db_first_name:
-                update_query += "first_name = ?, "
-                params.append(db_first_name)
-                needs_update = True
-            
-            if needs_update:
-                update_query = update_query.strip(", ") + " WHERE telegram_id = ?"
-                params.append(telegram_id)
-                cursor.execute(update_query, tuple(params))
-                conn.commit()
-                logger.info(f"Datos de usuario actualizados para ID {telegram_id}")
-                
+        # El UPDATE solo se aplica si algún dato no vacío cambió: sin cambios no se escribe la fila
+        cursor.execute(
+            """INSERT INTO users (telegram_id, username, first_name) VALUES (?, ?, ?)
+               ON CONFLICT(telegram_id) DO UPDATE SET
+                   username = CASE WHEN excluded.username != '' THEN excluded.username ELSE users.username END,
+                   first_name = CASE WHEN excluded.first_name != '' THEN excluded.first_name ELSE users.first_name END
+               WHERE (excluded.username != '' AND users.username IS NOT excluded.username)
+                  OR (excluded.first_name != '' AND users.first_name IS NOT excluded.first_name)""",
+            (telegram_id, db_username, db_first_name)
+        )
+        conn.commit()
+        if cursor.rowcount:
+            logger.info("Usuario creado o actualizado: ID %s, @%s, Nombre: %s", telegram_id, db_username, db_first_name)
+        with _user_cache_lock:
+            # Lo que quedó en la DB; un campo vacío conserva el valor conocido (None si no se conoce)
+            known = _user_cache.get(cache_key) or (None, None, 0.0)
+            _user_cache[cache_key] = (db_username or known[0], db_first_name or known[1], time.monotonic())
+            _user_cache.move_to_end(cache_key)
+            if len(_user_cache) > USER_CACHE_MAX_SIZE:
+                _user_cache.popitem(last=False)
     except sqlite3.Error as e:
         logger.error(f"Error al obtener o crear usuario {telegram_id}: {e}", exc_info=True)
     finally:
         if conn:
             conn.close()
 
+@traced()
 def update_user_ton_wallet(telegram_id: str, ton_wallet_address: str | None):
     """Asocia o actualiza la wallet TON de un usuario."""
     conn = None
@@ -232,7 +518,7 @@ def update_user_ton_wallet(telegram_id: str, ton_wallet_address: str | None):
         cursor.execute("UPDATE users SET ton_wallet = ? WHERE telegram_id = ?", (ton_wallet_address, telegram_id))
         conn.commit()
         if cursor.rowcount > 0:
-            logger.info(f"Wallet TON para usuario {telegram_id} actualizada a: {ton_wallet_address}")
+            logger.info("Wallet TON para usuario %s actualizada.", telegram_id, extra=log_fields(wallet=ton_wallet_address))
         else:
             # Podría ser que el usuario no exista, o la wallet ya era la misma.
             # get_or_create_user debe llamarse en el flujo del bot antes de esto.
@@ -242,7 +528,7 @@ def update_user_ton_wallet(telegram_id: str, ton_wallet_address: str | None):
             cursor.execute("UPDATE users SET ton_wallet = ? WHERE telegram_id = ?", (ton_wallet_address, telegram_id))
             conn.commit()
             if cursor.rowcount > 0:
-                 logger.info(f"Wallet TON establecida finalmente para {telegram_id} a: {ton_wallet_address}")
+                 logger.info("Wallet TON establecida finalmente para %s a: %s", telegram_id, ton_wallet_address)
 
     except sqlite3.Error as e:
         logger.error(f"Error actualizando wallet TON para {telegram_id}: {e}", exc_info=True)
@@ -250,6 +536,7 @@ def update_user_ton_wallet(telegram_id: str, ton_wallet_address: str | None):
         if conn:
             conn.close()
 
+@traced()
 def get_user_ton_wallet(telegram_id: str) -> str | None:
     """Obtiene la wallet TON registrada de un usuario."""
     conn = None
@@ -268,6 +555,7 @@ def get_user_ton_wallet(telegram_id: str) -> str | None:
 
 # --- Funciones para Transacciones TON (Verificación de Pagos Off-chain) ---
 
+@traced()
 def add_ton_transaction(
     telegram_id: str | None, user_ton_wallet: str, bot_ton_wallet: str,
     transaction_hash: str, value_nano: int, comment: str | None, 
@@ -291,9 +579,15 @@ def add_ton_transaction(
                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
             (telegram_id, user_ton_wallet, bot_ton_wallet, transaction_hash, value_nano, comment, tx_time_utc_iso, lottery_round_id_assoc)
         )
+        round_row = cursor.execute("SELECT round_type FROM rounds WHERE id = ?", (lottery_round_id_assoc,)).fetchone() \
+            if lottery_round_id_assoc is not None else None
+        _add_to_rollups(cursor, round_row[0] if round_row else None, tx_time_utc_iso, payments=1, payments_nano=value_nano)
         conn.commit()
         tx_db_id = cursor.lastrowid
-        logger.info(f"Transacción TON {transaction_hash[:10]}... guardada con ID {tx_db_id} para usuario {telegram_id}, asociada a ronda {lottery_round_id_assoc}.")
+        if telegram_id:
+            _bump_data_version(('payments', str(telegram_id))) # Invalida las páginas de /mis_pagos_ton de este usuario
+        logger.info("Transacción TON guardada.", extra=log_fields(tx_id=tx_db_id, hash=transaction_hash[:10], telegram_id=telegram_id,
+                                                               round_id=lottery_round_id_assoc, value_nano=value_nano))
         return tx_db_id
     except sqlite3.IntegrityError:
         logger.warning(f"Transacción TON con hash {transaction_hash[:10]}... ya existe. No se añadió.")
@@ -308,6 +602,7 @@ def add_ton_transaction(
 # --- Funciones check_transaction y add_v_transaction esperadas por ton_api.py ---
 # Estas funciones se adaptan para usar la nueva tabla ton_transactions
 
+@traced()
 def check_transaction(transaction_hash: str) -> bool:
     """
     Verifica si una transacción con el dado hash ya existe en la tabla ton_transactions.
@@ -321,10 +616,10 @@ def check_transaction(transaction_hash: str) -> bool:
         cursor.execute("SELECT id FROM ton_transactions WHERE transaction_hash = ?", (transaction_hash,))
         result = cursor.fetchone()
         if result:
-            logger.debug(f"check_transaction: Hash {transaction_hash[:10]}... encontrado en DB.")
+            logger.debug("check_transaction: Hash %s... encontrado en DB.", transaction_hash[:10])
             return True # El hash existe en la base de datos
         else:
-            logger.debug(f"check_transaction: Hash {transaction_hash[:10]}... NO encontrado en DB.")
+            logger.debug("check_transaction: Hash %s... NO encontrado en DB.", transaction_hash[:10])
             return False # El hash no existe
 
     except sqlite3.Error as e:
@@ -360,7 +655,7 @@ def add_v_transaction(source: str, tx_hash: str, value: int, comment: str) -> bo
         user_row = cursor.fetchone()
         if user_row:
             telegram_id_assoc = user_row["telegram_id"]
-            logger.debug(f"add_v_transaction: Wallet {source} asociada a telegram_id {telegram_id_assoc}.")
+            logger.debug("add_v_transaction: Wallet %s asociada a telegram_id %s.", source, telegram_id_assoc)
         else:
              logger.warning(f"add_v_transaction: No se encontró telegram_id asociado a la wallet de origen {source}. La transacción se guardará sin asociación directa a usuario Telegram.")
     except sqlite3.Error as e:
@@ -427,11 +722,126 @@ def get_user_ton_payments_history(telegram_id: str) -> list[dict]:
             conn.close()
 
 
+@traced()
+def get_user_ton_payments_page(telegram_id: str, page_size: int = 5, before: tuple | None = None,
+                               after: tuple | None = None) -> dict:
+    """
+    Una página del historial de pagos TON de un usuario, del más reciente al más antiguo, paginada
+    por clave (transaction_time, id) en lugar de OFFSET: cada página es un único rango del índice
+    idx_ton_transactions_user_time, cueste lo mismo la primera que la número cien.
+    `before` = (transaction_time, id) da la página más antigua que esa fila; `after`, la más reciente.
+    Retorna {'payments': [dict], 'has_older': bool, 'has_newer': bool}.
+    """
+    columns = "id, transaction_hash, value_nano, comment, transaction_time, lottery_round_id_assoc, user_ton_wallet"
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        if after is not None:
+            cursor.execute(
+                f"SELECT {columns} FROM ton_transactions WHERE telegram_id = ? AND (transaction_time, id) > (?, ?) "
+                "ORDER BY transaction_time ASC, id ASC LIMIT ?",
+                (telegram_id, after[0], after[1], page_size + 1)
+            )
+            rows = [dict(row) for row in cursor.fetchall()]
+            has_newer = len(rows) > page_size
+            return {'payments': rows[:page_size][::-1], 'has_older': True, 'has_newer': has_newer}
+
+        if before is not None:
+            cursor.execute(
+                f"SELECT {columns} FROM ton_transactions WHERE telegram_id = ? AND (transaction_time, id) < (?, ?) "
+                "ORDER BY transaction_time DESC, id DESC LIMIT ?",
+                (telegram_id, before[0], before[1], page_size + 1)
+            )
+        else:
+            cursor.execute(
+                f"SELECT {columns} FROM ton_transactions WHERE telegram_id = ? ORDER BY transaction_time DESC, id DESC LIMIT ?",
+                (telegram_id, page_size + 1)
+            )
+        rows = [dict(row) for row in cursor.fetchall()]
+        return {'payments': rows[:page_size], 'has_older': len(rows) > page_size, 'has_newer': before is not None}
+    except sqlite3.Error as e:
+        logger.error(f"Error obteniendo página de pagos TON para {telegram_id}: {e}", exc_info=True)
+        return {'payments': [], 'has_older': False, 'has_newer': False}
+    finally:
+        if conn:
+            conn.close()
+
+
+# --- Funciones de Lease (Elección de líder entre réplicas del bot) ---
+
+def try_acquire_lease(lease_name: str, holder_id: str, ttl_seconds: float, now: float | None = None) -> bool:
+    """
+    Adquiere o renueva un lease en una sola sentencia atómica.
+    Gana si el lease no existe, si ya es de `holder_id` (renovación/heartbeat)
+    o si el dueño anterior dejó que caducara. Retorna True si `holder_id` queda como dueño.
+    """
+    conn = None
+    now = time.time() if now is None else now
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """INSERT INTO scheduler_leases (lease_name, holder_id, expires_at, term)
+               VALUES (?, ?, ?, 1)
+               ON CONFLICT(lease_name) DO UPDATE SET
+                   term = CASE WHEN scheduler_leases.holder_id = excluded.holder_id
+                               THEN scheduler_leases.term ELSE scheduler_leases.term + 1 END,
+                   holder_id = excluded.holder_id,
+                   expires_at = excluded.expires_at
+               WHERE scheduler_leases.holder_id = excluded.holder_id OR scheduler_leases.expires_at < ?""",
+            (lease_name, holder_id, now + ttl_seconds, now)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        # Ante un error de DB (ej. 'database is locked') no podemos asegurar el lease: asumimos que no lo tenemos.
+        logger.error(f"Error adquiriendo/renovando lease '{lease_name}' para {holder_id}: {e}", exc_info=True)
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def release_lease(lease_name: str, holder_id: str) -> bool:
+    """Libera un lease solo si `holder_id` es su dueño actual (para un failover inmediato al apagar)."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        # Se marca como caducado en lugar de borrarlo para conservar el 'term'
+        cursor.execute("UPDATE scheduler_leases SET expires_at = 0 WHERE lease_name = ? AND holder_id = ?", (lease_name, holder_id))
+        conn.commit()
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Error liberando lease '{lease_name}' de {holder_id}: {e}", exc_info=True)
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def get_lease(lease_name: str) -> dict | None:
+    """Obtiene el estado actual de un lease (holder_id, expires_at, term) o None si nadie lo tiene."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT lease_name, holder_id, expires_at, term FROM scheduler_leases WHERE lease_name = ?", (lease_name,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Error obteniendo lease '{lease_name}': {e}", exc_info=True)
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
 # --- Funciones para Rondas de Lotería (Simuladas, adaptadas de tu original) ---
 # Estas funciones son para la lógica de simulación si aún la necesitas.
 # Si tu bot solo usará pagos TON reales, puedes eliminar o ignorar estas funciones
 # y las tablas 'rounds', 'round_participants', 'draw_results', 'creator_commission'.
 
+@traced()
 def create_new_round(round_type: str, creator_telegram_id: str | None, ticket_price: float = 1.0) -> int | None:
     """Crea una nueva ronda (simulada) y retorna su ID."""
     conn = None
@@ -457,8 +867,11 @@ def create_new_round(round_type: str, creator_telegram_id: str | None, ticket_pr
 
         sim_addr = generate_simulated_smart_contract_address(round_id)
         cursor.execute("UPDATE rounds SET simulated_contract_address = ? WHERE id = ?", (sim_addr, round_id))
+        _add_to_rollups(cursor, round_type, now_utc_iso, rounds_created=1)
         conn.commit()
-        logger.info(f"Nueva ronda simulada '{round_type}' ID:{round_id}, Precio:{ticket_price} (Creador:{creator_telegram_id}) creada.")
+        _bump_data_version(DATA_VERSION_ROUNDS)
+        logger.info("Nueva ronda simulada creada.", extra=log_fields(round_id=round_id, round_type=round_type,
+                                                                    ticket_price=ticket_price, creator=creator_telegram_id))
         return round_id
     except sqlite3.Error as e:
         logger.error(f"Error creando nueva ronda simulada '{round_type}': {e}", exc_info=True)
@@ -468,6 +881,7 @@ def create_new_round(round_type: str, creator_telegram_id: str | None, ticket_pr
         if conn:
             conn.close()
 
+@traced()
 def get_round_by_id(round_id: int) -> dict | None:
     """Obtiene datos de una ronda simulada por su ID."""
     conn = None
@@ -485,6 +899,7 @@ def get_round_by_id(round_id: int) -> dict | None:
         if conn:
             conn.close()
             
+@traced()
 def get_active_round() -> dict | None:
     """Obtiene la ronda simulada activa (waiting_to_start o waiting_for_payments, no eliminada)."""
     conn = None
@@ -504,6 +919,7 @@ def get_active_round() -> dict | None:
         if conn:
             conn.close()
             
+@traced()
 def get_rounds_by_status(status_list: list[str], check_deleted: bool = False) -> list[dict]:
     """Obtiene rondas simuladas por lista de estados."""
     conn = None
@@ -540,8 +956,11 @@ def add_participant_to_round(round_id: int, telegram_id: str, assigned_number: i
             "INSERT INTO round_participants (round_id, telegram_id, assigned_number, paid_real, purchase_time) VALUES (?, ?, ?, 1, ?)",
             (round_id, telegram_id, assigned_number, now_utc_iso)
         )
+        round_row = cursor.execute("SELECT round_type FROM rounds WHERE id = ?", (round_id,)).fetchone()
+        _add_to_rollups(cursor, round_row[0] if round_row else None, now_utc_iso, participants=1, tickets_sold=1)
         conn.commit()
-        logger.info(f"Participante {telegram_id} añadido a ronda simulada {round_id} con número {assigned_number}.")
+        _bump_data_version(DATA_VERSION_ROUNDS)
+        logger.info("Participante %s añadido a ronda simulada %s con número %s.", telegram_id, round_id, assigned_number)
         return True
     except sqlite3.IntegrityError: # Usuario ya en la ronda
         logger.warning(f"Participante {telegram_id} ya estaba en ronda simulada {round_id}.")
@@ -594,6 +1013,215 @@ def count_round_participants(round_id: int) -> int:
         if conn:
             conn.close()
 
+_PARTICIPANT_COLUMNS = "rp.telegram_id, u.username, u.first_name, rp.assigned_number, rp.paid_real, rp.purchase_time, rp.ticket_count"
+
+@traced()
+def add_tickets_to_round(round_id: int, telegram_id: str, ticket_count: int, max_tickets: int) -> dict | None:
+    """
+    Suma `ticket_count` boletos de un usuario a una ronda en una sola transacción.
+    La primera compra crea su fila con el siguiente número asignado; las siguientes solo
+    incrementan ticket_count (UNIQUE(round_id, telegram_id) se mantiene: un número por usuario).
+    Si la compra supera `max_tickets` boletos en la ronda no se escribe nada.
+    La compra que ocupa el último boleto marca rounds.filled_time en la misma transacción: solo
+    esa admisión recibe 'filled' True, así el sorteo inmediato se dispara una única vez.
+    Si la ronda ya no está abierta tampoco se escribe nada y 'closed' es True (el estado se
+    comprueba dentro de la transacción, no en cachés del llamador).
+    Retorna {'added', 'assigned_number', 'user_tickets', 'round_tickets', 'filled', 'closed'} ('added'
+    False si no cabía o estaba cerrada), o None ante un error de base de datos.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        # IMMEDIATE: el conteo de boletos y la inserción no se intercalan con otra compra
+        conn.execute("BEGIN IMMEDIATE")
+        round_row = cursor.execute("SELECT status, deleted, round_type FROM rounds WHERE id = ?", (round_id,)).fetchone()
+        if not round_row or round_row[1] or round_row[0] not in ('waiting_to_start', 'waiting_for_payments'):
+            conn.rollback()
+            return {'added': False, 'assigned_number': None, 'user_tickets': 0, 'round_tickets': 0,
+                    'filled': False, 'closed': True}
+        round_tickets, last_number = cursor.execute(
+            "SELECT COALESCE(SUM(ticket_count), 0), COALESCE(MAX(assigned_number), 0) FROM round_participants WHERE round_id = ?",
+            (round_id,)
+        ).fetchone()
+        if round_tickets + ticket_count > max_tickets:
+            conn.rollback()
+            existing = cursor.execute("SELECT assigned_number, ticket_count FROM round_participants WHERE round_id = ? AND telegram_id = ?",
+                                      (round_id, str(telegram_id))).fetchone()
+            return {'added': False, 'assigned_number': existing[0] if existing else None,
+                    'user_tickets': existing[1] if existing else 0, 'round_tickets': round_tickets,
+                    'filled': False, 'closed': False}
+
+        purchase_time = datetime.now(timezone.utc).isoformat()
+        cursor.execute(
+            """INSERT INTO round_participants (round_id, telegram_id, assigned_number, paid_real, purchase_time, ticket_count)
+               VALUES (?, ?, ?, 1, ?, ?)
+               ON CONFLICT(round_id, telegram_id) DO UPDATE SET ticket_count = ticket_count + excluded.ticket_count""",
+            (round_id, str(telegram_id), last_number + 1, purchase_time, ticket_count)
+        )
+        assigned_number, user_tickets = cursor.execute(
+            "SELECT assigned_number, ticket_count FROM round_participants WHERE round_id = ? AND telegram_id = ?",
+            (round_id, str(telegram_id))
+        ).fetchone()
+        # Participante nuevo solo si esta compra creó la fila (sus boletos son todos los de la compra)
+        _add_to_rollups(cursor, round_row[2], purchase_time, participants=int(user_tickets == ticket_count), tickets_sold=ticket_count)
+        filled = False
+        if round_tickets + ticket_count == max_tickets:
+            cursor.execute("UPDATE rounds SET filled_time = ? WHERE id = ? AND filled_time IS NULL",
+                           (datetime.now(timezone.utc).isoformat(), round_id))
+            filled = cursor.rowcount == 1
+        conn.commit()
+        _bump_data_version(DATA_VERSION_ROUNDS)
+        logger.info("Boletos añadidos a ronda.", extra=log_fields(round_id=round_id, telegram_id=telegram_id, tickets=ticket_count,
+                                                                 assigned_number=assigned_number, user_tickets=user_tickets))
+        return {'added': True, 'assigned_number': assigned_number, 'user_tickets': user_tickets,
+                'round_tickets': round_tickets + ticket_count, 'filled': filled, 'closed': False}
+    except sqlite3.Error as e:
+        logger.error(f"Error añadiendo boletos de {telegram_id} a ronda {round_id}: {e}", exc_info=True)
+        if conn: conn.rollback()
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def get_round_entry_totals(round_id: int) -> tuple[int, int]:
+    """(participantes, boletos) pagados de una ronda en una sola consulta."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        participants, tickets = conn.execute(
+            "SELECT COUNT(id), COALESCE(SUM(ticket_count), 0) FROM round_participants WHERE round_id = ? AND paid_real = 1",
+            (round_id,)
+        ).fetchone()
+        return participants, tickets
+    except sqlite3.Error as e:
+        logger.error(f"Error contando boletos de ronda {round_id}: {e}", exc_info=True)
+        return 0, 0
+    finally:
+        if conn:
+            conn.close()
+
+def get_participant(round_id: int, telegram_id: str) -> dict | None:
+    """Obtiene un participante concreto de una ronda (o None si no está unido)."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        row = conn.execute(
+            f"""SELECT {_PARTICIPANT_COLUMNS}
+                FROM round_participants rp LEFT JOIN users u ON rp.telegram_id = u.telegram_id
+                WHERE rp.round_id = ? AND rp.telegram_id = ?""",
+            (round_id, str(telegram_id))
+        ).fetchone()
+        return dict(row) if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Error obteniendo participante {telegram_id} de ronda {round_id}: {e}", exc_info=True)
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def get_participants_by_numbers(round_id: int, numbers: list[int]) -> dict[int, dict]:
+    """Participantes de una ronda con los números asignados dados, como {número: participante}."""
+    if not numbers:
+        return {}
+    conn = None
+    try:
+        conn = get_db_connection()
+        placeholders = ", ".join("?" for _ in numbers)
+        rows = conn.execute(
+            f"""SELECT {_PARTICIPANT_COLUMNS}
+                FROM round_participants rp LEFT JOIN users u ON rp.telegram_id = u.telegram_id
+                WHERE rp.round_id = ? AND rp.assigned_number IN ({placeholders})""",
+            (round_id, *numbers)
+        ).fetchall()
+        return {row['assigned_number']: dict(row) for row in rows}
+    except sqlite3.Error as e:
+        logger.error(f"Error obteniendo participantes por número de ronda {round_id}: {e}", exc_info=True)
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+def iter_round_participants(round_id: int, page_size: int = 1000):
+    """
+    Recorre los participantes de una ronda por orden de número asignado, en páginas de `page_size`
+    (paginación por clave sobre el índice). Cada página usa su propia conexión, así que no se retiene
+    un lock de lectura mientras el llamador procesa (p. ej. envía notificaciones) y la memoria queda acotada.
+    """
+    last_number = -1
+    while True:
+        conn = None
+        try:
+            conn = get_db_connection()
+            rows = conn.execute(
+                f"""SELECT {_PARTICIPANT_COLUMNS}
+                    FROM round_participants rp LEFT JOIN users u ON rp.telegram_id = u.telegram_id
+                    WHERE rp.round_id = ? AND rp.assigned_number > ?
+                    ORDER BY rp.assigned_number LIMIT ?""",
+                (round_id, last_number, page_size)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error recorriendo participantes de ronda {round_id}: {e}", exc_info=True)
+            return
+        finally:
+            if conn:
+                conn.close()
+        for row in rows:
+            yield dict(row)
+        if len(rows) < page_size:
+            return
+        last_number = rows[-1]['assigned_number']
+
+def iter_round_ticket_weights(round_id: int, page_size: int = 10000):
+    """Recorre (número asignado, boletos) de los participantes que pagaron, en orden y por páginas."""
+    last_number = -1
+    while True:
+        conn = None
+        try:
+            conn = get_db_connection()
+            rows = conn.execute(
+                """SELECT assigned_number, ticket_count FROM round_participants
+                   WHERE round_id = ? AND assigned_number > ? AND paid_real = 1
+                   ORDER BY assigned_number LIMIT ?""",
+                (round_id, last_number, page_size)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error recorriendo boletos de ronda {round_id}: {e}", exc_info=True)
+            return
+        finally:
+            if conn:
+                conn.close()
+        for row in rows:
+            yield row[0], row[1]
+        if len(rows) < page_size:
+            return
+        last_number = rows[-1][0]
+
+def iter_round_assigned_numbers(round_id: int, page_size: int = 10000):
+    """Recorre los números asignados (de participantes que pagaron) de una ronda en orden, por páginas."""
+    last_number = -1
+    while True:
+        conn = None
+        try:
+            conn = get_db_connection()
+            numbers = [row[0] for row in conn.execute(
+                """SELECT assigned_number FROM round_participants
+                   WHERE round_id = ? AND assigned_number > ? AND paid_real = 1
+                   ORDER BY assigned_number LIMIT ?""",
+                (round_id, last_number, page_size)
+            )]
+        except sqlite3.Error as e:
+            logger.error(f"Error recorriendo números de ronda {round_id}: {e}", exc_info=True)
+            return
+        finally:
+            if conn:
+                conn.close()
+        yield from numbers
+        if len(numbers) < page_size:
+            return
+        last_number = numbers[-1]
+
+@traced()
 def update_round_status(round_id: int, new_status: str) -> bool:
     """Actualiza el estado de una ronda simulada."""
     conn = None
@@ -606,14 +1234,21 @@ def update_round_status(round_id: int, new_status: str) -> bool:
         if new_status in ['finished', 'cancelled']:
             sql += ", end_time = ?"
             params.append(now_utc_iso)
+        elif new_status == 'drawing':
+            sql += ", drawing_since = ?"
+            params.append(now_utc_iso)
         sql += " WHERE id = ?"
         params.append(round_id)
         
+        previous = cursor.execute("SELECT status, round_type FROM rounds WHERE id = ?", (round_id,)).fetchone()
         cursor.execute(sql, tuple(params))
+        if previous and previous[0] != new_status: # Repetir el mismo estado no cuenta dos veces
+            _add_round_end_to_rollups(cursor, previous[1], new_status, now_utc_iso)
         conn.commit()
         updated_rows = cursor.rowcount
         if updated_rows > 0:
-            logger.info(f"Estado de ronda simulada {round_id} actualizado a '{new_status}'.")
+            _bump_data_version(DATA_VERSION_ROUNDS)
+            logger.info("Estado de ronda simulada %s actualizado a '%s'.", round_id, new_status)
         else:
             logger.warning(f"No se actualizó estado para ronda simulada {round_id} (¿no existe o estado ya era el mismo?).")
         return updated_rows > 0
@@ -625,6 +1260,132 @@ def update_round_status(round_id: int, new_status: str) -> bool:
         if conn:
             conn.close()
 
+@traced()
+def transition_round_status(round_id: int, from_status: str, to_status: str) -> bool:
+    """
+    Compare-and-swap del estado de una ronda: un único UPDATE condicionado al estado actual.
+    Retorna True solo si esta llamada hizo la transición (si otra tarea ya la movió, retorna False).
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        now_utc_iso = datetime.now(timezone.utc).isoformat()
+        sql = "UPDATE rounds SET status = ?"
+        params = [to_status]
+        if to_status in ['finished', 'cancelled']:
+            sql += ", end_time = ?"
+            params.append(now_utc_iso)
+        elif to_status == 'drawing':
+            sql += ", drawing_since = ?"
+            params.append(now_utc_iso)
+        sql += " WHERE id = ? AND status = ?"
+        params.extend([round_id, from_status])
+
+        cursor.execute(sql, tuple(params))
+        if cursor.rowcount == 1:
+            round_type = conn.execute("SELECT round_type FROM rounds WHERE id = ?", (round_id,)).fetchone()[0]
+            _add_round_end_to_rollups(cursor, round_type, to_status, now_utc_iso)
+        conn.commit()
+        if cursor.rowcount == 1:
+            _bump_data_version(DATA_VERSION_ROUNDS)
+        return cursor.rowcount == 1
+    except sqlite3.Error as e:
+        logger.error(f"Error en transición de ronda simulada {round_id} '{from_status}' -> '{to_status}': {e}", exc_info=True)
+        if conn: conn.rollback()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def get_stale_drawing_rounds(stale_before_iso: str) -> list[dict]:
+    """
+    Rondas en 'drawing' desde antes de `stale_before_iso` (o sin drawing_since, anteriores a la columna):
+    su cierre se cortó (fallo o caída del proceso) y nadie las va a liquidar si no se retoman.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        rows = conn.execute(
+            "SELECT * FROM rounds WHERE status = 'drawing' AND deleted = 0 "
+            "AND (drawing_since IS NULL OR drawing_since < ?) ORDER BY id",
+            (stale_before_iso,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+    except sqlite3.Error as e:
+        logger.error(f"Error obteniendo rondas atascadas en 'drawing': {e}", exc_info=True)
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def claim_stale_drawing_round(round_id: int, stale_before_iso: str) -> bool:
+    """
+    Compare-and-swap sobre drawing_since: renueva la marca de una ronda atascada en 'drawing' solo si sigue
+    atascada. Retorna True si esta llamada la reclamó (y por tanto debe retomar su cierre).
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.execute(
+            "UPDATE rounds SET drawing_since = ? WHERE id = ? AND status = 'drawing' "
+            "AND (drawing_since IS NULL OR drawing_since < ?)",
+            (datetime.now(timezone.utc).isoformat(), round_id, stale_before_iso)
+        )
+        conn.commit()
+        return cursor.rowcount == 1
+    except sqlite3.Error as e:
+        logger.error(f"Error reclamando la ronda atascada {round_id}: {e}", exc_info=True)
+        if conn: conn.rollback()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+@traced()
+def get_open_rounds() -> list[dict]:
+    """Obtiene las rondas simuladas abiertas (waiting_to_start o waiting_for_payments, no eliminadas)."""
+    return get_rounds_by_status(['waiting_to_start', 'waiting_for_payments'], check_deleted=True)
+
+def mark_round_as_deleted(round_id: int) -> bool:
+    """Marca una ronda simulada como eliminada (borrado lógico)."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE rounds SET deleted = 1 WHERE id = ?", (round_id,))
+        conn.commit()
+        if cursor.rowcount > 0:
+            _bump_data_version(DATA_VERSION_ROUNDS)
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Error marcando ronda simulada {round_id} como eliminada: {e}", exc_info=True)
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def update_participant_paid_status(round_id: int, telegram_id: str, paid_real: bool) -> bool:
+    """Actualiza el estado de pago (paid_real) de un participante de una ronda simulada."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE round_participants SET paid_real = ? WHERE round_id = ? AND telegram_id = ?",
+            (1 if paid_real else 0, round_id, telegram_id)
+        )
+        conn.commit()
+        if cursor.rowcount > 0:
+            _bump_data_version(DATA_VERSION_ROUNDS)
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Error actualizando pago de participante {telegram_id} en ronda simulada {round_id}: {e}", exc_info=True)
+        return False
+    finally:
+        if conn:
+            conn.close()
+
 def save_draw_results(round_id: int, results_list: list[dict]) -> bool:
     """Guarda resultados de un sorteo simulado."""
     conn = None
@@ -642,7 +1403,8 @@ def save_draw_results(round_id: int, results_list: list[dict]) -> bool:
                  r_data.get('prize_amount_simulated'), r_data.get('prize_amount_real'))
             )
         conn.commit() # Commit al final si todo va bien
-        logger.info(f"Resultados del sorteo simulado para ronda {round_id} guardados.")
+        _bump_data_version(DATA_VERSION_WINNERS)
+        logger.info("Resultados del sorteo simulado para ronda %s guardados.", round_id)
         return True
     except sqlite3.IntegrityError as ie: # Ej. UNIQUE constraint falló
         logger.warning(f"Error de integridad guardando resultados de sorteo para ronda {round_id}: {ie}")
@@ -670,7 +1432,7 @@ def save_creator_commission(round_id: int, creator_type: str, creator_telegram_i
             (round_id, creator_type, creator_telegram_id, amount_simulated, amount_real, transaction_id)
         )
         conn.commit()
-        logger.info(f"Comisión simulada '{creator_type}' para ronda {round_id} guardada.")
+        logger.info("Comisión simulada '%s' para ronda %s guardada.", creator_type, round_id)
         return True
     except sqlite3.IntegrityError:
         logger.warning(f"Comisión simulada '{creator_type}' para ronda {round_id} (Creador: {creator_telegram_id}) ya existe.")
@@ -683,6 +1445,148 @@ def save_creator_commission(round_id: int, creator_type: str, creator_telegram_i
         if conn:
             conn.close()
 
+@traced()
+def settle_round(round_id: int, results_list: list[dict], commissions_list: list[dict],
+                 from_status: str = 'drawing', to_status: str = 'finished') -> bool:
+    """
+    Liquida una ronda en UNA sola transacción (un solo commit/fsync):
+    resultados del sorteo, comisiones y el paso de `from_status` a `to_status`.
+    El cambio de estado es compare-and-swap: si la ronda ya no está en `from_status`
+    se deshace todo. Retorna True solo si la ronda quedó liquidada por esta llamada.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        # IMMEDIATE toma el lock de escritura al inicio: no hay lecturas que luego fallen al escribir
+        conn.execute("BEGIN IMMEDIATE")
+
+        cursor.executemany(
+            """INSERT INTO draw_results
+               (round_id, drawn_number, draw_order, winner_telegram_id, prize_amount_simulated, prize_amount_real, prize_amount_nano)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            [(round_id, r_data.get('drawn_number'), r_data.get('draw_order'), r_data.get('winner_telegram_id'),
+              r_data.get('prize_amount_simulated'), r_data.get('prize_amount_real'), r_data.get('prize_amount_nano'))
+             for r_data in results_list]
+        )
+        cursor.executemany(
+            """INSERT INTO creator_commission
+               (round_id, creator_type, creator_telegram_id, amount_simulated, amount_real, amount_nano, transaction_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            [(round_id, c_data.get('creator_type'), c_data.get('creator_telegram_id'), c_data.get('amount_simulated'),
+              c_data.get('amount_real'), c_data.get('amount_nano'), c_data.get('transaction_id')) for c_data in commissions_list]
+        )
+        end_time = datetime.now(timezone.utc).isoformat()
+        cursor.execute(
+            "UPDATE rounds SET status = ?, end_time = ? WHERE id = ? AND status = ?",
+            (to_status, end_time, round_id, from_status)
+        )
+        if cursor.rowcount != 1:
+            conn.rollback()
+            logger.warning(f"Liquidación de ronda {round_id} descartada: la ronda ya no estaba en '{from_status}'.")
+            return False
+        round_type = cursor.execute("SELECT round_type FROM rounds WHERE id = ?", (round_id,)).fetchone()[0]
+        _add_round_end_to_rollups(cursor, round_type, to_status, end_time,
+                                  prizes_nano=sum(r_data.get('prize_amount_nano') or 0 for r_data in results_list),
+                                  commissions_nano=sum(c_data.get('amount_nano') or 0 for c_data in commissions_list))
+
+        # Ranking histórico: suma incremental de los premios de esta ronda (una fila por ganador)
+        prizes_by_winner = {}
+        for r_data in results_list:
+            if r_data.get('winner_telegram_id'):
+                wins, prize_nano = prizes_by_winner.get(r_data['winner_telegram_id'], (0, 0))
+                prizes_by_winner[r_data['winner_telegram_id']] = (wins + 1, prize_nano + (r_data.get('prize_amount_nano') or 0))
+        settled_at = datetime.now(timezone.utc).isoformat()
+        cursor.executemany(
+            """INSERT INTO winner_stats (telegram_id, wins, total_prize_nano, last_round_id, last_win_time)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(telegram_id) DO UPDATE SET
+                   wins = wins + excluded.wins,
+                   total_prize_nano = total_prize_nano + excluded.total_prize_nano,
+                   last_round_id = excluded.last_round_id,
+                   last_win_time = excluded.last_win_time""",
+            [(telegram_id, wins, prize_nano, round_id, settled_at) for telegram_id, (wins, prize_nano) in prizes_by_winner.items()]
+        )
+
+        conn.commit()
+        _bump_data_version(DATA_VERSION_ROUNDS)
+        _bump_data_version(DATA_VERSION_WINNERS)
+        logger.info("Ronda %s liquidada: %s resultados, %s comisiones, estado '%s'.", round_id, len(results_list), len(commissions_list), to_status)
+        return True
+    except sqlite3.IntegrityError as ie: # Ej. resultados o comisiones ya guardados para esta ronda
+        logger.warning(f"Error de integridad liquidando ronda {round_id}. Transacción deshecha: {ie}")
+        if conn: conn.rollback()
+        return False
+    except sqlite3.Error as e:
+        logger.error(f"Error liquidando ronda {round_id}. Transacción deshecha: {e}", exc_info=True)
+        if conn: conn.rollback()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+# --- Ganadores (webapp) ---
+_WINNER_COLUMNS = """dr.id, dr.round_id, dr.draw_order, dr.drawn_number, dr.winner_telegram_id, dr.prize_amount_simulated,
+       dr.prize_amount_nano, u.username, u.first_name"""
+
+@traced()
+def get_draw_winners_page(limit: int = 20, before_id: int | None = None, after_id: int | None = None) -> list[dict]:
+    """
+    Premios con ganador de draw_results (con usuario), paginados por id: sin cursor o con `before_id`,
+    del más reciente al más antiguo; con `after_id`, los posteriores a ese id en orden ascendente
+    (para ponerse al día de forma incremental). Cada página es un rango de la clave primaria.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        if after_id is not None:
+            cursor.execute(
+                f"SELECT {_WINNER_COLUMNS} FROM draw_results dr LEFT JOIN users u ON u.telegram_id = dr.winner_telegram_id "
+                "WHERE dr.id > ? AND dr.winner_telegram_id IS NOT NULL ORDER BY dr.id ASC LIMIT ?",
+                (after_id, limit)
+            )
+        else:
+            cursor.execute(
+                f"SELECT {_WINNER_COLUMNS} FROM draw_results dr LEFT JOIN users u ON u.telegram_id = dr.winner_telegram_id "
+                "WHERE dr.id < ? AND dr.winner_telegram_id IS NOT NULL ORDER BY dr.id DESC LIMIT ?",
+                (before_id if before_id is not None else 2**63 - 1, limit)
+            )
+        return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"Error obteniendo ganadores (before={before_id}, after={after_id}): {e}", exc_info=True)
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def get_winner_leaderboard(limit: int = 10, after: tuple | None = None) -> list[dict]:
+    """
+    Ranking histórico desde winner_stats: mayor monto total primero (desempata premios y telegram_id).
+    `after` = (total_prize_nano, wins, telegram_id) de la última fila vista da la página siguiente.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        where, params = "", []
+        if after is not None:
+            where, params = "WHERE (ws.total_prize_nano, ws.wins, ws.telegram_id) < (?, ?, ?)", list(after)
+        cursor.execute(
+            f"""SELECT ws.telegram_id, ws.wins, ws.total_prize_nano, ws.last_round_id, ws.last_win_time, u.username, u.first_name
+                FROM winner_stats ws LEFT JOIN users u ON u.telegram_id = ws.telegram_id {where}
+                ORDER BY ws.total_prize_nano DESC, ws.wins DESC, ws.telegram_id DESC LIMIT ?""",
+            (*params, limit)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"Error obteniendo ranking de ganadores: {e}", exc_info=True)
+        return []
+    finally:
+        if conn:
+            conn.close()
+
 
 if __name__ == '__main__':
     # Configuración básica de logging si se ejecuta directamente
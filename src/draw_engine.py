@@ -0,0 +1,180 @@
+# src/draw_engine.py
+# Sorteo de ganadores de una ronda: k números distintos según el reparto de premios del número de participantes.
+# Con compras de varios boletos el sorteo pondera por boletos (tabla de alias).
+
+import logging
+import random
+from array import array
+
+from .payout_ledger import get_prize_split
+
+logger = logging.getLogger(__name__)
+
+# Fuente de azar del sorteo real (os.urandom); los tests y simulaciones pueden pasar su propio random.Random
+_system_random = random.SystemRandom()
+
+
+def get_winners_count(participants_count: int) -> int:
+    """Número de premios (órdenes de sorteo) para una ronda con `participants_count` participantes."""
+    return min(len(get_prize_split(participants_count)), participants_count)
+
+
+def sample_distinct_indices(population_size: int, k: int, rng: random.Random | None = None) -> list[int]:
+    """
+    k índices distintos de range(population_size), en orden de sorteo y uniformes sobre todas las
+    secuencias posibles. Fisher-Yates parcial con un diccionario de intercambios: O(k) en tiempo y
+    memoria, sin construir ni copiar la población.
+    """
+    if not 0 <= k <= population_size:
+        raise ValueError(f"No se pueden sortear {k} ganadores distintos entre {population_size} participantes.")
+    rng = rng or _system_random
+    swaps: dict[int, int] = {}
+    drawn = []
+    for i in range(k):
+        j = rng.randrange(i, population_size)
+        drawn.append(swaps.get(j, j))
+        swaps[j] = swaps.get(i, i)
+    return drawn
+
+
+def draw_winners(participants_data: list, rng: random.Random | None = None) -> list[dict]:
+    """
+    Sortea los ganadores de una ronda entre los participantes con número asignado.
+    Retorna una lista (por draw_order) de {'draw_order', 'drawn_number', 'winner_telegram_id', 'winner_username'}.
+    """
+    candidates = []
+    for p in participants_data:
+        number = p.get('assigned_number') if isinstance(p, dict) else p[2]
+        if number is not None:
+            candidates.append(p)
+    # Orden estable por número: el resultado solo depende del azar, no del orden de la consulta
+    candidates.sort(key=lambda p: p.get('assigned_number') if isinstance(p, dict) else p[2])
+
+    winners_count = get_winners_count(len(candidates))
+    results = []
+    for draw_order, index in enumerate(sample_distinct_indices(len(candidates), winners_count, rng)):
+        winner = candidates[index]
+        if isinstance(winner, dict):
+            telegram_id, username, number = winner.get('telegram_id'), winner.get('username'), winner.get('assigned_number')
+        else:
+            telegram_id, username, number = winner[0], winner[1], winner[2]
+        results.append({
+            'draw_order': draw_order,
+            'drawn_number': number,
+            'winner_telegram_id': str(telegram_id) if telegram_id is not None else None,
+            'winner_username': username,
+        })
+    logger.debug(f"DRAW_ENGINE: {winners_count} ganadores sorteados entre {len(candidates)} participantes.")
+    return results
+
+
+def draw_winning_numbers(participants_count: int, assigned_numbers, rng: random.Random | None = None) -> list[int]:
+    """
+    Sorteo para rondas grandes sin cargar participantes: elige k posiciones distintas entre
+    `participants_count` y las resuelve recorriendo `assigned_numbers` (iterable ordenado, p. ej.
+    db.iter_round_assigned_numbers). Memoria O(k); el recorrido se corta al encontrar la última posición.
+    Retorna los números ganadores por draw_order.
+    """
+    positions = sample_distinct_indices(participants_count, get_winners_count(participants_count), rng)
+    draw_order_by_position = {position: draw_order for draw_order, position in enumerate(positions)}
+    last_position = max(positions, default=-1)
+    drawn = [None] * len(positions)
+    for position, number in enumerate(assigned_numbers):
+        if position > last_position:
+            break
+        draw_order = draw_order_by_position.get(position)
+        if draw_order is not None:
+            drawn[draw_order] = number
+    if any(number is None for number in drawn):
+        logger.error(f"DRAW_ENGINE: Se esperaban {participants_count} números asignados y hubo menos; sorteo incompleto.")
+        return [number for number in drawn if number is not None]
+    return drawn
+
+
+def build_alias_table(weights: list[int]) -> tuple[list[int], list[int], int]:
+    """
+    Tabla de alias (método de Vose) para sortear índices con probabilidad proporcional a `weights`
+    (boletos por participante). Todo en enteros: la casilla i acepta su propio índice si un entero
+    uniforme de [0, total) cae bajo thresholds[i], y si no devuelve alias[i]. Así las probabilidades son
+    exactamente weights[i] / total, sin error de coma flotante. Construcción O(n).
+    Retorna (thresholds, alias, total).
+    """
+    n = len(weights)
+    total = sum(weights)
+    if n == 0 or total <= 0 or any(w < 0 for w in weights):
+        raise ValueError("La tabla de alias necesita al menos un peso positivo y ninguno negativo.")
+    # Peso escalado por n: la casilla media vale exactamente `total`
+    scaled = [w * n for w in weights]
+    thresholds = [total] * n
+    alias = list(range(n))
+    small = [i for i, s in enumerate(scaled) if s < total]
+    large = [i for i, s in enumerate(scaled) if s >= total]
+    while small and large:
+        s_i = small.pop()
+        l_i = large[-1]
+        thresholds[s_i] = scaled[s_i]
+        alias[s_i] = l_i
+        scaled[l_i] -= total - scaled[s_i]
+        if scaled[l_i] < total:
+            small.append(large.pop())
+    # Las casillas que quedan valen exactamente `total` (aritmética entera, sin residuos)
+    return thresholds, alias, total
+
+
+def alias_draw(table: tuple[list[int], list[int], int], rng: random.Random | None = None) -> int:
+    """Un índice de la tabla de alias en O(1): una casilla uniforme y un umbral entero."""
+    thresholds, alias, total = table
+    rng = rng or _system_random
+    i = rng.randrange(len(thresholds))
+    return i if rng.randrange(total) < thresholds[i] else alias[i]
+
+
+def sample_weighted_distinct_indices(weights: list[int], k: int, rng: random.Random | None = None) -> list[int]:
+    """
+    k índices distintos en orden de sorteo, cada extracción proporcional al peso entre los que aún
+    no salieron (sorteo sucesivo sin reposición, como sacar boletos de una urna y descartar al dueño).
+    Se rechazan los repetidos; cuando lo ya sorteado supera la mitad del peso, la tabla se reconstruye
+    con el resto, así cada extracción cuesta O(1) esperado aunque un participante tenga casi todos los boletos.
+    """
+    positive = sum(1 for w in weights if w > 0)
+    if not 0 <= k <= positive:
+        raise ValueError(f"No se pueden sortear {k} ganadores distintos entre {positive} participantes con boletos.")
+    rng = rng or _system_random
+    drawn: list[int] = []
+    taken: set[int] = set()
+    candidates = list(range(len(weights)))
+    table = build_alias_table(weights) if k else None
+    table_total = sum(weights)
+    taken_weight = 0
+    while len(drawn) < k:
+        if taken_weight * 2 > table_total:
+            candidates = [i for i in candidates if i not in taken and weights[i] > 0]
+            table = build_alias_table([weights[i] for i in candidates])
+            table_total = table[2]
+            taken_weight = 0
+        index = candidates[alias_draw(table, rng)]
+        if index in taken:
+            continue
+        taken.add(index)
+        taken_weight += weights[index]
+        drawn.append(index)
+    return drawn
+
+
+def draw_weighted_winning_numbers(ticket_weights, participants_count: int, tickets_count: int,
+                                  rng: random.Random | None = None) -> list[int]:
+    """
+    Sorteo de una ronda con compras de varios boletos: la probabilidad de cada participante es
+    proporcional a sus boletos. `ticket_weights` es un iterable de (número asignado, boletos)
+    (p. ej. db.iter_round_ticket_weights); se guarda en arrays compactos y se sortea con la tabla de alias.
+    El número de premios sale de los boletos, sin superar a los participantes distintos.
+    Retorna los números ganadores por draw_order.
+    """
+    numbers, weights = array('q'), array('q')
+    for number, tickets in ticket_weights:
+        numbers.append(number)
+        weights.append(tickets)
+    if len(numbers) != participants_count or sum(weights) != tickets_count:
+        logger.warning(f"DRAW_ENGINE: Se esperaban {participants_count} participantes/{tickets_count} boletos y se leyeron {len(numbers)}/{sum(weights)}.")
+    winners_count = min(get_winners_count(sum(weights)), len(numbers))
+    return [numbers[i] for i in sample_weighted_distinct_indices(weights, winners_count, rng)]
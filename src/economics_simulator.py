@@ -0,0 +1,211 @@
+# src/economics_simulator.py
+# Simulador Monte Carlo de la economía de las rondas (retorno esperado del jugador, parte de la casa y varianzas).
+#
+# Las reglas de pago NO se reimplementan aquí: las tablas por (tipo de ronda, participantes) se construyen
+# llamando a simulation_engine.compute_round_amounts, la misma función que usa el cálculo real de una ronda.
+# Cada shard solo muestrea rondas con NumPy y acumula un histograma (tipo, participantes); como las
+# estadísticas se derivan de ese histograma, los shards de distintos procesos se combinan sumándolos.
+#
+# Uso: python -m src.economics_simulator --rounds 10000000 --workers 4 --participants uniform:2-10 --user-created-share 0.3
+
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .round_manager import (
+    MIN_PARTICIPANTS_FOR_TIMED_DRAW,
+    MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW,
+    ROUND_TYPE_SCHEDULED,
+    ROUND_TYPE_USER_CREATED,
+)
+from .payout_ledger import MAX_PRIZE_TIERS
+from .simulation_engine import compute_round_amounts
+
+logger = logging.getLogger(__name__)
+
+# Índice 0: ronda programada; índice 1: ronda creada por un usuario (paga comisión de creador)
+SIMULATED_ROUND_TYPES = (ROUND_TYPE_SCHEDULED, ROUND_TYPE_USER_CREATED)
+COMMISSION_TYPES = ('gas_fee', 'bot', 'user')
+DEFAULT_PARTICIPANTS_SPEC = f"uniform:{MIN_PARTICIPANTS_FOR_TIMED_DRAW}-{MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW}"
+DEFAULT_BATCH_SIZE = 1_000_000
+
+
+def build_rule_tables(ticket_price: float = 1.0, winners_drawn: int = MAX_PRIZE_TIERS) -> dict[str, np.ndarray]:
+    """
+    Evalúa las reglas de pago para cada (tipo de ronda, número de participantes) y las guarda en arrays
+    de forma (len(SIMULATED_ROUND_TYPES), MAX+1). Las celdas con un número de participantes inválido quedan en 0.
+    """
+    shape = (len(SIMULATED_ROUND_TYPES), MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW + 1)
+    tables = {
+        'collected': np.zeros(shape),
+        'commissions': np.zeros(shape + (len(COMMISSION_TYPES),)),
+        'prize_pool': np.zeros(shape),
+        'prizes_sum': np.zeros(shape),     # Suma de premios pagados en la ronda
+        'prizes_sq_sum': np.zeros(shape),  # Suma de cuadrados de los premios (para la varianza por ticket)
+    }
+    for type_index, round_type in enumerate(SIMULATED_ROUND_TYPES):
+        for count in range(MIN_PARTICIPANTS_FOR_TIMED_DRAW, MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW + 1):
+            amounts = compute_round_amounts(count, round_type, has_creator=(round_type == ROUND_TYPE_USER_CREATED),
+                                            ticket_price=ticket_price, winners_drawn=winners_drawn)
+            tables['collected'][type_index, count] = amounts['collected']
+            tables['prize_pool'][type_index, count] = amounts['prize_pool']
+            tables['prizes_sum'][type_index, count] = sum(amounts['prizes'])
+            tables['prizes_sq_sum'][type_index, count] = sum(p * p for p in amounts['prizes'])
+            for c_index, c_type in enumerate(COMMISSION_TYPES):
+                tables['commissions'][type_index, count, c_index] = amounts['commissions'].get(c_type, 0.0)
+    return tables
+
+
+def sample_participant_counts(rng: np.random.Generator, spec: str, size: int) -> np.ndarray:
+    """
+    Muestrea `size` números de participantes según `spec`:
+    'uniform:A-B', 'poisson:LAMBDA' (recortado al rango válido) o pesos explícitos 'N=P,N=P,...'.
+    """
+    low, high = MIN_PARTICIPANTS_FOR_TIMED_DRAW, MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW
+    kind, _, params = spec.partition(':')
+    if kind == 'uniform':
+        a, _, b = params.partition('-')
+        a, b = int(a), int(b or a)
+        if not (low <= a <= b <= high):
+            raise ValueError(f"Rango uniforme inválido '{spec}' (debe estar dentro de {low}-{high}).")
+        return rng.integers(a, b + 1, size=size)
+    if kind == 'poisson':
+        return np.clip(rng.poisson(float(params), size=size), low, high)
+
+    counts, weights = [], []
+    for item in spec.split(','):
+        count, _, weight = item.partition('=')
+        counts.append(int(count))
+        weights.append(float(weight))
+    if not counts or any(not (low <= c <= high) for c in counts) or sum(weights) <= 0:
+        raise ValueError(f"Distribución de participantes inválida '{spec}'.")
+    probabilities = np.asarray(weights) / sum(weights)
+    return rng.choice(np.asarray(counts), size=size, p=probabilities)
+
+
+def simulate_shard(seed: np.random.SeedSequence, rounds: int, participants_spec: str,
+                   user_created_share: float, batch_size: int = DEFAULT_BATCH_SIZE) -> np.ndarray:
+    """
+    Simula `rounds` rondas y retorna el histograma de (tipo de ronda, participantes).
+    Trabaja por lotes de `batch_size` para acotar la memoria con cualquier número de rondas.
+    """
+    rng = np.random.default_rng(seed)
+    n_cells = len(SIMULATED_ROUND_TYPES) * (MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW + 1)
+    histogram = np.zeros(n_cells, dtype=np.int64)
+    remaining = rounds
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        counts = sample_participant_counts(rng, participants_spec, size)
+        is_user_created = rng.random(size) < user_created_share
+        cells = is_user_created * (MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW + 1) + counts
+        histogram += np.bincount(cells, minlength=n_cells)
+        remaining -= size
+    return histogram.reshape(len(SIMULATED_ROUND_TYPES), MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW + 1)
+
+
+def summarize(histogram: np.ndarray, tables: dict[str, np.ndarray], ticket_price: float = 1.0) -> dict:
+    """
+    Estadísticas exactas para las rondas del histograma:
+    - Retorno por ticket: cada ticket gana a lo sumo un premio, así que en una ronda de k tickets
+      E[X] = sum(premios)/k y E[X^2] = sum(premios^2)/k; se ponderan por los tickets de cada celda.
+    - Parte de la casa por ronda: comisiones + pozo no repartido; media y varianza entre rondas.
+    """
+    rounds = int(histogram.sum())
+    if rounds == 0:
+        raise ValueError("No hay rondas simuladas.")
+    participants = np.arange(histogram.shape[1])
+    tickets_per_cell = histogram * participants
+    tickets = int(tickets_per_cell.sum())
+
+    collected = float((histogram * tables['collected']).sum())
+    prizes = float((histogram * tables['prizes_sum']).sum())
+    commissions = (histogram[..., None] * tables['commissions']).sum(axis=(0, 1))
+    unallocated = float((histogram * (tables['prize_pool'] - tables['prizes_sum'])).sum())
+
+    return_mean = prizes / tickets
+    return_sq_mean = float((histogram * tables['prizes_sq_sum']).sum()) / tickets
+    return_variance = max(0.0, return_sq_mean - return_mean ** 2)
+
+    house_per_round = tables['collected'] - tables['prizes_sum']
+    house_mean = float((histogram * house_per_round).sum()) / rounds
+    house_variance = max(0.0, float((histogram * house_per_round ** 2).sum()) / rounds - house_mean ** 2)
+
+    return {
+        'rounds': rounds,
+        'tickets': tickets,
+        'ticket_price': ticket_price,
+        'expected_player_return': return_mean / ticket_price,  # Fracción del precio del ticket que vuelve al jugador
+        'player_return_per_ticket': {
+            'mean': return_mean,
+            'variance': return_variance,
+            'std': return_variance ** 0.5,
+        },
+        'house_take': {
+            'share': (collected - prizes) / collected,
+            'commissions_share': {c_type: float(amount) / collected for c_type, amount in zip(COMMISSION_TYPES, commissions)},
+            'unallocated_pool_share': unallocated / collected,
+            'per_round_mean': house_mean,
+            'per_round_variance': house_variance,
+        },
+        'participants_histogram': {
+            round_type: {int(k): int(n) for k, n in zip(participants, histogram[type_index]) if n}
+            for type_index, round_type in enumerate(SIMULATED_ROUND_TYPES)
+        },
+    }
+
+
+def simulate_economics(rounds: int, participants_spec: str = DEFAULT_PARTICIPANTS_SPEC,
+                       user_created_share: float = 0.0, ticket_price: float = 1.0,
+                       winners_drawn: int = MAX_PRIZE_TIERS, workers: int = 1, seed: int | None = None,
+                       batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """
+    Simula `rounds` rondas repartidas en `workers` procesos (cada uno con su propio stream de
+    números aleatorios derivado de `seed`) y retorna el informe de summarize() con la duración.
+    """
+    if rounds <= 0 or workers <= 0:
+        raise ValueError("rounds y workers deben ser positivos.")
+    started = time.perf_counter()
+    tables = build_rule_tables(ticket_price, winners_drawn)
+    shard_seeds = np.random.SeedSequence(seed).spawn(workers)
+    shard_rounds = [rounds // workers + (1 if i < rounds % workers else 0) for i in range(workers)]
+    shard_args = [(s, n, participants_spec, user_created_share, batch_size)
+                  for s, n in zip(shard_seeds, shard_rounds) if n > 0]
+
+    if len(shard_args) == 1:
+        histograms = [simulate_shard(*shard_args[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(shard_args)) as executor:
+            histograms = list(executor.map(simulate_shard, *zip(*shard_args)))
+
+    report = summarize(sum(histograms), tables, ticket_price)
+    elapsed = time.perf_counter() - started
+    report['workers'] = len(shard_args)
+    report['elapsed_seconds'] = elapsed
+    report['rounds_per_second'] = rounds / elapsed if elapsed > 0 else None
+    return report
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Simulación Monte Carlo de la economía de las rondas.")
+    parser.add_argument('--rounds', type=int, default=1_000_000)
+    parser.add_argument('--participants', default=DEFAULT_PARTICIPANTS_SPEC,
+                        help="'uniform:A-B', 'poisson:LAMBDA' o pesos 'N=P,N=P,...'")
+    parser.add_argument('--user-created-share', type=float, default=0.0,
+                        help="Fracción de rondas creadas por usuarios (pagan comisión de creador).")
+    parser.add_argument('--ticket-price', type=float, default=1.0)
+    parser.add_argument('--winners-drawn', type=int, default=MAX_PRIZE_TIERS)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    report = simulate_economics(args.rounds, args.participants, args.user_created_share, args.ticket_price,
+                                args.winners_drawn, args.workers, args.seed)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
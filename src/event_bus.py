@@ -0,0 +1,139 @@
+# src/event_bus.py
+# Bus de eventos en proceso: round_manager publica los cambios de rondas (creada, nuevo participante,
+# cerrada) y los consumidores (el stream SSE de la webapp) los reciben como deltas, sin volver a
+# consultar la DB. Es seguro entre hilos: el bot publica desde el event loop y Flask lee desde sus hilos;
+# el modo asíncrono de la webapp (webapp/async_app.py) recibe los eventos en su propio event loop.
+# Solo ve lo que pasa en este proceso: otro proceso que escriba en la misma DB no publica aquí.
+
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+EVENT_ROUND_CREATED = 'round-created'
+EVENT_PARTICIPANT_JOINED = 'participant-joined'
+EVENT_ROUND_CLOSED = 'round-closed'
+
+# Últimos eventos guardados para que un cliente que se reconecta (Last-Event-ID) recupere lo que se perdió
+EVENT_HISTORY_SIZE = 512
+# Eventos pendientes por suscriptor; uno que no los consume a tiempo se desconecta y debe resincronizar
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+_event_ids = itertools.count(1)
+_history = deque(maxlen=EVENT_HISTORY_SIZE)
+_subscribers = set()
+_bus_lock = threading.Lock()
+
+
+class Subscription:
+    """Cola de eventos de un consumidor. `needs_resync` indica que se perdieron eventos (recargar el estado completo)."""
+
+    def __init__(self, needs_resync: bool = False):
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.needs_resync = needs_resync
+
+    def get(self, timeout: float | None = None) -> dict | None:
+        """Siguiente evento, o None si no llegó ninguno en `timeout` segundos."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _offer(self, event: dict) -> bool:
+        """Entrega sin bloquear (con _bus_lock tomado). False si la cola está llena."""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+
+class AsyncSubscription(Subscription):
+    """
+    Suscripción para un consumidor en un event loop: los eventos llegan a un asyncio.Queue mediante
+    loop.call_soon_threadsafe, así que se puede publicar desde cualquier hilo sin bloquear al loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, needs_resync: bool = False):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.needs_resync = needs_resync
+        self._in_flight = 0 # Eventos programados en el loop que todavía no entraron a la cola
+
+    async def get(self, timeout: float | None = None) -> dict | None:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def _offer(self, event: dict) -> bool:
+        if self.queue.qsize() + self._in_flight >= SUBSCRIBER_QUEUE_SIZE:
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError: # Loop cerrado: el consumidor ya no existe
+            return False
+        self._in_flight += 1
+        return True
+
+    def _put(self, event: dict) -> None:
+        with _bus_lock:
+            self._in_flight -= 1
+        if not self.needs_resync:
+            self.queue.put_nowait(event) # Nunca llena: _offer reservó el lugar
+
+
+def publish(event_type: str, data: dict) -> dict:
+    """Publica un evento a todos los suscriptores. Retorna el evento {'id', 'type', 'data'}. Nunca bloquea."""
+    with _bus_lock:
+        event = {'id': next(_event_ids), 'type': event_type, 'data': data}
+        _history.append(event)
+        for subscription in list(_subscribers):
+            if not subscription._offer(event):
+                # Consumidor lento: se le da de baja en lugar de frenar a quien publica
+                _subscribers.discard(subscription)
+                subscription.needs_resync = True
+                logger.warning(f"EVENT_BUS: Suscriptor lento descartado ({SUBSCRIBER_QUEUE_SIZE} eventos pendientes).")
+    return event
+
+
+def subscribe(last_event_id: int | None = None, loop: asyncio.AbstractEventLoop | None = None) -> Subscription:
+    """
+    Nueva suscripción. Con `last_event_id` la cola empieza con los eventos posteriores a ese id que sigan
+    en el historial; si ya no están todos (o el id es de antes de un reinicio), la suscripción nace con
+    needs_resync=True. Con `loop` retorna una AsyncSubscription (`await sub.get(timeout)`).
+    """
+    with _bus_lock:
+        subscription = AsyncSubscription(loop) if loop is not None else Subscription()
+        if last_event_id is not None:
+            missed = [event for event in _history if event['id'] > last_event_id]
+            oldest_kept = _history[0]['id'] if _history else None
+            last_published = _history[-1]['id'] if _history else 0
+            if last_event_id > last_published: # Id de un proceso anterior (reinicio): su estado no sirve
+                subscription.needs_resync = True
+            elif oldest_kept is not None and oldest_kept > last_event_id + 1:
+                subscription.needs_resync = True
+            elif len(missed) < SUBSCRIBER_QUEUE_SIZE:
+                for event in missed:
+                    subscription._offer(event)
+            else:
+                subscription.needs_resync = True
+        if not subscription.needs_resync: # Quien debe resincronizar no recibe nada más por esta suscripción
+            _subscribers.add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription: Subscription) -> None:
+    with _bus_lock:
+        _subscribers.discard(subscription)
+
+
+def get_bus_stats() -> dict:
+    """Suscriptores activos, último id publicado y eventos en el historial."""
+    with _bus_lock:
+        return {'subscribers': len(_subscribers), 'last_event_id': _history[-1]['id'] if _history else 0,
+                'history': len(_history)}
@@ -0,0 +1,246 @@
+# src/fake_services.py
+# Servicios de reemplazo para benchmarks y pruebas de carga: un Bot API de Telegram y un toncenter
+# falsos, servidos por HTTP real con aiohttp, cada uno en su propio hilo y event loop (ton_api usa
+# `requests`, que bloquea el loop del bot: si el toncenter falso viviera en ese loop no respondería
+# nunca). El bot habla con ellos por su camino normal: aiogram con un TelegramAPIServer apuntando al
+# falso y ton_api con API_BASE apuntando al otro. También construye Updates sintéticos para el Dispatcher.
+
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import threading
+import time
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+FAKE_BOT_TOKEN = '123456789:AAFakeTokenForLocalBenchmarks_000000000'
+
+
+class ThreadedAiohttpServer:
+    """Sirve una aplicación aiohttp en 127.0.0.1 desde un hilo propio. `start()` retorna la URL base."""
+
+    def __init__(self):
+        self.url = None
+        self._loop = None
+        self._thread = None
+        self._runner = None
+
+    def create_app(self) -> web.Application:
+        raise NotImplementedError
+
+    def start(self) -> str:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+        async def serve():
+            self._runner = web.AppRunner(self.create_app(), access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, '127.0.0.1', 0).start()
+            return self._runner.addresses[0][1]
+
+        port = asyncio.run_coroutine_threadsafe(serve(), self._loop).result()
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class FakeTelegramServer(ThreadedAiohttpServer):
+    """
+    Bot API mínimo: responde sendMessage / editMessageText / sendDocument con un Message plausible, answerCallbackQuery
+    y el resto con True. Guarda cada llamada (método y parámetros) para que el cliente sintético "lea"
+    lo que el bot le envió. `response_delay` simula la latencia de api.telegram.org.
+    """
+
+    def __init__(self, response_delay: float = 0.0):
+        super().__init__()
+        self.response_delay = response_delay
+        self.calls = [] # (método, parámetros)
+        self._messages_by_chat = {} # chat_id -> parámetros de sendMessage / editMessageText / sendDocument, en orden
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        return app
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post()) if request.content_type != 'application/json' else await request.json()
+        if self.response_delay:
+            await asyncio.sleep(self.response_delay)
+        if method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            chat_id = int(params.get('chat_id', 0))
+            message_id = int(params['message_id']) if 'message_id' in params else next(self._message_ids)
+            params['_message_id'] = message_id # Para que el cliente sintético pulse botones de este mensaje
+            result = {'message_id': message_id, 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+            if method == 'sendDocument': # Multipart: guardamos nombre y contenido del archivo
+                upload = params['document']
+                if isinstance(upload, str) and upload.startswith('attach://'): # aiogram adjunta el archivo aparte
+                    upload = params.pop(upload[len('attach://'):])
+                params['document'] = {'file_name': upload.filename, 'content': upload.file.read()}
+                params['text'] = params.get('caption', '')
+                result.update(text=None, caption=params['text'],
+                              document={'file_id': f"doc{message_id}", 'file_unique_id': f"doc{message_id}",
+                                        'file_name': upload.filename})
+        elif method == 'getMe':
+            result = {'id': int(FAKE_BOT_TOKEN.split(':')[0]), 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        else:
+            result = True
+        with self._lock:
+            self.calls.append((method, params))
+            if method in ('sendMessage', 'editMessageText', 'sendDocument'):
+                self._messages_by_chat.setdefault(str(params.get('chat_id')), []).append(params)
+        return web.json_response({'ok': True, 'result': result})
+
+    def method_counts(self) -> dict:
+        with self._lock:
+            counts = {}
+            for method, _ in self.calls:
+                counts[method] = counts.get(method, 0) + 1
+            return counts
+
+    def sent_to(self, chat_id) -> list[dict]:
+        """Parámetros de los sendMessage / editMessageText / sendDocument dirigidos a `chat_id`, en orden."""
+        with self._lock:
+            return list(self._messages_by_chat.get(str(chat_id), ()))
+
+    def last_button(self, chat_id, prefix: str) -> tuple[str, int] | None:
+        """
+        (callback_data, message_id) del último botón inline que empieza por `prefix` enviado a `chat_id`:
+        lo que pulsaría el usuario.
+        """
+        for params in reversed(self.sent_to(chat_id)):
+            markup = params.get('reply_markup')
+            if not markup:
+                continue
+            for row in json.loads(markup).get('inline_keyboard', []):
+                for button in row:
+                    if (button.get('callback_data') or '').startswith(prefix):
+                        return button['callback_data'], params['_message_id']
+        return None
+
+
+class FakeToncenterServer(ThreadedAiohttpServer):
+    """
+    toncenter v2 mínimo: detectAddress (acepta direcciones de 48 caracteres) y getTransactions (las
+    transacciones ya visibles, de la más nueva a la más vieja). Un pago añadido con `delay_seconds`
+    aparece pasado ese tiempo, como una transacción que aún no se confirmó en la red.
+    """
+
+    def __init__(self, response_delay: float = 0.0):
+        super().__init__()
+        self.response_delay = response_delay
+        self.request_counts = {}
+        self._transactions = [] # (visible_desde, transacción), en orden de llegada
+        self._lt = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/api/v2/detectAddress', self._detect_address)
+        app.router.add_get('/api/v2/getTransactions', self._get_transactions)
+        return app
+
+    @property
+    def api_base(self) -> str:
+        return f"{self.url}/api/v2/" # Valor para ton_api.API_BASE
+
+    def _count(self, method: str) -> None:
+        with self._lock:
+            self.request_counts[method] = self.request_counts.get(method, 0) + 1
+
+    async def _detect_address(self, request: web.Request) -> web.Response:
+        self._count('detectAddress')
+        if self.response_delay:
+            await asyncio.sleep(self.response_delay)
+        address = request.query.get('address', '')
+        if len(address) != 48:
+            return web.json_response({'ok': False, 'error': 'Invalid address', 'code': 416})
+        return web.json_response({'ok': True, 'result': {'bounceable': {'b64url': address}}})
+
+    async def _get_transactions(self, request: web.Request) -> web.Response:
+        self._count('getTransactions')
+        if self.response_delay:
+            await asyncio.sleep(self.response_delay)
+        limit = int(request.query.get('limit', 10))
+        now = time.monotonic()
+        with self._lock:
+            visible = [tx for visible_at, tx in self._transactions if visible_at <= now]
+        return web.json_response({'ok': True, 'result': visible[::-1][:limit]})
+
+    def add_payment(self, source: str, value_nano: int, comment: str, delay_seconds: float = 0.0) -> str:
+        """Registra un pago entrante a la wallet del bot. Retorna su body_hash."""
+        with self._lock:
+            tx = synthetic_transaction(source, value_nano, comment, next(self._lt))
+            self._transactions.append((time.monotonic() + delay_seconds, tx))
+        return tx['in_msg']['body_hash']
+
+
+# --- Datos sintéticos ---
+def synthetic_wallet(n: int) -> str:
+    """Dirección TON ficticia pero con el largo de una real (48 caracteres, b64url bounceable)."""
+    return 'EQ' + hashlib.sha256(f"wallet-{n}".encode()).hexdigest()[:46]
+
+
+def synthetic_transaction(source: str, value_nano: int, comment: str, lt: int) -> dict:
+    """Transacción entrante con la forma de getTransactions (in_msg con source, value, message y body_hash)."""
+    body_hash = hashlib.sha256(f"{lt}-{source}-{value_nano}-{comment}".encode()).hexdigest()
+    return {'utime': int(time.time()), 'transaction_id': {'lt': str(lt), 'hash': body_hash},
+            'in_msg': {'source': source, 'destination': 'bot', 'value': str(value_nano), 'message': comment,
+                       'body_hash': body_hash}}
+
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+
+
+def message_update(update_id: int, user_id: int, text: str, message_id: int | None = None) -> dict:
+    """Update de un mensaje de texto privado (los comandos llevan su entidad bot_command)."""
+    message = {'message_id': message_id or update_id, 'date': int(time.time()),
+               'chat': {'id': user_id, 'type': 'private'}, 'from': _user(user_id), 'text': text}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def callback_update(update_id: int, user_id: int, data: str, message_id: int) -> dict:
+    """Update de un botón inline pulsado sobre el mensaje `message_id` del chat privado del usuario."""
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': _user(user_id), 'chat_instance': str(user_id), 'data': data,
+        'message': {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': int(FAKE_BOT_TOKEN.split(':')[0]), 'is_bot': True, 'first_name': 'FakeBot'},
+                    'text': '...'}}}
+
+
+def create_fake_bot(telegram_url: str):
+    """aiogram.Bot que habla con el Bot API falso en `telegram_url`."""
+    from aiogram import Bot
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.enums import ParseMode
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(telegram_url))
+    return Bot(token=FAKE_BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
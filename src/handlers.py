@@ -11,12 +11,17 @@ from aiogram.fsm.state import State, StatesGroup
 
 # --- Importaciones de Aiogram Filters (Corregidas para v3.x) ---
 # Ya NO importamos Text aquí porque la importación falla.
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 # --- Fin Importaciones Aiogram Filters ---
+from aiogram.enums import ParseMode # En v3 ParseMode ya no vive en types
 
+import asyncio
+import json
 import logging
+import os
 import hashlib # Para generar comentario único
-from datetime import datetime # Para timestamp en comentario único
+from collections import OrderedDict # Caché de páginas de /mis_pagos_ton
+from datetime import datetime, timedelta, timezone # Para timestamp en comentario único y ventanas de /estadisticas
 
 # --- Importaciones de tu proyecto (Corregidas a absolutas) ---
 # Asegúrate de que estas funciones existan en tu src/db.py fusionado y actualizado
@@ -28,6 +33,12 @@ import src.ton_api as ton_api # Corregido a importación absoluta y usamos alias
 # Importamos PaymentManager si aún tiene lógica necesaria (ej. generar comentario, validar dirección)
 import src.payment_manager as payment_manager # Corregido a importación absoluta y usamos alias
 
+# Alta en la ronda tras un pago verificado (un pago de N × precio compra N boletos)
+import src.round_manager as round_manager
+from src.payout_ledger import format_nano, ton_to_nano
+import src.profiling as profiling # Perfilado bajo demanda de los comandos de administrador
+from src.tracing import handler_span_middleware # Un span por handler (src/tracing.py)
+
 
 logger = logging.getLogger(__name__)
 
@@ -46,7 +57,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
     if current_state is not None:
          # Si el usuario está en otro estado, ignoramos el /start aquí
          # O podrías enviar un mensaje como: "Ya estás en medio de una acción. Usa /cancelar si quieres detenerla."
-         logger.debug(f"Ignoring /start command from user {message.from_user.id} in state {current_state}")
+         logger.debug("Ignoring /start command from user %s in state %s", message.from_user.id, current_state)
          return
     # --- FIN VERIFICACIÓN DE ESTADO ---
 
@@ -95,7 +106,7 @@ async def cmd_buy_ticket_start(message: types.Message, state: FSMContext, pm_ins
     current_state = await state.get_state()
     if current_state is not None:
          # Si el usuario está en otro estado, ignoramos el comando o sugerimos cancelar
-         logger.debug(f"Ignoring /comprar_boleto command from user {message.from_user.id} in state {current_state}")
+         logger.debug("Ignoring /comprar_boleto command from user %s in state %s", message.from_user.id, current_state)
          await message.answer(f"Ya estás en medio de una acción ({current_state}). Usa /cancelar si quieres detenerla antes de comprar un boleto.")
          return
     # --- FIN VERIFICACIÓN DE ESTADO ---
@@ -106,12 +117,24 @@ async def cmd_buy_ticket_start(message: types.Message, state: FSMContext, pm_ins
     expected_button_text = "🎟️ Comprar Boleto (/comprar_boleto)"
     expected_command_text = "/comprar_boleto"
     
-    if message.text and message.text != expected_button_text and message.text.lower() != expected_command_text:
+    # El comando admite la cantidad de boletos: /comprar_boleto 3
+    command_parts = message.text.split() if message.text else []
+    if message.text and message.text != expected_button_text and (not command_parts or command_parts[0].lower() != expected_command_text):
          # Si el texto no coincide con el botón ni con el comando esperado, ignorar
-         logger.debug(f"Ignoring message text '{message.text}' from user {message.from_user.id} for cmd_buy_ticket_start.")
+         logger.debug("Ignoring message text '%s' from user %s for cmd_buy_ticket_start.", message.text, message.from_user.id)
          return # Ignorar mensajes que no son el botón o comando /comprar_boleto
     # --- FIN VERIFICACIÓN DE TEXTO ---
 
+    ticket_count = 1
+    if message.text != expected_button_text and len(command_parts) > 1:
+        try:
+            ticket_count = int(command_parts[1])
+        except ValueError:
+            ticket_count = 0
+        if not 1 <= ticket_count <= round_manager.MAX_TICKETS_PER_PURCHASE:
+            await message.answer(f"Indica cuántos boletos quieres comprar, entre 1 y {round_manager.MAX_TICKETS_PER_PURCHASE}. Ejemplo: /comprar_boleto 3")
+            return
+
     # --- CORRECCIÓN AQUÍ ---
     await state.clear() # Usar .clear() en lugar de .finish()
     # --- Fin CORRECCIÓN ---
@@ -119,7 +142,7 @@ async def cmd_buy_ticket_start(message: types.Message, state: FSMContext, pm_ins
 
     # --- 1. Obtener información de la ronda lógica activa (si usas rondas lógicas) ---
     # Si tu lotería es continua o no usa rondas lógicas específicas, puedes omitir esto
-    active_round_data = src.db.get_active_round() # Llamada con prefijo (Asume que esta función retorna un dict o None)
+    active_round_data = round_manager.get_current_active_round() # Desde la caché de rondas abiertas (dict o None)
     
     if not active_round_data:
         await message.answer("Lo siento, no hay ninguna ronda de lotería activa en este momento. Intenta más tarde.")
@@ -130,7 +153,8 @@ async def cmd_buy_ticket_start(message: types.Message, state: FSMContext, pm_ins
     active_round_id = active_round_data.get('id', 'N/A') # Usamos .get para seguridad
     ticket_price_ton = active_round_data.get('ticket_price_simulated', 1.0) # Obtener precio de la ronda o usar default
 
-    ticket_price_nano = int(ticket_price_ton * (10**9))
+    ticket_price_nano = ton_to_nano(ticket_price_ton)
+    amount_nano = ticket_price_nano * ticket_count # Un solo pago por todos los boletos
     
     # --- 2. Generar Comentario Único para la Transacción ---
     # Este comentario asocia el pago a este usuario y esta ronda lógica
@@ -147,23 +171,25 @@ async def cmd_buy_ticket_start(message: types.Message, state: FSMContext, pm_ins
     # --- 4. Guardar detalles del pago esperado en FSM ---
     await state.update_data(
         payment_comment=payment_comment_text,
-        amount_nano=ticket_price_nano,
+        amount_nano=amount_nano,
+        ticket_price_nano=ticket_price_nano,
+        ticket_count=ticket_count,
         bot_wallet_to_pay=bot_wallet_address,
         lottery_round_id=str(active_round_id), # Guardar como string para consistencia
-        ticket_price_ton_display=ticket_price_ton,
+        ticket_price_ton_display=format_nano(amount_nano),
         user_telegram_id=user_id_str # Guardar Telegram ID para usarlo en la verificación
     )
 
     # --- 5. Pedir la wallet TON al usuario (la que usará para pagar) ---
     # Esto es necesario para que find_transaction pueda buscar transacciones desde esa wallet.
     await message.answer(
-        f"Vas a comprar un boleto para la ronda <b>{active_round_id}</b> por <b>{ticket_price_ton} TON</b>.\n\n"
+        f"Vas a comprar {'un boleto' if ticket_count == 1 else f'{ticket_count} boletos'} para la ronda <b>{active_round_id}</b> por <b>{format_nano(amount_nano)} TON</b>.\n\n"
         "Por favor, envía ahora la <b>dirección de tu wallet TON</b> (la que usarás para hacer el pago)."
         "Esta dirección se guardará para futuras compras y para el envío de premios si ganas.",
-        parse_mode=types.ParseMode.HTML
+        parse_mode=ParseMode.HTML
     )
     # Cambiar al estado de espera de la wallet del usuario
-    await BuyTicketStates.awaiting_user_wallet_input.set()
+    await state.set_state(BuyTicketStates.awaiting_user_wallet_input)
 
 
 async def process_user_wallet_input(message: types.Message, state: FSMContext, pm_instance: payment_manager.PaymentManager): # Usar alias payment_manager
@@ -172,7 +198,7 @@ async def process_user_wallet_input(message: types.Message, state: FSMContext, p
     # Este handler debería ejecutarse solo en el estado awaiting_user_wallet_input
     current_state = await state.get_state()
     if current_state != BuyTicketStates.awaiting_user_wallet_input:
-         logger.debug(f"Ignoring message from user {message.from_user.id} in state {current_state}. Expected {BuyTicketStates.awaiting_user_wallet_input}")
+         logger.debug("Ignoring message from user %s in state %s. Expected %s", message.from_user.id, current_state, BuyTicketStates.awaiting_user_wallet_input)
          # Opcional: enviar un mensaje de "inesperado"
          # await message.answer("No esperaba ese mensaje ahora. Intenta /comprar_boleto para iniciar una nueva compra.")
          return # Ignorar if not in correct state
@@ -182,7 +208,7 @@ async def process_user_wallet_input(message: types.Message, state: FSMContext, p
     # Este handler está registrado para capturar CUALQUIER texto no manejado por otros handlers.
     # Necesitamos verificar que el mensaje *sea* de texto para evitar errores si recibe fotos, etc.
     if not message.text:
-         logger.debug(f"Ignoring non-text message from user {message.from_user.id} in state {current_state}.")
+         logger.debug("Ignoring non-text message from user %s in state %s.", message.from_user.id, current_state)
          # Opcional: responder "por favor, envía texto"
          return
     # --- FIN VERIFICACIÓN DE TEXTO ---
@@ -217,7 +243,6 @@ async def process_user_wallet_input(message: types.Message, state: FSMContext, p
     ticket_price_display = user_fsm_data['ticket_price_ton_display']
 
     # --- 6. Presentar Instrucciones de Pago y Botones Deep Link ---
-    keyboard_payment_links = types.InlineKeyboardMarkup(row_width=1)
     # Asegúrate de usar la URL correcta para Testnet/Mainnet if different for wallets
     # api.WORK_MODE can be used to determine if it's testnet or mainnet
     
@@ -232,15 +257,19 @@ async def process_user_wallet_input(message: types.Message, state: FSMContext, p
     # Generic ton:// URL
     generic_ton_url = f"ton://transfer/{bot_wallet_address}?amount={amount_to_pay_nano}&text={payment_comment_text}"
 
-    keyboard_payment_links.add(types.InlineKeyboardButton(text="🔷 Pagar con Tonkeeper", url=tonkeeper_url))
-    keyboard_payment_links.add(types.InlineKeyboardButton(text="💎 Pagar con Tonhub", url=tonhub_url))
-    keyboard_payment_links.add(types.InlineKeyboardButton(text="🚀 Pagar con otra wallet TON", url=generic_ton_url))
+    # En v3 el teclado se construye con la lista de filas (un botón por fila)
+    keyboard_payment_links = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🔷 Pagar con Tonkeeper", url=tonkeeper_url)],
+        [types.InlineKeyboardButton(text="💎 Pagar con Tonhub", url=tonhub_url)],
+        [types.InlineKeyboardButton(text="🚀 Pagar con otra wallet TON", url=generic_ton_url)],
+    ])
 
     # Button for the user to confirm payment
-    keyboard_confirm_action = types.InlineKeyboardMarkup(row_width=1)
     # Include the unique comment in callback_data to identify verification
-    keyboard_confirm_action.add(types.InlineKeyboardButton(text="✅ He realizado el pago", callback_data=f"verify_payment_{payment_comment_text}"))
-    keyboard_confirm_action.add(types.InlineKeyboardButton(text="❌ Cancelar compra", callback_data="payment_cancel"))
+    keyboard_confirm_action = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="✅ He realizado el pago", callback_data=f"verify_payment_{payment_comment_text}")],
+        [types.InlineKeyboardButton(text="❌ Cancelar compra", callback_data="payment_cancel")],
+    ])
 
 
     await message.answer(
@@ -251,7 +280,7 @@ async def process_user_wallet_input(message: types.Message, state: FSMContext, p
         f"Realizarás el pago desde tu wallet:\n<code>{user_wallet_standardized}</code>\n\n"
         "Puedes usar los botones de abajo para abrir tu wallet con los datos precargados:",
         reply_markup=keyboard_payment_links,
-        parse_mode=types.ParseMode.HTML
+        parse_mode=ParseMode.HTML
     )
     await message.answer(
         "Una vez que hayas completado la transacción en tu wallet, presiona el botón '✅ He realizado el pago'.",
@@ -259,7 +288,7 @@ async def process_user_wallet_input(message: types.Message, state: FSMContext, p
     )
     
     # --- 7. Change to Verification Waiting State ---
-    await BuyTicketStates.awaiting_payment_verification.set()
+    await state.set_state(BuyTicketStates.awaiting_payment_verification)
 
 
 async def callback_verify_payment(callback_query: types.CallbackQuery, state: FSMContext, pm_instance: payment_manager.PaymentManager, bot_instance: Bot): # Use alias payment_manager
@@ -268,7 +297,7 @@ async def callback_verify_payment(callback_query: types.CallbackQuery, state: FS
     # This handler should execute only in the awaiting_payment_verification state
     current_state = await state.get_state()
     if current_state != BuyTicketStates.awaiting_payment_verification:
-         logger.debug(f"Ignoring verify payment callback from user {callback_query.from_user.id} in state {current_state}. Expected {BuyTicketStates.awaiting_payment_verification}")
+         logger.debug("Ignoring verify payment callback from user %s in state %s. Expected %s", callback_query.from_user.id, current_state, BuyTicketStates.awaiting_payment_verification)
          await callback_query.answer("Unexpected action. Your payment request might have expired. Try /buy_ticket again.")
          return
     # --- END STATE CHECK ---
@@ -298,65 +327,51 @@ async def callback_verify_payment(callback_query: types.CallbackQuery, state: FS
         return
 
     user_sending_wallet = user_fsm_data['user_sending_wallet']
-    expected_amount_nano = user_fsm_data['amount_nano']
-    # expected_bot_wallet = user_fsm_data['bot_wallet_to_pay'] # Not needed to pass to find_transaction
+    # Datos guardados antes de la compra de varios boletos: un boleto al precio de amount_nano
+    ticket_price_nano = user_fsm_data.get('ticket_price_nano', user_fsm_data['amount_nano'])
     lottery_round_id_assoc = user_fsm_data['lottery_round_id'] # ID of the logical round
 
     # --- Call payment verification function ---
-    # ton_api.find_transaction already handles interaction with db.check_transaction and db.add_ton_transaction
-    # and associates the Telegram ID if passed.
-    # Use ton_api.find_transaction
-    is_verified = ton_api.find_transaction(
+    # ton_api.find_ticket_payment handles db.check_transaction and db.add_ton_transaction and
+    # accepts any exact multiple of the ticket price: the paid amount decides the tickets bought.
+    tickets_paid = ton_api.find_ticket_payment(
         user_wallet=user_sending_wallet, # The wallet from which the user paid (standardized)
-        value_nano=str(expected_amount_nano), # Expected amount in nanoTONs (as a string for the API)
+        ticket_price_nano=ticket_price_nano,
         comment=unique_comment_from_callback, # The unique comment we expect
-        telegram_id=user_id_str # Pass the Telegram ID for DB association
+        telegram_id=user_id_str, # Pass the Telegram ID for DB association
+        max_tickets=round_manager.MAX_TICKETS_PER_PURCHASE,
+        lottery_round_id=int(lottery_round_id_assoc)
     )
 
     # --- Process verification result ---
-    if is_verified:
-        # If verification was successful, the payment is already registered in ton_transactions.
-        # Now, if your off-chain draw logic needs to register participants
-        # in a separate table (e.g., round_participants) or associate the payment to a logical round
-        # in a more formal way, do it here.
-        
-        # Example (if you keep the round_participants table for simulation logic):
-        # try:
-        #     # Assign participant number and register in round_participants table
-        #     current_participants_count = src.db.count_participants_in_round(int(lottery_round_id_assoc)) # You need this function
-        #     assigned_number = current_participants_count + 1 # Simple assignment logic
-        #
-        #     src.db.add_participant_to_round( # You need this function in db.py
-        #         round_id=int(lottery_round_id_assoc),
-        #         telegram_id=user_id_str,
-        #         assigned_number=assigned_number # Or the corresponding number
-        #     )
-        #     # Notify the user with the assigned number (if applicable)
-        #     await bot_instance.edit_message_text(...) # Message with assigned number
-        #
-        # except Exception as e:
-        #     logger.error(f"Error registering participant in simulation round {lottery_round_id_assoc} for user {user_id_str}: {e}")
-        #     # Notify the user about the problem in ticket registration
-        #     await bot_instance.send_message(...)
-
-        # General success message if you only register in ton_transactions
+    if tickets_paid:
+        # The payment is registered in ton_transactions; now the tickets enter the round.
+        joined, join_message, _, _ = round_manager.add_participant(
+            int(lottery_round_id_assoc), user_id_str, callback_query.from_user.username, tickets=tickets_paid)
+        if not joined:
+            # Paid but the round closed or ran out of room in the meantime: the payment stays recorded for a refund
+            logger.error(f"Pago verificado de {user_id_str} ({tickets_paid} boletos) sin alta en ronda {lottery_round_id_assoc}: {join_message}")
+            join_message = (f"{join_message}\nTu pago quedó registrado; contacta al administrador para la devolución.")
+
         await bot_instance.edit_message_text(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
-            text=f"¡Pago confirmado! 🎉\nTu pago de <code>{expected_amount_nano / (10**9)}</code> TON para la ronda <b>{lottery_round_id_assoc}</b> ha sido verificado y registrado.\n"
+            text=f"¡Pago confirmado! 🎉\nTu pago de <code>{format_nano(tickets_paid * ticket_price_nano)}</code> TON ({tickets_paid} boleto(s)) para la ronda <b>{lottery_round_id_assoc}</b> ha sido verificado y registrado.\n"
+                     f"{join_message}\n"
                      f"¡Mucha suerte, {callback_query.from_user.first_name}!\n\n"
                      "Puedes ver tus pagos verificados con /mis_pagos_ton o iniciar otra compra con /comprar_boleto.",
-            parse_mode=types.ParseMode.HTML,
+            parse_mode=ParseMode.HTML,
             reply_markup=None # Remove inline buttons
         )
         
         await state.clear() # Corrected from .finish()
     else:
         # If find_transaction returned False
-        keyboard_retry_cancel = types.InlineKeyboardMarkup(row_width=1)
         # The callback_data for retry must include the original unique comment
-        keyboard_retry_cancel.add(types.InlineKeyboardButton(text="🔄 Reintentar Verificación", callback_data=f"verify_payment_{unique_comment_from_callback}"))
-        keyboard_retry_cancel.add(types.InlineKeyboardButton(text="❌ Cancelar Compra", callback_data="payment_cancel"))
+        keyboard_retry_cancel = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="🔄 Reintentar Verificación", callback_data=f"verify_payment_{unique_comment_from_callback}")],
+            [types.InlineKeyboardButton(text="❌ Cancelar Compra", callback_data="payment_cancel")],
+        ])
         
         # Try to edit the previous message if possible, otherwise send a new one
         try:
@@ -366,12 +381,12 @@ async def callback_verify_payment(callback_query: types.CallbackQuery, state: FS
                 text="No pudimos confirmar tu pago en este momento.\n"
                      "Asegúrate de que:\n"
                      "1. La transacción ya se haya confirmado en la red TON (puede tardar un poco).\n"
-                     "2. Hayas enviado el monto exacto.\n"
+                     "2. Hayas enviado el monto exacto (un múltiplo exacto del precio del boleto).\n"
                      "3. Hayas incluido el comentario correcto.\n"
                      "4. Hayas pagado desde la wallet que nos indicaste.\n\n"
                      "Puedes esperar unos segundos y reintentar la verificación o cancelar la compra.",
                 reply_markup=keyboard_retry_cancel,
-                parse_mode=types.ParseMode.HTML
+                parse_mode=ParseMode.HTML
             )
         except Exception:
             # If editing fails (e.g., very old message), send a new message
@@ -380,12 +395,12 @@ async def callback_verify_payment(callback_query: types.CallbackQuery, state: FS
                 text="No pudimos confirmar tu pago en este momento.\n"
                      "Asegúrate de que:\n"
                      "1. La transacción ya se haya confirmado en la red TON (puede tardar un poco).\n"
-                     "2. Hayas enviado el monto exacto.\n"
+                     "2. Hayas enviado el monto exacto (un múltiplo exacto del precio del boleto).\n"
                      "3. Hayas incluido el comentario correcto.\n"
                      "4. Hayas pagado desde la wallet que nos indicaste.\n\n"
                      "Puedes esperar unos segundos y reintentar la verificación o cancelar la compra.",
                 reply_markup=keyboard_retry_cancel,
-                parse_mode=types.ParseMode.HTML
+                parse_mode=ParseMode.HTML
             )
 
 
@@ -409,7 +424,7 @@ async def callback_payment_cancel(callback_query: types.CallbackQuery, state: FS
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
             text="The ticket purchase has been canceled.",
-            parse_mode=types.ParseMode.HTML,
+            parse_mode=ParseMode.HTML,
             reply_markup=None # Remove inline buttons
         )
     except Exception: 
@@ -464,51 +479,289 @@ async def cmd_my_paid_tickets(message: types.Message, state: FSMContext): # <--
     
     # Ensure user exists in DB
     src.db.get_or_create_user(str(message.from_user.id), message.from_user.username, message.from_user.first_name) # Call with prefix
-    
-    # Get verified TON payments history from ton_transactions table
-    user_payments = src.db.get_user_ton_payments_history(user_id_str) # Call with prefix
 
-    if not user_payments:
-        await message.answer("No verified payments found associated with your Telegram account.\n"
-                             "Ensure you have completed a ticket purchase and your payment was verified by the bot.")
+    # First page of the verified TON payments history (keyset-paginated, see render_payments_page)
+    response_text, keyboard = render_payments_page(user_id_str)
+    await message.answer(response_text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+
+# --- /mis_pagos_ton pagination ---
+# Each page is one index range scan on (transaction_time, id) (db.get_user_ton_payments_page).
+# Rendered pages are cached per user and dropped when a new payment is recorded for that user
+# (db.get_data_version(('payments', telegram_id)) changes).
+PAYMENTS_PAGE_SIZE = 5
+PAYMENTS_PAGE_CACHE_USERS = 1000 # Users with cached pages (LRU)
+PAYMENTS_PAGE_CACHE_PAGES_PER_USER = 20
+TELEGRAM_MESSAGE_LIMIT = 4096
+PAYMENTS_CALLBACK_PREFIX = "pay|" # callback_data: pay|<older|newer>|<transaction_time>|<id> (Telegram allows 64 bytes)
+
+_payments_page_cache = OrderedDict() # telegram_id -> {'version': int, 'pages': OrderedDict(cursor -> (text, keyboard))}
+
+
+def _format_payment_entry(payment: dict) -> str:
+    value_nano = payment.get('value_nano')
+    comment = payment.get('comment')
+    user_wallet_display = payment.get('user_ton_wallet') or 'Unknown'
+    tx_hash_display = payment.get('transaction_hash') or 'Unknown'
+    tx_time_display = payment.get('transaction_time') or 'Unknown date'
+    lottery_round_id_assoc = payment.get('lottery_round_id_assoc')
+
+    value_ton = format_nano(value_nano) if value_nano is not None else "N/A"
+    comment_display = comment if comment else "No comment"
+    # Show associated round if it exists, or the comment otherwise
+    round_info_line = (f"   Associated Round: {lottery_round_id_assoc}\n" if lottery_round_id_assoc is not None
+                       else f"   Original Comment: <code>{comment_display}</code>\n")
+    tx_hash_short = tx_hash_display[:10] + '...' if tx_hash_display != 'Unknown' else 'Unknown'
+    tx_time_short = tx_time_display[:10] if tx_time_display != 'Unknown date' else 'Unknown date'
+
+    return (f"🔹 Payment of <b>{value_ton} TON</b>\n"
+            f"{round_info_line}"
+            f"   From Wallet: <code>{user_wallet_display}</code>\n"
+            f"   TX Hash: <code>{tx_hash_short}</code>\n"
+            f"   Verification Date: {tx_time_short}\n"
+            f"\n")
+
+
+def _payments_callback_data(direction: str, payment: dict) -> str:
+    return f"{PAYMENTS_CALLBACK_PREFIX}{direction}|{payment['transaction_time']}|{payment['id']}"
+
+
+def render_payments_page(telegram_id: str, direction: str | None = None, cursor: tuple | None = None) -> tuple:
+    """
+    Text and inline keyboard of one /mis_pagos_ton page. `direction` is 'older' or 'newer' and
+    `cursor` the (transaction_time, id) of the row the user paged from; without them, the newest page.
+    The text always fits in one Telegram message. Returns (text, keyboard | None).
+    """
+    version = src.db.get_data_version(('payments', telegram_id))
+    page_key = (direction, cursor)
+    user_cache = _payments_page_cache.get(telegram_id)
+    if user_cache is not None and user_cache['version'] == version and page_key in user_cache['pages']:
+        _payments_page_cache.move_to_end(telegram_id)
+        return user_cache['pages'][page_key]
+
+    page = src.db.get_user_ton_payments_page(
+        telegram_id, PAYMENTS_PAGE_SIZE,
+        before=cursor if direction == 'older' else None, after=cursor if direction == 'newer' else None)
+    payments = page['payments']
+
+    if not payments:
+        text = ("No verified payments found associated with your Telegram account.\n"
+                "Ensure you have completed a ticket purchase and your payment was verified by the bot.")
+        rendered = (text, None)
+    else:
+        header = "<b>History of your verified payments (TON Transactions):</b>\n\n"
+        response_text = header
+        shown = []
+        for payment in payments:
+            entry = _format_payment_entry(payment)
+            if len(response_text) + len(entry) > TELEGRAM_MESSAGE_LIMIT:
+                break # The rest goes to the next page: the cursor is the last entry shown
+            response_text += entry
+            shown.append(payment)
+        if not shown: # A single entry over the limit (should not happen with 100-char comments)
+            shown = payments[:1]
+            response_text = (header + _format_payment_entry(payments[0]))[:TELEGRAM_MESSAGE_LIMIT]
+        has_older = page['has_older'] or len(shown) < len(payments)
+
+        buttons = []
+        if page['has_newer']:
+            buttons.append(types.InlineKeyboardButton(text="⬅️ Más recientes", callback_data=_payments_callback_data('newer', shown[0])))
+        if has_older:
+            buttons.append(types.InlineKeyboardButton(text="Más antiguos ➡️", callback_data=_payments_callback_data('older', shown[-1])))
+        rendered = (response_text, types.InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None)
+
+    if user_cache is None or user_cache['version'] != version:
+        user_cache = {'version': version, 'pages': OrderedDict()}
+    user_cache['pages'][page_key] = rendered
+    if len(user_cache['pages']) > PAYMENTS_PAGE_CACHE_PAGES_PER_USER:
+        user_cache['pages'].popitem(last=False)
+    _payments_page_cache[telegram_id] = user_cache
+    _payments_page_cache.move_to_end(telegram_id)
+    if len(_payments_page_cache) > PAYMENTS_PAGE_CACHE_USERS:
+        _payments_page_cache.popitem(last=False)
+    return rendered
+
+
+async def callback_payments_page(callback_query: types.CallbackQuery, bot_instance: Bot):
+    """Handles the next/previous buttons of /mis_pagos_ton."""
+    try:
+        _, direction, transaction_time, payment_id = callback_query.data.split('|')
+        cursor = (transaction_time, int(payment_id))
+    except ValueError:
+        logger.error(f"Unexpected callback data for payments pagination: {callback_query.data}")
+        await callback_query.answer("Internal error processing request.", show_alert=True)
+        return
+    if direction not in ('older', 'newer'):
+        await callback_query.answer("Internal error processing request.", show_alert=True)
         return
 
-    response_text = "<b>History of your verified payments (TON Transactions):</b>\n\n"
-    for payment in user_payments:
-        # Ensure keys exist in the `payment` dictionary
-        value_nano = payment.get('value_nano')
-        comment = payment.get('comment')
-        user_wallet_display = payment.get('user_ton_wallet', 'Unknown')
-        tx_hash_display = payment.get('transaction_hash', 'Unknown')
-        tx_time_display = payment.get('transaction_time', 'Unknown date')
-        lottery_round_id_assoc = payment.get('lottery_round_id_assoc', 'N/A') # Get associated round if exists
+    await callback_query.answer()
+    response_text, keyboard = render_payments_page(str(callback_query.from_user.id), direction, cursor)
+    try:
+        await bot_instance.edit_message_text(
+            chat_id=callback_query.message.chat.id,
+            message_id=callback_query.message.message_id,
+            text=response_text,
+            parse_mode=ParseMode.HTML,
+            reply_markup=keyboard
+        )
+    except Exception:
+        await bot_instance.send_message(callback_query.message.chat.id, response_text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
 
+# --- Admin commands: on-demand profiling (src/profiling.py) ---
+# Only the Telegram ids in ADMIN_TELEGRAM_ID (config.json, comma-separated) may use them; for everyone
+# else the commands do not exist. Reports come back as a .txt document.
+def _load_admin_ids() -> frozenset:
+    config_path = os.path.join(os.path.dirname(__file__), '..', 'config.json')
+    try:
+        with open(config_path, 'r') as f:
+            raw = json.load(f).get('ADMIN_TELEGRAM_ID') or ''
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read ADMIN_TELEGRAM_ID from config.json ({e}). Admin commands disabled.")
+        return frozenset()
+    return frozenset(part.strip() for part in str(raw).split(',') if part.strip().isdigit())
 
-        value_ton = value_nano / (10**9) if value_nano is not None else "N/A"
-        comment_display = comment if comment else "No comment"
+ADMIN_TELEGRAM_IDS = _load_admin_ids()
 
-        # Show associated round if it exists, or the comment otherwise
-        round_info_line = f"   Associated Round: {lottery_round_id_assoc}\n" if lottery_round_id_assoc != 'N/A' else f"   Original Comment: <code>{comment_display}</code>\n"
 
+def is_admin(telegram_id) -> bool:
+    return str(telegram_id) in ADMIN_TELEGRAM_IDS
 
-        tx_hash_short = tx_hash_display[:10] + '...' if tx_hash_display != 'Unknown' else 'Unknown'
-        tx_time_short = tx_time_display[:10] if tx_time_display != 'Unknown date' else 'Unknown date'
 
+async def _send_report(bot_instance: Bot, chat_id: int, name: str, report: str, summary: str):
+    document = types.BufferedInputFile(report.encode('utf-8'), filename=f"{name}_{datetime.now():%Y%m%d_%H%M%S}.txt")
+    await bot_instance.send_document(chat_id, document, caption=summary)
 
-        response_text += (f"🔹 Payment of <b>{value_ton} TON</b>\n"
-                          f"{round_info_line}" # Use the round/comment info line
-                          f"   From Wallet: <code>{user_wallet_display}</code>\n"
-                          f"   TX Hash: <code>{tx_hash_short}</code>\n" 
-                          f"   Verification Date: {tx_time_short}\n" 
-                          f"\n")
-    
-    await message.answer(response_text, parse_mode=types.ParseMode.HTML)
+
+# Pending auto-stop tasks: the loop only keeps weak references to tasks, so we hold them here until they
+# finish. Each one is named after its session kind so a manual stop can cancel it.
+_auto_stop_tasks = set()
+
+
+def _schedule_auto_stop(kind: str, coroutine):
+    task = asyncio.create_task(coroutine, name=f"auto_stop_{kind}")
+    _auto_stop_tasks.add(task)
+    task.add_done_callback(_auto_stop_tasks.discard)
 
 
-# NOTE: cmd_my_paid_tickets now needs the `state` argument for the internal check.
-# If registered with `dp.message.register(cmd_my_paid_tickets, ...)` without lambda,
-# the dispatcher will NOT pass `state`. It must be registered with a lambda if it needs `state`.
-# We will update the registration to pass `state`.
+def _cancel_auto_stop(kind: str):
+    for task in list(_auto_stop_tasks):
+        if task.get_name() == f"auto_stop_{kind}":
+            task.cancel()
+
+
+async def _auto_stop_profile(bot_instance: Bot, chat_id: int, session_id: int, stop, name: str, in_thread: bool = False):
+    """
+    Stops a session the admin forgot about after profiling.PROFILE_MAX_SECONDS and sends its report.
+    in_thread=True runs `stop` in a worker thread (the memory diff); cProfile must be disabled on the loop thread.
+    """
+    await asyncio.sleep(profiling.PROFILE_MAX_SECONDS)
+    report, summary = await asyncio.to_thread(stop, session_id) if in_thread else stop(session_id)
+    if report is not None:
+        logger.warning(f"Profiling session {session_id} stopped after {profiling.PROFILE_MAX_SECONDS}s.")
+        await _send_report(bot_instance, chat_id, name, report, f"(detenido automáticamente) {summary}")
+
+
+async def cmd_profile_start(message: types.Message, command: CommandObject, bot_instance: Bot):
+    """/perfil_iniciar [cpu|muestreo]: starts a CPU profile of the event loop thread."""
+    if not is_admin(message.from_user.id):
+        return
+    mode = (command.args or profiling.CPU_MODE_CPROFILE).strip().lower()
+    started, text, session_id = profiling.start_cpu_profile(mode)
+    if started:
+        logger.warning(f"Admin {message.from_user.id} started a '{mode}' profile (session {session_id}).")
+        _schedule_auto_stop('cpu', _auto_stop_profile(bot_instance, message.chat.id, session_id, profiling.stop_cpu_profile, f"perfil_{mode}"))
+        text += f" Detenlo con /perfil_detener (máximo {profiling.PROFILE_MAX_SECONDS // 60} min)."
+    await message.answer(text)
+
+
+async def cmd_profile_stop(message: types.Message, bot_instance: Bot):
+    """/perfil_detener: stops the CPU profile and sends the report sorted by cumulative time."""
+    if not is_admin(message.from_user.id):
+        return
+    session = profiling.get_cpu_session()
+    _cancel_auto_stop('cpu')
+    report, summary = profiling.stop_cpu_profile()
+    if report is None:
+        await message.answer(summary)
+        return
+    await _send_report(bot_instance, message.chat.id, f"perfil_{session['mode']}", report, summary)
+
+
+async def cmd_memory_start(message: types.Message, bot_instance: Bot):
+    """/memoria_iniciar: takes the tracemalloc baseline snapshot."""
+    if not is_admin(message.from_user.id):
+        return
+    started, text, session_id = profiling.start_memory_trace()
+    if started:
+        logger.warning(f"Admin {message.from_user.id} started a memory trace (session {session_id}).")
+        _schedule_auto_stop('memory', _auto_stop_profile(bot_instance, message.chat.id, session_id, profiling.stop_memory_trace, "memoria",
+                                                         in_thread=True))
+        text += f" Detenla con /memoria_detener (máximo {profiling.PROFILE_MAX_SECONDS // 60} min)."
+    await message.answer(text)
+
+
+async def cmd_memory_stop(message: types.Message, bot_instance: Bot):
+    """/memoria_detener: sends the snapshot diff sorted by allocation growth."""
+    if not is_admin(message.from_user.id):
+        return
+    _cancel_auto_stop('memory')
+    report, summary = await asyncio.to_thread(profiling.stop_memory_trace) # Comparing snapshots can take seconds
+    if report is None:
+        await message.answer(summary)
+        return
+    await _send_report(bot_instance, message.chat.id, "memoria", report, summary)
+
+
+# --- Admin command: /estadisticas (/stats) ---
+# Reads only the rollup tables (db.get_stats_totals): each window is a primary-key range of at most
+# 30 daily or 24 hourly buckets per round type, so the answer costs the same with any history size.
+STATS_WINDOWS = (('Hoy', 'day', 0), ('Últimas 24 h', 'hour', 23), ('Últimos 7 días', 'day', 6), ('Últimos 30 días', 'day', 29))
+
+
+def _stats_since(period: str, back: int, now: datetime) -> str:
+    if period == 'hour':
+        return (now - timedelta(hours=back)).strftime('%Y-%m-%dT%H')
+    return (now - timedelta(days=back)).strftime('%Y-%m-%d')
+
+
+def _cancellation_rate(totals: dict) -> str:
+    ended = totals['rounds_finished'] + totals['rounds_cancelled']
+    return f"{totals['rounds_cancelled'] * 100 / ended:.1f}%" if ended else "—"
+
+
+def render_stats(now: datetime | None = None) -> str:
+    """HTML text of /estadisticas: totals per window and, for the last window, per round type."""
+    now = now or datetime.now(timezone.utc)
+    lines = ["📊 <b>Estadísticas</b> (UTC)"]
+    by_type = {}
+    for title, period, back in STATS_WINDOWS:
+        by_type = src.db.get_stats_totals(period, _stats_since(period, back, now))
+        totals = {column: sum(row[column] for row in by_type.values()) for column in src.db.STATS_COUNTERS}
+        lines += ["", f"<b>{title}</b>",
+                  f"🎟️ {totals['tickets_sold']} boletos · 👥 {totals['participants']} participantes",
+                  f"💰 {totals['payments']} pagos · {format_nano(totals['payments_nano'])} TON",
+                  f"🎲 {totals['rounds_created']} rondas creadas · {totals['rounds_finished']} sorteadas · "
+                  f"{totals['rounds_cancelled']} canceladas ({_cancellation_rate(totals)})",
+                  f"🏆 {format_nano(totals['prizes_nano'])} TON en premios · {format_nano(totals['commissions_nano'])} TON en comisiones"]
+    if by_type: # Desglose de la última ventana (la más larga)
+        lines += ["", f"<b>Por tipo de ronda ({STATS_WINDOWS[-1][0].lower()})</b>"]
+        for round_type, totals in sorted(by_type.items(), key=lambda item: item[1]['payments_nano'], reverse=True):
+            lines.append(f"• <code>{round_type or 'sin ronda'}</code>: {totals['tickets_sold']} boletos, "
+                         f"{format_nano(totals['payments_nano'])} TON cobrados, {_cancellation_rate(totals)} canceladas")
+    return '\n'.join(lines)
+
+
+async def cmd_stats(message: types.Message):
+    """/estadisticas (/stats): sales, payments and round outcomes from the rollup tables."""
+    if not is_admin(message.from_user.id):
+        return
+    await message.answer(render_stats(), parse_mode=ParseMode.HTML)
+
+
+# NOTE: aiogram v3 injects handler arguments by name: `state` comes from the FSM middleware and
+# `pm_instance` / `bot_instance` from the dispatcher's workflow_data (set in register_all_handlers).
 
 
 def register_all_handlers(dp: Dispatcher, bot_instance: Bot, pm_instance: payment_manager.PaymentManager): # Use alias payment_manager
@@ -517,48 +770,55 @@ def register_all_handlers(dp: Dispatcher, bot_instance: Bot, pm_instance: paymen
     # db_instance is not passed to individual handlers because functions from db.py
     # called directly already manage their own connection.
 
+    # Shared dependencies: every handler that declares pm_instance / bot_instance receives them
+    dp.workflow_data.update(pm_instance=pm_instance, bot_instance=bot_instance)
+    # Tracing: every handler runs inside a span, parent of its ton_api / db / Bot API spans
+    dp.message.middleware(handler_span_middleware)
+    dp.callback_query.middleware(handler_span_middleware)
+
     # Command and Text Handlers
-    # --- V3 REGISTRATION SYNTAX (WITHOUT STATEFILTER OR TEXT FILTER - COMPLETE WORKAROUND) ---
-    # State and text filters are handled INSIDE the handlers now.
+    # State and text filters are handled INSIDE the handlers.
     # We only use CommandStart and Command filters in register(), and lambda filters for text.
 
     # Register handlers for commands
     dp.message.register(cmd_start, CommandStart()) # Registers /start command
     dp.message.register(cmd_cancel, Command("cancelar")) # Registers /cancelar command
-    # These handlers need lambda to pass `state` and `pm_instance`
-    # --- CORRECCIÓN: Añadir await en las lambdas que llaman handlers async ---
-    dp.message.register(lambda msg, state: await cmd_buy_ticket_start(msg, state, pm_instance), Command("comprar_boleto")) # Registers /comprar_boleto command
-    dp.message.register(lambda msg, state: await cmd_my_paid_tickets(msg, state), Command("mis_pagos_ton")) # Registers /mis_pagos_ton command
+    dp.message.register(cmd_buy_ticket_start, Command("comprar_boleto")) # Registers /comprar_boleto [cantidad]
+    dp.message.register(cmd_my_paid_tickets, Command("mis_pagos_ton")) # Registers /mis_pagos_ton command
+    # Admin-only profiling and statistics commands (ignored for everyone else)
+    dp.message.register(cmd_profile_start, Command("perfil_iniciar"))
+    dp.message.register(cmd_profile_stop, Command("perfil_detener"))
+    dp.message.register(cmd_memory_start, Command("memoria_iniciar"))
+    dp.message.register(cmd_memory_stop, Command("memoria_detener"))
+    dp.message.register(cmd_stats, Command("estadisticas", "stats"))
 
     # Register handlers for button text (using lambda filters)
     # These handlers check text AND state internally.
-    # We register the same handlers for the button text.
-    dp.message.register(lambda msg, state: await cmd_buy_ticket_start(msg, state, pm_instance), lambda message: isinstance(message.text, str) and message.text == "🎟️ Comprar Boleto (/comprar_boleto)")
-    dp.message.register(lambda msg, state: await cmd_my_paid_tickets(msg, state), lambda message: isinstance(message.text, str) and message.text == "📜 Mis Pagos TON (/mis_pagos_ton)")
+    dp.message.register(cmd_buy_ticket_start, lambda message: isinstance(message.text, str) and message.text == "🎟️ Comprar Boleto (/comprar_boleto)")
+    dp.message.register(cmd_my_paid_tickets, lambda message: isinstance(message.text, str) and message.text == "📜 Mis Pagos TON (/mis_pagos_ton)")
 
     # Register a handler for ANY other text messages
     # This handler must check the state internally to know if it's expecting a wallet address.
     # It must be registered *after* all command and specific text button handlers.
-    dp.message.register(lambda message, state: await process_user_wallet_input(message, state, pm_instance), lambda message: isinstance(message.text, str))
-    # --- Fin CORRECCIÓN ---
+    dp.message.register(process_user_wallet_input, lambda message: isinstance(message.text, str))
 
 
     # Callback Handlers (inline buttons)
     # These handlers must verify the state INTERNALLY
     dp.callback_query.register(
-        lambda cb_query, state: await callback_verify_payment(cb_query, state, pm_instance, bot_instance), # <-- Add await here too
+        callback_verify_payment,
         lambda c: c.data and c.data.startswith('verify_payment_') # Callback data filter (positional)
     )
 
     dp.callback_query.register(
-        lambda cb_query, state: await callback_payment_cancel(cb_query, state, bot_instance), # <-- Add await here too
-        lambda c: c.data == 'payment_cancel' # Callback data filter (posicional)
+        callback_payments_page,
+        lambda c: c.data and c.data.startswith(PAYMENTS_CALLBACK_PREFIX) # /mis_pagos_ton next/previous buttons
     )
 
+    dp.callback_query.register(
+        callback_payment_cancel,
+        lambda c: c.data == 'payment_cancel' # Callback data filter (posicional)
+    )
 
-    logger.info("Handlers from src.handlers (Aiogram v3 - COMPLETE WORKAROUND) registered.")
 
-    # NOTE: The logic for registering the /open_rounds handler (if round_manager is available)
-    # was in bot.py. It could be moved here or kept in bot.py by registering directly with the dispatcher.
-    # Since the availability of round_manager is checked in bot.py, it's easier to register it there.
-    # Ensure that the registration logic in bot.py also uses dp.message.register.
\ No newline at end of file
+    logger.info("Handlers from src.handlers (Aiogram v3) registered.")
@@ -0,0 +1,100 @@
+# src/leader_election.py
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+# Importar las funciones de lease de bajo nivel
+from .db import (
+    try_acquire_lease as db_try_acquire_lease,
+    release_lease as db_release_lease,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Constantes de Elección de Líder ---
+SCHEDULER_LEASE_NAME = 'scheduler'
+DEFAULT_LEASE_TTL_SECONDS = 30
+# Por defecto renovamos 3 veces por TTL, así un heartbeat perdido no hace caer el lease.
+DEFAULT_HEARTBEAT_DIVISOR = 3
+
+
+class LeaderElector:
+    """
+    Elección de líder basada en un lease con heartbeat guardado en SQLite.
+
+    Todas las réplicas del bot siguen atendiendo updates de Telegram; solo la que
+    tiene el lease ejecuta los jobs programados. Si el líder muere sin liberar el lease,
+    otra réplica lo toma como máximo `ttl_seconds + heartbeat_interval_seconds`
+    después del último heartbeat del líder caído. Los listeners de add_acquired_listener
+    se llaman cada vez que esta réplica pasa a ser líder (p. ej. para retomar el trabajo
+    que el líder anterior dejó a medias).
+    """
+
+    def __init__(self, lease_name: str = SCHEDULER_LEASE_NAME, ttl_seconds: float = DEFAULT_LEASE_TTL_SECONDS,
+                 heartbeat_interval_seconds: float | None = None, holder_id: str | None = None):
+        if heartbeat_interval_seconds is None:
+            heartbeat_interval_seconds = ttl_seconds / DEFAULT_HEARTBEAT_DIVISOR
+        if heartbeat_interval_seconds <= 0 or heartbeat_interval_seconds >= ttl_seconds:
+            raise ValueError("El intervalo de heartbeat del lease debe ser mayor que 0 y menor que el TTL.")
+
+        self.lease_name = lease_name
+        self.ttl_seconds = ttl_seconds
+        self.heartbeat_interval_seconds = heartbeat_interval_seconds
+        self.holder_id = holder_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # Reloj monotónico local hasta el cual podemos asumir que el lease es nuestro
+        self._valid_until = 0.0
+        self._stopped = False
+        self._acquired_listeners = []
+
+    def add_acquired_listener(self, callback) -> None:
+        """Registra callback() para cuando esta réplica adquiera el lease (se llama desde heartbeat)."""
+        self._acquired_listeners.append(callback)
+
+    @property
+    def is_leader(self) -> bool:
+        """True mientras el último heartbeat exitoso siga vigente en el reloj local."""
+        return time.monotonic() < self._valid_until
+
+    def heartbeat(self) -> bool:
+        """Intenta adquirir o renovar el lease una vez. Retorna True si esta réplica es líder."""
+        was_leader = self.is_leader
+        # Medimos antes de llamar a la DB: el lease local caduca un poco antes que el de la DB, nunca después.
+        attempt_started = time.monotonic()
+        acquired = db_try_acquire_lease(self.lease_name, self.holder_id, self.ttl_seconds)
+        if acquired:
+            self._valid_until = attempt_started + self.ttl_seconds
+            if not was_leader:
+                logger.info(f"LEADER: Réplica {self.holder_id} es ahora líder del lease '{self.lease_name}'.")
+                for callback in self._acquired_listeners:
+                    try:
+                        callback()
+                    except Exception as e:
+                        logger.error(f"LEADER: Error en un listener de adquisición del lease '{self.lease_name}': {e}", exc_info=True)
+        else:
+            self._valid_until = 0.0
+            if was_leader:
+                logger.warning(f"LEADER: Réplica {self.holder_id} perdió el lease '{self.lease_name}'.")
+        return acquired
+
+    async def run(self):
+        """Bucle de heartbeat; se lanza con asyncio.create_task y termina con stop()."""
+        logger.info(f"LEADER: Heartbeat de lease '{self.lease_name}' iniciado para {self.holder_id} "
+                    f"(TTL {self.ttl_seconds}s, cada {self.heartbeat_interval_seconds}s).")
+        while not self._stopped:
+            try:
+                self.heartbeat()
+            except Exception as e:
+                self._valid_until = 0.0
+                logger.error(f"LEADER: Error inesperado en heartbeat de {self.holder_id}: {e}", exc_info=True)
+            await asyncio.sleep(self.heartbeat_interval_seconds)
+
+    def stop(self, release: bool = True):
+        """Detiene el heartbeat y, si se pide, libera el lease para que otra réplica lo tome sin esperar al TTL."""
+        self._stopped = True
+        self._valid_until = 0.0
+        if release and db_release_lease(self.lease_name, self.holder_id):
+            logger.info(f"LEADER: Lease '{self.lease_name}' liberado por {self.holder_id}.")
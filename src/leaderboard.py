@@ -0,0 +1,91 @@
+# src/leaderboard.py
+# Ganadores para la webapp: los premios más recientes desde un buffer circular en memoria y el ranking
+# histórico desde winner_stats (que db.settle_round mantiene en la misma transacción de la liquidación).
+# Ninguna lectura agrega el historial de draw_results.
+
+import logging
+import threading
+import time
+from collections import deque
+
+from .db import (
+    get_draw_winners_page as db_get_draw_winners_page,
+    get_winner_leaderboard as db_get_winner_leaderboard,
+    get_data_version,
+    DATA_VERSION_WINNERS,
+)
+from .round_manager import ROUND_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+RECENT_WINNERS_BUFFER_SIZE = 200 # Premios recientes en memoria; páginas más antiguas se leen de la DB
+MAX_WINNERS_PAGE_SIZE = 100
+# Otro proceso (el bot) liquida rondas sin avisar a este: el buffer se pone al día cada tanto
+RECENT_WINNERS_REFRESH_SECONDS = ROUND_CACHE_TTL_SECONDS
+
+# Buffer circular de filas de draw_results con ganador, en orden ascendente de id (el más reciente al final)
+_recent_winners = deque(maxlen=RECENT_WINNERS_BUFFER_SIZE)
+_recent_state = {'loaded': False, 'last_id': 0, 'version': None, 'synced_at': 0.0}
+_recent_lock = threading.Lock()
+
+
+def reset_recent_winners() -> None:
+    """Vacía el buffer (se recarga en la siguiente lectura). Para tests o tras cambiar de base de datos."""
+    with _recent_lock:
+        _recent_winners.clear()
+        _recent_state.update(loaded=False, last_id=0, version=None, synced_at=0.0)
+
+
+def _sync_recent_winners(force: bool = False) -> None:
+    """Añade al buffer los premios con id mayor que el último visto (la primera vez, los últimos N)."""
+    version = get_data_version(DATA_VERSION_WINNERS)
+    with _recent_lock:
+        fresh = time.monotonic() - _recent_state['synced_at'] <= RECENT_WINNERS_REFRESH_SECONDS
+        if _recent_state['loaded'] and not force and _recent_state['version'] == version and fresh:
+            return
+        if not _recent_state['loaded']:
+            rows = db_get_draw_winners_page(RECENT_WINNERS_BUFFER_SIZE)[::-1]
+            _recent_winners.extend(rows)
+            _recent_state['loaded'] = True
+        else:
+            while True:
+                rows = db_get_draw_winners_page(RECENT_WINNERS_BUFFER_SIZE, after_id=_recent_state['last_id'])
+                _recent_winners.extend(rows)
+                if rows:
+                    _recent_state['last_id'] = rows[-1]['id']
+                if len(rows) < RECENT_WINNERS_BUFFER_SIZE:
+                    break
+        if _recent_winners:
+            _recent_state['last_id'] = _recent_winners[-1]['id']
+        _recent_state['version'], _recent_state['synced_at'] = version, time.monotonic()
+
+
+def note_round_settled(round_id: int) -> None:
+    """Llamar tras liquidar una ronda en este proceso: sus ganadores entran al buffer de inmediato."""
+    _sync_recent_winners(force=True)
+    logger.debug(f"LEADERBOARD: Buffer de ganadores al día tras liquidar ronda {round_id}.")
+
+
+def get_recent_winners(limit: int = 20, before_id: int | None = None) -> list[dict]:
+    """
+    Premios más recientes (del más nuevo al más viejo), paginados por id de draw_results: `before_id`
+    es el id del último premio de la página anterior. Se sirven del buffer mientras la página quepa
+    en él; las páginas más antiguas van a la DB por la clave primaria.
+    """
+    limit = max(1, min(limit, MAX_WINNERS_PAGE_SIZE))
+    _sync_recent_winners()
+    with _recent_lock:
+        buffered = list(_recent_winners)
+    # El buffer cubre todo el historial si nunca se llenó; si no, solo desde su fila más antigua
+    covers_all = len(buffered) < RECENT_WINNERS_BUFFER_SIZE
+    page = [row for row in reversed(buffered) if before_id is None or row['id'] < before_id][:limit]
+    if len(page) == limit or covers_all:
+        return page
+    # La página sigue más allá del buffer (una página vacía implica que before_id ya es anterior al buffer)
+    next_before = page[-1]['id'] if page else before_id
+    return page + db_get_draw_winners_page(limit - len(page), before_id=next_before)
+
+
+def get_top_winners(limit: int = 10, after: tuple | None = None) -> list[dict]:
+    """Ranking histórico (top-N por monto total de premios), leído por índice de winner_stats."""
+    return db_get_winner_leaderboard(max(1, min(limit, MAX_WINNERS_PAGE_SIZE)), after)
@@ -0,0 +1,282 @@
+# src/load_generator.py
+# Generador de carga: N usuarios virtuales compran boletos a la vez a través del Dispatcher real y los
+# handlers de src.handlers (BuyTicketStates: /comprar_boleto -> wallet -> "✅ He realizado el pago"),
+# contra el Bot API y el toncenter falsos de src/fake_services.py. Cada pago "llega" a la red pasado un
+# retraso aleatorio, así que el usuario que verifica antes de tiempo reintenta como lo haría en Telegram.
+# Mientras tanto, unos hilos lectores hacen de webapp consultando la misma base (lock de SQLite compartido).
+# Reporta throughput, percentiles de latencia, esperas por el lock de escritura de la DB, el lag del
+# event loop con las llamadas que lo bloquearon (src/loop_monitor.py), percentiles por span
+# (src/tracing.py, --trace-output para exportarlos) y tasas de error:
+#   python -m src.load_generator --users 2000 --concurrency 500 --payment-delay 0.5 3
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs, urlparse
+
+from . import db
+from . import round_manager
+from . import ton_api
+from .benchmark_suite import summarize_latencies, temporary_database
+from .loop_monitor import LoopMonitor
+from . import tracing
+from .round_manager import ROUND_TYPE_SCHEDULED
+
+logger = logging.getLogger(__name__)
+
+LOAD_USERS = 1_000
+LOAD_CONCURRENCY = 200 # Usuarios con una compra en curso al mismo tiempo
+PAYMENT_DELAY_SECONDS = (0.5, 3.0) # Lo que tarda un pago en aparecer en getTransactions
+THINK_SECONDS = (0.0, 0.5) # Pausa del usuario entre un paso y el siguiente
+VERIFY_RETRY_SECONDS = 2.0
+MAX_VERIFY_ATTEMPTS = 5
+READER_THREADS = 2 # Lecturas concurrentes de "la webapp" sobre la misma base
+READER_INTERVAL_SECONDS = 0.01
+
+CONFIRMED_TEXT = 'Pago confirmado'
+NOT_JOINED_TEXT = 'contacta al administrador' # Pago registrado pero sin cupo en la ronda (devolución)
+VERIFY_PREFIX = 'verify_payment_'
+
+
+class BotHarness:
+    """El bot armado contra los servidores falsos: Dispatcher con los handlers reales y cierre de rondas llenas."""
+
+    def __init__(self, dp, bot, telegram, toncenter):
+        self.dp, self.bot, self.telegram, self.toncenter = dp, bot, telegram, toncenter
+        self.draw_tasks = []
+        self.updates_fed = 0
+        self._update_ids = itertools.count(1)
+
+    def next_update_id(self) -> int:
+        return next(self._update_ids)
+
+    async def feed(self, data: dict) -> float:
+        """Procesa un Update (dict de la Bot API) como lo haría el polling. Retorna su latencia en segundos."""
+        from aiogram.types import Update
+
+        started = time.perf_counter()
+        self.updates_fed += 1
+        await self.dp.feed_update(self.bot, Update.model_validate(data, context={'bot': self.bot}))
+        return time.perf_counter() - started
+
+
+@asynccontextmanager
+async def bot_harness(telegram_delay: float = 0.0, toncenter_delay: float = 0.0):
+    """
+    Levanta los servidores falsos, apunta ton_api a su toncenter y arma Bot + Dispatcher con los
+    handlers reales. Como bot.on_startup, una ronda llena se sortea al instante (trigger_immediate_draw)
+    y, como el job de rondas programadas, se abre enseguida la siguiente.
+    """
+    from aiogram import Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    import src.bot as bot_module
+    from .fake_services import FakeTelegramServer, FakeToncenterServer, create_fake_bot
+    from .handlers import register_all_handlers
+    from .payment_manager import PaymentManager
+
+    telegram, toncenter = FakeTelegramServer(telegram_delay), FakeToncenterServer(toncenter_delay)
+    telegram.start()
+    toncenter.start()
+    previous_api_base = ton_api.API_BASE
+    ton_api.API_BASE = toncenter.api_base
+    bot = create_fake_bot(telegram.url)
+    bot.session.middleware(tracing.bot_request_span_middleware)
+    dp = Dispatcher(storage=MemoryStorage())
+    register_all_handlers(dp, bot, PaymentManager())
+    harness = BotHarness(dp, bot, telegram, toncenter)
+    loop = asyncio.get_running_loop()
+
+    def on_round_filled(round_id: int):
+        harness.draw_tasks.append(loop.create_task(bot_module.trigger_immediate_draw(round_id, bot)))
+        round_manager.create_round(ROUND_TYPE_SCHEDULED)
+
+    round_manager.add_round_filled_listener(on_round_filled)
+    try:
+        round_manager.create_round(ROUND_TYPE_SCHEDULED)
+        yield harness
+        if harness.draw_tasks:
+            await asyncio.gather(*harness.draw_tasks, return_exceptions=True)
+    finally:
+        round_manager.remove_round_filled_listener(on_round_filled)
+        ton_api.API_BASE = previous_api_base
+        await bot.session.close()
+        telegram.stop()
+        toncenter.stop()
+
+
+def _payment_request(messages: list[dict]) -> dict | None:
+    """Monto, comentario y botón de verificación de las últimas instrucciones de pago que recibió el usuario."""
+    request = {}
+    for params in reversed(messages):
+        markup = json.loads(params['reply_markup']) if params.get('reply_markup') else {}
+        for row in markup.get('inline_keyboard', []):
+            for button in row:
+                if 'callback_data' not in request and (button.get('callback_data') or '').startswith(VERIFY_PREFIX):
+                    request.update(callback_data=button['callback_data'], message_id=params['_message_id'])
+                if 'amount_nano' not in request and (button.get('url') or '').startswith('ton://transfer/'):
+                    query = parse_qs(urlparse(button['url']).query)
+                    request.update(amount_nano=int(query['amount'][0]), comment=query['text'][0])
+        if len(request) == 4:
+            return request
+    return None
+
+
+def _start_readers(count: int, interval: float, stop: threading.Event) -> list[threading.Thread]:
+    """Hilos que leen como la webapp (rondas abiertas y ganadores) y toman el lock compartido de SQLite."""
+    def read_loop():
+        while not stop.is_set():
+            db.get_open_rounds()
+            db.get_draw_winners_page(20)
+            stop.wait(interval)
+    threads = [threading.Thread(target=read_loop, name=f"reader-{n}", daemon=True) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+async def _virtual_user(harness: BotHarness, user_id: int, rng: random.Random, settings: dict, metrics: dict) -> None:
+    from .fake_services import callback_update, message_update, synthetic_wallet
+
+    telegram, started = harness.telegram, time.perf_counter()
+
+    async def think():
+        await asyncio.sleep(rng.uniform(*settings['think_seconds']))
+
+    try:
+        tickets = rng.randint(1, min(3, round_manager.MAX_TICKETS_PER_PURCHASE))
+        metrics['command'].append(await harness.feed(
+            message_update(harness.next_update_id(), user_id, f"/comprar_boleto {tickets}")))
+        await think()
+        wallet = synthetic_wallet(user_id)
+        metrics['wallet'].append(await harness.feed(message_update(harness.next_update_id(), user_id, wallet)))
+        request = _payment_request(telegram.sent_to(user_id))
+        if request is None: # Sin ronda activa, wallet rechazada, etc.
+            metrics['errors']['no_payment_request'] += 1
+            return
+        harness.toncenter.add_payment(wallet, request['amount_nano'], request['comment'],
+                                      delay_seconds=rng.uniform(*settings['payment_delay']))
+        await think()
+        for attempt in range(1, settings['max_verify_attempts'] + 1):
+            seen = len(telegram.sent_to(user_id))
+            metrics['verify'].append(await harness.feed(
+                callback_update(harness.next_update_id(), user_id, request['callback_data'], request['message_id'])))
+            replies = ' '.join(params.get('text', '') for params in telegram.sent_to(user_id)[seen:])
+            if CONFIRMED_TEXT in replies:
+                metrics['verify_attempts'].append(attempt)
+                if NOT_JOINED_TEXT in replies:
+                    metrics['errors']['paid_not_joined'] += 1
+                else:
+                    metrics['confirmed'] += 1
+                    metrics['time_to_confirmation'].append(time.perf_counter() - started)
+                return
+            await asyncio.sleep(settings['verify_retry_seconds'])
+        metrics['errors']['unconfirmed'] += 1
+    except Exception as e:
+        metrics['errors']['handler_exception'] += 1
+        logger.error(f"LOAD: Usuario virtual {user_id} falló: {e}", exc_info=True)
+
+
+async def run_load(users: int = LOAD_USERS, concurrency: int = LOAD_CONCURRENCY,
+                   payment_delay: tuple = PAYMENT_DELAY_SECONDS, think_seconds: tuple = THINK_SECONDS,
+                   verify_retry_seconds: float = VERIFY_RETRY_SECONDS, max_verify_attempts: int = MAX_VERIFY_ATTEMPTS,
+                   telegram_delay: float = 0.0, toncenter_delay: float = 0.0, reader_threads: int = READER_THREADS,
+                   seed: int = 0) -> dict:
+    """Corre la carga sobre la base de datos actual. Ver run_load_test para una base temporal."""
+    rng = random.Random(seed)
+    settings = {'payment_delay': payment_delay, 'think_seconds': think_seconds,
+                'verify_retry_seconds': verify_retry_seconds, 'max_verify_attempts': max_verify_attempts}
+    metrics = {'command': [], 'wallet': [], 'verify': [], 'time_to_confirmation': [], 'verify_attempts': [],
+               'confirmed': 0,
+               'errors': {'handler_exception': 0, 'no_payment_request': 0, 'unconfirmed': 0, 'paid_not_joined': 0}}
+    db.reset_lock_wait_stats()
+    tracing.reset_span_stats()
+    stop_readers = threading.Event()
+    readers = _start_readers(reader_threads, READER_INTERVAL_SECONDS, stop_readers)
+    try:
+        async with bot_harness(telegram_delay, toncenter_delay) as harness:
+            slots = asyncio.Semaphore(concurrency)
+            monitor = LoopMonitor(interval_seconds=0.05, debug=True, report_interval_seconds=None)
+            monitor_task = asyncio.create_task(monitor.run())
+
+            async def user(n):
+                async with slots:
+                    await _virtual_user(harness, 7_000_000 + n, random.Random(rng.random()), settings, metrics)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(user(n) for n in range(users)))
+            elapsed = time.perf_counter() - started
+            monitor.stop()
+            await monitor_task
+            updates_fed, rounds_drawn = harness.updates_fed, len(harness.draw_tasks)
+        telegram_calls, toncenter_calls = harness.telegram.method_counts(), dict(harness.toncenter.request_counts)
+    finally:
+        stop_readers.set()
+        for thread in readers:
+            thread.join()
+
+    failed = sum(metrics['errors'].values())
+    all_updates = metrics['command'] + metrics['wallet'] + metrics['verify']
+    attempts = metrics['verify_attempts']
+    return {
+        'config': {'users': users, 'concurrency': concurrency, 'payment_delay_seconds': list(payment_delay),
+                   'think_seconds': list(think_seconds), 'verify_retry_seconds': verify_retry_seconds,
+                   'max_verify_attempts': max_verify_attempts, 'telegram_delay': telegram_delay,
+                   'toncenter_delay': toncenter_delay, 'reader_threads': reader_threads, 'seed': seed},
+        'users': users, 'confirmed': metrics['confirmed'], 'elapsed_seconds': elapsed,
+        'throughput': {'flows_per_second': (metrics['confirmed'] + failed) / elapsed if elapsed > 0 else None,
+                       'confirmed_per_second': metrics['confirmed'] / elapsed if elapsed > 0 else None,
+                       'updates_per_second': updates_fed / elapsed if elapsed > 0 else None},
+        'latency': {'update': summarize_latencies(all_updates),
+                    'steps': {step: summarize_latencies(metrics[step]) for step in ('command', 'wallet', 'verify')},
+                    'time_to_confirmation': summarize_latencies(metrics['time_to_confirmation'])},
+        'verify_attempts': {'mean': sum(attempts) / len(attempts) if attempts else None, 'max': max(attempts, default=None)},
+        'errors': metrics['errors'], 'error_count': failed, 'error_rate': failed / users if users else 0.0,
+        'db_lock_waits': db.get_lock_wait_stats(), 'event_loop': monitor.get_stats(),
+        'spans': tracing.get_span_stats(), 'rounds_drawn': rounds_drawn,
+        'telegram_calls': telegram_calls, 'toncenter_calls': toncenter_calls,
+    }
+
+
+def run_load_test(trace_export_path: str | None = None, **kwargs) -> dict:
+    """
+    run_load sobre una base de datos temporal con la medición de esperas del lock y las trazas
+    activadas (los spans también se exportan a `trace_export_path`, si se indica).
+    """
+    db.enable_lock_wait_tracking(True)
+    tracing.configure_tracing(True, trace_export_path)
+    try:
+        with temporary_database():
+            return asyncio.run(run_load(**kwargs))
+    finally:
+        db.enable_lock_wait_tracking(False)
+        tracing.configure_tracing(False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Carga sintética de compras de boletos a través del Dispatcher.")
+    parser.add_argument('--users', type=int, default=LOAD_USERS)
+    parser.add_argument('--concurrency', type=int, default=LOAD_CONCURRENCY)
+    parser.add_argument('--payment-delay', type=float, nargs=2, default=PAYMENT_DELAY_SECONDS, metavar=('MIN', 'MAX'))
+    parser.add_argument('--think', type=float, nargs=2, default=THINK_SECONDS, metavar=('MIN', 'MAX'))
+    parser.add_argument('--verify-retry', type=float, default=VERIFY_RETRY_SECONDS)
+    parser.add_argument('--verify-attempts', type=int, default=MAX_VERIFY_ATTEMPTS)
+    parser.add_argument('--telegram-delay', type=float, default=0.0, help="Latencia de cada llamada al Bot API falso")
+    parser.add_argument('--toncenter-delay', type=float, default=0.0, help="Latencia de cada llamada al toncenter falso")
+    parser.add_argument('--readers', type=int, default=READER_THREADS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-output', default=None, help="Exporta los spans a este JSONL (ver python -m src.tracing)")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    print(json.dumps(run_load_test(
+        trace_export_path=args.trace_output, users=args.users, concurrency=args.concurrency,
+        payment_delay=tuple(args.payment_delay), think_seconds=tuple(args.think), verify_retry_seconds=args.verify_retry,
+        max_verify_attempts=args.verify_attempts, telegram_delay=args.telegram_delay,
+        toncenter_delay=args.toncenter_delay, reader_threads=args.readers, seed=args.seed), indent=2))
@@ -0,0 +1,253 @@
+# src/log_pipeline.py
+# Logging sin bloquear el event loop: el hilo que loguea (el loop del bot, un hilo de la webapp) solo
+# encola el LogRecord en una QueueHandler; un QueueListener en su propio hilo lo formatea y lo escribe.
+# El formateo es perezoso: la QueueHandler no interpola el mensaje (la estándar sí, en prepare()), así
+# que los `logger.info("... %s", valor)` se resuelven en el hilo del listener. Los campos estructurados
+# van en `extra=log_fields(clave=valor)` y salen como pares clave=valor. Los mensajes de alta frecuencia
+# se muestrean por módulo: con LOG_SAMPLING {"src.db": 10}, de cada plantilla INFO/DEBUG de src.db se
+# escribe 1 de cada 10 (WARNING y superiores nunca se descartan).
+#   python -m src.log_pipeline --records 20000
+
+import argparse
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+DEFAULT_LOG_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - [%(filename)s:%(lineno)d] - %(message)s'
+LOG_BENCH_RECORDS = 20_000
+# Plantillas con contador propio en SamplingFilter (LRU): un f-string interpolado es una plantilla
+# nueva en cada registro y, sin tope, el diccionario crecería sin fin
+SAMPLING_MAX_TEMPLATES = 1_024
+
+_listener = None # QueueListener activo (uno por proceso)
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+
+def log_fields(**fields) -> dict:
+    """Campos estructurados de un registro: `logger.info("Pago verificado", extra=log_fields(hash=h))`."""
+    return {'fields': fields}
+
+
+def _format_value(value) -> str:
+    text = str(value)
+    if not text or any(c in text for c in ' ="\n'):
+        return json.dumps(text, ensure_ascii=False)
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    """`ts=... level=INFO logger=src.db msg="..." clave=valor ...` en una línea por registro."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        parts = [f"ts={datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')}",
+                 f"level={record.levelname}", f"logger={record.name}", f"msg={_format_value(record.getMessage())}"]
+        parts.extend(f"{key}={_format_value(value)}" for key, value in getattr(record, 'fields', {}).items())
+        if record.exc_info:
+            parts.append(f"exc={_format_value(self.formatException(record.exc_info))}")
+        elif record.exc_text:
+            parts.append(f"exc={_format_value(record.exc_text)}")
+        return ' '.join(parts)
+
+
+class TextFormatter(logging.Formatter):
+    """El formato de texto de siempre, con los campos estructurados añadidos al final del mensaje."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if not fields:
+            return line
+        head, sep, tail = line.partition('\n') # La traza de una excepción va debajo
+        return head + ' ' + ' '.join(f"{key}={_format_value(value)}" for key, value in fields.items()) + sep + tail
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Deja pasar 1 de cada N registros INFO/DEBUG por plantilla de mensaje, con N según el módulo
+    (el prefijo de logger más largo en `rates`). Cuenta lo descartado por logger. Los contadores por
+    plantilla son un LRU de `max_templates` entradas.
+    """
+
+    def __init__(self, rates: dict[str, int] | None = None, max_templates: int = SAMPLING_MAX_TEMPLATES):
+        super().__init__()
+        self.rates = {name: int(rate) for name, rate in (rates or {}).items() if int(rate) > 1}
+        self.max_templates = max_templates
+        self._counters = OrderedDict() # (logger, plantilla) -> itertools.count, en orden LRU
+        self.dropped = {}
+        self._lock = threading.Lock()
+
+    def _rate_for(self, name: str) -> int:
+        best, rate = -1, 1
+        for prefix, prefix_rate in self.rates.items():
+            if (name == prefix or name.startswith(prefix + '.')) and len(prefix) > best:
+                best, rate = len(prefix), prefix_rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not self.rates:
+            return True
+        rate = self._rate_for(record.name)
+        if rate == 1:
+            return True
+        key = (record.name, record.msg) # La plantilla sin interpolar: agrupa los mensajes repetidos
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = itertools.count()
+                if len(self._counters) > self.max_templates:
+                    self._counters.popitem(last=False)
+            else:
+                self._counters.move_to_end(key)
+            if next(counter) % rate == 0:
+                keep = True
+            else:
+                keep = False
+                self.dropped[record.name] = self.dropped.get(record.name, 0) + 1
+        if keep:
+            record.fields = {**getattr(record, 'fields', {}), 'sampled': f"1/{rate}"}
+        return keep
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que no formatea en el hilo que loguea: la cola es en memoria del mismo proceso,
+    así que el registro viaja tal cual (msg + args) y el listener lo interpola al escribirlo.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: str | int = logging.INFO, structured: bool = True, sampling: dict[str, int] | None = None,
+                  stream=None) -> logging.handlers.QueueListener:
+    """
+    Reemplaza los handlers del logger raíz por una LazyQueueHandler (con el muestreo) y arranca un
+    QueueListener que escribe en `stream` (stderr por defecto). Llamarla de nuevo reconfigura.
+    """
+    global _listener, _queue_handler
+    with _setup_lock:
+        stop_logging()
+        root = logging.getLogger()
+        output = logging.StreamHandler(stream)
+        output.setFormatter(KeyValueFormatter() if structured else TextFormatter(DEFAULT_LOG_FORMAT))
+        log_queue = queue.SimpleQueue()
+        _queue_handler = LazyQueueHandler(log_queue)
+        _queue_handler.addFilter(SamplingFilter(sampling))
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        return _listener
+
+
+def stop_logging() -> None:
+    """Vacía la cola y detiene el listener (los registros pendientes se escriben antes de volver)."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.flush()
+        _listener = None
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+
+atexit.register(stop_logging)
+
+
+def get_logging_stats() -> dict:
+    """Registros pendientes en la cola y descartados por el muestreo, por logger."""
+    handler = _queue_handler
+    if handler is None:
+        return {'enabled': False, 'queued': 0, 'dropped': {}}
+    sampler = next((f for f in handler.filters if isinstance(f, SamplingFilter)), None)
+    with sampler._lock:
+        dropped = dict(sampler.dropped)
+    return {'enabled': True, 'queued': handler.queue.qsize(), 'dropped': dropped, 'sampling': dict(sampler.rates)}
+
+
+# --- Benchmark: latencia del camino del handler con logging síncrono vs. en cola ---
+def _payment_log_lines(logger: logging.Logger, n: int) -> None:
+    """Los registros de un pago verificado antes de este módulo: 5 líneas con f-strings."""
+    logger.info(f"find_transaction: Transacción encontrada y verificada.")
+    logger.info(f"  Origen: EQ{n:046d}")
+    logger.info(f"  Valor: {n * 1000} nanoTON")
+    logger.info(f"  Comentario: 'L1U{n}T1-{n}'")
+    logger.info(f"  Hash: {n:064x}")
+
+def _payment_log_structured(logger: logging.Logger, n: int) -> None:
+    """El mismo pago como un único registro estructurado y perezoso."""
+    logger.info("find_transaction: Transacción encontrada y verificada.",
+                extra=log_fields(source=f"EQ{n:046d}", value_nano=n * 1000, comment=f"L1U{n}T1-{n}", hash=f"{n:064x}"))
+
+def _high_frequency_line(logger: logging.Logger, n: int) -> None:
+    logger.info("Participante %s añadido a ronda %s con número %s.", n, n // 10, n % 10)
+
+def benchmark_logging(records: int = LOG_BENCH_RECORDS, sampling_rate: int = 10) -> dict:
+    """
+    Tiempo que pasa el hilo que loguea (el event loop, en el bot) por cada pago verificado más una
+    línea de alta frecuencia, escribiendo a un archivo: handler síncrono con las líneas de antes vs.
+    pipeline en cola con el registro estructurado, con y sin muestreo.
+    """
+    from .benchmark_suite import summarize_latencies
+
+    logger = logging.getLogger('bench.log_pipeline')
+    root = logging.getLogger()
+    previous_handlers, previous_level = list(root.handlers), root.level
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        scenarios = (('sync', _payment_log_lines, None), ('queue', _payment_log_structured, None),
+                     ('queue_sampled', _payment_log_structured, {'bench': sampling_rate}))
+        for name, emit, sampling in scenarios:
+            with open(os.path.join(tmp, f"{name}.log"), 'w', encoding='utf-8') as stream:
+                for handler in list(root.handlers):
+                    root.removeHandler(handler)
+                if name == 'sync':
+                    handler = logging.StreamHandler(stream)
+                    handler.setFormatter(logging.Formatter(DEFAULT_LOG_FORMAT))
+                    root.addHandler(handler)
+                    root.setLevel(logging.INFO)
+                else:
+                    setup_logging(logging.INFO, structured=True, sampling=sampling, stream=stream)
+                latencies = []
+                started_all = time.perf_counter()
+                for n in range(records):
+                    started = time.perf_counter()
+                    emit(logger, n)
+                    _high_frequency_line(logger, n)
+                    latencies.append(time.perf_counter() - started)
+                caller_seconds = time.perf_counter() - started_all
+                stats = get_logging_stats()
+                stop_logging()
+                drained_seconds = time.perf_counter() - started_all # Incluye vaciar la cola
+            results[name] = {'caller': summarize_latencies(latencies, caller_seconds), 'drained_seconds': drained_seconds,
+                             'bytes_written': os.path.getsize(os.path.join(tmp, f"{name}.log")),
+                             'dropped': sum(stats['dropped'].values()) if stats['enabled'] else 0}
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in previous_handlers:
+        root.addHandler(handler)
+    root.setLevel(previous_level)
+    sync_p50, queue_p50 = results['sync']['caller']['p50_ms'], results['queue']['caller']['p50_ms']
+    return {'records': records, 'sampling_rate': sampling_rate, 'scenarios': results,
+            'caller_p50_speedup': sync_p50 / queue_p50 if sync_p50 and queue_p50 else None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de logging en cola frente al síncrono.")
+    parser.add_argument('--records', type=int, default=LOG_BENCH_RECORDS)
+    parser.add_argument('--sampling-rate', type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(benchmark_logging(args.records, args.sampling_rate), indent=2))
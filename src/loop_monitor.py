@@ -0,0 +1,184 @@
+# src/loop_monitor.py
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# --- Constantes del monitor del event loop ---
+DEFAULT_LAG_INTERVAL_SECONDS = 0.25 # Cada cuánto se despierta la tarea que mide el retraso
+DEFAULT_SLOW_CALLBACK_SECONDS = 0.1 # Un callback que bloquea el loop más que esto es "lento"
+DEFAULT_REPORT_INTERVAL_SECONDS = 300 # Cada cuánto se loguean los peores ofensores
+LAG_SAMPLES = 2_000 # Últimos retrasos medidos que se guardan para los percentiles
+TOP_OFFENDERS = 5
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_active_monitor = None # El LoopMonitor en marcha, para get_loop_stats()
+
+
+def _is_project_frame(filename: str) -> bool:
+    return filename.startswith(_PROJECT_ROOT) and 'site-packages' not in filename
+
+def _offender_key(frames: list[traceback.FrameSummary]) -> tuple[str, str]:
+    """
+    (ofensor, bloqueado_en) de una pila del hilo del loop, de la más externa a la más interna:
+    el frame más interno del proyecto (p. ej. un handler o ton_api) y la llamada donde estaba parado.
+    """
+    innermost = frames[-1]
+    blocked_in = f"{os.path.basename(innermost.filename)}:{innermost.lineno} {innermost.name}"
+    for frame in reversed(frames):
+        if _is_project_frame(frame.filename):
+            return f"{os.path.relpath(frame.filename, _PROJECT_ROOT)}:{frame.lineno} {frame.name}", blocked_in
+    return blocked_in, blocked_in
+
+
+class LoopMonitor:
+    """
+    Mide el retraso (lag) del event loop: una tarea duerme `interval_seconds` y registra cuánto tarde
+    despierta. Todo lo que corre en el loop (handlers, jobs, aiohttp) retrasa ese despertar, así que
+    una llamada síncrona (sqlite3, requests) aparece como lag.
+
+    En modo debug además arranca un hilo vigilante: si el loop no despierta a tiempo, captura la pila
+    del hilo del loop en ese momento (el callback que lo está bloqueando) y, cuando el loop vuelve,
+    le atribuye la duración del bloqueo. Los ofensores se agrupan por el frame más interno del proyecto.
+    """
+
+    def __init__(self, interval_seconds: float = DEFAULT_LAG_INTERVAL_SECONDS,
+                 slow_callback_seconds: float = DEFAULT_SLOW_CALLBACK_SECONDS, debug: bool = False,
+                 report_interval_seconds: float | None = DEFAULT_REPORT_INTERVAL_SECONDS):
+        if interval_seconds <= 0 or slow_callback_seconds <= 0:
+            raise ValueError("El intervalo y el umbral de callback lento del monitor deben ser mayores que 0.")
+        self.interval_seconds = interval_seconds
+        self.slow_callback_seconds = slow_callback_seconds
+        self.debug = debug
+        self.report_interval_seconds = report_interval_seconds
+        self._lags = deque(maxlen=LAG_SAMPLES)
+        self._stats = {'ticks': 0, 'stalls': 0, 'stalled_seconds': 0.0, 'max_lag_seconds': 0.0}
+        self._offenders = {} # ofensor -> {'count', 'total_seconds', 'max_seconds', 'blocked_in', 'stack'}
+        self._pending_stall = None # (latido, ofensor, bloqueado_en, pila) capturado por el vigilante
+        self._last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._watchdog = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    # --- Medición ---
+    async def run(self):
+        """Bucle de medición; se lanza con asyncio.create_task y termina con stop()."""
+        global _active_monitor
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        _active_monitor = self
+        if self.debug:
+            loop.slow_callback_duration = self.slow_callback_seconds # Mismo umbral para los avisos de asyncio en debug
+            self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+            self._watchdog.start()
+        logger.info(f"LOOP_MONITOR: Midiendo lag cada {self.interval_seconds}s (callback lento > "
+                    f"{self.slow_callback_seconds * 1000:.0f} ms, detector de pilas {'activo' if self.debug else 'inactivo'}).")
+        last_report = time.monotonic()
+        try:
+            while not self._stopped.is_set():
+                beat = self._last_beat
+                await asyncio.sleep(self.interval_seconds)
+                now = time.monotonic()
+                self._record_tick(beat, max(0.0, now - beat - self.interval_seconds))
+                self._last_beat = now
+                if self.report_interval_seconds and now - last_report >= self.report_interval_seconds:
+                    self.log_top_offenders()
+                    last_report = now
+        finally:
+            self._stopped.set()
+            if _active_monitor is self:
+                _active_monitor = None
+
+    def stop(self):
+        self._stopped.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _record_tick(self, beat: float, lag: float) -> None:
+        with self._lock:
+            self._stats['ticks'] += 1
+            self._lags.append(lag)
+            self._stats['max_lag_seconds'] = max(self._stats['max_lag_seconds'], lag)
+            if lag < self.slow_callback_seconds:
+                return
+            self._stats['stalls'] += 1
+            self._stats['stalled_seconds'] += lag
+            pending, self._pending_stall = self._pending_stall, None
+            if pending is None or pending[0] != beat: # Sin pila capturada (modo normal, o bloqueo muy corto)
+                return
+            _, key, blocked_in, stack = pending
+            offender = self._offenders.setdefault(key, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                                                        'blocked_in': blocked_in, 'stack': stack})
+            offender['count'] += 1
+            offender['total_seconds'] += lag
+            if lag > offender['max_seconds']: # Guardamos la pila del peor bloqueo
+                offender.update(max_seconds=lag, blocked_in=blocked_in, stack=stack)
+        logger.debug(f"LOOP_MONITOR: Loop bloqueado {lag * 1000:.0f} ms en {key} ({blocked_in}).")
+
+    # --- Detector de callbacks lentos (modo debug) ---
+    def _watch(self):
+        """Hilo vigilante: captura la pila del hilo del loop cuando este lleva más del umbral sin despertar."""
+        captured_beat = None
+        while not self._stopped.wait(self.slow_callback_seconds / 2):
+            beat = self._last_beat
+            if beat == captured_beat or time.monotonic() - beat - self.interval_seconds < self.slow_callback_seconds:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            frames = traceback.extract_stack(frame)
+            key, blocked_in = _offender_key(frames)
+            with self._lock:
+                self._pending_stall = (beat, key, blocked_in, ''.join(traceback.format_list(frames)))
+            captured_beat = beat
+
+    # --- Métricas ---
+    def get_stats(self) -> dict:
+        """Lag del loop (percentiles en ms), bloqueos sobre el umbral y los peores ofensores."""
+        with self._lock:
+            lags = sorted(self._lags)
+            stats = dict(self._stats)
+        def percentile(p):
+            return round(lags[min(len(lags) - 1, int(p * len(lags)))] * 1000, 3) if lags else None
+        return {'ticks': stats['ticks'], 'interval_ms': self.interval_seconds * 1000,
+                'slow_callback_ms': self.slow_callback_seconds * 1000, 'debug': self.debug,
+                'lag_p50_ms': percentile(0.50), 'lag_p95_ms': percentile(0.95), 'lag_p99_ms': percentile(0.99),
+                'lag_max_ms': round(stats['max_lag_seconds'] * 1000, 3), 'stalls': stats['stalls'],
+                'stalled_seconds': stats['stalled_seconds'], 'top_offenders': self.top_offenders()}
+
+    def top_offenders(self, limit: int = TOP_OFFENDERS) -> list[dict]:
+        """Ofensores ordenados por tiempo total bloqueando el loop (sin la pila completa)."""
+        with self._lock:
+            ranked = sorted(self._offenders.items(), key=lambda item: item[1]['total_seconds'], reverse=True)[:limit]
+            return [{'offender': key, 'count': o['count'], 'total_ms': round(o['total_seconds'] * 1000, 1),
+                     'max_ms': round(o['max_seconds'] * 1000, 1), 'blocked_in': o['blocked_in']} for key, o in ranked]
+
+    def get_offender_stack(self, offender: str) -> str | None:
+        """Pila del peor bloqueo registrado para `offender`."""
+        with self._lock:
+            entry = self._offenders.get(offender)
+            return entry['stack'] if entry else None
+
+    def log_top_offenders(self) -> None:
+        stats = self.get_stats()
+        logger.info(f"LOOP_MONITOR: Lag p50 {stats['lag_p50_ms']} ms, p99 {stats['lag_p99_ms']} ms, "
+                    f"máx {stats['lag_max_ms']} ms; {stats['stalls']} bloqueo(s) > {stats['slow_callback_ms']:.0f} ms.")
+        for rank, offender in enumerate(stats['top_offenders'], 1):
+            logger.warning(f"LOOP_MONITOR: #{rank} {offender['offender']}: {offender['count']} bloqueo(s), "
+                           f"{offender['total_ms']} ms en total (máx {offender['max_ms']} ms) en {offender['blocked_in']}.")
+
+
+def get_loop_stats() -> dict | None:
+    """Métricas del monitor en marcha en este proceso, o None si no hay ninguno."""
+    monitor = _active_monitor
+    return monitor.get_stats() if monitor is not None else None
@@ -0,0 +1,225 @@
+# src/payout_ledger.py
+# Reglas de pago de una ronda y su aritmética en enteros (nanoTON).
+#
+# Todos los montos se calculan en nanoTON (1 TON = 10**9 nanoTON) y los porcentajes en puntos básicos,
+# así que el resultado es exacto y no depende del orden de las operaciones con floats:
+# - Cada comisión se redondea hacia abajo; los nanoTON sobrantes se quedan en el pozo de premios.
+# - El pozo se reparte entre los tramos del reparto con el método del mayor resto: cada tramo recibe
+#   su parte entera y los nanoTON restantes van, de uno en uno, a los tramos con mayor resto
+#   (a igual resto, el de menor orden de sorteo).
+# - Lo que no se paga (tramos sin ganador sorteado) queda como 'unallocated_nano'.
+# Invariante: collected_nano == sum(comisiones) + sum(premios) + unallocated_nano.
+#
+# Benchmark del modo por lotes: python -m src.payout_ledger --rounds 1000000
+
+import argparse
+import functools
+import json
+import math
+import time
+from decimal import Decimal, ROUND_HALF_EVEN
+
+import numpy as np
+
+from .round_manager import (
+    MIN_PARTICIPANTS_FOR_TIMED_DRAW,
+    MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW,
+    ROUND_TYPE_USER_CREATED,
+)
+
+NANOTON_PER_TON = 10**9
+BPS_DENOMINATOR = 10_000 # Porcentajes en puntos básicos (1 bp = 0.01%)
+
+# --- Constantes de Porcentajes y Distribución Simuladas (de tu payment_manager.py original) ---
+COMMISSION_PERCENT_GAS_SIMULATED = 0.10
+COMMISSION_PERCENT_BOT = 0.10
+COMMISSION_PERCENT_USER_CREATOR = 0.05
+
+PRIZE_SPLIT_1_WINNER = [1.0]
+PRIZE_SPLIT_2_WINNERS = [0.70, 0.30]
+PRIZE_SPLIT_3_WINNERS = [0.50, 0.30, 0.20]
+PRIZE_SPLIT_4_WINNERS = [0.40, 0.30, 0.20, 0.10]
+# Los repartos fijos de arriba cubren rondas de hasta 10 participantes
+LEGACY_SPLIT_MAX_PARTICIPANTS = 10
+
+# Rondas grandes (más de 10 participantes): ganan ~40% de los boletos como en una ronda de 10,
+# con un tope de premios, y el tramo i se lleva un peso proporcional a 1/(i+1).
+LARGE_ROUND_WINNERS_RATIO = 0.4
+LARGE_ROUND_MAX_WINNERS = 100
+MAX_PRIZE_TIERS = LARGE_ROUND_MAX_WINNERS
+
+# Orden fijo de las comisiones (columnas del modo por lotes)
+COMMISSION_TYPES = ('gas_fee', 'bot', 'user')
+
+
+def to_basis_points(fraction: float) -> int:
+    """0.10 -> 1000 puntos básicos."""
+    return int(round(fraction * BPS_DENOMINATOR))
+
+def ton_to_nano(amount_ton: float | str | Decimal) -> int:
+    """Convierte TON a nanoTON redondeando al nanoTON más cercano (empates a par)."""
+    nano = Decimal(str(amount_ton)) * NANOTON_PER_TON
+    return int(nano.quantize(Decimal(1), rounding=ROUND_HALF_EVEN))
+
+def nano_to_ton(amount_nano: int) -> float:
+    return amount_nano / NANOTON_PER_TON
+
+def format_nano(amount_nano: int, min_decimals: int = 2) -> str:
+    """Texto exacto de un monto en nanoTON: 2400000000 -> '2.40', 266666667 -> '0.266666667'."""
+    sign = '-' if amount_nano < 0 else ''
+    whole, frac = divmod(abs(amount_nano), NANOTON_PER_TON)
+    frac_text = f"{frac:09d}".rstrip('0').ljust(min_decimals, '0')
+    return f"{sign}{whole}.{frac_text}" if frac_text else f"{sign}{whole}"
+
+
+# --- Reglas de pago por ronda ---
+
+@functools.lru_cache(maxsize=4096)
+def get_prize_split_bps(participants_count: int) -> tuple[int, ...]:
+    """Reparto del pozo en puntos básicos (uno por orden de sorteo); suma BPS_DENOMINATOR o está vacío."""
+    if participants_count < MIN_PARTICIPANTS_FOR_TIMED_DRAW:
+        return ()
+    if participants_count <= 3:
+        split = PRIZE_SPLIT_1_WINNER
+    elif participants_count <= 6:
+        split = PRIZE_SPLIT_2_WINNERS
+    elif participants_count <= 9:
+        split = PRIZE_SPLIT_3_WINNERS
+    elif participants_count <= LEGACY_SPLIT_MAX_PARTICIPANTS:
+        split = PRIZE_SPLIT_4_WINNERS
+    else:
+        winners = min(LARGE_ROUND_MAX_WINNERS, math.ceil(participants_count * LARGE_ROUND_WINNERS_RATIO))
+        return tuple(allocate_largest_remainder(BPS_DENOMINATOR, [BPS_DENOMINATOR * 100 // (i + 1) for i in range(winners)]))
+    return tuple(to_basis_points(pct) for pct in split)
+
+def get_prize_split(participants_count: int) -> list[float]:
+    """Reparto del pozo (porcentaje por orden de sorteo) según el número de participantes."""
+    return [bps / BPS_DENOMINATOR for bps in get_prize_split_bps(participants_count)]
+
+def get_commission_rates(round_type: str, has_creator: bool) -> list[tuple[str, float]]:
+    """Comisiones fijas (creator_type, porcentaje) que se descuentan de lo recaudado en una ronda."""
+    rates = [('gas_fee', COMMISSION_PERCENT_GAS_SIMULATED), ('bot', COMMISSION_PERCENT_BOT)]
+    if round_type == ROUND_TYPE_USER_CREATED and has_creator:
+        rates.append(('user', COMMISSION_PERCENT_USER_CREATOR))
+    return rates
+
+
+def allocate_largest_remainder(total_nano: int, weights_bps: list[int]) -> list[int]:
+    """
+    Reparte `total_nano` en proporción a `weights_bps` sin perder ni crear nanoTON.
+    El sobrante del redondeo hacia abajo va a los mayores restos (empates: menor índice).
+    """
+    denominator = sum(weights_bps)
+    if not weights_bps or denominator <= 0:
+        return [0] * len(weights_bps)
+    shares, remainders = [], []
+    for weight in weights_bps:
+        share, remainder = divmod(total_nano * weight, denominator)
+        shares.append(share)
+        remainders.append(remainder)
+    leftover = total_nano - sum(shares)
+    for index in sorted(range(len(shares)), key=lambda i: (-remainders[i], i))[:leftover]:
+        shares[index] += 1
+    return shares
+
+
+def compute_round_ledger(participants_count: int, round_type: str, has_creator: bool,
+                         ticket_price_nano: int = NANOTON_PER_TON, winners_drawn: int = MAX_PRIZE_TIERS) -> dict:
+    """
+    Libro completo de UNA ronda en una sola pasada (función pura, todo en nanoTON):
+    recaudado, comisiones por tipo, pozo, premios por orden de sorteo y lo no repartido.
+    """
+    collected_nano = participants_count * ticket_price_nano
+    commissions_nano = {c_type: collected_nano * to_basis_points(rate) // BPS_DENOMINATOR
+                        for c_type, rate in get_commission_rates(round_type, has_creator)}
+    prize_pool_nano = collected_nano - sum(commissions_nano.values())
+    prize_split = get_prize_split(participants_count)
+    tier_shares = allocate_largest_remainder(prize_pool_nano, list(get_prize_split_bps(participants_count)))
+    prizes_nano = tier_shares[:winners_drawn]
+    return {
+        'collected_nano': collected_nano,
+        'commissions_nano': commissions_nano,
+        'prize_pool_nano': prize_pool_nano,
+        'prize_split': prize_split,
+        'prizes_nano': prizes_nano,
+        'unallocated_nano': prize_pool_nano - sum(prizes_nano),
+    }
+
+
+# --- Modo por lotes (NumPy): las mismas reglas sobre arrays de rondas ---
+
+@functools.lru_cache(maxsize=8)
+def _split_bps_table(max_participants: int) -> np.ndarray:
+    """Tabla (participantes -> pesos por tramo) para 0..max_participants; tan ancha como el mayor reparto."""
+    splits = [get_prize_split_bps(count) for count in range(max_participants + 1)]
+    table = np.zeros((max_participants + 1, max(len(split) for split in splits) or 1), dtype=np.int64)
+    for count, split in enumerate(splits):
+        table[count, :len(split)] = split
+    return table
+
+
+def compute_ledger_batch(participants_counts, with_creator_commission, ticket_price_nano=NANOTON_PER_TON,
+                         winners_drawn: int = MAX_PRIZE_TIERS) -> dict[str, np.ndarray]:
+    """
+    Versión vectorizada de compute_round_ledger para N rondas (mismo redondeo, nanoTON a nanoTON).
+    `with_creator_commission[i]` indica si la ronda i es 'user_created' con creador.
+    Retorna arrays int64: collected, commissions (N x len(COMMISSION_TYPES)), prize_pool,
+    prizes (N x mayor número de tramos del lote, ceros en tramos no pagados) y unallocated.
+    Las rondas con más participantes que MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW no tienen reparto.
+    """
+    counts = np.asarray(participants_counts, dtype=np.int64)
+    with_creator = np.asarray(with_creator_commission, dtype=bool)
+    collected = counts * np.asarray(ticket_price_nano, dtype=np.int64)
+
+    commissions = np.empty((counts.size, len(COMMISSION_TYPES)), dtype=np.int64)
+    commissions[:, 0] = collected * to_basis_points(COMMISSION_PERCENT_GAS_SIMULATED) // BPS_DENOMINATOR
+    commissions[:, 1] = collected * to_basis_points(COMMISSION_PERCENT_BOT) // BPS_DENOMINATOR
+    commissions[:, 2] = np.where(with_creator, collected * to_basis_points(COMMISSION_PERCENT_USER_CREATOR) // BPS_DENOMINATOR, 0)
+    prize_pool = collected - commissions.sum(axis=1)
+
+    # Fuera de rango no hay reparto (pesos 0): todo el pozo queda sin repartir
+    max_count = int(np.clip(counts.max(initial=0), 0, MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW))
+    weights = _split_bps_table(max_count)[np.clip(counts, 0, max_count)]
+    weights[counts > max_count] = 0
+    denominator = weights.sum(axis=1)
+    has_split = denominator > 0
+    safe_denominator = np.where(has_split, denominator, 1)[:, None]
+    raw = prize_pool[:, None] * weights
+    prizes, remainders = raw // safe_denominator, raw % safe_denominator
+    leftover = np.where(has_split, prize_pool - prizes.sum(axis=1), 0)
+    # Rango de cada tramo ordenando por resto descendente (orden estable = menor índice en empates)
+    ranks = np.argsort(np.argsort(-remainders, axis=1, kind='stable'), axis=1)
+    prizes += ranks < leftover[:, None]
+    prizes[:, winners_drawn:] = 0
+
+    return {
+        'collected': collected,
+        'commissions': commissions,
+        'prize_pool': prize_pool,
+        'prizes': prizes,
+        'unallocated': prize_pool - prizes.sum(axis=1),
+    }
+
+
+def benchmark_batch(rounds: int = 1_000_000, seed: int | None = 0,
+                    max_participants: int = LEGACY_SPLIT_MAX_PARTICIPANTS) -> dict:
+    """Mide compute_ledger_batch sobre `rounds` rondas aleatorias (participantes y tipo)."""
+    rng = np.random.default_rng(seed)
+    max_participants = min(max_participants, MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW)
+    counts = rng.integers(MIN_PARTICIPANTS_FOR_TIMED_DRAW, max_participants + 1, size=rounds)
+    with_creator = rng.random(rounds) < 0.5
+    started = time.perf_counter()
+    ledger = compute_ledger_batch(counts, with_creator)
+    elapsed = time.perf_counter() - started
+    balanced = bool((ledger['commissions'].sum(axis=1) + ledger['prizes'].sum(axis=1) + ledger['unallocated']
+                     == ledger['collected']).all())
+    return {'rounds': rounds, 'elapsed_seconds': elapsed,
+            'rounds_per_second': rounds / elapsed if elapsed > 0 else None, 'balanced': balanced}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark del cálculo de libros de ronda en modo por lotes.")
+    parser.add_argument('--rounds', type=int, default=1_000_000)
+    parser.add_argument('--max-participants', type=int, default=LEGACY_SPLIT_MAX_PARTICIPANTS)
+    args = parser.parse_args()
+    print(json.dumps(benchmark_batch(args.rounds, max_participants=args.max_participants), indent=2))
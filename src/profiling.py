@@ -0,0 +1,200 @@
+# src/profiling.py
+# Perfilado bajo demanda del bot en marcha (lo manejan los comandos de administrador de src/handlers.py):
+#   cpu        cProfile sobre el hilo que lo inicia (el del event loop: handlers y jobs de src.bot)
+#   muestreo   un hilo que toma la pila del hilo objetivo cada SAMPLING_INTERVAL_SECONDS; casi sin costo
+#              para el loop, apto para dejarlo un rato en producción
+#   memoria    tracemalloc: instantánea al iniciar y diferencia al detener, por crecimiento de memoria
+# Cada sesión se detiene devolviendo un informe de texto (ordenado por tiempo acumulado o por
+# crecimiento de memoria) que el handler envía como documento. Solo hay una sesión de CPU y una de
+# memoria a la vez.
+
+import cProfile
+import io
+import linecache
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+CPU_MODE_CPROFILE = 'cpu'
+CPU_MODE_SAMPLING = 'muestreo'
+CPU_MODES = (CPU_MODE_CPROFILE, CPU_MODE_SAMPLING)
+SAMPLING_INTERVAL_SECONDS = 0.005
+PROFILE_MAX_SECONDS = 600 # Una sesión olvidada se detiene sola (ver handlers.cmd_profile_start)
+REPORT_TOP_ENTRIES = 60
+MEMORY_TRACE_FRAMES = 10
+MEMORY_TOP_ENTRIES = 40
+MEMORY_TOP_TRACEBACKS = 5
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_cpu_session = None # {'id', 'mode', 'started', 'profiler'}
+_memory_session = None # {'id', 'started', 'baseline', 'started_tracing'}
+_session_ids = iter(range(1, 10**9))
+_sessions_lock = threading.Lock()
+
+
+def _short_path(filename: str) -> str:
+    return os.path.relpath(filename, _PROJECT_ROOT) if filename.startswith(_PROJECT_ROOT) else filename
+
+
+class SamplingProfiler:
+    """Muestrea la pila de `thread_id` desde un hilo propio y cuenta tiempo propio e inclusivo por función."""
+
+    def __init__(self, thread_id: int, interval_seconds: float = SAMPLING_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval_seconds = interval_seconds
+        self.samples = 0
+        self.self_counts = {} # (archivo, línea de la función, nombre) -> muestras en que estaba en la cima
+        self.inclusive_counts = {} # ... -> muestras en que estaba en cualquier punto de la pila
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            seen = set()
+            top = True
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if top:
+                    self.self_counts[key] = self.self_counts.get(key, 0) + 1
+                    top = False
+                if key not in seen: # La recursión no cuenta doble
+                    seen.add(key)
+                    self.inclusive_counts[key] = self.inclusive_counts.get(key, 0) + 1
+                frame = frame.f_back
+
+    def report(self, limit: int = REPORT_TOP_ENTRIES) -> str:
+        lines = [f"{'inclusivo':>10} {'propio':>8}  función"]
+        total = self.samples or 1
+        ranked = sorted(self.inclusive_counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+        for (filename, lineno, name), count in ranked:
+            lines.append(f"{count * 100 / total:9.1f}% {self.self_counts.get((filename, lineno, name), 0) * 100 / total:7.1f}%"
+                         f"  {name} ({_short_path(filename)}:{lineno})")
+        return '\n'.join(lines)
+
+
+# --- CPU ---
+def get_cpu_session() -> dict | None:
+    with _sessions_lock:
+        return dict(_cpu_session) if _cpu_session else None
+
+def start_cpu_profile(mode: str = CPU_MODE_CPROFILE, thread_id: int | None = None) -> tuple[bool, str, int | None]:
+    """
+    Inicia una sesión de CPU sobre el hilo actual (o `thread_id`, solo en modo muestreo).
+    Retorna (iniciada, mensaje, id_de_sesión).
+    """
+    global _cpu_session
+    if mode not in CPU_MODES:
+        return False, f"Modo de perfil desconocido '{mode}'. Usa: {', '.join(CPU_MODES)}.", None
+    with _sessions_lock:
+        if _cpu_session is not None:
+            return False, f"Ya hay un perfil '{_cpu_session['mode']}' en curso (sesión {_cpu_session['id']}).", None
+        if mode == CPU_MODE_CPROFILE:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable() # Solo el hilo actual: el del event loop cuando lo llama un handler
+            except ValueError as e: # Otro profiler (sys.setprofile) ya activo
+                return False, f"No se pudo iniciar cProfile: {e}", None
+        else:
+            profiler = SamplingProfiler(thread_id or threading.get_ident())
+            profiler.start()
+        _cpu_session = {'id': next(_session_ids), 'mode': mode, 'started': time.monotonic(), 'profiler': profiler}
+        return True, f"Perfil '{mode}' iniciado (sesión {_cpu_session['id']}).", _cpu_session['id']
+
+def stop_cpu_profile(session_id: int | None = None, limit: int = REPORT_TOP_ENTRIES) -> tuple[str | None, str]:
+    """
+    Detiene la sesión de CPU (si `session_id` coincide, cuando se indica) y retorna (informe, resumen).
+    El informe de cProfile va ordenado por tiempo acumulado; el de muestreo, por muestras inclusivas.
+    """
+    global _cpu_session
+    with _sessions_lock:
+        session = _cpu_session
+        if session is None or (session_id is not None and session['id'] != session_id):
+            return None, "No hay un perfil de CPU en curso."
+        _cpu_session = None
+    duration = time.monotonic() - session['started']
+    profiler = session['profiler']
+    if session['mode'] == CPU_MODE_CPROFILE:
+        profiler.disable()
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        body = output.getvalue()
+        summary = f"Perfil cProfile: {duration:.1f} s, {stats.total_calls} llamadas."
+    else:
+        profiler.stop()
+        body = profiler.report(limit)
+        summary = f"Perfil por muestreo: {duration:.1f} s, {profiler.samples} muestras cada {profiler.interval_seconds * 1000:.0f} ms."
+    return f"{summary}\nOrdenado por tiempo acumulado (top {limit}).\n\n{body}", summary
+
+
+# --- Memoria ---
+def get_memory_session() -> dict | None:
+    with _sessions_lock:
+        return {k: v for k, v in _memory_session.items() if k != 'baseline'} if _memory_session else None
+
+def _memory_filters() -> list[tracemalloc.Filter]:
+    return [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'), tracemalloc.Filter(False, '<unknown>')]
+
+def start_memory_trace() -> tuple[bool, str, int | None]:
+    """Activa tracemalloc (si no lo estaba) y toma la instantánea base. Retorna (iniciada, mensaje, id)."""
+    global _memory_session
+    with _sessions_lock:
+        if _memory_session is not None:
+            return False, f"Ya hay una traza de memoria en curso (sesión {_memory_session['id']}).", None
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(MEMORY_TRACE_FRAMES)
+        baseline = tracemalloc.take_snapshot().filter_traces(_memory_filters())
+        _memory_session = {'id': next(_session_ids), 'started': time.monotonic(), 'baseline': baseline,
+                           'started_tracing': started_tracing}
+        return True, f"Traza de memoria iniciada (sesión {_memory_session['id']}).", _memory_session['id']
+
+def stop_memory_trace(session_id: int | None = None, limit: int = MEMORY_TOP_ENTRIES) -> tuple[str | None, str]:
+    """
+    Toma otra instantánea, la compara con la base y retorna (informe, resumen): las líneas que más
+    memoria ganaron y las pilas de los mayores crecimientos. Apaga tracemalloc si lo encendió la sesión.
+    """
+    global _memory_session
+    with _sessions_lock:
+        session = _memory_session
+        if session is None or (session_id is not None and session['id'] != session_id):
+            return None, "No hay una traza de memoria en curso."
+        _memory_session = None
+    snapshot = tracemalloc.take_snapshot().filter_traces(_memory_filters())
+    current, peak = tracemalloc.get_traced_memory()
+    if session['started_tracing']:
+        tracemalloc.stop()
+    duration = time.monotonic() - session['started']
+    by_line = sorted(snapshot.compare_to(session['baseline'], 'lineno'), key=lambda s: s.size_diff, reverse=True)
+    growth = sum(stat.size_diff for stat in by_line)
+    summary = f"Traza de memoria: {duration:.1f} s, {growth / 1024:+.1f} KiB netos (pico trazado {peak / 1024 / 1024:.1f} MiB)."
+
+    lines = [summary, f"Ordenado por crecimiento de memoria (top {limit}).", '']
+    for stat in by_line[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} bloques  "
+                     f"{_short_path(frame.filename)}:{frame.lineno}  (total {stat.size / 1024:.1f} KiB)")
+    by_traceback = sorted(snapshot.compare_to(session['baseline'], 'traceback'), key=lambda s: s.size_diff, reverse=True)
+    for rank, stat in enumerate(by_traceback[:MEMORY_TOP_TRACEBACKS], 1):
+        if stat.size_diff <= 0:
+            break
+        lines.extend(['', f"#{rank} {stat.size_diff / 1024:+.1f} KiB en {stat.count_diff:+d} bloques:"])
+        lines.extend(f"  {_short_path(frame.filename)}:{frame.lineno}" for frame in reversed(stat.traceback))
+    return '\n'.join(lines), summary
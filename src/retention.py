@@ -0,0 +1,246 @@
+# src/retention.py
+# Retención de la base del bot: las rondas terminadas ('finished' o 'cancelled') con más de
+# RETENTION_DAYS días se mueven, con sus participantes, resultados y comisiones, a una base de archivo
+# aparte (ARCHIVE_DATABASE_NAME), en lotes acotados. Cada lote es una transacción sobre las dos bases
+# (la de archivo va con ATTACH): se inserta en el archivo y se borra de la base principal a la vez, así
+# una fila nunca queda en las dos ni en ninguna. Entre lotes se suelta el lock de escritura durante
+# RETENTION_BATCH_SLEEP_SECONDS para que los handlers y la webapp sigan escribiendo. Una ronda grande se
+# mueve por tramos de RETENTION_BATCH_ROWS participantes; la fila de la ronda se mueve al final.
+# Después, PRAGMA incremental_vacuum devuelve al sistema las páginas liberadas, también por tramos.
+# Reemplaza al antiguo clean_db.py (borrado total con DELETEs sin límite). El job lo agenda bot.py:
+#   python -m src.retention --days 30
+#   python -m src.retention --enable-incremental-vacuum   # Una vez, con el bot detenido (VACUUM completo)
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from . import db
+from .leaderboard import reset_recent_winners # Buffer de ganadores recientes en memoria
+
+logger = logging.getLogger(__name__)
+
+# --- Constantes de retención ---
+ARCHIVE_DATABASE_NAME = 'bot_lotto_archive.db'
+RETENTION_DAYS = 30
+RETENTION_BATCH_ROUNDS = 50
+RETENTION_BATCH_ROWS = 5_000 # Filas de round_participants por transacción
+RETENTION_BATCH_SLEEP_SECONDS = 0.05
+RETENTION_VACUUM_PAGES = 1_000 # Páginas libres devueltas por paso de incremental_vacuum
+RETENTION_INTERVAL_SECONDS = 24 * 3600
+RETENTION_STATUSES = ('finished', 'cancelled') # round_state_machine.TERMINAL_STATUSES
+# Tablas que se archivan, en el orden en que se crean en el archivo (las hijas referencian a rounds)
+ARCHIVED_TABLES = ('rounds', 'round_participants', 'draw_results', 'creator_commission')
+_ROUND_CHILD_TABLES = ('draw_results', 'creator_commission') # Pocas filas por ronda: van junto con la ronda
+AUTO_VACUUM_INCREMENTAL = 2
+
+_retention_stats = {'runs': 0, 'failures': 0, 'last': None, 'last_error': None}
+_retention_lock = threading.Lock() # Una pasada a la vez por proceso
+
+
+def _table_columns(conn: sqlite3.Connection, schema: str, table: str) -> dict[str, str]:
+    return {row['name']: row['type'] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")}
+
+def _prepare_archive(conn: sqlite3.Connection) -> dict[str, str]:
+    """
+    Crea en la base adjunta 'archive' las tablas que falten con el mismo esquema que la principal y
+    agrega las columnas nuevas de migraciones posteriores. Retorna tabla -> lista de columnas para el INSERT.
+    """
+    column_lists = {}
+    for table in ARCHIVED_TABLES:
+        create_sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+        conn.execute(create_sql.replace(f"CREATE TABLE {table}", f"CREATE TABLE IF NOT EXISTS archive.{table}", 1))
+        main_columns = _table_columns(conn, 'main', table)
+        archive_columns = _table_columns(conn, 'archive', table)
+        for column, column_type in main_columns.items():
+            if column not in archive_columns:
+                conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column} {column_type}")
+                logger.info(f"RETENTION: Columna '{column}' añadida a '{table}' en el archivo.")
+        column_lists[table] = ', '.join(main_columns)
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_participants_round ON round_participants(round_id)")
+    conn.commit()
+    return column_lists
+
+def _move_rows(conn: sqlite3.Connection, table: str, columns: str, where: str, params: tuple) -> int:
+    """Copia al archivo las filas de `table` que cumplen `where` y las borra de la principal (misma transacción)."""
+    conn.execute(f"INSERT OR REPLACE INTO archive.{table} ({columns}) SELECT {columns} FROM main.{table} WHERE {where}", params)
+    return conn.execute(f"DELETE FROM main.{table} WHERE {where}", params).rowcount
+
+def archive_old_rounds(days: float = RETENTION_DAYS, archive_path: str = ARCHIVE_DATABASE_NAME, source: str = db.DATABASE_NAME,
+                       batch_rounds: int = RETENTION_BATCH_ROUNDS, batch_rows: int = RETENTION_BATCH_ROWS,
+                       batch_sleep: float = RETENTION_BATCH_SLEEP_SECONDS, max_batches: int | None = None) -> dict:
+    """
+    Mueve al archivo las rondas en RETENTION_STATUSES que terminaron hace más de `days` días.
+    Retorna {'cutoff', 'rounds', 'rows' (por tabla), 'batches', 'max_batch_seconds', 'duration_seconds', 'complete'};
+    'complete' es False si se cortó por `max_batches` (la próxima pasada sigue donde quedó).
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    statuses = ', '.join('?' for _ in RETENTION_STATUSES)
+    eligible_sql = (f"SELECT id FROM main.rounds WHERE status IN ({statuses}) AND COALESCE(end_time, start_time) < ? "
+                    f"ORDER BY id LIMIT ?")
+    rows = {table: 0 for table in ARCHIVED_TABLES}
+    batches, archived_rounds, max_batch_seconds = 0, 0, 0.0
+    complete = True
+    started = time.perf_counter()
+
+    conn = db.get_db_connection(source)
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (os.path.abspath(archive_path),))
+        column_lists = _prepare_archive(conn)
+        while True:
+            if max_batches is not None and batches >= max_batches:
+                complete = False
+                break
+            batch_started = time.perf_counter()
+            # IMMEDIATE: el lock de escritura desde el inicio, la lista de rondas no cambia a mitad del lote
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                round_ids = [row['id'] for row in conn.execute(eligible_sql, (*RETENTION_STATUSES, cutoff, batch_rounds))]
+                if not round_ids:
+                    conn.rollback()
+                    break
+                in_rounds = f"round_id IN ({', '.join('?' for _ in round_ids)})"
+                # Un tramo de participantes; si quedan más, las rondas se terminan de mover en el siguiente lote
+                moved = _move_rows(conn, 'round_participants', column_lists['round_participants'],
+                                   f"id IN (SELECT id FROM main.round_participants WHERE {in_rounds} ORDER BY id LIMIT ?)",
+                                   (*round_ids, batch_rows))
+                rows['round_participants'] += moved
+                if moved < batch_rows:
+                    for table in _ROUND_CHILD_TABLES:
+                        rows[table] += _move_rows(conn, table, column_lists[table], in_rounds, tuple(round_ids))
+                    moved_rounds = _move_rows(conn, 'rounds', column_lists['rounds'],
+                                              f"id IN ({', '.join('?' for _ in round_ids)})", tuple(round_ids))
+                    rows['rounds'] += moved_rounds
+                    archived_rounds += moved_rounds
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            batches += 1
+            max_batch_seconds = max(max_batch_seconds, time.perf_counter() - batch_started)
+            if batch_sleep > 0:
+                time.sleep(batch_sleep) # Sin lock: los escritores del bot pasan entre lotes
+        conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+    if batches:
+        db._bump_data_version(db.DATA_VERSION_ROUNDS)
+        db._bump_data_version(db.DATA_VERSION_WINNERS)
+    if rows['draw_results']:
+        # El buffer solo agrega premios con id mayor que el último visto: sin vaciarlo, los archivados
+        # se seguirían sirviendo. Es el buffer de este proceso; el de otro (la webapp) los conserva hasta
+        # que los premios nuevos los desplacen.
+        reset_recent_winners()
+    return {'cutoff': cutoff, 'rounds': archived_rounds, 'rows': rows, 'batches': batches,
+            'max_batch_seconds': max_batch_seconds, 'duration_seconds': time.perf_counter() - started, 'complete': complete}
+
+
+# --- VACUUM incremental ---
+def incremental_vacuum(source: str = db.DATABASE_NAME, pages_per_step: int = RETENTION_VACUUM_PAGES,
+                       step_sleep: float = RETENTION_BATCH_SLEEP_SECONDS) -> dict:
+    """
+    Devuelve las páginas libres al sistema de a `pages_per_step`, soltando el lock entre pasos.
+    Solo actúa con auto_vacuum=INCREMENTAL (las bases nuevas lo tienen desde db.init_db; las anteriores
+    necesitan una vez enable_incremental_vacuum). Retorna {'enabled', 'freed_pages', 'freed_bytes',
+    'steps', 'freelist_pages' (las que quedan), 'duration_seconds'}.
+    """
+    started = time.perf_counter()
+    conn = db.get_db_connection(source)
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            return {'enabled': False, 'freed_pages': 0, 'freed_bytes': 0, 'steps': 0, 'freelist_pages': free_before,
+                    'duration_seconds': time.perf_counter() - started}
+        free, steps = free_before, 0
+        while free > 0:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages_per_step)})").fetchall() # Cada fila es un paso del pragma
+            steps += 1
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= free: # Nada más que liberar (otra conexión usó las páginas libres)
+                free = remaining
+                break
+            free = remaining
+            if free > 0 and step_sleep > 0:
+                time.sleep(step_sleep)
+    finally:
+        conn.close()
+    freed = free_before - free
+    return {'enabled': True, 'freed_pages': freed, 'freed_bytes': freed * page_size, 'steps': steps,
+            'freelist_pages': free, 'duration_seconds': time.perf_counter() - started}
+
+def enable_incremental_vacuum(source: str = db.DATABASE_NAME) -> bool:
+    """
+    Pasa una base existente a auto_vacuum=INCREMENTAL. Requiere un VACUUM completo (reescribe el
+    archivo y bloquea la base mientras dura): correrlo una vez, con el bot detenido.
+    """
+    conn = db.get_db_connection(source)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        logger.info(f"RETENTION: '{source}' convertida a auto_vacuum=INCREMENTAL.")
+        return True
+    finally:
+        conn.close()
+
+
+# --- Job ---
+def run_retention(days: float = RETENTION_DAYS, archive_path: str = ARCHIVE_DATABASE_NAME, **kwargs) -> dict | None:
+    """Pasada del job: archiva y luego vacía las páginas libres. Registra el resultado en get_retention_stats() y nunca lanza."""
+    try:
+        with _retention_lock:
+            archived = archive_old_rounds(days, archive_path, **kwargs)
+            vacuum = incremental_vacuum(kwargs.get('source', db.DATABASE_NAME),
+                                        step_sleep=kwargs.get('batch_sleep', RETENTION_BATCH_SLEEP_SECONDS))
+    except Exception as e:
+        with _retention_lock:
+            _retention_stats['runs'] += 1
+            _retention_stats['failures'] += 1
+            _retention_stats['last_error'] = str(e)
+        logger.error(f"RETENTION: Falló la pasada de retención: {e}", exc_info=True)
+        return None
+    result = {**archived, 'vacuum': vacuum}
+    with _retention_lock:
+        _retention_stats['runs'] += 1
+        _retention_stats['last'] = result
+    logger.info(f"RETENTION: {archived['rounds']} ronda(s) anteriores a {archived['cutoff']} archivadas en '{archive_path}' "
+                f"({archived['rows']['round_participants']} participantes, {archived['batches']} lotes, lote más largo "
+                f"{archived['max_batch_seconds'] * 1000:.1f} ms).")
+    if vacuum['enabled']:
+        logger.info(f"RETENTION: incremental_vacuum liberó {vacuum['freed_bytes'] / 1024 / 1024:.1f} MiB en {vacuum['steps']} pasos.")
+    elif vacuum['freelist_pages']:
+        logger.warning(f"RETENTION: {vacuum['freelist_pages']} páginas libres sin devolver: la base no tiene auto_vacuum=INCREMENTAL "
+                       f"(ver `python -m src.retention --enable-incremental-vacuum`).")
+    return result
+
+def get_retention_stats() -> dict:
+    """Pasadas de retención de este proceso, fallos y el resultado de la última."""
+    with _retention_lock:
+        return dict(_retention_stats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Archiva las rondas terminadas antiguas y compacta la base de datos del bot.")
+    parser.add_argument('--source', default=db.DATABASE_NAME)
+    parser.add_argument('--archive', default=ARCHIVE_DATABASE_NAME)
+    parser.add_argument('--days', type=float, default=RETENTION_DAYS, help="Antigüedad mínima de las rondas a archivar")
+    parser.add_argument('--batch-rounds', type=int, default=RETENTION_BATCH_ROUNDS)
+    parser.add_argument('--batch-rows', type=int, default=RETENTION_BATCH_ROWS, help="Participantes por transacción")
+    parser.add_argument('--sleep', type=float, default=RETENTION_BATCH_SLEEP_SECONDS, help="Pausa entre lotes (s)")
+    parser.add_argument('--max-batches', type=int, default=None)
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="Solo convertir la base a auto_vacuum=INCREMENTAL (VACUUM completo, con el bot detenido)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    if args.enable_incremental_vacuum:
+        print(json.dumps({'source': args.source, 'converted': enable_incremental_vacuum(args.source)}, indent=2))
+    else:
+        print(json.dumps(run_retention(args.days, args.archive, source=args.source, batch_rounds=args.batch_rounds,
+                                       batch_rows=args.batch_rows, batch_sleep=args.sleep, max_batches=args.max_batches), indent=2))
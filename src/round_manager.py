@@ -1,33 +1,65 @@
 # botloteria/src/round_manager.py
 
+import json
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
 
 # Importar las funciones de base de datos de bajo nivel
 from .db import (
     create_new_round as db_create_new_round,
-    get_active_round as db_get_active_round,
     get_round_by_id as db_get_round_by_id,
     get_open_rounds as db_get_open_rounds,
-    add_participant_to_round as db_add_participant_to_round,
-    count_participants_in_round as db_count_participants_in_round,
     update_round_status as db_update_round_status,
     mark_round_as_deleted as db_mark_round_as_deleted,
     get_participants_in_round as db_get_participants_in_round,
-    update_participant_paid_status as db_update_participant_paid_status # <-- Importar esta función para marcar pago
+    get_participant as db_get_participant,
+    add_tickets_to_round as db_add_tickets_to_round,
+    get_round_entry_totals as db_get_round_entry_totals,
 )
+# Deltas de rondas para los consumidores en vivo (stream SSE de la webapp)
+from .event_bus import (
+    publish as publish_event,
+    EVENT_ROUND_CREATED,
+    EVENT_PARTICIPANT_JOINED,
+    EVENT_ROUND_CLOSED,
+)
+from .log_pipeline import log_fields # Campos estructurados (clave=valor) de los registros
 
 logger = logging.getLogger(__name__)
 
 # --- Constantes de Ronda ---
 # Mínimo de participantes para que una ronda *pueda* sortearse por tiempo
 MIN_PARTICIPANTS_FOR_TIMED_DRAW = 2
-# Máximo de participantes para sorteo inmediato
-MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW = 10
+# Máximo de participantes por ronda (se sortea al llenarse). Configurable con MAX_PARTICIPANTS_PER_ROUND
+# en config.json: con más de 10 la ronda usa el reparto escalable de payout_ledger (modo de rondas grandes).
+DEFAULT_MAX_PARTICIPANTS_PER_ROUND = 10
+
+def _load_int_setting(key: str, default: int, minimum: int) -> int:
+    config_path = os.path.join(os.path.dirname(__file__), '..', 'config.json')
+    try:
+        with open(config_path, 'r') as f:
+            value = int(json.load(f).get(key, default))
+    except (OSError, ValueError, TypeError) as e: # Sin config.json o valor inválido: valor por defecto
+        logger.warning(f"No se pudo leer {key} de config.json ({e}). Usando {default}.")
+        return default
+    return max(value, minimum)
+
+def _load_max_participants_per_round() -> int:
+    return _load_int_setting('MAX_PARTICIPANTS_PER_ROUND', DEFAULT_MAX_PARTICIPANTS_PER_ROUND, MIN_PARTICIPANTS_FOR_TIMED_DRAW)
+
+MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW = _load_max_participants_per_round()
+
+# Máximo de boletos en una sola compra (un pago de N × precio compra N boletos). MAX_TICKETS_PER_PURCHASE en config.json.
+DEFAULT_MAX_TICKETS_PER_PURCHASE = 5
+MAX_TICKETS_PER_PURCHASE = _load_int_setting('MAX_TICKETS_PER_PURCHASE', DEFAULT_MAX_TICKETS_PER_PURCHASE, 1)
 
 # El MIN_PARTICIPANTS original (10) ahora representa el límite máximo de participantes.
 MIN_PARTICIPANTS = 10 # Límite máximo de participantes
-DRAW_NUMBERS_COUNT = 1 # Número de números sorteados (siempre 1)
+DRAW_NUMBERS_COUNT = 1 # Mínimo de números sorteados; el sorteo saca uno por premio del reparto (ver draw_engine)
 
 ROUND_STATUS_WAITING_TO_START = 'waiting_to_start'
 ROUND_STATUS_WAITING_FOR_PAYMENTS = 'waiting_for_payments' # Este estado se usa brevemente antes de 'drawing'
@@ -39,55 +71,228 @@ ROUND_TYPE_BOT_CREATED = 'scheduled' # Alias
 ROUND_TYPE_USER_CREATED = 'user_created'
 
 
+# --- Sorteo inmediato al llenarse una ronda ---
+# Oyentes que se llaman con el round_id cuando una admisión vende el último boleto (una sola vez por ronda).
+# El bot registra el suyo en on_startup; sin oyente (p. ej. la webapp) la ronda llena la sortea el job.
+_round_filled_listeners = []
+# Latencias recientes (segundos) entre el último boleto vendido y la ronda liquidada
+FILL_TO_DRAW_LATENCY_SAMPLES = 1000
+_fill_to_draw_latencies = deque(maxlen=FILL_TO_DRAW_LATENCY_SAMPLES)
+
+def add_round_filled_listener(listener) -> None:
+    """Registra `listener(round_id)` para el momento en que una ronda se llena."""
+    _round_filled_listeners.append(listener)
+
+def remove_round_filled_listener(listener) -> None:
+    if listener in _round_filled_listeners:
+        _round_filled_listeners.remove(listener)
+
+def _notify_round_filled(round_id: int) -> None:
+    for listener in list(_round_filled_listeners):
+        try:
+            listener(round_id)
+        except Exception as e: # Un oyente roto no debe tumbar la admisión (el job hará el sorteo)
+            logger.error(f"Error en oyente de ronda llena {round_id}: {e}", exc_info=True)
+
+def record_fill_to_draw_latency(round_id: int, latency_seconds: float) -> None:
+    """Guarda la latencia entre el último boleto y la liquidación de una ronda llena."""
+    _fill_to_draw_latencies.append(latency_seconds)
+    logger.info("Ronda %s sorteada %.0f ms después de llenarse.", round_id, latency_seconds * 1000)
+
+def get_fill_to_draw_latency_stats() -> dict:
+    """Resumen de las últimas latencias último-boleto -> sorteo: {'count', 'p50', 'p95', 'max'} en segundos."""
+    samples = sorted(_fill_to_draw_latencies)
+    if not samples:
+        return {'count': 0, 'p50': None, 'p95': None, 'max': None}
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+    return {'count': len(samples), 'p50': percentile(0.50), 'p95': percentile(0.95), 'max': samples[-1]}
+
+
+# --- Caché de rondas en memoria ---
+# Rondas abiertas y sus conteos en vivo (participantes, boletos). Se actualiza write-through desde
+# create_round, add_participant y los cambios de estado (round_state_machine.transition, la liquidación);
+# las rondas terminadas o eliminadas salen de la caché. Otros procesos (bot/webapp) escriben en la misma
+# DB sin pasar por esta caché, así que cada entrada caduca a los ROUND_CACHE_TTL_SECONDS.
+# La caché solo sirve lecturas: la admisión comprueba estado y cupo en la DB (db.add_tickets_to_round).
+ROUND_CACHE_MAX_SIZE = _load_int_setting('ROUND_CACHE_MAX_SIZE', 256, 1)
+ROUND_CACHE_TTL_SECONDS = _load_int_setting('ROUND_CACHE_TTL_SECONDS', 5, 0)
+_OPEN_STATUSES = (ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_WAITING_FOR_PAYMENTS)
+
+# round_id -> {'round': dict | None, 'round_at', 'participants', 'tickets', 'counts_at'} en orden LRU
+_round_cache = OrderedDict()
+_open_round_ids = None # set de ids abiertos si la lista completa está en caché, None si no
+_open_rounds_at = 0.0
+_round_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_round_cache_lock = threading.RLock()
+
+
+def _is_fresh(cached_at: float | None) -> bool:
+    return cached_at is not None and time.monotonic() - cached_at <= ROUND_CACHE_TTL_SECONDS
+
+def _is_open_round(round_data: dict) -> bool:
+    return not round_data.get('deleted') and round_data.get('status') in _OPEN_STATUSES
+
+def _cache_hit(hit: bool) -> None:
+    _round_cache_stats['hits' if hit else 'misses'] += 1
+
+def _cache_entry(round_id: int) -> dict:
+    entry = _round_cache.get(round_id)
+    if entry is None:
+        entry = {'round': None, 'round_at': None, 'participants': None, 'tickets': None, 'counts_at': None}
+        _round_cache[round_id] = entry
+        while len(_round_cache) > ROUND_CACHE_MAX_SIZE:
+            _evict_round(next(iter(_round_cache)))
+    _round_cache.move_to_end(round_id)
+    return entry
+
+def _evict_round(round_id: int) -> None:
+    global _open_round_ids
+    if _round_cache.pop(round_id, None) is not None:
+        _round_cache_stats['evictions'] += 1
+    if _open_round_ids is not None and round_id in _open_round_ids:
+        _open_round_ids = None # La lista de abiertas ya no está completa en caché
+
+def _cache_store_round(round_data: dict) -> None:
+    """Guarda la fila de una ronda abierta; una ronda terminada, cerrada o eliminada sale de la caché."""
+    round_id = round_data['id']
+    if not _is_open_round(round_data):
+        if round_data.get('status') in (ROUND_STATUS_FINISHED, ROUND_STATUS_CANCELLED) or round_data.get('deleted'):
+            _evict_round(round_id)
+            return
+        if _open_round_ids is not None:
+            _open_round_ids.discard(round_id)
+    entry = _cache_entry(round_id)
+    entry['round'], entry['round_at'] = dict(round_data), time.monotonic()
+
+def note_round_status(round_id: int, new_status: str) -> None:
+    """
+    Write-through de un cambio de estado ya confirmado en la DB (transición CAS, liquidación,
+    actualización manual). Las rondas terminadas salen de la caché. Una ronda que deja de estar
+    abierta se publica como EVENT_ROUND_CLOSED (una vez por cada estado que alcance).
+    """
+    with _round_cache_lock:
+        if new_status in (ROUND_STATUS_FINISHED, ROUND_STATUS_CANCELLED):
+            _evict_round(round_id)
+        else:
+            entry = _round_cache.get(round_id)
+            if entry is not None and entry['round'] is not None:
+                entry['round']['status'] = new_status
+                _cache_store_round(entry['round'])
+                if new_status == ROUND_STATUS_DRAWING:
+                    entry['round_at'] = None # La DB también marcó drawing_since: la próxima lectura la refresca
+            if _open_round_ids is not None and new_status not in _OPEN_STATUSES:
+                _open_round_ids.discard(round_id)
+    if new_status not in _OPEN_STATUSES:
+        publish_event(EVENT_ROUND_CLOSED, {'round_id': round_id, 'status': new_status})
+
+def invalidate_round_cache(round_id: int | None = None) -> None:
+    """Descarta una ronda de la caché (o toda la caché si no se indica ronda)."""
+    global _open_round_ids
+    with _round_cache_lock:
+        if round_id is None:
+            _round_cache.clear()
+            _open_round_ids = None
+        else:
+            _evict_round(round_id)
+
+def get_round_cache_stats() -> dict:
+    """Métricas de la caché de rondas: aciertos, fallos, tasa de acierto, expulsiones y tamaño."""
+    with _round_cache_lock:
+        lookups = _round_cache_stats['hits'] + _round_cache_stats['misses']
+        return {**_round_cache_stats, 'hit_rate': _round_cache_stats['hits'] / lookups if lookups else 0.0,
+                'size': len(_round_cache)}
+
+
 # --- Funciones de Gestión de Rondas de Alto Nivel ---
 
-def create_round(round_type: str = ROUND_TYPE_SCHEDULED, creator_telegram_id: str = None) -> int | None:
+def create_round(round_type: str = ROUND_TYPE_SCHEDULED, creator_telegram_id: str = None, ticket_price: float = 1.0) -> int | None:
     """
-    Crea una nueva ronda llamando a la función de base de datos.
+    Crea una nueva ronda llamando a la función de base de datos y la deja en la caché con 0 boletos.
     Retorna el ID de la nueva ronda o None.
     """
-    logger.info(f"Intentando crear nueva ronda de tipo '{round_type}' (Creador: {creator_telegram_id}).")
-    round_id = db_create_new_round(round_type, creator_telegram_id)
+    logger.info("Intentando crear nueva ronda de tipo '%s' (Creador: %s).", round_type, creator_telegram_id)
+    round_id = db_create_new_round(round_type, creator_telegram_id, ticket_price)
     if round_id:
-        logger.info(f"Ronda creada exitosamente con ID: {round_id}.")
+        logger.info("Ronda creada exitosamente con ID: %s.", round_id)
+        round_data = db_get_round_by_id(round_id)
+        if round_data:
+            with _round_cache_lock:
+                _cache_store_round(round_data)
+                entry = _round_cache.get(round_id)
+                if entry is not None:
+                    entry['participants'], entry['tickets'], entry['counts_at'] = 0, 0, time.monotonic()
+                if _open_round_ids is not None:
+                    _open_round_ids.add(round_id)
+            publish_event(EVENT_ROUND_CREATED, {'round': dict(round_data)})
     else:
         logger.error("Falló la creación de la ronda en la base de datos.")
     return round_id
 
-def get_current_active_round() -> tuple | None:
+def get_current_active_round() -> dict | None:
     """
-    Obtiene la ronda activa actual (esperando participantes o pagos).
-    Llama a la función de base de datos.
+    Obtiene la ronda activa actual (esperando participantes o pagos): la abierta más reciente.
+    Se sirve desde la caché de rondas abiertas.
     Retorna los datos de la ronda o None.
     """
     logger.debug("Buscando ronda activa actual.")
-    return db_get_active_round()
+    open_rounds = get_available_rounds()
+    return open_rounds[0] if open_rounds else None
 
-def get_round(round_id: int) -> tuple | None:
+def get_round(round_id: int) -> dict | None:
     """
-    Obtiene los datos de una ronda específica por su ID.
-    Llama a la función de base de datos.
+    Obtiene los datos de una ronda específica por su ID (de la caché si está abierta y vigente).
     Retorna los datos de la ronda o None.
     """
-    logger.debug(f"Buscando ronda por ID: {round_id}.")
-    return db_get_round_by_id(round_id)
-
-def get_available_rounds() -> list[tuple]:
+    logger.debug("Buscando ronda por ID: %s.", round_id)
+    with _round_cache_lock:
+        entry = _round_cache.get(round_id)
+        if entry is not None and entry['round'] is not None and _is_fresh(entry['round_at']):
+            _cache_hit(True)
+            _round_cache.move_to_end(round_id)
+            return dict(entry['round'])
+        _cache_hit(False)
+    round_data = db_get_round_by_id(round_id)
+    if round_data:
+        with _round_cache_lock:
+            _cache_store_round(round_data)
+    return round_data
+
+def get_available_rounds() -> list[dict]:
     """
-    Obtiene una lista de rondas abiertas (esperando participantes o pagos).
-    Llama a la función de base de datos.
+    Obtiene una lista de rondas abiertas (esperando participantes o pagos), de la más reciente
+    a la más antigua. Se sirve desde la caché mientras la lista completa esté vigente.
     Retorna una lista de rondas.
     """
+    global _open_round_ids, _open_rounds_at
     logger.debug("Buscando rondas abiertas.")
-    return db_get_open_rounds()
-
-def add_participant(round_id: int, telegram_id: str, username: str) -> tuple:
+    with _round_cache_lock:
+        if _open_round_ids is not None and _is_fresh(_open_rounds_at):
+            entries = [_round_cache.get(round_id) for round_id in _open_round_ids]
+            if all(entry is not None and entry['round'] is not None and _is_fresh(entry['round_at']) for entry in entries):
+                _cache_hit(True)
+                return [dict(entry['round']) for entry in sorted(entries, key=lambda e: e['round']['id'], reverse=True)]
+        _cache_hit(False)
+    open_rounds = db_get_open_rounds()
+    with _round_cache_lock:
+        if len(open_rounds) <= ROUND_CACHE_MAX_SIZE:
+            for round_data in open_rounds:
+                _cache_store_round(round_data)
+            _open_round_ids, _open_rounds_at = {r['id'] for r in open_rounds}, time.monotonic()
+        else: # No caben todas: no se puede servir la lista completa desde la caché
+            _open_round_ids = None
+    return open_rounds
+
+def add_participant(round_id: int, telegram_id: str, username: str, tickets: int | None = None) -> tuple:
     """
     Intenta añadir un usuario como participante a una ronda.
     Asigna el siguiente número disponible y lo marca como pagado.
-    Retorna (éxito: bool, mensaje: str, assigned_number: int | None, current_participants_count: int)
+    Con `tickets` (compra verificada de varios boletos) suma esos boletos al usuario, aunque ya
+    estuviera en la ronda; sin él es la unión clásica de un boleto y rechaza a quien ya está unido.
+    El cupo de la ronda (MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW) se cuenta en boletos.
+    Retorna (éxito: bool, mensaje: str, assigned_number: int | None, current_tickets_count: int)
     """
-    logger.info(f"Intentando añadir participante {telegram_id} ({username}) a ronda {round_id}.")
+    logger.debug("Intentando añadir participante %s (%s) a ronda %s (%s boleto(s)).", telegram_id, username, round_id, tickets or 1)
 
     # Verificar si la ronda existe y está abierta
     ronda_data = get_round(round_id)
@@ -95,77 +300,104 @@ def add_participant(round_id: int, telegram_id: str, username: str) -> tuple:
          logger.error(f"Intento de añadir participante a ronda inexistente: {round_id}.")
          return False, "Error interno: La ronda especificada no existe.", None, 0
 
-
-    # Desempaquetamos para verificar estado y si está eliminada
-    ronda_id_db, _, _, status, _, _, deleted, _ = ronda_data
+    status, deleted = ronda_data['status'], ronda_data['deleted']
     # La ronda está abierta si está en waiting_to_start O waiting_for_payments (para permitir unirse si llegó a 10 pero aún no sorteó)
     if deleted or status not in [ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_WAITING_FOR_PAYMENTS]:
          logger.warning(f"Intento de añadir participante {telegram_id} a ronda no abierta {round_id} (Estado: {status}, Eliminada: {deleted}).")
          return False, f"⚠️ La ronda ID {round_id} no está abierta para unirse.", None, 0
 
-
-    current_participants_count = count_round_participants(round_id)
-
-    # Verificar si la ronda ya está llena (máximo 10 participantes)
-    if current_participants_count >= MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW: # Comparar con el máximo (10)
-        logger.warning(f"Intento de añadir participante {telegram_id} a ronda llena {round_id}.")
-        return False, f"⚠️ La ronda ID {round_id} ya está llena ({current_participants_count}/{MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW}).", None, current_participants_count
-
-
-    # Asignar el siguiente número disponible (basado en la cuenta actual)
-    assigned_number = current_participants_count + 1
-
-    # Añadir el participante a la base de datos
-    # db_add_participant_to_round retorna True si la inserción fue exitosa, False si ya existía (UNIQUE constraint)
-    success_add_db = db_add_participant_to_round(round_id, telegram_id, assigned_number)
-
-    if success_add_db:
-        # --- Marcar al participante como pagado inmediatamente al unirse ---
-        # paid_real = True indica que ha "comprado el boleto" simulado.
-        # update_participant_paid_status llama a db.py
-        success_update_paid = db_update_participant_paid_status(round_id, telegram_id, paid_real=True) # <-- Marcar como pagado
-
-        if success_update_paid:
-            current_participants_count += 1 # Incrementar la cuenta local solo si se añadió y marcó como pagado
-            logger.info(f"Participante {telegram_id} añadido y marcado como pagado en ronda {round_id}. Número asignado: {assigned_number}. Total: {current_participants_count}.")
-            # Mensaje de éxito actualizado para reflejar que el pago es al unirse
-            return True, f"✅ ¡Te has unido a la ronda ID <code>{round_id}</code> y has comprado tu boleto! Tu número asignado es el <b>{assigned_number}</b>.\nParticipantes: {current_participants_count}/10.", assigned_number, current_participants_count
-        else:
-             # Si falla la actualización de paid_real (muy improbable si add_participant_to_round fue True)
-             logger.error(f"Falló la actualización de paid_real para participante {telegram_id} en ronda {round_id} después de añadirlo.")
-             # Considera si deberías borrar el participante insertado o dejarlo. Por ahora, retornamos error.
-             return False, f"❌ Error interno al marcar tu pago para ronda {round_id}. Contacta al administrador.", None, current_participants_count
-
-
-    else:
-        # Esto ocurre si db_add_participant_to_round devuelve False (usuario ya en ronda - UNIQUE constraint)
-        logger.warning(f"Participante {telegram_id} ya estaba unido a ronda {round_id}.")
-        # Obtener el número asignado y el estado de pago actual para el mensaje
-        participants_in_round = db_get_participants_in_round(round_id) # Llama a db.py
-        existing_participant_data = next((p for p in participants_in_round if str(p[0]) == str(telegram_id)), None)
+    if tickets is None:
+        existing_participant_data = db_get_participant(round_id, telegram_id) # Búsqueda por índice, sin cargar la ronda
         if existing_participant_data:
-             assigned_num = existing_participant_data[2]
-             is_paid = existing_participant_data[4] # p[4] es paid_real
-             status_msg = "y tu boleto está comprado." if is_paid else "pero tu pago aún no está registrado." # Aunque ahora siempre es true
-             return False, f"⚠️ Ya estás unido a la ronda ID <code>{round_id}</code> con el número <b>{assigned_num}</b>, {status_msg}", assigned_num, current_participants_count
+            logger.warning(f"Participante {telegram_id} ya estaba unido a ronda {round_id}.")
+            assigned_num = existing_participant_data['assigned_number']
+            status_msg = "y tu boleto está comprado." if existing_participant_data['paid_real'] else "pero tu pago aún no está registrado."
+            _, current_tickets_count = get_round_entry_totals(round_id)
+            return False, f"⚠️ Ya estás unido a la ronda ID <code>{round_id}</code> con el número <b>{assigned_num}</b>, {status_msg}", assigned_num, current_tickets_count
+        tickets = 1
+
+    # Cupo, número asignado e inserción en una sola transacción (dos uniones simultáneas no comparten número)
+    admission = db_add_tickets_to_round(round_id, telegram_id, tickets, MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW)
+    if admission is None:
+        return False, f"❌ Error interno al registrar tu boleto en la ronda {round_id}. Contacta al administrador.", None, 0
+    if admission['closed']: # La caché la daba por abierta, pero ya se cerró (p. ej. desde otro proceso)
+        invalidate_round_cache(round_id)
+        logger.warning(f"Intento de añadir participante {telegram_id} a ronda no abierta {round_id}.")
+        return False, f"⚠️ La ronda ID {round_id} no está abierta para unirse.", None, 0
+
+    current_tickets_count = admission['round_tickets']
+    _cache_note_admission(round_id, admission, tickets)
+    if not admission['added']:
+        logger.warning(f"Intento de añadir {tickets} boleto(s) de {telegram_id} a ronda {round_id} sin cupo ({current_tickets_count}/{MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW}).")
+        return False, f"⚠️ La ronda ID {round_id} no tiene cupo para {tickets} boleto(s) ({current_tickets_count}/{MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW}).", admission['assigned_number'], current_tickets_count
+
+    participants_count, _ = get_round_entry_totals(round_id) # De la caché recién actualizada
+    publish_event(EVENT_PARTICIPANT_JOINED, {'round_id': round_id, 'participants': participants_count,
+                                             'tickets': current_tickets_count, 'max_tickets': MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW})
+
+    if admission['filled']:
+        # Esta admisión vendió el último boleto: se dispara el cierre sin esperar al job
+        logger.info("Ronda %s llena (%s/%s). Disparando sorteo inmediato.", round_id, current_tickets_count, MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW)
+        _notify_round_filled(round_id)
+
+    assigned_number = admission['assigned_number']
+    tickets_text = "tu boleto" if admission['user_tickets'] == 1 else f"{admission['user_tickets']} boletos"
+    logger.info("Participante admitido en ronda.", extra=log_fields(round_id=round_id, telegram_id=telegram_id,
+                                                                   user_tickets=admission['user_tickets'],
+                                                                   assigned_number=assigned_number, round_tickets=current_tickets_count))
+    return True, f"✅ ¡Te has unido a la ronda ID <code>{round_id}</code> y has comprado {tickets_text}! Tu número asignado es el <b>{assigned_number}</b>.\nBoletos: {current_tickets_count}/{MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW}.", assigned_number, current_tickets_count
+
+
+def _cache_note_admission(round_id: int, admission: dict, tickets: int) -> None:
+    """Write-through de una admisión: el total de boletos viene de la transacción; un usuario nuevo suma un participante."""
+    with _round_cache_lock:
+        entry = _round_cache.get(round_id)
+        if entry is None:
+            return
+        if not admission['added']:
+            # Sin cupo: el total que vio la transacción es el vigente
+            if _is_fresh(entry['counts_at']):
+                entry['tickets'] = admission['round_tickets']
+            return
+        if entry['participants'] is not None and _is_fresh(entry['counts_at']):
+            new_participant = admission['user_tickets'] == tickets
+            entry['participants'] += 1 if new_participant else 0
+            entry['tickets'] = admission['round_tickets']
+            entry['counts_at'] = time.monotonic()
         else:
-             # Esto no debería pasar si ya estaba en la base de datos, pero por seguridad
-             return False, f"⚠️ Ya estás unido a la ronda ID <code>{round_id}</code>.", None, current_participants_count
-
+            entry['participants'] = entry['tickets'] = entry['counts_at'] = None
+        if admission['filled'] and entry['round'] is not None:
+            entry['round_at'] = None # filled_time cambió en la DB: la próxima lectura la refresca
+
+def get_round_entry_totals(round_id: int) -> tuple[int, int]:
+    """(participantes, boletos) de una ronda, de la caché si están vigentes."""
+    with _round_cache_lock:
+        entry = _round_cache.get(round_id)
+        if entry is not None and entry['participants'] is not None and _is_fresh(entry['counts_at']):
+            _cache_hit(True)
+            _round_cache.move_to_end(round_id)
+            return entry['participants'], entry['tickets']
+        _cache_hit(False)
+    participants, tickets = db_get_round_entry_totals(round_id)
+    with _round_cache_lock:
+        entry = _round_cache.get(round_id)
+        if entry is not None and entry['round'] is not None and _is_open_round(entry['round']):
+            entry['participants'], entry['tickets'], entry['counts_at'] = participants, tickets, time.monotonic()
+    return participants, tickets
 
 def count_round_participants(round_id: int) -> int:
     """
-    Cuenta el número de participantes en una ronda específica llamando a la función de base de datos.
+    Cuenta el número de participantes en una ronda específica (caché de conteos en vivo o base de datos).
     """
-    logger.debug(f"Contando participantes para ronda {round_id}.")
-    return db_count_participants_in_round(round_id)
+    logger.debug("Contando participantes para ronda %s.", round_id)
+    return get_round_entry_totals(round_id)[0]
 
 def get_round_participants_data(round_id: int) -> list[tuple]:
     """
     Obtiene los datos completos de los participantes en una ronda llamando a la función de base de datos.
     Retorna una lista de tuplas (telegram_id, username, assigned_number, paid_simulated, paid_real).
     """
-    logger.debug(f"Obteniendo datos de participantes para ronda {round_id}.")
+    logger.debug("Obteniendo datos de participantes para ronda %s.", round_id)
     return db_get_participants_in_round(round_id)
 
 
@@ -174,13 +406,20 @@ def update_round_status_manager(round_id: int, new_status: str) -> bool:
     Actualiza el estado de una ronda llamando a la función de base de datos.
     Retorna True/False.
     """
-    logger.info(f"Actualizando estado de ronda {round_id} a '{new_status}'.")
-    return db_update_round_status(round_id, new_status)
+    logger.info("Actualizando estado de ronda %s a '%s'.", round_id, new_status)
+    updated = db_update_round_status(round_id, new_status)
+    if updated:
+        note_round_status(round_id, new_status)
+    return updated
 
 def mark_round_for_deletion(round_id: int) -> bool:
     """
     Marca una ronda para su eliminación lógica llamando a la función de base de datos.
     Retorna True/False.
     """
-    logger.info(f"Marcando ronda {round_id} para eliminación.")
-    return db_mark_round_as_deleted(round_id)
\ No newline at end of file
+    logger.info("Marcando ronda %s para eliminación.", round_id)
+    marked = db_mark_round_as_deleted(round_id)
+    invalidate_round_cache(round_id)
+    if marked:
+        publish_event(EVENT_ROUND_CLOSED, {'round_id': round_id, 'status': 'deleted'})
+    return marked
\ No newline at end of file
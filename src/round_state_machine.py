@@ -0,0 +1,57 @@
+# src/round_state_machine.py
+
+import logging
+
+# Importar la transición compare-and-swap de bajo nivel
+from .db import transition_round_status as db_transition_round_status
+
+# Estados de ronda (definidos en round_manager)
+from .round_manager import (
+    ROUND_STATUS_WAITING_TO_START,
+    ROUND_STATUS_WAITING_FOR_PAYMENTS,
+    ROUND_STATUS_DRAWING,
+    ROUND_STATUS_FINISHED,
+    ROUND_STATUS_CANCELLED,
+    note_round_status, # Write-through de la caché de rondas
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Ciclo de vida de una ronda ---
+# Tabla de transiciones permitidas: estado actual -> estados a los que puede pasar.
+# 'finished' y 'cancelled' son terminales.
+ALLOWED_TRANSITIONS = {
+    ROUND_STATUS_WAITING_TO_START: frozenset({ROUND_STATUS_WAITING_FOR_PAYMENTS, ROUND_STATUS_DRAWING, ROUND_STATUS_CANCELLED}),
+    ROUND_STATUS_WAITING_FOR_PAYMENTS: frozenset({ROUND_STATUS_DRAWING, ROUND_STATUS_CANCELLED}),
+    ROUND_STATUS_DRAWING: frozenset({ROUND_STATUS_FINISHED, ROUND_STATUS_CANCELLED}),
+    ROUND_STATUS_FINISHED: frozenset(),
+    ROUND_STATUS_CANCELLED: frozenset(),
+}
+
+OPEN_STATUSES = (ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_WAITING_FOR_PAYMENTS)
+TERMINAL_STATUSES = (ROUND_STATUS_FINISHED, ROUND_STATUS_CANCELLED)
+
+
+def is_transition_allowed(from_status: str, to_status: str) -> bool:
+    """Indica si el ciclo de vida permite pasar de `from_status` a `to_status`."""
+    return to_status in ALLOWED_TRANSITIONS.get(from_status, ())
+
+
+def transition(round_id: int, from_status: str, to_status: str) -> bool:
+    """
+    Mueve una ronda de `from_status` a `to_status` con un único UPDATE condicional.
+    Retorna True si esta llamada ganó la transición. Si la ronda ya no estaba en
+    `from_status` (otra tarea o réplica se adelantó) o la transición no está en
+    ALLOWED_TRANSITIONS, retorna False y no toca la base de datos.
+    """
+    if not is_transition_allowed(from_status, to_status):
+        logger.error(f"Transición no permitida para ronda {round_id}: '{from_status}' -> '{to_status}'.")
+        return False
+
+    won = db_transition_round_status(round_id, from_status, to_status)
+    if won:
+        note_round_status(round_id, to_status)
+        logger.info(f"Ronda {round_id}: '{from_status}' -> '{to_status}'.")
+    else:
+        logger.info(f"Ronda {round_id}: transición '{from_status}' -> '{to_status}' perdida (la ronda ya no estaba en '{from_status}').")
+    return won
@@ -1,195 +1,226 @@
 # src/simulation_engine.py
 import logging
-import sqlite3 # Para manejar la transacción de comisiones
-from datetime import datetime # Si necesitas timestamps aquí
 
 # Importar funciones de base de datos necesarias
+from .db import settle_round as db_settle_round # Liquidación atómica (resultados + comisiones + estado)
 from .db import (
-    save_draw_results,
-    save_creator_commission as db_save_creator_commission,
-    get_db_connection # Para manejar la transacción de comisiones
+    get_round_entry_totals as db_get_round_entry_totals,
+    iter_round_assigned_numbers as db_iter_round_assigned_numbers,
+    iter_round_ticket_weights as db_iter_round_ticket_weights,
+    get_participants_by_numbers as db_get_participants_by_numbers,
+    get_participant as db_get_participant,
 )
+from .draw_engine import draw_weighted_winning_numbers, draw_winning_numbers
 
 # Importar constantes de ronda (si son necesarias para la lógica aquí)
 from .round_manager import (
     MIN_PARTICIPANTS_FOR_TIMED_DRAW,
     MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW,
-    ROUND_TYPE_USER_CREATED,
+    ROUND_STATUS_DRAWING,
+    ROUND_STATUS_FINISHED,
+    note_round_status, # Write-through de la caché de rondas
 )
+from .leaderboard import note_round_settled # Buffer de ganadores recientes de la webapp
 
 logger = logging.getLogger(__name__)
 
-# --- Constantes de Porcentajes y Distribución Simuladas (de tu payment_manager.py original) ---
-COMMISSION_PERCENT_GAS_SIMULATED = 0.10
-COMMISSION_PERCENT_BOT = 0.10
-COMMISSION_PERCENT_USER_CREATOR = 0.05
+# Reglas de pago y aritmética en nanoTON (los PRIZE_SPLIT_* y COMMISSION_PERCENT_* viven en payout_ledger)
+from .payout_ledger import (
+    MAX_PRIZE_TIERS,
+    NANOTON_PER_TON,
+    compute_round_ledger,
+    format_nano,
+    get_commission_rates,
+    nano_to_ton,
+)
 
-PRIZE_SPLIT_1_WINNER = [1.0]
-PRIZE_SPLIT_2_WINNERS = [0.70, 0.30]
-PRIZE_SPLIT_3_WINNERS = [0.50, 0.30, 0.20]
-PRIZE_SPLIT_4_WINNERS = [0.40, 0.30, 0.20, 0.10]
+def _participant_field(participant, key: str, index: int):
+    """Acceso a un campo del participante, sea dict (sqlite3.Row convertido) o tupla legacy."""
+    return participant.get(key) if isinstance(participant, dict) else participant[index]
 
-async def calculate_and_save_simulated_payouts(
-    round_id: int, 
-    drawn_numbers: list[int], 
-    participants_data: list[tuple], 
-    round_type: str, 
-    creator_id: str | None
-) -> tuple[list[str], list[str]]:
+
+# Etiquetas de las comisiones para los mensajes (creator_type -> texto)
+COMMISSION_LABELS = {
+    'gas_fee': "Fondo Gas Simulado",
+    'bot': "Comisión Bot",
+    'user': "Comisión Creador",
+}
+
+
+def compute_round_amounts(participants_count: int, round_type: str, has_creator: bool,
+                          ticket_price: float = 1.0, winners_drawn: int = MAX_PRIZE_TIERS) -> dict:
+    """
+    Vista en TON (floats) del libro de una ronda de payout_ledger.compute_round_ledger.
+    La usa el simulador económico (src/economics_simulator.py); los pagos reales usan el libro en nanoTON.
     """
-    Calcula los premios y comisiones simuladas para una ronda finalizada.
-    Adaptado de tu payment_manager.py::perform_payout_calculation_and_save.
-    Guarda los resultados y comisiones en la base de datos.
-    Retorna listas de strings con la información de ganadores y comisiones para mensajes.
+    ledger = compute_round_ledger(participants_count, round_type, has_creator,
+                                  ticket_price_nano=round(ticket_price * NANOTON_PER_TON), winners_drawn=winners_drawn)
+    return {
+        'collected': nano_to_ton(ledger['collected_nano']),
+        'commissions': {c_type: nano_to_ton(amount) for c_type, amount in ledger['commissions_nano'].items()},
+        'prize_pool': nano_to_ton(ledger['prize_pool_nano']),
+        'prize_split': ledger['prize_split'],
+        'prizes': [nano_to_ton(amount) for amount in ledger['prizes_nano']],
+    }
+
+
+def calculate_simulated_payouts(
+    round_id: int,
+    drawn_numbers: list[int],
+    participants_data: list,
+    round_type: str,
+    creator_id: str | None,
+    ticket_price_nano: int = NANOTON_PER_TON,
+    participants_count: int | None = None
+) -> tuple[list[dict], list[dict], list[str], list[str]] | None:
+    """
+    Calcula (sin tocar la base de datos) los premios y comisiones simuladas de una ronda
+    a partir de su libro en nanoTON (payout_ledger.compute_round_ledger).
+    Si se pasa `participants_count`, `participants_data` solo necesita a los ganadores (y al creador):
+    así cierran las rondas grandes sin cargar a todos los participantes.
+    Retorna (resultados_para_db, comisiones_para_db, mensajes_ganadores, mensajes_comisiones),
+    o None si el número de participantes no es válido para el cálculo.
     """
     logger.debug(f"SIM_ENGINE: Iniciando cálculo de pagos simulados para ronda {round_id} (Tipo: {round_type}).")
 
-    current_participants_count = len(participants_data)
+    current_participants_count = participants_count if participants_count is not None else len(participants_data)
 
     if not (MIN_PARTICIPANTS_FOR_TIMED_DRAW <= current_participants_count <= MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW):
         logger.error(f"SIM_ENGINE: Ronda {round_id} con número inválido de participantes ({current_participants_count}) para cálculo.")
-        return [], [f"Error: Número inválido de participantes ({current_participants_count}) para cálculo de pagos."]
+        return None
 
-    total_collected_simulated = float(current_participants_count)
+    ledger = compute_round_ledger(current_participants_count, round_type, bool(creator_id),
+                                  ticket_price_nano=ticket_price_nano, winners_drawn=len(drawn_numbers))
+    commission_rates = dict(get_commission_rates(round_type, bool(creator_id)))
 
     commissions_to_save_in_db = []
     commissions_messages = []
-
-    gas_commission_amount = total_collected_simulated * COMMISSION_PERCENT_GAS_SIMULATED
-    commissions_to_save_in_db.append({
-        'creator_type': 'gas_fee', 'creator_telegram_id': None,
-        'amount_simulated': f"{gas_commission_amount:.2f} unidades", 'amount_real': gas_commission_amount
-    })
-    commissions_messages.append(f"- Fondo Gas Simulado ({int(COMMISSION_PERCENT_GAS_SIMULATED*100)}%): {gas_commission_amount:.2f} unidades")
-
-    bot_commission_amount = total_collected_simulated * COMMISSION_PERCENT_BOT
-    commissions_to_save_in_db.append({
-        'creator_type': 'bot', 'creator_telegram_id': None,
-        'amount_simulated': f"{bot_commission_amount:.2f} unidades", 'amount_real': bot_commission_amount
-    })
-    commissions_messages.append(f"- Comisión Bot ({int(COMMISSION_PERCENT_BOT*100)}%): {bot_commission_amount:.2f} unidades")
-
-    user_creator_commission_amount = 0.0
-    if round_type == ROUND_TYPE_USER_CREATED and creator_id:
-        user_creator_commission_amount = total_collected_simulated * COMMISSION_PERCENT_USER_CREATOR
+    for c_type, amount_nano in ledger['commissions_nano'].items():
+        c_creator_id = creator_id if c_type == 'user' else None
         commissions_to_save_in_db.append({
-            'creator_type': 'user', 'creator_telegram_id': creator_id,
-            'amount_simulated': f"{user_creator_commission_amount:.2f} unidades", 'amount_real': user_creator_commission_amount
+            'creator_type': c_type, 'creator_telegram_id': c_creator_id,
+            'amount_simulated': f"{format_nano(amount_nano)} unidades", 'amount_real': nano_to_ton(amount_nano),
+            'amount_nano': amount_nano
         })
-        creator_username = next((p[1] for p in participants_data if str(p[0]) == str(creator_id)), creator_id or 'desconocido')
-        commissions_messages.append(f"- Comisión Creador @{creator_username} ({int(COMMISSION_PERCENT_USER_CREATOR*100)}%): {user_creator_commission_amount:.2f} unidades")
-
-    total_fixed_commission_amount = gas_commission_amount + bot_commission_amount + user_creator_commission_amount
-    prize_pool_for_winners_amount = max(0.0, total_collected_simulated - total_fixed_commission_amount)
-    logger.debug(f"SIM_ENGINE: Ronda {round_id} - Total Recaudado: {total_collected_simulated:.2f}, Comisiones Fijas: {total_fixed_commission_amount:.2f}, Pozo Premios: {prize_pool_for_winners_amount:.2f}")
-
-    prize_split_percentages = []
-    if MIN_PARTICIPANTS_FOR_TIMED_DRAW <= current_participants_count <= 3:
-        prize_split_percentages = PRIZE_SPLIT_1_WINNER
-    elif 4 <= current_participants_count <= 6:
-        prize_split_percentages = PRIZE_SPLIT_2_WINNERS
-    elif 7 <= current_participants_count <= 9:
-        prize_split_percentages = PRIZE_SPLIT_3_WINNERS
-    elif current_participants_count == 10:
-        prize_split_percentages = PRIZE_SPLIT_4_WINNERS
-    
+        label = COMMISSION_LABELS.get(c_type, c_type)
+        if c_type == 'user':
+            creator_username = next((_participant_field(p, 'username', 1) for p in participants_data
+                                     if str(_participant_field(p, 'telegram_id', 0)) == str(creator_id)), creator_id or 'desconocido')
+            label = f"{label} @{creator_username}"
+        commissions_messages.append(f"- {label} ({int(commission_rates[c_type]*100)}%): {format_nano(amount_nano)} unidades")
+
+    logger.debug(f"SIM_ENGINE: Ronda {round_id} - Total Recaudado: {ledger['collected_nano']} nano, Comisiones Fijas: {sum(ledger['commissions_nano'].values())} nano, Pozo Premios: {ledger['prize_pool_nano']} nano")
+
+    prize_split_percentages = ledger['prize_split']
+
     winners_info_for_db = []
     winners_messages = []
 
     if not drawn_numbers:
         logger.warning(f"SIM_ENGINE: No se sortearon números para ronda {round_id}.")
+
+    participants_by_number = {_participant_field(p, 'assigned_number', 2): p for p in participants_data}
+    # Un premio por número sorteado, en orden de sorteo: draw_order i cobra el tramo i del reparto
+    for draw_order, (drawn_number, prize_amount_nano) in enumerate(zip(drawn_numbers, ledger['prizes_nano'])):
+        prize_percentage = prize_split_percentages[draw_order]
+        winner_participant_data = participants_by_number.get(drawn_number)
+
+        if winner_participant_data:
+            winner_telegram_id = _participant_field(winner_participant_data, 'telegram_id', 0)
+            winner_username = _participant_field(winner_participant_data, 'username', 1)
+            prize_amount_simulated_text = f"{format_nano(prize_amount_nano)} unidades"
+
+            winners_messages.append(
+                f"- {draw_order + 1}º @{winner_username or winner_telegram_id} (Número {drawn_number}): Gana {prize_amount_simulated_text} ({int(prize_percentage*100)}% del Pozo)"
+            )
+            winners_info_for_db.append({
+                'drawn_number': drawn_number, 'draw_order': draw_order,
+                'winner_telegram_id': str(winner_telegram_id),
+                'winner_username': winner_username,
+                'prize_percentage': prize_percentage,
+                'prize_amount_simulated': prize_amount_simulated_text,
+                'prize_amount_real': nano_to_ton(prize_amount_nano),
+                'prize_amount_nano': prize_amount_nano
+            })
+        else: # El número sorteado no lo tenía nadie (no debería pasar si se sortea de números asignados)
+            logger.warning(f"SIM_ENGINE: Número sorteado {drawn_number} no encontrado entre participantes de ronda {round_id}.")
+            winners_messages.append(f"El número sorteado {drawn_number} no fue asignado. ¡El pozo se acumula (simulado)!")
+            winners_info_for_db.append({
+                'drawn_number': drawn_number, 'draw_order': draw_order,
+                'winner_telegram_id': None, 'winner_username': None, 'prize_percentage': prize_percentage,
+                'prize_amount_simulated': "Sin Ganador Asignado", 'prize_amount_real': 0.0, 'prize_amount_nano': 0
+            })
+
+    return winners_info_for_db, commissions_to_save_in_db, winners_messages, commissions_messages
+
+
+async def calculate_and_save_simulated_payouts(
+    round_id: int, 
+    drawn_numbers: list[int], 
+    participants_data: list[tuple], 
+    round_type: str, 
+    creator_id: str | None,
+    ticket_price_nano: int = NANOTON_PER_TON,
+    participants_count: int | None = None
+) -> tuple[list[str], list[str], bool, list[dict]]:
+    """
+    Calcula los premios y comisiones simuladas para una ronda en 'drawing' y la liquida
+    con db.settle_round: resultados (todas las filas de draw_order), comisiones y estado
+    'finished' en una sola transacción.
+    Retorna (mensajes_ganadores, mensajes_comisiones, liquidada, resultados). `resultados` son
+    los premios por draw_order (ganador, número, monto) para las notificaciones. Si `liquidada`
+    es False no se guardó nada y la ronda sigue como estaba.
+    """
+    payouts = calculate_simulated_payouts(round_id, drawn_numbers, participants_data, round_type, creator_id,
+                                          ticket_price_nano, participants_count)
+    if payouts is None:
+        invalid_count = participants_count if participants_count is not None else len(participants_data)
+        return [], [f"Error: Número inválido de participantes ({invalid_count}) para cálculo de pagos."], False, []
+
+    winners_info_for_db, commissions_to_save_in_db, winners_messages, commissions_messages = payouts
+
+    settled = db_settle_round(round_id, winners_info_for_db, commissions_to_save_in_db,
+                              from_status=ROUND_STATUS_DRAWING, to_status=ROUND_STATUS_FINISHED)
+    if settled:
+        note_round_status(round_id, ROUND_STATUS_FINISHED)
+        note_round_settled(round_id)
+        logger.info(f"SIM_ENGINE: Ronda {round_id} liquidada (resultados, comisiones y estado) en una sola transacción.")
+    else:
+        logger.error(f"SIM_ENGINE: No se pudo liquidar la ronda {round_id}. No se guardaron resultados ni comisiones.")
+
+    return winners_messages, commissions_messages, settled, winners_info_for_db
+
+
+async def draw_and_settle_round(round_id: int, round_type: str, creator_id: str | None,
+                                ticket_price_nano: int = NANOTON_PER_TON, rng=None) -> dict:
+    """
+    Sorteo y liquidación de una ronda en 'drawing' sin cargar a sus participantes: cuenta, sortea
+    recorriendo el índice de números asignados y solo lee las filas de los ganadores (y del creador).
+    Coste O(participantes) en tiempo y O(ganadores) en memoria, también con decenas de miles de boletos.
+    Si alguien compró varios boletos, el sorteo pondera por boletos (tabla de alias) y el libro de pagos
+    se calcula sobre los boletos vendidos.
+    Retorna {'participants_count', 'tickets_count', 'drawn_numbers', 'winners_messages', 'commissions_messages', 'settled', 'results'}.
+    """
+    participants_count, tickets_count = db_get_round_entry_totals(round_id)
+    outcome = {'participants_count': participants_count, 'tickets_count': tickets_count, 'drawn_numbers': [],
+               'winners_messages': [], 'commissions_messages': [], 'settled': False, 'results': []}
+    if participants_count < MIN_PARTICIPANTS_FOR_TIMED_DRAW:
+        return outcome
+
+    if tickets_count == participants_count: # Un boleto por participante: sorteo uniforme por índice
+        drawn_numbers = draw_winning_numbers(participants_count, db_iter_round_assigned_numbers(round_id), rng)
     else:
-        # En tu lógica original, aunque drawn_numbers es una lista, parece que solo usas el primero para determinar múltiples ganadores
-        # si hay múltiples porcentajes en prize_split_percentages.
-        # Para simplificar y seguir la idea de "un número sorteado principal", tomaremos el primer número.
-        # Si tu intención era tener múltiples números sorteados distintos, esta parte necesitaría ajuste.
-        
-        # Asumimos que `drawn_numbers` contiene los números en el orden en que deben recibir premios según `prize_split_percentages`.
-        # Tu `perform_simulated_draw_and_payout` original seleccionaba un *único* número ganador y luego buscaba si
-        # ese número estaba en la lista de participantes. El código aquí se adaptará para buscar CADA número sorteado
-        # si `drawn_numbers` pudiera contener más de uno y `prize_split_percentages` tuviera varios elementos.
-        # PERO, como ahora indicas que se sortea 1 número, la lógica se simplifica:
-        
-        if drawn_numbers: # Debería haber al menos un número
-            main_drawn_number = drawn_numbers[0] # El único número sorteado que importa para el premio principal
-
-            # Encontrar al participante que tiene ESE número
-            winner_participant_data = next((p for p in participants_data if p[2] == main_drawn_number), None) # p[2] is assigned_number
-
-            if winner_participant_data:
-                # Aplicar el prize_split_percentages al único ganador
-                # (aunque prize_split_percentages podría tener varios elementos, solo el primero se usa si hay un solo ganador)
-                prize_percentage = prize_split_percentages[0] if prize_split_percentages else 0
-                prize_amount = prize_pool_for_winners_amount * prize_percentage
-                prize_amount_simulated_text = f"{prize_amount:.2f} unidades"
-
-                winners_messages.append(
-                    f"- @{winner_participant_data[1] or winner_participant_data[0]} (Número {main_drawn_number}): Gana {prize_amount_simulated_text} ({int(prize_percentage*100)}% del Pozo)"
-                )
-                winners_info_for_db.append({
-                    'drawn_number': main_drawn_number, 'draw_order': 0, # 0 para el primer (y único) premio
-                    'winner_telegram_id': str(winner_participant_data[0]),
-                    'prize_amount_simulated': prize_amount_simulated_text,
-                    'prize_amount_real': prize_amount
-                })
-            else: # El número sorteado no lo tenía nadie (no debería pasar si se sortea de números asignados)
-                logger.warning(f"SIM_ENGINE: Número sorteado {main_drawn_number} no encontrado entre participantes de ronda {round_id}.")
-                winners_messages.append(f"El número sorteado {main_drawn_number} no fue asignado. ¡El pozo se acumula (simulado)!")
-                winners_info_for_db.append({
-                    'drawn_number': main_drawn_number, 'draw_order': 0,
-                    'winner_telegram_id': None, 
-                    'prize_amount_simulated': "Sin Ganador Asignado", 'prize_amount_real': 0.0
-                })
-
-    # Guardar resultados del sorteo (ganadores)
-    if winners_info_for_db:
-        save_draw_results(round_id, winners_info_for_db) # Tu función de db.py
-        logger.info(f"SIM_ENGINE: Resultados del sorteo (simulado) guardados en DB para ronda {round_id}.")
-    else: # Si no hubo drawn_numbers o no se encontró ganador con el número sorteado
-        # Podrías querer guardar un registro de que no hubo ganador
-        if drawn_numbers: # Si se sorteó un número pero no hubo ganador
-             save_draw_results(round_id, [{
-                'drawn_number': drawn_numbers[0], 'draw_order': 0, 'winner_telegram_id': None,
-                'prize_amount_simulated': "Sin Ganador", 'prize_amount_real': 0.0
-            }])
-        logger.warning(f"SIM_ENGINE: No hay información de ganadores para guardar en DB para ronda {round_id}.")
-
-    # Guardar Comisiones Simuladas DENTRO DE UNA TRANSACCIÓN
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        conn.execute("BEGIN TRANSACTION") # Iniciar transacción explícitamente
-
-        for commission_info in commissions_to_save_in_db:
-            try:
-                # db_save_creator_commission ahora es una función normal que maneja su propia conexión
-                # Para una transacción, es mejor pasar el cursor.
-                # Re-implementaremos db_save_creator_commission para aceptar cursor.
-                # O, aquí, manejamos la transacción explícitamente.
-                 cursor.execute(
-                    """
-                    INSERT INTO creator_commission (
-                        round_id, creator_type, creator_telegram_id, amount_simulated, amount_real, transaction_id
-                    ) VALUES (?, ?, ?, ?, ?, ?)
-                    """,
-                    (round_id, commission_info['creator_type'], commission_info['creator_telegram_id'], 
-                     commission_info['amount_simulated'], commission_info['amount_real'], None)
-                )
-            except sqlite3.IntegrityError:
-                logger.warning(f"SIM_ENGINE: Comisión duplicada para ronda {round_id}, tipo '{commission_info['creator_type']}'. Saltando.")
-                # No relanzamos para permitir que otras comisiones se guarden si esta falla por duplicado.
-                # Pero si cualquier otra cosa falla, la transacción se deshará.
-            # Otros sqlite3.Error serán capturados por el except externo y desharán la transacción.
-
-        conn.commit() # Confirmar la transacción si todo fue bien
-        logger.info(f"SIM_ENGINE: Comisiones simuladas guardadas en DB para ronda {round_id}.")
-    except sqlite3.Error as e:
-        logger.error(f"SIM_ENGINE: Error SQLite guardando comisiones para ronda {round_id}. Transacción deshecha: {e}", exc_info=True)
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
-            
-    return winners_messages, commissions_messages
\ No newline at end of file
+        drawn_numbers = draw_weighted_winning_numbers(db_iter_round_ticket_weights(round_id), participants_count, tickets_count, rng)
+    winners_data = db_get_participants_by_numbers(round_id, drawn_numbers)
+    participants_subset = list(winners_data.values())
+    if creator_id:
+        creator_data = db_get_participant(round_id, creator_id)
+        if creator_data:
+            participants_subset.append(creator_data)
+    logger.info(f"SIM_ENGINE: Ronda {round_id}: {len(drawn_numbers)} números sorteados entre {participants_count} participantes ({tickets_count} boletos).")
+
+    winners_messages, commissions_messages, settled, results = await calculate_and_save_simulated_payouts(
+        round_id, drawn_numbers, participants_subset, round_type, creator_id, ticket_price_nano, tickets_count)
+    outcome.update(drawn_numbers=drawn_numbers, winners_messages=winners_messages,
+                   commissions_messages=commissions_messages, settled=settled, results=results)
+    return outcome
@@ -7,6 +7,8 @@ import os
 # Importamos nuestro módulo db para interactuar con la base de datos local
 # Asegúrate de que db.py esté en la misma carpeta src y contenga las funciones necesarias
 from src import db # Importación absoluta corregida
+from src.log_pipeline import log_fields # Campos estructurados (clave=valor) de los registros
+from src.tracing import traced # Spans de las llamadas a toncenter (src/tracing.py)
 
 logger = logging.getLogger(__name__)
 
@@ -65,6 +67,7 @@ logger.info(f"Wallet de recepción del bot: {WALLET}")
 
 # --- Funciones de Interacción con la API de TON Center ---
 
+@traced()
 def detect_address(address: str) -> str | bool:
     """
     Valida una dirección de TON y retorna su formato b64url bounceable si es válida.
@@ -72,7 +75,7 @@ def detect_address(address: str) -> str | bool:
     """
     url = f"{API_BASE}detectAddress?address={address}&api_key={API_TOKEN}"
     try:
-        logger.debug(f"Llamando a detectAddress para '{address}'")
+        logger.debug("Llamando a detectAddress para '%s'", address)
         r = requests.get(url)
         r.raise_for_status() # Lanza una excepción para códigos de estado de error (4xx o 5xx)
         response = json.loads(r.text)
@@ -95,6 +98,7 @@ def detect_address(address: str) -> str | bool:
         return False
 
 
+@traced()
 def get_address_transactions(address: str = WALLET, limit: int = 30) -> list | None:
     """
     Obtiene las últimas transacciones entrantes para una dirección de wallet.
@@ -106,7 +110,7 @@ def get_address_transactions(address: str = WALLET, limit: int = 30) -> list | N
     # o se usan otros métodos (websockets, etc.).
     url = f"{API_BASE}getTransactions?address={address}&limit={limit}&archival=true&api_key={API_TOKEN}"
     try:
-        logger.debug(f"Llamando a getTransactions para '{address}' con limit={limit}")
+        logger.debug("Llamando a getTransactions para '%s' con limit=%s", address, limit)
         r = requests.get(url)
         r.raise_for_status() # Lanza una excepción para códigos de estado de error
         response = json.loads(r.text)
@@ -131,20 +135,35 @@ def get_address_transactions(address: str = WALLET, limit: int = 30) -> list | N
         return None
 
 
-def find_transaction(user_wallet: str, value_nano: str, comment: str, telegram_id: str | None = None) -> bool:
+def match_ticket_payment_value(value_nano, ticket_price_nano: int, max_tickets: int = 1) -> int:
     """
-    Busca una transacción entrante específica (por origen, valor y comentario)
-    en las últimas transacciones de la wallet del bot.
-    Verifica si la transacción ya fue procesada usando db.check_transaction.
-    Si la encuentra y no ha sido procesada, la registra en db.add_ton_transaction
-    y retorna True. Retorna False si no la encuentra o ya fue procesada.
+    Boletos que paga un monto: N si `value_nano` es exactamente N × `ticket_price_nano` con
+    1 <= N <= `max_tickets`, 0 en cualquier otro caso (montos parciales, sobrantes o inválidos).
+    """
+    try:
+        value = int(value_nano)
+    except (TypeError, ValueError):
+        return 0
+    if ticket_price_nano <= 0 or value <= 0:
+        return 0
+    tickets, remainder = divmod(value, ticket_price_nano)
+    return tickets if remainder == 0 and tickets <= max_tickets else 0
+
+
+def _find_and_register_payment(user_wallet: str, comment: str, value_matches, telegram_id: str | None = None,
+                               lottery_round_id: int | None = None) -> int | None:
+    """
+    Busca en las últimas transacciones de la wallet del bot un mensaje entrante de `user_wallet`
+    con `comment` cuyo valor acepte `value_matches(valor)`, que no haya sido procesado antes
+    (db.check_transaction). Lo registra con db.add_ton_transaction y retorna su valor en nanoTON,
+    o None si no hay ninguno nuevo.
     """
     # Obtener las últimas transacciones para la wallet del bot
     transactions = get_address_transactions(WALLET)
 
     if transactions is None:
         logger.error("find_transaction no pudo obtener transacciones de la API.")
-        return False # No se pudieron obtener transacciones
+        return None # No se pudieron obtener transacciones
 
     # Iterar sobre las transacciones encontradas
     for transaction in transactions:
@@ -155,66 +174,73 @@ def find_transaction(user_wallet: str, value_nano: str, comment: str, telegram_i
 
             msg = transaction['in_msg']
 
-            # Comparar los datos de la transacción con los esperados
-            # Convertimos value_nano a string para la comparación si es necesario,
-            # ya que el JSON de la API lo retorna como string.
-            if msg['source'] == user_wallet and msg['value'] == str(value_nano) and msg['message'] == comment:
+            # Comparar los datos de la transacción con los esperados (el JSON de la API trae el valor como string)
+            if msg['source'] == user_wallet and msg['message'] == comment and value_matches(msg['value']):
 
                 # Si los datos coinciden, verificar si esta transacción ya fue verificada en la DB
                 tx_hash = msg['body_hash']
                 if not db.check_transaction(tx_hash):
                     # Si no ha sido verificada, registrarla en la DB usando add_ton_transaction
                     try:
-                        # add_ton_transaction necesita telegram_id y bot_ton_wallet.
-                        # bot_ton_wallet es la wallet del bot (WALLET).
-                        # telegram_id debería obtenerse en el handler o pasarse aquí.
-                        # Si no se pasa, intentamos obtenerlo de la DB por la wallet de origen,
-                        # o lo guardamos como NULL temporalmente.
-                        
-                        # Intentamos obtener el telegram_id asociado a esta wallet de origen
-                        # Esto requiere que el usuario haya registrado su wallet previamente
-                        # (ej. al iniciar el bot o al intentar unirse/pagar por primera vez)
-                        # Si el handler no pasa el telegram_id, lo buscamos.
-                        assoc_telegram_id = telegram_id
-                        # Necesitas implementar get_user_telegram_id_by_ton_wallet en db.py si quieres buscar por wallet
-                        # if assoc_telegram_id is None:
-                        #      assoc_telegram_id = db.get_user_telegram_id_by_ton_wallet(user_wallet)
-
+                        # Si el handler no pasa el telegram_id se guarda como NULL
+                        # (buscarlo por wallet requiere get_user_telegram_id_by_ton_wallet en db.py)
                         added_successfully = db.add_ton_transaction(
-                            telegram_id=assoc_telegram_id, # Usar el ID asociado o None
+                            telegram_id=telegram_id,
                             user_ton_wallet=msg['source'],
                             bot_ton_wallet=WALLET, # La wallet del bot
                             transaction_hash=tx_hash,
                             value_nano=int(msg['value']), # Guardar valor como INT en DB
                             comment=msg['message'],
-                            lottery_round_id_assoc=None # Puedes asociar a una ronda lógica si la tienes
+                            lottery_round_id_assoc=lottery_round_id
                         )
 
                         if added_successfully is not None: # add_ton_transaction retorna ID o None
-                            logger.info(f"find_transaction: Transacción encontrada y verificada.")
-                            logger.info(f"  Origen: {msg['source']}")
-                            logger.info(f"  Valor: {msg['value']} nanoTON")
-                            logger.info(f"  Comentario: '{msg['message']}'")
-                            logger.info(f"  Hash: {tx_hash}")
-                            return True # Transacción encontrada y verificada exitosamente
+                            logger.info("find_transaction: Transacción encontrada y verificada.",
+                                        extra=log_fields(source=msg['source'], value_nano=msg['value'],
+                                                         comment=msg['message'], hash=tx_hash))
+                            return int(msg['value']) # Transacción encontrada y verificada exitosamente
                         else:
                             # Falló add_ton_transaction (ej. error de DB, aunque check_transaction dijo que no existía)
                             logger.error(f"find_transaction: Falló el registro de la transacción {tx_hash} en DB.")
-                            return False # Error al registrar
+                            return None # Error al registrar
 
                     except Exception as e:
                         logger.error(f"Error inesperado al registrar transacción verificada en DB: {e}", exc_info=True)
-                        return False # Error al registrar
+                        return None # Error al registrar
                 else:
-                    # La transacción fue encontrada pero ya estaba verificada
-                    logger.info(f"find_transaction: Transacción encontrada pero ya verificada (Hash: {tx_hash[:10]}...).")
-                    # Continuar buscando, por si el usuario envió la misma cantidad/comentario varias veces
-                    # (aunque con hash único, esto solo ocurriría si el hash no se registró correctamente antes)
-                    pass # No retornamos False aquí, seguimos buscando
+                    # La transacción fue encontrada pero ya estaba verificada: seguimos buscando,
+                    # por si el usuario envió la misma cantidad/comentario varias veces
+                    logger.info("find_transaction: Transacción encontrada pero ya verificada (Hash: %s...).", tx_hash[:10])
 
     # Si terminamos de iterar y no encontramos la transacción no verificada
     logger.info("find_transaction: No se encontró la transacción requerida en las últimas transacciones o ya estaba verificada.")
-    return False
+    return None
+
+
+@traced()
+def find_transaction(user_wallet: str, value_nano: str, comment: str, telegram_id: str | None = None) -> bool:
+    """
+    Busca una transacción entrante específica (por origen, valor exacto y comentario)
+    en las últimas transacciones de la wallet del bot.
+    Verifica si la transacción ya fue procesada usando db.check_transaction.
+    Si la encuentra y no ha sido procesada, la registra en db.add_ton_transaction
+    y retorna True. Retorna False si no la encuentra o ya fue procesada.
+    """
+    return _find_and_register_payment(user_wallet, comment, lambda value: value == str(value_nano), telegram_id) is not None
+
+
+@traced()
+def find_ticket_payment(user_wallet: str, ticket_price_nano: int, comment: str, telegram_id: str | None = None,
+                        max_tickets: int = 1, lottery_round_id: int | None = None) -> int:
+    """
+    Como find_transaction, pero acepta cualquier múltiplo exacto del precio del boleto: un pago
+    verificado de N × precio compra N boletos (hasta `max_tickets`). La transacción queda asociada
+    a `lottery_round_id`. Retorna los boletos pagados, o 0 si no hay un pago nuevo que coincida.
+    """
+    value = _find_and_register_payment(
+        user_wallet, comment, lambda value: match_ticket_payment_value(value, ticket_price_nano, max_tickets) > 0,
+        telegram_id, lottery_round_id)
+    return match_ticket_payment_value(value, ticket_price_nano, max_tickets) if value is not None else 0
 
 
 # --- Sección para pruebas directas del script ---
@@ -0,0 +1,236 @@
+# src/tracing.py
+# Trazas en proceso: spans anidados por contexto (contextvars, así cada tarea de asyncio y cada
+# asyncio.to_thread hereda el span padre) alrededor de los handlers, las llamadas al Bot API,
+# ton_api y las funciones de src.db. Un update lento se descompone en su árbol de spans:
+#   handler.callback_verify_payment
+#     ton_api.find_transaction
+#       ton_api.get_address_transactions
+#       db.check_transaction / db.add_ton_transaction
+#     telegram.editMessageText
+# Los spans terminados se acumulan por nombre (percentiles en get_span_stats) y, si hay archivo de
+# exportación, un hilo los escribe como JSONL sin bloquear el loop. El archivo rota al pasar de
+# TRACE_EXPORT_MAX_BYTES (se conserva un solo archivo anterior, `<ruta>.1`), así ocupa como mucho el
+# doble. Apagado por defecto en config.json: cada tick del scheduler ya son decenas de spans de db.
+# Resumen de un archivo:
+#   python -m src.tracing traces.jsonl --slowest 5
+
+import argparse
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SPAN_SAMPLES = 5_000 # Últimas duraciones por nombre de span para los percentiles
+DEFAULT_TRACE_EXPORT_PATH = 'traces.jsonl'
+TRACE_EXPORT_MAX_BYTES = 50 * 1024 * 1024
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_tracing = {'enabled': False}
+_span_durations = {} # nombre -> deque de duraciones en ms
+_span_counts = {} # nombre -> {'count', 'errors'}
+_spans_lock = threading.Lock()
+_exporter = None # {'queue', 'thread', 'path', 'max_bytes'}
+
+
+def _new_id() -> str:
+    return os.urandom(8).hex()
+
+
+# --- Spans ---
+@contextmanager
+def span(name: str, **attributes):
+    """Abre un span hijo del span actual (o la raíz de una traza nueva). Cede el dict del span o None si está apagado."""
+    if not _tracing['enabled']:
+        yield None
+        return
+    parent = _current_span.get()
+    record = {'trace_id': parent['trace_id'] if parent else _new_id(), 'span_id': _new_id(),
+              'parent_id': parent['span_id'] if parent else None, 'name': name, 'start': time.time(),
+              'duration_ms': None, 'attributes': attributes}
+    token = _current_span.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['duration_ms'] = (time.perf_counter() - started) * 1000
+        _current_span.reset(token)
+        _finish(record)
+
+def traced(name: str | None = None):
+    """Decorador: cada llamada a la función (síncrona o async) es un span `name` (por defecto modulo.función)."""
+    def decorate(function):
+        span_name = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}"
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if not _tracing['enabled']:
+                    return await function(*args, **kwargs)
+                with span(span_name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _tracing['enabled']:
+                return function(*args, **kwargs)
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def current_span() -> dict | None:
+    return _current_span.get()
+
+def _finish(record: dict) -> None:
+    with _spans_lock:
+        durations = _span_durations.get(record['name'])
+        if durations is None:
+            durations = _span_durations[record['name']] = deque(maxlen=SPAN_SAMPLES)
+            _span_counts[record['name']] = {'count': 0, 'errors': 0}
+        durations.append(record['duration_ms'])
+        counts = _span_counts[record['name']]
+        counts['count'] += 1
+        counts['errors'] += 'error' in record
+    exporter = _exporter
+    if exporter is not None:
+        exporter['queue'].put(record)
+
+
+# --- Middlewares de aiogram (callables simples: no hace falta importar aiogram aquí) ---
+async def handler_span_middleware(handler, event, data):
+    """Middleware interno de dp.message / dp.callback_query: un span por handler que atiende el update."""
+    if not _tracing['enabled']:
+        return await handler(event, data)
+    handler_object = data.get('handler')
+    name = getattr(getattr(handler_object, 'callback', None), '__name__', type(event).__name__)
+    user = getattr(event, 'from_user', None)
+    with span(f"handler.{name}", user_id=getattr(user, 'id', None)):
+        return await handler(event, data)
+
+async def bot_request_span_middleware(make_request, bot, method):
+    """Middleware de bot.session: un span por llamada al Bot API (mensajes, ediciones, notificaciones)."""
+    if not _tracing['enabled']:
+        return await make_request(bot, method)
+    with span(f"telegram.{type(method).__name__[0].lower()}{type(method).__name__[1:]}"):
+        return await make_request(bot, method)
+
+
+# --- Configuración y exportación ---
+def configure_tracing(enabled: bool = True, export_path: str | None = None, max_bytes: int = TRACE_EXPORT_MAX_BYTES) -> None:
+    """
+    Enciende/apaga el trazado y (re)inicia el exportador JSONL si se indica `export_path`; el archivo
+    rota a `<export_path>.1` al superar `max_bytes`.
+    """
+    global _exporter
+    stop_exporter()
+    _tracing['enabled'] = enabled
+    if enabled and export_path:
+        exporter = {'queue': queue.SimpleQueue(), 'path': export_path, 'max_bytes': max_bytes}
+        exporter['thread'] = threading.Thread(target=_export_loop, args=(exporter,), name='trace-exporter', daemon=True)
+        exporter['thread'].start()
+        _exporter = exporter
+        logger.info(f"TRACING: Exportando spans a {export_path}.")
+
+def stop_exporter() -> None:
+    """Escribe los spans pendientes y detiene el hilo exportador."""
+    global _exporter
+    exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter['queue'].put(None)
+        exporter['thread'].join()
+
+def _export_loop(exporter: dict) -> None:
+    span_queue, path = exporter['queue'], exporter['path']
+    output = _open_export_file(path, exporter['max_bytes'])
+    try:
+        while True:
+            record = span_queue.get()
+            while record is not None: # Escribe en lote todo lo que ya esté en la cola
+                output.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+                try:
+                    record = span_queue.get_nowait()
+                except queue.Empty:
+                    break
+            output.flush()
+            if record is None:
+                return
+            if output.tell() >= exporter['max_bytes']:
+                output.close()
+                output = _open_export_file(path, exporter['max_bytes'])
+    finally:
+        output.close()
+
+
+def _open_export_file(path: str, max_bytes: int):
+    """Abre el JSONL en modo append, rotándolo antes a `<path>.1` si ya llegó al límite (también al arrancar)."""
+    if os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+        os.replace(path, path + '.1') # Pisa el anterior: como mucho dos archivos
+    return open(path, 'a', encoding='utf-8')
+
+def reset_span_stats() -> None:
+    with _spans_lock:
+        _span_durations.clear()
+        _span_counts.clear()
+
+
+# --- Resúmenes ---
+def _percentiles(durations: list[float]) -> dict:
+    samples = sorted(durations)
+    def percentile(p):
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))], 3) if samples else None
+    return {'p50_ms': percentile(0.50), 'p95_ms': percentile(0.95), 'p99_ms': percentile(0.99), 'max_ms': percentile(1.0)}
+
+def get_span_stats() -> dict:
+    """Por nombre de span: {'count', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'}, del más lento (p95) al más rápido."""
+    with _spans_lock:
+        snapshot = {name: (list(durations), dict(_span_counts[name])) for name, durations in _span_durations.items()}
+    stats = {name: {**counts, **_percentiles(durations)} for name, (durations, counts) in snapshot.items()}
+    return dict(sorted(stats.items(), key=lambda item: item[1]['p95_ms'] or 0, reverse=True))
+
+def summarize_trace_file(path: str, slowest: int = 5) -> dict:
+    """
+    Percentiles por nombre de span de un JSONL exportado y, para las `slowest` trazas más lentas,
+    el tiempo total por nombre de span dentro de cada una (dónde se fue el tiempo).
+    """
+    durations, counts, traces = {}, {}, {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            durations.setdefault(record['name'], []).append(record['duration_ms'])
+            entry = counts.setdefault(record['name'], {'count': 0, 'errors': 0})
+            entry['count'] += 1
+            entry['errors'] += 'error' in record
+            traces.setdefault(record['trace_id'], []).append(record)
+    spans = {name: {**counts[name], **_percentiles(values)} for name, values in durations.items()}
+    roots = [next((r for r in records if r['parent_id'] is None), None) for records in traces.values()]
+    roots = sorted((r for r in roots if r is not None), key=lambda r: r['duration_ms'], reverse=True)[:slowest]
+    breakdowns = []
+    for root in roots:
+        by_name = {}
+        for record in traces[root['trace_id']]:
+            if record is not root:
+                by_name[record['name']] = round(by_name.get(record['name'], 0.0) + record['duration_ms'], 3)
+        breakdowns.append({'trace_id': root['trace_id'], 'root': root['name'], 'duration_ms': round(root['duration_ms'], 3),
+                           'spans_ms': dict(sorted(by_name.items(), key=lambda item: item[1], reverse=True))})
+    return {'spans': dict(sorted(spans.items(), key=lambda item: item[1]['p95_ms'] or 0, reverse=True)),
+            'slowest_traces': breakdowns}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Resumen de un archivo de spans exportado (JSONL).")
+    parser.add_argument('path', nargs='?', default=DEFAULT_TRACE_EXPORT_PATH)
+    parser.add_argument('--slowest', type=int, default=5, help="Trazas más lentas a desglosar")
+    args = parser.parse_args()
+    print(json.dumps(summarize_trace_file(args.path, args.slowest), indent=2, ensure_ascii=False))
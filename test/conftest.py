@@ -0,0 +1,33 @@
+# Configuración común de los tests
+
+import pytest
+
+import src.db as db
+import src.leaderboard as leaderboard
+import src.round_manager as round_manager
+
+
+@pytest.fixture(autouse=True)
+def fresh_round_cache():
+    """Cada test usa su propia base de datos temporal: las cachés de rondas y ganadores no deben arrastrar filas de otro test."""
+    round_manager.invalidate_round_cache()
+    leaderboard.reset_recent_winners()
+    yield
+    round_manager.invalidate_round_cache()
+    leaderboard.reset_recent_winners()
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Base de datos nueva por test: DATABASE_NAME es una ruta relativa, así que basta con trabajar en tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    db.init_db()
+    return tmp_path
+
+
+@pytest.fixture
+def make_participants():
+    """Fábrica de participantes de una ronda: `count` usuarios con un boleto cada uno (números 1..count)."""
+    def build(count: int) -> list[dict]:
+        return [{'telegram_id': str(1000 + n), 'username': f"user{n}", 'assigned_number': n} for n in range(1, count + 1)]
+    return build
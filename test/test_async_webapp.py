@@ -0,0 +1,86 @@
+# Tests del modo asíncrono de la webapp (aiohttp en el event loop del bot)
+
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import src.event_bus as event_bus
+import src.round_manager as round_manager
+import webapp.app as flask_webapp
+import webapp.async_app as async_app
+from src.round_manager import ROUND_TYPE_SCHEDULED
+
+
+@pytest.fixture
+def temp_db(temp_db, monkeypatch):
+    monkeypatch.setattr(flask_webapp, 'RESPONSE_CACHE_TTL_SECONDS', 3600)
+    flask_webapp.clear_response_cache()
+    yield temp_db
+    flask_webapp.clear_response_cache()
+
+
+def _run(scenario):
+    async def main():
+        async with TestClient(TestServer(async_app.create_async_app())) as client:
+            return await scenario(client)
+    return asyncio.run(main())
+
+
+def test_async_routes_match_flask_and_share_the_cache(temp_db):
+    round_id = round_manager.create_round(ROUND_TYPE_SCHEDULED)
+    flask_client = flask_webapp.app.test_client()
+    flask_rounds = flask_client.get('/api/open_rounds')
+
+    async def scenario(client):
+        index = await client.get('/')
+        assert index.status == 200 and 'text/html' in index.headers['Content-Type']
+        rounds = await client.get('/api/open_rounds')
+        # Misma entrada de caché que Flask: mismo cuerpo y mismo ETag, y el 304 vale en ambos
+        assert await rounds.json() == flask_rounds.get_json()
+        assert rounds.headers['ETag'] == flask_rounds.headers['ETag']
+        assert (await client.get('/api/open_rounds', headers={'If-None-Match': rounds.headers['ETag']})).status == 304
+
+        joined = await client.post(f'/api/join_round/{round_id}', json={'telegram_id': '2001', 'username': 'ana'})
+        assert joined.status == 200 and (await joined.json())['success']
+        after = await client.get('/api/open_rounds', headers={'If-None-Match': rounds.headers['ETag']})
+        assert after.status == 200 and (await after.json())[0]['participants'].startswith('1/')
+
+        assert (await client.post(f'/api/join_round/{round_id}', json={})).status == 400
+        created = await client.post('/api/create_round', json={'telegram_id': '2002', 'username': 'beto'})
+        assert created.status == 200 and (await created.json())['round_id']
+        assert (await client.get('/api/winners?limit=abc')).status == 400
+        assert (await client.get('/api/winners/top')).status == 200
+
+    _run(scenario)
+
+
+def test_async_stream_receives_events_published_from_other_threads(temp_db):
+    async def scenario(client):
+        stats_before = event_bus.get_bus_stats()['subscribers']
+        response = await client.get('/api/rounds/stream')
+        assert response.headers['Content-Type'].startswith('text/event-stream')
+        assert (await response.content.readuntil(b'\n\n')).startswith(b'retry:')
+
+        # Las escrituras del bot (o de un hilo de to_thread) publican fuera del loop del stream
+        round_id = await asyncio.to_thread(round_manager.create_round, ROUND_TYPE_SCHEDULED)
+        message = (await asyncio.wait_for(response.content.readuntil(b'\n\n'), 5)).decode()
+        assert 'event: round-created' in message and f'"id": {round_id}' in message
+        assert event_bus.get_bus_stats()['subscribers'] == stats_before + 1
+
+        response.close()
+        for _ in range(50): # El servidor da de baja la suscripción al detectar el cierre
+            if event_bus.get_bus_stats()['subscribers'] == stats_before:
+                break
+            round_manager.create_round(ROUND_TYPE_SCHEDULED)
+            await asyncio.sleep(0.05)
+        assert event_bus.get_bus_stats()['subscribers'] == stats_before
+
+    _run(scenario)
+
+
+def test_benchmark_compares_both_servers():
+    result = async_app.benchmark_flask_vs_async(requests_count=30, concurrency=3, rounds=2, participants_per_round=2)
+    assert result['servers']['flask']['statuses'] == {'200': 30}
+    assert result['servers']['async']['statuses'] == {'200': 30}
+    assert result['async_speedup'] is not None
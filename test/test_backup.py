@@ -0,0 +1,75 @@
+# Tests de los respaldos en caliente (API de backup de SQLite, verificación y rotación)
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import src.backup as backup
+import src.db as db
+
+
+@pytest.fixture
+def seeded_db(temp_db):
+    conn = db.get_db_connection()
+    conn.executemany("INSERT INTO users (telegram_id, username, ton_wallet) VALUES (?, ?, ?)",
+                     ((str(n), f"user{n}", 'EQ' + 'x' * 46) for n in range(20_000)))
+    conn.commit()
+    conn.close()
+    return temp_db
+
+
+def _count_users(path) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_snapshots_are_copied_in_steps_verified_and_rotated(seeded_db):
+    results = [backup.backup_database('backups', keep=2, pages_per_step=16, step_sleep=0) for _ in range(3)]
+    first = results[0]
+    assert first['ok'] and first['integrity'] == 'ok' and first['steps'] > 1
+    assert first['bytes'] == first['pages'] * 4096 and first['throughput_mb_s'] > 0
+    assert _count_users(results[-1]['path']) == 20_000
+    assert backup.list_backups('backups') == [r['path'] for r in results[1:]] # Se conservan las 2 más nuevas
+    assert results[-1]['rotated'] == [first['path']]
+    assert not list((seeded_db / 'backups').glob('*.partial'))
+    assert backup.verify_backup(results[-1]['path']) == 'ok'
+
+
+def test_concurrent_writers_are_not_blocked_and_snapshot_is_consistent(seeded_db, monkeypatch):
+    monkeypatch.setattr(backup, 'BACKUP_MAX_RESTARTS', 3)
+    stop, write_latencies = threading.Event(), []
+
+    def writer():
+        n = 100_000
+        while not stop.is_set():
+            started = time.perf_counter()
+            db.get_or_create_user(str(n), f"nuevo{n}")
+            write_latencies.append(time.perf_counter() - started)
+            n += 1
+            time.sleep(0.002)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        result = backup.run_scheduled_backup('backups', keep=3, pages_per_step=8, step_sleep=0.001)
+    finally:
+        stop.set()
+        thread.join()
+    assert result['ok'] and write_latencies
+    assert result['single_step_fallback'] == (result['restarts'] > 3)
+    assert 20_000 <= _count_users(result['path']) <= 20_000 + len(write_latencies)
+    assert max(write_latencies) < 1.0 # Los escritores esperan como mucho un paso, no la copia entera
+    assert backup.get_backup_stats()['last'] == result
+
+
+def test_failed_verification_discards_the_snapshot(seeded_db, monkeypatch):
+    monkeypatch.setattr(backup, 'verify_backup', lambda path: '*** in database main ***')
+    result = backup.run_scheduled_backup('backups')
+    assert result['ok'] is False and result['path'] is None
+    assert backup.list_backups('backups') == [] and not list((seeded_db / 'backups').glob('*'))
+    assert backup.get_backup_stats()['last_error'].startswith('integrity_check')
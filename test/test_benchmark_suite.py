@@ -0,0 +1,40 @@
+# Tests de la suite de benchmarks y de los servicios falsos (Telegram / toncenter) que usa
+
+import json
+
+import requests
+
+import src.benchmark_suite as benchmark_suite
+from src.fake_services import FakeToncenterServer, synthetic_wallet
+
+
+def test_fake_toncenter_serves_payments_once_visible():
+    with FakeToncenterServer() as toncenter:
+        wallet = synthetic_wallet(1)
+        assert requests.get(f"{toncenter.api_base}detectAddress", params={'address': wallet}).json()['ok']
+        assert not requests.get(f"{toncenter.api_base}detectAddress", params={'address': 'corta'}).json()['ok']
+
+        toncenter.add_payment(wallet, 2_000_000_000, 'visible')
+        toncenter.add_payment(wallet, 1_000_000_000, 'pendiente', delay_seconds=60)
+        page = requests.get(f"{toncenter.api_base}getTransactions", params={'limit': 30}).json()['result']
+        assert [tx['in_msg']['message'] for tx in page] == ['visible']
+        assert toncenter.request_counts == {'detectAddress': 2, 'getTransactions': 1}
+
+
+def test_suite_runs_every_benchmark_and_emits_json():
+    report = benchmark_suite.run_suite(scale=0.002, seed=1)
+    json.dumps(report) # Serializable para comparar corridas
+    assert set(report['results']) == set(benchmark_suite.BENCHMARKS)
+    assert report['meta']['sqlite']
+
+    operations = report['results']['db']['operations']
+    assert operations['add_ton_transaction']['calls'] == report['results']['db']['iterations']
+    assert all(stats['p50_ms'] is not None for stats in operations.values())
+    for scenarios in report['results']['ton_api']['page_sizes'].values():
+        assert scenarios['match_last']['matched'] == report['results']['ton_api']['iterations']
+
+    payouts = report['results']['payouts']
+    assert payouts['settled'] == payouts['rounds']
+    buy_flow = report['results']['buy_flow']
+    assert buy_flow['error_count'] == 0 and buy_flow['confirmed'] == buy_flow['users']
+    assert buy_flow['toncenter_calls']['getTransactions'] == buy_flow['users']
@@ -0,0 +1,70 @@
+# Tests del sorteo multi-ganador (k números distintos, uniforme por orden de sorteo)
+
+import asyncio
+import random
+
+import pytest
+
+import src.db as db
+from src.draw_engine import draw_winners, get_winners_count, sample_distinct_indices
+from src.round_manager import ROUND_STATUS_DRAWING, ROUND_TYPE_SCHEDULED
+from src.round_state_machine import transition
+from src.simulation_engine import calculate_and_save_simulated_payouts
+
+# Valor crítico de chi-cuadrado con 9 grados de libertad para p = 0.001
+CHI2_CRITICAL_DF9_P001 = 27.877
+
+
+def test_winners_count_follows_prize_split():
+    assert [get_winners_count(n) for n in (2, 3, 4, 6, 7, 9, 10)] == [1, 1, 2, 2, 3, 3, 4]
+
+
+def test_sampler_returns_distinct_indices():
+    rng = random.Random(1)
+    for population, k in [(10, 4), (10, 10), (50_000, 4), (1, 1), (5, 0)]:
+        drawn = sample_distinct_indices(population, k, rng)
+        assert len(drawn) == len(set(drawn)) == k
+        assert all(0 <= i < population for i in drawn)
+    with pytest.raises(ValueError):
+        sample_distinct_indices(3, 4, rng)
+
+
+def test_sampler_is_uniform_for_every_draw_order():
+    population, k, draws = 10, 4, 1_000_000
+    rng = random.Random(20240601)
+    counts = [[0] * population for _ in range(k)]
+    for _ in range(draws):
+        for draw_order, index in enumerate(sample_distinct_indices(population, k, rng)):
+            counts[draw_order][index] += 1
+
+    expected = draws / population
+    for draw_order in range(k):
+        chi2 = sum((observed - expected) ** 2 / expected for observed in counts[draw_order])
+        assert chi2 < CHI2_CRITICAL_DF9_P001, f"draw_order {draw_order} no es uniforme (chi2={chi2:.2f})"
+
+
+def test_multi_winner_round_settles_every_draw_order(temp_db, make_participants):
+    round_id = db.create_new_round(ROUND_TYPE_SCHEDULED, None)
+    for participant in make_participants(10):
+        db.get_or_create_user(participant['telegram_id'], participant['username'], None)
+        db.add_participant_to_round(round_id, participant['telegram_id'], participant['assigned_number'])
+    assert transition(round_id, 'waiting_to_start', ROUND_STATUS_DRAWING)
+
+    participants = db.get_participants_in_round(round_id)
+    winners = draw_winners(participants, random.Random(3))
+    assert [w['draw_order'] for w in winners] == [0, 1, 2, 3]
+    assert len({w['drawn_number'] for w in winners}) == 4
+
+    _, _, settled, results = asyncio.run(calculate_and_save_simulated_payouts(
+        round_id, [w['drawn_number'] for w in winners], participants, ROUND_TYPE_SCHEDULED, None))
+    assert settled is True
+    assert [r['winner_telegram_id'] for r in results] == [w['winner_telegram_id'] for w in winners]
+    # Pozo de 8 TON repartido 40/30/20/10
+    assert [r['prize_amount_nano'] for r in results] == [3_200_000_000, 2_400_000_000, 1_600_000_000, 800_000_000]
+
+    conn = db.get_db_connection()
+    try:
+        rows = conn.execute("SELECT draw_order FROM draw_results WHERE round_id = ? ORDER BY draw_order", (round_id,)).fetchall()
+    finally:
+        conn.close()
+    assert [r[0] for r in rows] == [0, 1, 2, 3]
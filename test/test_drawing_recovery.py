@@ -0,0 +1,94 @@
+# Tests de la recuperación de rondas en 'drawing' (liquidación fallida, cierre cortado)
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import src.bot as bot
+import src.db as db
+import src.simulation_engine as simulation_engine
+from src.round_manager import ROUND_STATUS_CANCELLED, ROUND_STATUS_DRAWING, ROUND_STATUS_FINISHED, ROUND_TYPE_SCHEDULED
+from src.round_state_machine import transition
+
+PARTICIPANTS = 4
+
+
+class FakeBot:
+    """Bot mínimo: guarda los mensajes en lugar de enviarlos a Telegram."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((str(chat_id), text))
+
+
+@pytest.fixture
+def drawing_round(temp_db, monkeypatch):
+    monkeypatch.setattr(bot, 'DRAWING_SETTLE_RETRY_SECONDS', 0)
+    round_id = db.create_new_round(ROUND_TYPE_SCHEDULED, None)
+    for number in range(1, PARTICIPANTS + 1):
+        db.get_or_create_user(str(1000 + number), f"user{number}", f"User {number}")
+        assert db.add_participant_to_round(round_id, str(1000 + number), number)
+    assert transition(round_id, 'waiting_to_start', ROUND_STATUS_DRAWING)
+    return round_id
+
+
+def _failing_settle(monkeypatch, failures: int) -> list:
+    calls = []
+    real_settle = simulation_engine.db_settle_round
+
+    def settle(*args, **kwargs):
+        calls.append(args[0])
+        return False if len(calls) <= failures else real_settle(*args, **kwargs)
+    monkeypatch.setattr(simulation_engine, 'db_settle_round', settle)
+    return calls
+
+
+def _set_drawing_since(round_id: int, when: str | None):
+    conn = db.get_db_connection()
+    conn.execute("UPDATE rounds SET drawing_since = ? WHERE id = ?", (when, round_id))
+    conn.commit()
+    conn.close()
+
+
+def test_failed_settlement_is_retried(drawing_round, monkeypatch):
+    calls = _failing_settle(monkeypatch, failures=bot.DRAWING_SETTLE_ATTEMPTS - 1)
+    fake_bot = FakeBot()
+    asyncio.run(bot.execute_simulated_round_closure(drawing_round, fake_bot))
+
+    assert calls == [drawing_round] * bot.DRAWING_SETTLE_ATTEMPTS
+    assert db.get_round_by_id(drawing_round)['status'] == ROUND_STATUS_FINISHED
+    assert sum('Sorteo de la Ronda' in text for _, text in fake_bot.sent) == PARTICIPANTS
+
+
+def test_settlement_that_keeps_failing_cancels_the_round(drawing_round, monkeypatch):
+    calls = _failing_settle(monkeypatch, failures=bot.DRAWING_SETTLE_ATTEMPTS)
+    fake_bot = FakeBot()
+    asyncio.run(bot.execute_simulated_round_closure(drawing_round, fake_bot))
+
+    assert len(calls) == bot.DRAWING_SETTLE_ATTEMPTS
+    round_data = db.get_round_by_id(drawing_round)
+    assert round_data['status'] == ROUND_STATUS_CANCELLED and round_data['end_time']
+    cancelled = [chat_id for chat_id, text in fake_bot.sent if 'ha sido cancelada' in text]
+    assert sorted(cancelled) == [str(1000 + n) for n in range(1, PARTICIPANTS + 1)]
+
+
+def test_job_resumes_rounds_stuck_in_drawing(drawing_round):
+    fresh_round = db.create_new_round(ROUND_TYPE_SCHEDULED, None)
+    assert transition(fresh_round, 'waiting_to_start', ROUND_STATUS_DRAWING) # Cierre en curso: no se toca
+    assert db.get_round_by_id(fresh_round)['drawing_since'] is not None
+    stuck_since = (datetime.now(timezone.utc) - timedelta(seconds=bot.DRAWING_STALE_SECONDS + 60)).isoformat()
+    _set_drawing_since(drawing_round, stuck_since)
+    fake_bot = FakeBot()
+
+    async def scenario():
+        # Dos réplicas a la vez: el compare-and-swap sobre drawing_since deja el cierre a una sola
+        return await asyncio.gather(bot.recover_stale_drawing_rounds(fake_bot), bot.recover_stale_drawing_rounds(fake_bot))
+
+    assert sorted(asyncio.run(scenario())) == [0, 1]
+    assert db.get_round_by_id(drawing_round)['status'] == ROUND_STATUS_FINISHED
+    assert db.get_round_by_id(fresh_round)['status'] == ROUND_STATUS_DRAWING
+    assert sum('Sorteo de la Ronda' in text for _, text in fake_bot.sent) == PARTICIPANTS
+    assert asyncio.run(bot.recover_stale_drawing_rounds(fake_bot)) == 0
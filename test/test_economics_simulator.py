@@ -0,0 +1,44 @@
+# Tests del simulador económico (mismas reglas de pago que el cálculo real de una ronda)
+
+import pytest
+
+from src.economics_simulator import simulate_economics
+from src.round_manager import ROUND_TYPE_SCHEDULED, ROUND_TYPE_USER_CREATED
+from src.draw_engine import get_winners_count
+from src.simulation_engine import calculate_simulated_payouts
+
+
+@pytest.mark.parametrize('count, round_type', [(3, ROUND_TYPE_SCHEDULED), (4, ROUND_TYPE_USER_CREATED), (10, ROUND_TYPE_SCHEDULED)])
+def test_simulator_matches_round_payout_calculation(count, round_type, make_participants):
+    creator_id = '1001' if round_type == ROUND_TYPE_USER_CREATED else None
+    drawn_numbers = list(range(1, get_winners_count(count) + 1))
+    winners, commissions, _, _ = calculate_simulated_payouts(1, drawn_numbers, make_participants(count), round_type, creator_id)
+    paid = sum(w['prize_amount_real'] for w in winners)
+    paid_sq = sum(w['prize_amount_real'] ** 2 for w in winners)
+    house = sum(c['amount_real'] for c in commissions)
+
+    report = simulate_economics(1000, participants_spec=f"{count}=1",
+                                user_created_share=1.0 if creator_id else 0.0, seed=7)
+
+    assert report['expected_player_return'] == pytest.approx(paid / count)
+    assert report['player_return_per_ticket']['variance'] == pytest.approx(paid_sq / count - (paid / count) ** 2)
+    assert sum(report['house_take']['commissions_share'].values()) == pytest.approx(house / count)
+    assert report['house_take']['per_round_mean'] == pytest.approx(count - paid)
+    assert report['house_take']['per_round_variance'] == pytest.approx(0.0, abs=1e-9)
+
+
+def test_sharded_run_is_reproducible_and_covers_all_rounds():
+    kwargs = dict(rounds=200_001, participants_spec='uniform:2-10', user_created_share=0.3, seed=42)
+    sharded = simulate_economics(workers=3, **kwargs)
+    again = simulate_economics(workers=3, **kwargs)
+
+    assert sharded['rounds'] == 200_001
+    assert sum(sum(h.values()) for h in sharded['participants_histogram'].values()) == 200_001
+    assert sharded['participants_histogram'] == again['participants_histogram']
+    # Retorno + parte de la casa = todo lo recaudado
+    assert sharded['expected_player_return'] + sharded['house_take']['share'] == pytest.approx(1.0)
+
+
+def test_invalid_participants_spec_is_rejected():
+    with pytest.raises(ValueError):
+        simulate_economics(10, participants_spec='uniform:1-40')
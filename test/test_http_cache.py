@@ -0,0 +1,63 @@
+# Tests de la caché HTTP (ETag / GET condicional) de las lecturas de la webapp
+
+import pytest
+
+import src.round_manager as round_manager
+import webapp.app as webapp
+from src.round_manager import ROUND_TYPE_SCHEDULED
+
+
+@pytest.fixture
+def client(temp_db, monkeypatch):
+    monkeypatch.setattr(webapp, 'RESPONSE_CACHE_TTL_SECONDS', 3600)
+    webapp.clear_response_cache()
+    yield webapp.app.test_client()
+    webapp.clear_response_cache()
+
+
+def test_unchanged_resource_answers_304_without_rebuilding(client, monkeypatch):
+    round_id = round_manager.create_round(ROUND_TYPE_SCHEDULED)
+    first = client.get('/api/open_rounds')
+    assert first.status_code == 200 and first.headers['ETag'] and first.headers['Last-Modified']
+    assert [r['id'] for r in first.get_json()] == [round_id]
+
+    def no_rebuild(*args, **kwargs):
+        raise AssertionError("se reconstruyó el JSON con la versión sin cambios")
+    monkeypatch.setattr(round_manager, 'get_available_rounds', no_rebuild)
+
+    assert client.get('/api/open_rounds').data == first.data # Cuerpo servido de memoria
+    not_modified = client.get('/api/open_rounds', headers={'If-None-Match': first.headers['ETag']})
+    assert not_modified.status_code == 304 and not_modified.data == b''
+    since = client.get('/api/open_rounds', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert since.status_code == 304
+    assert client.get('/api/winners').status_code == 200 # Otro recurso, otra entrada
+
+
+def test_round_and_participant_writes_change_the_etag(client):
+    round_id = round_manager.create_round(ROUND_TYPE_SCHEDULED)
+    before = client.get('/api/open_rounds')
+    winners_etag = client.get('/api/winners').headers['ETag']
+
+    round_manager.add_participant(round_id, '1001', 'ana')
+    after = client.get('/api/open_rounds', headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 200 and after.headers['ETag'] != before.headers['ETag']
+    assert after.get_json()[0]['participants'].startswith('1/')
+    assert after.headers['Last-Modified'] != before.headers['Last-Modified']
+    # Una unión no cambia los ganadores
+    assert client.get('/api/winners', headers={'If-None-Match': winners_etag}).status_code == 304
+
+    round_manager.mark_round_for_deletion(round_id)
+    assert client.get('/api/open_rounds').get_json() == []
+
+
+def test_cache_can_be_disabled_and_benchmark_runs(client, monkeypatch):
+    monkeypatch.setattr(webapp, 'RESPONSE_CACHE_ENABLED', False)
+    response = client.get('/api/open_rounds')
+    assert response.status_code == 200 and 'ETag' not in response.headers
+
+    monkeypatch.setattr(webapp, 'RESPONSE_CACHE_ENABLED', True)
+    result = webapp.benchmark_read_endpoints(requests_count=20, rounds=3, participants_per_round=2)
+    open_rounds = result['endpoints']['/api/open_rounds']
+    assert open_rounds['uncached']['statuses'] == {'200': 20}
+    assert open_rounds['cached']['statuses'] == {'200': 20}
+    assert open_rounds['conditional_304']['statuses'] == {'304': 20}
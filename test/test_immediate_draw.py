@@ -0,0 +1,79 @@
+# Tests del sorteo inmediato al venderse el último boleto (una sola vez por ronda)
+
+import asyncio
+import threading
+
+import pytest
+
+import src.bot as bot
+import src.db as db
+import src.round_manager as round_manager
+from src.round_manager import ROUND_STATUS_FINISHED, ROUND_TYPE_SCHEDULED
+
+ROUND_CAPACITY = 5
+
+
+class FakeBot:
+    """Bot mínimo: guarda los mensajes en lugar de enviarlos a Telegram."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((str(chat_id), text))
+
+
+@pytest.fixture
+def small_rounds(temp_db, monkeypatch):
+    monkeypatch.setattr(round_manager, 'MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW', ROUND_CAPACITY)
+    monkeypatch.setattr(round_manager, '_round_filled_listeners', [])
+    monkeypatch.setattr(round_manager, '_fill_to_draw_latencies', round_manager.deque(maxlen=10))
+    return temp_db
+
+
+def test_concurrent_joins_fill_the_round_exactly_once(small_rounds):
+    round_id = round_manager.create_round(ROUND_TYPE_SCHEDULED)
+    filled = []
+    round_manager.add_round_filled_listener(filled.append)
+
+    barrier = threading.Barrier(12)
+    def join(n):
+        barrier.wait()
+        round_manager.add_participant(round_id, str(1000 + n), f"user{n}")
+    threads = [threading.Thread(target=join, args=(n,)) for n in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert filled == [round_id]
+    assert db.get_round_entry_totals(round_id) == (ROUND_CAPACITY, ROUND_CAPACITY)
+    assert db.get_round_by_id(round_id)['filled_time'] is not None
+
+
+def test_last_ticket_triggers_a_single_draw_and_records_latency(small_rounds):
+    fake_bot = FakeBot()
+
+    async def scenario():
+        round_id = round_manager.create_round(ROUND_TYPE_SCHEDULED)
+        triggered = []
+        round_manager.add_round_filled_listener(
+            lambda rid: triggered.append(asyncio.ensure_future(bot.trigger_immediate_draw(rid, fake_bot))))
+        for n in range(ROUND_CAPACITY - 1):
+            round_manager.add_participant(round_id, str(1000 + n), f"user{n}")
+        assert triggered == []
+        # El último boleto llega por una compra verificada (tickets=1)
+        success, _, _, tickets = round_manager.add_participant(round_id, '2000', 'buyer', tickets=1)
+        assert success and tickets == ROUND_CAPACITY
+        # Un segundo disparo (p. ej. el job) pierde la transición y no vuelve a sortear
+        results = await asyncio.gather(*triggered, bot.trigger_immediate_draw(round_id, fake_bot))
+        return round_id, results
+
+    round_id, results = asyncio.run(scenario())
+    assert sorted(results) == [False, True]
+    assert db.get_round_by_id(round_id)['status'] == ROUND_STATUS_FINISHED
+    stats = round_manager.get_fill_to_draw_latency_stats()
+    assert stats['count'] == 1 and 0 <= stats['max'] < 5
+    # Un resumen por participante
+    summaries = [chat_id for chat_id, text in fake_bot.sent if 'Sorteo de la Ronda' in text]
+    assert len(summaries) == ROUND_CAPACITY
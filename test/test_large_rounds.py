@@ -0,0 +1,66 @@
+# Tests del modo de rondas grandes (miles de boletos: sorteo por índice y recorrido por páginas)
+
+import asyncio
+import random
+import time
+import tracemalloc
+
+import pytest
+
+import src.db as db
+import src.simulation_engine as simulation_engine
+from src.payout_ledger import LARGE_ROUND_MAX_WINNERS
+from src.round_manager import ROUND_STATUS_DRAWING, ROUND_STATUS_FINISHED, ROUND_TYPE_SCHEDULED
+from src.round_state_machine import transition
+
+LARGE_ROUND_TICKETS = 50_000
+
+
+@pytest.fixture
+def large_round(temp_db, monkeypatch):
+    monkeypatch.setattr(simulation_engine, 'MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW', LARGE_ROUND_TICKETS)
+    round_id = db.create_new_round(ROUND_TYPE_SCHEDULED, None)
+    conn = db.get_db_connection()
+    try:
+        conn.executemany("INSERT INTO users (telegram_id, username) VALUES (?, ?)",
+                         ((str(100_000 + n), f"user{n}") for n in range(1, LARGE_ROUND_TICKETS + 1)))
+        conn.executemany("INSERT INTO round_participants (round_id, telegram_id, assigned_number, paid_real) VALUES (?, ?, ?, 1)",
+                         ((round_id, str(100_000 + n), n) for n in range(1, LARGE_ROUND_TICKETS + 1)))
+        conn.commit()
+    finally:
+        conn.close()
+    assert transition(round_id, 'waiting_to_start', ROUND_STATUS_DRAWING)
+    return round_id
+
+
+def test_large_round_closes_in_seconds_with_bounded_memory(large_round):
+    tracemalloc.start()
+    started = time.perf_counter()
+    outcome = asyncio.run(simulation_engine.draw_and_settle_round(large_round, ROUND_TYPE_SCHEDULED, None, rng=random.Random(5)))
+    elapsed = time.perf_counter() - started
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert outcome['settled'] is True
+    assert outcome['participants_count'] == LARGE_ROUND_TICKETS
+    assert len(outcome['drawn_numbers']) == len(set(outcome['drawn_numbers'])) == LARGE_ROUND_MAX_WINNERS
+    assert all(r['winner_telegram_id'] == str(100_000 + r['drawn_number']) for r in outcome['results'])
+    assert elapsed < 5.0
+    # Sin cargar la ronda entera: la memoria depende de los ganadores y las páginas, no de los 50.000 boletos
+    assert peak_bytes < 8 * 1024 * 1024
+
+    assert db.get_round_by_id(large_round)['status'] == ROUND_STATUS_FINISHED
+    conn = db.get_db_connection()
+    try:
+        rows, paid_nano = conn.execute("SELECT COUNT(*), SUM(prize_amount_nano) FROM draw_results WHERE round_id = ?", (large_round,)).fetchone()
+    finally:
+        conn.close()
+    assert rows == LARGE_ROUND_MAX_WINNERS
+    assert paid_nano == LARGE_ROUND_TICKETS * 10**9 * 8 // 10 # Pozo = 80% de lo recaudado
+
+
+def test_participants_are_streamed_in_pages(large_round):
+    numbers = [p['assigned_number'] for p in db.iter_round_participants(large_round, page_size=777)]
+    assert numbers == list(range(1, LARGE_ROUND_TICKETS + 1))
+    assert sum(1 for _ in db.iter_round_assigned_numbers(large_round, page_size=4096)) == LARGE_ROUND_TICKETS
+    assert db.get_participants_by_numbers(large_round, [1, 49_999])[49_999]['telegram_id'] == str(149_999)
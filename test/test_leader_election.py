@@ -0,0 +1,123 @@
+# Tests de elección de líder por lease (varias réplicas del bot sobre la misma base de datos)
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+
+import src.bot as bot
+import src.db as db
+from src.leader_election import LeaderElector, SCHEDULER_LEASE_NAME
+from src.round_manager import ROUND_STATUS_DRAWING, ROUND_STATUS_FINISHED, ROUND_TYPE_SCHEDULED
+from src.round_state_machine import transition
+
+LEASE_TTL_SECONDS = 1.0
+HEARTBEAT_INTERVAL_SECONDS = 0.25
+
+
+class FakeBot:
+    """Bot mínimo: guarda los mensajes en lugar de enviarlos a Telegram."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((str(chat_id), text))
+
+
+def _run_leader_replica(holder_id: str, drawing_round_id: int | None = None):
+    elector = LeaderElector(ttl_seconds=LEASE_TTL_SECONDS, heartbeat_interval_seconds=HEARTBEAT_INTERVAL_SECONDS,
+                            holder_id=holder_id)
+    if drawing_round_id is not None:
+        # El job del líder gana la transición a 'drawing' y el proceso muere antes de liquidar
+        while not elector.heartbeat():
+            time.sleep(0.05)
+        transition(drawing_round_id, 'waiting_to_start', ROUND_STATUS_DRAWING)
+    asyncio.run(elector.run())
+
+
+def _wait_for_holder(holder_id: str, timeout: float = 5.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        lease = db.get_lease(SCHEDULER_LEASE_NAME)
+        if lease and lease['holder_id'] == holder_id:
+            return lease
+        time.sleep(0.05)
+    pytest.fail(f"La réplica {holder_id} no adquirió el lease a tiempo.")
+
+
+def test_only_one_replica_holds_the_lease(temp_db):
+    replica_a = LeaderElector(ttl_seconds=LEASE_TTL_SECONDS, heartbeat_interval_seconds=HEARTBEAT_INTERVAL_SECONDS, holder_id='a')
+    replica_b = LeaderElector(ttl_seconds=LEASE_TTL_SECONDS, heartbeat_interval_seconds=HEARTBEAT_INTERVAL_SECONDS, holder_id='b')
+
+    assert replica_a.heartbeat() is True
+    assert replica_b.heartbeat() is False
+    # Las renovaciones del líder no cambian el term; el seguidor sigue sin entrar
+    assert replica_a.heartbeat() is True
+    assert replica_b.heartbeat() is False
+    assert replica_a.is_leader and not replica_b.is_leader
+    assert db.get_lease(SCHEDULER_LEASE_NAME)['term'] == 1
+
+    # Un apagado ordenado libera el lease y el failover es inmediato
+    replica_a.stop(release=True)
+    assert replica_b.heartbeat() is True
+    assert db.get_lease(SCHEDULER_LEASE_NAME)['term'] == 2
+
+
+def test_invalid_heartbeat_interval_is_rejected():
+    with pytest.raises(ValueError):
+        LeaderElector(ttl_seconds=1.0, heartbeat_interval_seconds=1.0)
+
+
+def test_failover_after_leader_is_killed(temp_db, monkeypatch):
+    # Umbral reducido para el test: el real cubre el peor caso de un cierre vivo (minutos)
+    monkeypatch.setattr(bot, 'DRAWING_STALE_SECONDS', HEARTBEAT_INTERVAL_SECONDS)
+    round_id = db.create_new_round(ROUND_TYPE_SCHEDULED, None)
+    for number in range(1, 4):
+        db.get_or_create_user(str(1000 + number), f"user{number}")
+        assert db.add_participant_to_round(round_id, str(1000 + number), number)
+
+    ctx = multiprocessing.get_context('fork')
+    leader_process = ctx.Process(target=_run_leader_replica, args=('replica-leader', round_id), daemon=True)
+    leader_process.start()
+    try:
+        first_lease = _wait_for_holder('replica-leader')
+        deadline = time.monotonic() + 5
+        while db.get_round_by_id(round_id)['status'] != ROUND_STATUS_DRAWING:
+            assert time.monotonic() < deadline, "El líder nunca pasó la ronda a 'drawing'."
+            time.sleep(0.05)
+
+        follower = LeaderElector(ttl_seconds=LEASE_TTL_SECONDS, heartbeat_interval_seconds=HEARTBEAT_INTERVAL_SECONDS,
+                                 holder_id='replica-follower')
+        acquisitions = []
+        follower.add_acquired_listener(lambda: acquisitions.append(time.monotonic()))
+        assert follower.heartbeat() is False
+
+        # Matar al líder sin darle opción a liberar el lease (como un crash o un OOM kill)
+        os.kill(leader_process.pid, signal.SIGKILL)
+        leader_process.join(timeout=5)
+        killed_at = time.monotonic()
+
+        while not follower.heartbeat():
+            assert time.monotonic() - killed_at < 5, "El seguidor nunca tomó el lease."
+            time.sleep(follower.heartbeat_interval_seconds)
+        failover_seconds = time.monotonic() - killed_at
+
+        # Cota de failover: TTL del lease + un intervalo de heartbeat (más margen para el scheduler del SO)
+        assert failover_seconds <= LEASE_TTL_SECONDS + HEARTBEAT_INTERVAL_SECONDS + 0.5
+        new_lease = db.get_lease(SCHEDULER_LEASE_NAME)
+        assert new_lease['holder_id'] == 'replica-follower'
+        assert new_lease['term'] == first_lease['term'] + 1
+
+        # Al tomar el lease, el nuevo líder retoma la ronda que el caído dejó en 'drawing' (como on_startup)
+        assert len(acquisitions) == 1
+        fake_bot = FakeBot()
+        assert asyncio.run(bot.recover_stale_drawing_rounds(fake_bot)) == 1
+        assert db.get_round_by_id(round_id)['status'] == ROUND_STATUS_FINISHED
+        assert sum('Sorteo de la Ronda' in text for _, text in fake_bot.sent) == 3
+    finally:
+        if leader_process.is_alive():
+            leader_process.kill()
@@ -0,0 +1,18 @@
+# Tests del generador de carga (usuarios virtuales concurrentes contra los servicios falsos)
+
+import src.db as db
+import src.load_generator as load_generator
+
+
+def test_concurrent_buyers_confirm_after_payments_land():
+    report = load_generator.run_load_test(
+        users=12, concurrency=6, payment_delay=(0.05, 0.2), think_seconds=(0.0, 0.02),
+        verify_retry_seconds=0.1, max_verify_attempts=20, reader_threads=1, seed=3)
+    # Con rondas casi llenas algunos pagos pueden quedar sin cupo: se reportan como error, no se pierden
+    assert report['confirmed'] + report['errors']['paid_not_joined'] == report['users'] == 12
+    assert report['errors']['handler_exception'] == report['errors']['unconfirmed'] == 0
+    assert report['rounds_drawn'] >= 1
+    assert report['latency']['steps']['verify']['calls'] >= 12
+    assert report['verify_attempts']['max'] >= 1
+    assert report['db_lock_waits']['acquisitions'] > 0
+    assert not db._lock_wait_tracking['enabled'] # Solo durante la corrida
@@ -0,0 +1,76 @@
+# Tests del pipeline de logging en cola (formateo perezoso, campos estructurados y muestreo)
+
+import io
+import logging
+import threading
+
+import pytest
+
+import src.log_pipeline as log_pipeline
+from src.log_pipeline import log_fields
+
+
+@pytest.fixture
+def pipeline():
+    root = logging.getLogger()
+    previous_handlers, previous_level = list(root.handlers), root.level
+    stream = io.StringIO()
+    yield stream
+    log_pipeline.stop_logging()
+    for handler in previous_handlers:
+        root.addHandler(handler)
+    root.setLevel(previous_level)
+
+
+class _ThreadRecorder:
+    """Argumento de log que anota en qué hilo se interpoló."""
+
+    def __init__(self):
+        self.formatted_in = None
+
+    def __str__(self):
+        self.formatted_in = threading.current_thread().name
+        return 'valor'
+
+
+def test_records_are_formatted_by_the_listener_with_fields(pipeline):
+    log_pipeline.setup_logging('INFO', structured=True, stream=pipeline)
+    logger = logging.getLogger('src.ton_api')
+    argument = _ThreadRecorder()
+    logger.info("Pago %s verificado.", argument, extra=log_fields(hash='abc', comment='L1U2 T3'))
+    logger.debug("No se escribe")
+    log_pipeline.stop_logging()
+
+    assert argument.formatted_in not in (None, threading.current_thread().name)
+    (line,) = pipeline.getvalue().splitlines()
+    assert 'level=INFO logger=src.ton_api msg="Pago valor verificado."' in line
+    assert line.endswith('hash=abc comment="L1U2 T3"')
+
+
+def test_sampling_keeps_one_in_n_per_template_and_all_warnings(pipeline):
+    log_pipeline.setup_logging('INFO', structured=False, sampling={'src.db': 5}, stream=pipeline)
+    for n in range(20):
+        logging.getLogger('src.db').info("Participante %s añadido.", n)
+        logging.getLogger('src.db').warning("Advertencia %s", n)
+        logging.getLogger('src.ton_api').info("Sin muestreo %s", n)
+    stats = log_pipeline.get_logging_stats()
+    log_pipeline.stop_logging()
+
+    lines = pipeline.getvalue().splitlines()
+    assert [line for line in lines if 'Participante' in line][0].endswith('Participante 0 añadido. sampled=1/5')
+    assert sum('Participante' in line for line in lines) == 4
+    assert sum('Advertencia' in line for line in lines) == sum('Sin muestreo' in line for line in lines) == 20
+    assert stats['dropped'] == {'src.db': 16}
+    assert log_pipeline.get_logging_stats() == {'enabled': False, 'queued': 0, 'dropped': {}}
+
+
+def test_sampling_counters_are_a_bounded_lru():
+    sampler = log_pipeline.SamplingFilter({'src.db': 2}, max_templates=3)
+
+    def record(msg):
+        return logging.LogRecord('src.db', logging.INFO, __file__, 1, msg, None, None)
+
+    for n in range(100): # Mensajes ya interpolados: una plantilla por registro
+        sampler.filter(record(f"Ronda {n} liquidada."))
+    assert len(sampler._counters) == 3
+    assert [sampler.filter(record("Ronda %s liquidada.")) for _ in range(4)] == [True, False, True, False]
@@ -0,0 +1,61 @@
+# Tests del monitor de lag del event loop y del detector de callbacks lentos
+
+import asyncio
+import logging
+import time
+
+import pytest
+
+import src.loop_monitor as loop_monitor
+from src.loop_monitor import LoopMonitor
+
+
+def _blocking_handler():
+    time.sleep(0.3) # Como una llamada síncrona (sqlite3 / requests) dentro de un handler
+
+
+def _run_with_monitor(monitor, scenario):
+    async def main():
+        task = asyncio.create_task(monitor.run())
+        await asyncio.sleep(0.05)
+        await scenario()
+        await asyncio.sleep(monitor.interval_seconds * 3)
+        stats = loop_monitor.get_loop_stats()
+        monitor.stop()
+        await task
+        return stats
+    return asyncio.run(main())
+
+
+def test_debug_mode_attributes_blocking_calls_to_their_stack():
+    monitor = LoopMonitor(interval_seconds=0.02, slow_callback_seconds=0.1, debug=True, report_interval_seconds=None)
+
+    async def scenario():
+        _blocking_handler()
+        await asyncio.sleep(0.05)
+        _blocking_handler()
+
+    stats = _run_with_monitor(monitor, scenario)
+    assert stats['stalls'] == 2 and stats['lag_max_ms'] >= 250
+    (offender,) = stats['top_offenders']
+    assert offender['offender'].startswith('test/test_loop_monitor.py:') and offender['offender'].endswith('_blocking_handler')
+    assert offender['count'] == 2 and offender['blocked_in'].startswith('test_loop_monitor.py:')
+    assert 'scenario' in monitor.get_offender_stack(offender['offender'])
+    assert loop_monitor.get_loop_stats() is None # El monitor detenido ya no se reporta
+
+
+def test_normal_mode_only_measures_lag(caplog):
+    caplog.set_level(logging.INFO, logger='src.loop_monitor')
+    monitor = LoopMonitor(interval_seconds=0.02, slow_callback_seconds=0.1, report_interval_seconds=None)
+
+    async def scenario():
+        _blocking_handler()
+
+    stats = _run_with_monitor(monitor, scenario)
+    assert stats['stalls'] == 1 and stats['top_offenders'] == [] and stats['ticks'] >= 3
+    assert stats['lag_p50_ms'] < 100
+    monitor.log_top_offenders()
+    assert '1 bloqueo(s)' in caplog.text
+
+    with pytest.raises(ValueError):
+        LoopMonitor(interval_seconds=0)
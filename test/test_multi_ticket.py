@@ -0,0 +1,120 @@
+# Tests de la compra de varios boletos (pago múltiplo del precio y sorteo ponderado por boletos)
+
+import asyncio
+import random
+from fractions import Fraction
+
+import pytest
+
+import src.db as db
+import src.round_manager as round_manager
+import src.simulation_engine as simulation_engine
+import src.ton_api as ton_api
+from src.draw_engine import alias_draw, build_alias_table, sample_weighted_distinct_indices
+from src.round_manager import ROUND_STATUS_DRAWING, ROUND_STATUS_FINISHED, ROUND_TYPE_SCHEDULED
+from src.round_state_machine import transition
+
+# Valor crítico de chi-cuadrado con 3 grados de libertad para p = 0.001
+CHI2_CRITICAL_DF3_P001 = 16.266
+TICKET_PRICE_NANO = 10**9
+
+
+def test_alias_table_probabilities_are_exact():
+    weights = [1, 2, 3, 4, 7, 0, 13]
+    thresholds, alias, total = build_alias_table(weights)
+    n = len(weights)
+    probability = [Fraction(0)] * n
+    for slot in range(n):
+        probability[slot] += Fraction(thresholds[slot], total * n)
+        probability[alias[slot]] += Fraction(total - thresholds[slot], total * n)
+    assert probability == [Fraction(w, sum(weights)) for w in weights]
+    with pytest.raises(ValueError):
+        build_alias_table([0, 0])
+
+
+def test_alias_draws_follow_ticket_weights():
+    weights, draws = [1, 2, 3, 4], 200_000
+    table = build_alias_table(weights)
+    rng = random.Random(33)
+    counts = [0] * len(weights)
+    for _ in range(draws):
+        counts[alias_draw(table, rng)] += 1
+    expected = [draws * w / sum(weights) for w in weights]
+    chi2 = sum((o - e) ** 2 / e for o, e in zip(counts, expected))
+    assert chi2 < CHI2_CRITICAL_DF3_P001
+
+
+def test_weighted_sampler_returns_distinct_winners_even_with_a_dominant_buyer():
+    rng = random.Random(9)
+    weights = [10_000] + [1] * 9
+    for _ in range(200):
+        drawn = sample_weighted_distinct_indices(weights, 10, rng)
+        assert sorted(drawn) == list(range(10))
+    with pytest.raises(ValueError):
+        sample_weighted_distinct_indices([3, 0], 2, rng)
+
+
+def test_tickets_are_added_atomically_within_round_capacity(temp_db):
+    round_id = db.create_new_round(ROUND_TYPE_SCHEDULED, None)
+    first = db.add_tickets_to_round(round_id, '1001', 3, max_tickets=10)
+    assert first == {'added': True, 'assigned_number': 1, 'user_tickets': 3, 'round_tickets': 3, 'filled': False, 'closed': False}
+    assert db.add_tickets_to_round(round_id, '1002', 2, max_tickets=10)['assigned_number'] == 2
+    # Una segunda compra suma boletos pero conserva el número del usuario
+    again = db.add_tickets_to_round(round_id, '1001', 4, max_tickets=10)
+    assert (again['assigned_number'], again['user_tickets'], again['round_tickets']) == (1, 7, 9)
+    # Sin cupo no se escribe nada
+    full = db.add_tickets_to_round(round_id, '1003', 2, max_tickets=10)
+    assert full['added'] is False and full['round_tickets'] == 9
+    assert db.get_round_entry_totals(round_id) == (2, 9)
+    assert list(db.iter_round_ticket_weights(round_id, page_size=1)) == [(1, 7), (2, 2)]
+
+
+def test_add_participant_with_tickets_reports_round_tickets(temp_db):
+    round_id = round_manager.create_round(ROUND_TYPE_SCHEDULED)
+    success, _, number, tickets = round_manager.add_participant(round_id, '1001', 'user1', tickets=3)
+    assert (success, number, tickets) == (True, 1, 3)
+    # La unión clásica (sin compra) rechaza a quien ya está en la ronda
+    success, _, number, tickets = round_manager.add_participant(round_id, '1001', 'user1')
+    assert (success, number, tickets) == (False, 1, 3)
+    success, _, number, tickets = round_manager.add_participant(round_id, '1002', 'user2')
+    assert (success, number, tickets) == (True, 2, 4)
+
+
+def test_weighted_round_settles_on_tickets_sold(temp_db):
+    round_id = db.create_new_round(ROUND_TYPE_SCHEDULED, None)
+    for telegram_id, tickets in (('1001', 5), ('1002', 1), ('1003', 1), ('1004', 1)):
+        db.get_or_create_user(telegram_id, f"user{telegram_id}", None)
+        assert db.add_tickets_to_round(round_id, telegram_id, tickets, max_tickets=10)['added']
+    assert transition(round_id, 'waiting_to_start', ROUND_STATUS_DRAWING)
+
+    outcome = asyncio.run(simulation_engine.draw_and_settle_round(round_id, ROUND_TYPE_SCHEDULED, None, rng=random.Random(4)))
+    assert outcome['settled'] is True
+    assert (outcome['participants_count'], outcome['tickets_count']) == (4, 8)
+    # 8 boletos → reparto de tres premios; pozo = 80% de 8 TON
+    assert len(outcome['drawn_numbers']) == len(set(outcome['drawn_numbers'])) == 3
+    assert sum(r['prize_amount_nano'] for r in outcome['results']) == 8 * TICKET_PRICE_NANO * 8 // 10
+    assert db.get_round_by_id(round_id)['status'] == ROUND_STATUS_FINISHED
+
+
+def test_payment_value_must_be_an_exact_multiple_of_the_price():
+    assert ton_api.match_ticket_payment_value('3000000000', TICKET_PRICE_NANO, max_tickets=5) == 3
+    assert ton_api.match_ticket_payment_value(TICKET_PRICE_NANO, TICKET_PRICE_NANO) == 1
+    assert ton_api.match_ticket_payment_value('2500000000', TICKET_PRICE_NANO, max_tickets=5) == 0
+    assert ton_api.match_ticket_payment_value('6000000000', TICKET_PRICE_NANO, max_tickets=5) == 0
+    assert ton_api.match_ticket_payment_value('0', TICKET_PRICE_NANO, max_tickets=5) == 0
+    assert ton_api.match_ticket_payment_value('abc', TICKET_PRICE_NANO, max_tickets=5) == 0
+
+
+def test_find_ticket_payment_buys_one_entry_per_price_multiple(temp_db, monkeypatch):
+    transactions = [
+        {'in_msg': {'source': 'EQuser', 'value': '2500000000', 'message': 'L1U1001T1', 'body_hash': 'partial'}},
+        {'in_msg': {'source': 'EQuser', 'value': '3000000000', 'message': 'L1U1001T1', 'body_hash': 'triple'}},
+    ]
+    monkeypatch.setattr(ton_api, 'get_address_transactions', lambda *args, **kwargs: transactions)
+    db.get_or_create_user('1001', 'user1', None)
+
+    assert ton_api.find_ticket_payment('EQuser', TICKET_PRICE_NANO, 'L1U1001T1', '1001', max_tickets=5, lottery_round_id=1) == 3
+    # El mismo pago no compra boletos dos veces
+    assert ton_api.find_ticket_payment('EQuser', TICKET_PRICE_NANO, 'L1U1001T1', '1001', max_tickets=5, lottery_round_id=1) == 0
+    # La verificación exacta de un solo monto sigue funcionando
+    assert ton_api.find_transaction('EQuser', '2500000000', 'L1U1001T1', '1001') is True
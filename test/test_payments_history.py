@@ -0,0 +1,102 @@
+# Tests del historial de pagos paginado por clave (/mis_pagos_ton)
+
+import pytest
+
+import src.db as db
+import src.handlers as handlers
+
+
+@pytest.fixture
+def temp_db(temp_db, monkeypatch):
+    monkeypatch.setattr(handlers, '_payments_page_cache', handlers.OrderedDict())
+    db.get_or_create_user('1001', 'ana', 'Ana')
+    return temp_db
+
+
+def _insert_payments(count: int, telegram_id: str = '1001', same_time: bool = False, comment: str = 'L1U1001T1'):
+    conn = db.get_db_connection()
+    try:
+        conn.executemany(
+            """INSERT INTO ton_transactions (telegram_id, user_ton_wallet, bot_ton_wallet, transaction_hash, value_nano, comment, transaction_time)
+               VALUES (?, 'EQuser', 'EQbot', ?, ?, ?, ?)""",
+            ((telegram_id, f"hash{telegram_id}_{n}", (n + 1) * 10**9, comment,
+              '2024-01-01T00:00:00+00:00' if same_time else f"2024-01-01T00:{n // 60:02d}:{n % 60:02d}+00:00")
+             for n in range(count)))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _walk_older(telegram_id: str, page_size: int) -> list[list[int]]:
+    pages, cursor = [], None
+    while True:
+        page = db.get_user_ton_payments_page(telegram_id, page_size, before=cursor)
+        pages.append([p['id'] for p in page['payments']])
+        if not page['has_older']:
+            return pages
+        last = page['payments'][-1]
+        cursor = (last['transaction_time'], last['id'])
+
+
+@pytest.mark.parametrize('same_time', [False, True])
+def test_keyset_pages_cover_history_once_in_order(temp_db, same_time):
+    _insert_payments(23, same_time=same_time)
+    _insert_payments(4, telegram_id='2002')
+    pages = _walk_older('1001', page_size=5)
+    assert [len(p) for p in pages] == [5, 5, 5, 5, 3]
+    # Del más reciente al más antiguo, sin repetir ni saltar filas (con fechas empatadas desempata el id)
+    all_ids = [i for page in pages for i in page]
+    conn = db.get_db_connection()
+    try:
+        expected = [row[0] for row in conn.execute(
+            "SELECT id FROM ton_transactions WHERE telegram_id = '1001' ORDER BY transaction_time DESC, id DESC")]
+    finally:
+        conn.close()
+    assert all_ids == expected
+
+    # Desde la tercera página, "más recientes" devuelve exactamente la segunda
+    third_first = _row_cursor(pages[2][0])
+    newer = db.get_user_ton_payments_page('1001', 5, after=third_first)
+    assert [p['id'] for p in newer['payments']] == pages[1]
+    assert newer['has_newer'] is True and newer['has_older'] is True
+    first = db.get_user_ton_payments_page('1001', 5, after=_row_cursor(pages[1][0]))
+    assert [p['id'] for p in first['payments']] == pages[0] and first['has_newer'] is False
+
+
+def _row_cursor(payment_id: int) -> tuple:
+    conn = db.get_db_connection()
+    try:
+        row = conn.execute("SELECT transaction_time, id FROM ton_transactions WHERE id = ?", (payment_id,)).fetchone()
+        return row[0], row[1]
+    finally:
+        conn.close()
+
+
+def test_rendered_pages_fit_telegram_limit_and_link_to_each_other(temp_db, monkeypatch):
+    monkeypatch.setattr(handlers, 'PAYMENTS_PAGE_SIZE', 50)
+    _insert_payments(120, comment='x' * 100)
+    text, keyboard = handlers.render_payments_page('1001')
+    assert len(text) <= handlers.TELEGRAM_MESSAGE_LIMIT
+    [older_button] = keyboard.inline_keyboard[0]
+    assert len(older_button.callback_data.encode()) <= 64
+
+    _, direction, transaction_time, payment_id = older_button.callback_data.split('|')
+    text_2, keyboard_2 = handlers.render_payments_page('1001', direction, (transaction_time, int(payment_id)))
+    assert len(text_2) <= handlers.TELEGRAM_MESSAGE_LIMIT and text_2 != text
+    assert [b.text for b in keyboard_2.inline_keyboard[0]] == ["⬅️ Más recientes", "Más antiguos ➡️"]
+
+
+def test_page_cache_is_invalidated_by_a_new_payment(temp_db, monkeypatch):
+    _insert_payments(3)
+    first, _ = handlers.render_payments_page('1001')
+
+    calls = []
+    real_page = db.get_user_ton_payments_page
+    monkeypatch.setattr(db, 'get_user_ton_payments_page', lambda *a, **kw: calls.append(a) or real_page(*a, **kw))
+    assert handlers.render_payments_page('1001')[0] == first
+    assert calls == [] # Servida desde la caché
+
+    db.add_ton_transaction('1001', 'EQuser', 'EQbot', 'new_hash', 7 * 10**9, 'L2U1001T2', 2)
+    refreshed, _ = handlers.render_payments_page('1001')
+    assert len(calls) == 1
+    assert "7.00 TON" in refreshed and refreshed != first
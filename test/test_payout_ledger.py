@@ -0,0 +1,85 @@
+# Tests del libro de pagos en nanoTON (redondeo determinista y reparto del resto)
+
+import numpy as np
+import pytest
+
+from src.payout_ledger import (
+    COMMISSION_TYPES,
+    LARGE_ROUND_MAX_WINNERS,
+    MAX_PRIZE_TIERS,
+    allocate_largest_remainder,
+    benchmark_batch,
+    compute_ledger_batch,
+    compute_round_ledger,
+    format_nano,
+    get_prize_split_bps,
+    ton_to_nano,
+)
+from src.round_manager import MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW, ROUND_TYPE_SCHEDULED, ROUND_TYPE_USER_CREATED
+
+
+def _ledger_total(ledger: dict) -> int:
+    return sum(ledger['commissions_nano'].values()) + sum(ledger['prizes_nano']) + ledger['unallocated_nano']
+
+
+def test_round_ledger_exact_amounts():
+    ledger = compute_round_ledger(3, ROUND_TYPE_SCHEDULED, has_creator=False)
+    assert ledger['collected_nano'] == 3_000_000_000
+    assert ledger['commissions_nano'] == {'gas_fee': 300_000_000, 'bot': 300_000_000}
+    assert ledger['prizes_nano'] == [2_400_000_000]
+    assert ledger['unallocated_nano'] == 0
+
+
+def test_remainder_goes_to_largest_remainders_and_nothing_is_lost():
+    assert allocate_largest_remainder(10, [5000, 3000, 2000]) == [5, 3, 2]
+    assert allocate_largest_remainder(7, [3333, 3333, 3334]) == [2, 2, 3]
+    # Empate de restos: gana el menor orden de sorteo
+    assert allocate_largest_remainder(1, [5000, 5000]) == [1, 0]
+
+    ledger = compute_round_ledger(7, ROUND_TYPE_USER_CREATED, has_creator=True,
+                                  ticket_price_nano=333_333_333, winners_drawn=3)
+    assert _ledger_total(ledger) == ledger['collected_nano']
+    assert sum(ledger['prizes_nano']) == ledger['prize_pool_nano']
+
+
+@pytest.mark.parametrize('ticket_price_nano', [1_000_000_000, 333_333_333, 1, 7])
+@pytest.mark.parametrize('winners_drawn', [1, MAX_PRIZE_TIERS])
+def test_batch_mode_matches_scalar_ledger(ticket_price_nano, winners_drawn):
+    counts = np.arange(0, MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW + 1)
+    for with_creator in (False, True):
+        batch = compute_ledger_batch(counts, np.full(counts.size, with_creator), ticket_price_nano, winners_drawn)
+        for i, count in enumerate(counts):
+            round_type = ROUND_TYPE_USER_CREATED if with_creator else ROUND_TYPE_SCHEDULED
+            ledger = compute_round_ledger(int(count), round_type, with_creator, ticket_price_nano, winners_drawn)
+            commissions = [ledger['commissions_nano'].get(c_type, 0) for c_type in COMMISSION_TYPES]
+            prizes = ledger['prizes_nano'] + [0] * (batch['prizes'].shape[1] - len(ledger['prizes_nano']))
+            assert batch['commissions'][i].tolist() == commissions
+            assert batch['prizes'][i].tolist() == prizes
+            assert batch['unallocated'][i] == ledger['unallocated_nano']
+
+
+def test_large_round_prize_tiers_scale_with_participants():
+    assert get_prize_split_bps(10) == (4000, 3000, 2000, 1000)
+    for count in (11, 250, 50_000):
+        split = get_prize_split_bps(count)
+        assert sum(split) == 10_000
+        assert list(split) == sorted(split, reverse=True) and split[-1] > 0
+    assert len(get_prize_split_bps(11)) == 5
+    assert len(get_prize_split_bps(50_000)) == LARGE_ROUND_MAX_WINNERS
+
+    ledger = compute_round_ledger(50_000, ROUND_TYPE_SCHEDULED, has_creator=False)
+    assert len(ledger['prizes_nano']) == LARGE_ROUND_MAX_WINNERS
+    assert _ledger_total(ledger) == ledger['collected_nano'] and ledger['unallocated_nano'] == 0
+
+
+def test_batch_benchmark_balances_every_round():
+    result = benchmark_batch(100_000)
+    assert result['balanced'] is True
+
+
+def test_ton_conversion_and_formatting():
+    assert ton_to_nano(1.0) == 1_000_000_000
+    assert ton_to_nano(0.1) == 100_000_000
+    assert ton_to_nano('2.5') == 2_500_000_000
+    assert format_nano(2_400_000_000) == "2.40"
+    assert format_nano(266_666_667) == "0.266666667"
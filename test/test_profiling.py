@@ -0,0 +1,123 @@
+# Tests del perfilado bajo demanda (src/profiling.py) y de sus comandos de administrador
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import src.handlers as handlers
+import src.profiling as profiling
+
+_retained = [] # Lo que asigna _allocate sigue vivo hasta la segunda instantánea
+
+
+def _busy(seconds: float):
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(200))
+    return total
+
+
+def _allocate():
+    _retained.append([bytes(1024) for _ in range(2000)])
+
+
+@pytest.fixture(autouse=True)
+def no_sessions_left():
+    yield
+    profiling.stop_cpu_profile()
+    profiling.stop_memory_trace()
+    _retained.clear()
+
+
+def test_cprofile_report_is_sorted_by_cumulative_time():
+    started, _, session_id = profiling.start_cpu_profile(profiling.CPU_MODE_CPROFILE)
+    assert started and not profiling.start_cpu_profile(profiling.CPU_MODE_SAMPLING)[0] # Una sesión a la vez
+    _busy(0.05)
+    assert profiling.stop_cpu_profile(session_id + 1) == (None, "No hay un perfil de CPU en curso.")
+    report, summary = profiling.stop_cpu_profile(session_id)
+    assert summary.startswith('Perfil cProfile') and 'cumulative time' in report and '_busy' in report
+    assert profiling.get_cpu_session() is None
+    assert not profiling.start_cpu_profile('otro')[0]
+
+
+def test_sampling_profiler_finds_the_busy_function():
+    started, _, _ = profiling.start_cpu_profile(profiling.CPU_MODE_SAMPLING, thread_id=threading.get_ident())
+    assert started
+    _busy(0.3)
+    report, summary = profiling.stop_cpu_profile()
+    busy_line = next(line for line in report.splitlines() if line.endswith(f"_busy (test/test_profiling.py:{_busy.__code__.co_firstlineno})"))
+    assert float(busy_line.split('%')[0]) > 50
+    assert 'muestras' in summary
+
+
+def test_memory_diff_is_sorted_by_growth():
+    started, _, _ = profiling.start_memory_trace()
+    assert started and not profiling.start_memory_trace()[0]
+    _allocate()
+    report, summary = profiling.stop_memory_trace()
+    first_entry = report.splitlines()[3]
+    assert f"test/test_profiling.py:{_allocate.__code__.co_firstlineno + 1}" in first_entry
+    assert first_entry.split()[0].startswith('+') and 'KiB netos' in summary
+    assert profiling.get_memory_session() is None
+
+
+def test_admin_commands_send_the_report_as_a_document(monkeypatch):
+    from aiogram import Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from aiogram.types import Update
+
+    from src.fake_services import FakeTelegramServer, create_fake_bot, message_update
+    from src.payment_manager import PaymentManager
+
+    monkeypatch.setattr(handlers, 'ADMIN_TELEGRAM_IDS', frozenset({'42'}))
+
+    async def main():
+        with FakeTelegramServer() as telegram:
+            bot = create_fake_bot(telegram.url)
+            dp = Dispatcher(storage=MemoryStorage())
+            handlers.register_all_handlers(dp, bot, PaymentManager())
+            updates = iter(range(1, 100))
+            for user_id, text in ((7, '/perfil_iniciar'), (42, '/perfil_iniciar muestreo'), (42, '/perfil_detener'),
+                                  (42, '/memoria_iniciar'), (42, '/memoria_detener')):
+                update = message_update(next(updates), user_id, text)
+                await dp.feed_update(bot, Update.model_validate(update, context={'bot': bot}))
+            await asyncio.sleep(0) # Las tareas canceladas terminan en la siguiente vuelta del loop
+            assert handlers._auto_stop_tasks == set() # Detener a mano cancela la parada automática
+            await bot.session.close()
+            return telegram.sent_to(7), telegram.sent_to(42)
+
+    not_admin, admin = asyncio.run(main())
+    assert not_admin == [] # Para los demás el comando no existe
+    documents = [params['document'] for params in admin if 'document' in params]
+    assert [doc['file_name'].split('_2')[0] for doc in documents] == ['perfil_muestreo', 'memoria']
+    assert b'Ordenado por tiempo acumulado' in documents[0]['content']
+    assert b'Ordenado por crecimiento de memoria' in documents[1]['content']
+
+
+def test_forgotten_memory_trace_is_stopped_off_the_event_loop(monkeypatch):
+    from src.fake_services import FakeTelegramServer, create_fake_bot
+
+    monkeypatch.setattr(profiling, 'PROFILE_MAX_SECONDS', 0)
+    stopped_in = []
+
+    def stop(session_id):
+        stopped_in.append(threading.current_thread() is threading.main_thread())
+        return profiling.stop_memory_trace(session_id)
+
+    async def main():
+        with FakeTelegramServer() as telegram:
+            bot = create_fake_bot(telegram.url)
+            started, _, session_id = profiling.start_memory_trace()
+            assert started
+            handlers._schedule_auto_stop('memory', handlers._auto_stop_profile(bot, 42, session_id, stop, "memoria", in_thread=True))
+            await asyncio.gather(*handlers._auto_stop_tasks)
+            await bot.session.close()
+            return telegram.sent_to(42)
+
+    sent = asyncio.run(main())
+    assert stopped_in == [False] # El diff de instantáneas no bloquea el loop
+    assert handlers._auto_stop_tasks == set()
+    assert sent[0]['caption'].startswith('(detenido automáticamente)')
@@ -0,0 +1,101 @@
+# Tests de la retención: rondas terminadas antiguas al archivo por lotes y VACUUM incremental
+
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import src.db as db
+import src.retention as retention
+from src.round_manager import ROUND_TYPE_USER_CREATED
+
+
+def _settled_round(participants: int, ended_days_ago: float, status: str = 'finished') -> int:
+    round_id = db.create_new_round(ROUND_TYPE_USER_CREATED, None)
+    conn = db.get_db_connection()
+    conn.executemany("INSERT INTO round_participants (round_id, telegram_id, assigned_number, paid_real) VALUES (?, ?, ?, 1)",
+                     ((round_id, str(n), n) for n in range(1, participants + 1)))
+    conn.execute("UPDATE rounds SET status = ?, end_time = ? WHERE id = ?",
+                 (status, (datetime.now(timezone.utc) - timedelta(days=ended_days_ago)).isoformat(), round_id))
+    conn.execute("INSERT INTO draw_results (round_id, drawn_number, draw_order, winner_telegram_id) VALUES (?, 1, 0, '1')", (round_id,))
+    conn.execute("INSERT INTO creator_commission (round_id, creator_type) VALUES (?, 'bot')", (round_id,))
+    conn.commit()
+    conn.close()
+    return round_id
+
+
+def _counts(path: str, round_id: int) -> dict:
+    conn = sqlite3.connect(path)
+    try:
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table} WHERE round_id = ?", (round_id,)).fetchone()[0]
+                  for table in ('round_participants', 'draw_results', 'creator_commission')}
+        counts['rounds'] = conn.execute("SELECT COUNT(*) FROM rounds WHERE id = ?", (round_id,)).fetchone()[0]
+        return counts
+    finally:
+        conn.close()
+
+
+def test_old_terminal_rounds_move_to_the_archive_in_bounded_batches(temp_db):
+    big = _settled_round(250, ended_days_ago=40)
+    cancelled = _settled_round(3, ended_days_ago=35, status='cancelled')
+    recent = _settled_round(5, ended_days_ago=2)
+    open_round = db.create_new_round(ROUND_TYPE_USER_CREATED, None)
+
+    result = retention.archive_old_rounds(30, 'archive.db', batch_rounds=1, batch_rows=100, batch_sleep=0)
+
+    assert result['complete'] and result['rounds'] == 2
+    assert result['batches'] == 4 # 3 tramos de la ronda grande (el último la cierra) + 1 de la cancelada
+    assert result['rows'] == {'rounds': 2, 'round_participants': 253, 'draw_results': 2, 'creator_commission': 2}
+    for round_id, participants in ((big, 250), (cancelled, 3)):
+        assert _counts(db.DATABASE_NAME, round_id) == {'round_participants': 0, 'draw_results': 0, 'creator_commission': 0, 'rounds': 0}
+        assert _counts('archive.db', round_id) == {'round_participants': participants, 'draw_results': 1,
+                                                   'creator_commission': 1, 'rounds': 1}
+    assert _counts(db.DATABASE_NAME, recent)['round_participants'] == 5
+    assert db.get_round_by_id(open_round) is not None
+    # Una segunda pasada no encuentra nada que mover
+    assert retention.archive_old_rounds(30, 'archive.db', batch_sleep=0)['batches'] == 0
+
+
+def test_max_batches_stops_and_the_next_pass_resumes(temp_db):
+    round_id = _settled_round(30, ended_days_ago=60)
+    first = retention.archive_old_rounds(30, 'archive.db', batch_rows=10, batch_sleep=0, max_batches=2)
+    assert not first['complete'] and first['rows']['round_participants'] == 20 and first['rounds'] == 0
+    assert db.get_round_by_id(round_id) is not None # La ronda se mueve al final, con el último tramo
+    second = retention.archive_old_rounds(30, 'archive.db', batch_rows=10, batch_sleep=0)
+    assert second['complete'] and second['rounds'] == 1
+    assert _counts('archive.db', round_id)['round_participants'] == 30
+
+
+def test_retention_pass_returns_freed_pages_with_incremental_vacuum(temp_db):
+    conn = db.get_db_connection()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == retention.AUTO_VACUUM_INCREMENTAL # Base nueva de init_db
+    conn.close()
+    _settled_round(20_000, ended_days_ago=90)
+    size_before = (temp_db / db.DATABASE_NAME).stat().st_size
+
+    result = retention.run_retention(30, 'archive.db', batch_sleep=0)
+
+    assert result['rounds'] == 1 and result['vacuum']['enabled']
+    assert result['vacuum']['freed_pages'] > 0 and result['vacuum']['freelist_pages'] == 0
+    assert (temp_db / db.DATABASE_NAME).stat().st_size < size_before
+    assert retention.get_retention_stats()['last'] == result
+
+
+def test_legacy_database_is_converted_to_incremental_vacuum(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = sqlite3.connect(db.DATABASE_NAME)
+    conn.execute("CREATE TABLE users (telegram_id TEXT PRIMARY KEY)") # Base creada antes de auto_vacuum
+    conn.close()
+    db.init_db()
+    assert retention.incremental_vacuum()['enabled'] is False
+    assert retention.enable_incremental_vacuum() is True
+    assert retention.incremental_vacuum()['enabled'] is True
+    assert retention.enable_incremental_vacuum() is False
+
+
+def test_archived_winners_leave_the_recent_winners_buffer(temp_db):
+    from src.leaderboard import get_recent_winners
+
+    old = _settled_round(2, ended_days_ago=40)
+    recent = _settled_round(2, ended_days_ago=1)
+    assert [row['round_id'] for row in get_recent_winners()] == [recent, old] # Buffer cargado con los dos premios
+    retention.archive_old_rounds(30, 'archive.db', batch_sleep=0)
+    assert [row['round_id'] for row in get_recent_winners()] == [recent]
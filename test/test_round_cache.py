@@ -0,0 +1,87 @@
+# Tests de la caché de rondas de round_manager (write-through y consistencia con la DB)
+
+import asyncio
+import random
+
+import pytest
+
+import src.db as db
+import src.round_manager as round_manager
+import src.simulation_engine as simulation_engine
+from src.round_manager import ROUND_STATUS_DRAWING, ROUND_STATUS_WAITING_TO_START, ROUND_TYPE_SCHEDULED, ROUND_TYPE_USER_CREATED
+from src.round_state_machine import transition
+
+
+@pytest.fixture
+def temp_db(temp_db, monkeypatch):
+    monkeypatch.setattr(round_manager, 'ROUND_CACHE_TTL_SECONDS', 3600) # Sin caducidad: todo lo sirve el write-through
+    monkeypatch.setattr(round_manager, '_round_cache_stats', {'hits': 0, 'misses': 0, 'evictions': 0})
+    return temp_db
+
+
+def _assert_cache_matches_db(round_ids):
+    assert round_manager.get_available_rounds() == db.get_open_rounds()
+    assert round_manager.get_current_active_round() == db.get_active_round()
+    for round_id in round_ids:
+        db_round = db.get_round_by_id(round_id)
+        assert round_manager.get_round(round_id) == db_round
+        assert round_manager.get_round_entry_totals(round_id) == db.get_round_entry_totals(round_id)
+
+
+def test_cache_stays_consistent_with_db_through_the_round_lifecycle(temp_db):
+    rng = random.Random(35)
+    round_ids = [round_manager.create_round(ROUND_TYPE_SCHEDULED)]
+    round_manager.get_available_rounds() # Carga la lista de abiertas
+    round_ids.append(round_manager.create_round(ROUND_TYPE_USER_CREATED, creator_telegram_id='1001'))
+    _assert_cache_matches_db(round_ids)
+
+    for n in range(40):
+        round_id = rng.choice(round_ids)
+        round_manager.add_participant(round_id, str(1000 + rng.randrange(12)), f"user{n}", tickets=rng.choice([None, 1, 2]))
+        _assert_cache_matches_db(round_ids)
+
+    assert transition(round_ids[0], ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_DRAWING)
+    _assert_cache_matches_db(round_ids)
+    asyncio.run(simulation_engine.draw_and_settle_round(round_ids[0], ROUND_TYPE_SCHEDULED, None, rng=rng))
+    _assert_cache_matches_db(round_ids)
+    # La ronda terminada ya no ocupa la caché
+    assert round_ids[0] not in round_manager._round_cache
+
+    round_manager.mark_round_for_deletion(round_ids[1])
+    _assert_cache_matches_db(round_ids)
+    assert round_manager.get_current_active_round() is None
+
+
+def test_repeated_reads_are_served_from_cache(temp_db, monkeypatch):
+    round_id = round_manager.create_round(ROUND_TYPE_SCHEDULED)
+    round_manager.add_participant(round_id, '1001', 'user1')
+    round_manager.get_available_rounds()
+
+    def no_db(*args, **kwargs):
+        raise AssertionError("lectura a la DB con la caché vigente")
+    monkeypatch.setattr(round_manager, 'db_get_round_by_id', no_db)
+    monkeypatch.setattr(round_manager, 'db_get_open_rounds', no_db)
+    monkeypatch.setattr(round_manager, 'db_get_round_entry_totals', no_db)
+
+    before = round_manager.get_round_cache_stats()
+    for _ in range(100):
+        assert round_manager.get_current_active_round()['id'] == round_id
+        assert round_manager.get_round(round_id)['id'] == round_id
+        assert round_manager.count_round_participants(round_id) == 1
+    stats = round_manager.get_round_cache_stats()
+    assert stats['hits'] - before['hits'] == 300 and stats['misses'] == before['misses']
+    assert stats['hit_rate'] > 0.95
+
+
+def test_cache_is_bounded_and_entries_expire(temp_db, monkeypatch):
+    monkeypatch.setattr(round_manager, 'ROUND_CACHE_MAX_SIZE', 3)
+    round_ids = [round_manager.create_round(ROUND_TYPE_SCHEDULED) for _ in range(5)]
+    assert len(round_manager._round_cache) == 3
+    assert round_manager.get_round_cache_stats()['evictions'] == 2
+    # Con más abiertas que capacidad la lista se sigue leyendo bien de la DB
+    assert [r['id'] for r in round_manager.get_available_rounds()] == sorted(round_ids, reverse=True)
+
+    # Una escritura de otro proceso (directa a la DB) se ve al caducar la entrada
+    monkeypatch.setattr(round_manager, 'ROUND_CACHE_TTL_SECONDS', 0)
+    db.add_tickets_to_round(round_ids[-1], '2001', 2, max_tickets=10)
+    assert round_manager.get_round_entry_totals(round_ids[-1]) == (1, 2)
@@ -0,0 +1,88 @@
+# Tests del bus de eventos de rondas y del stream SSE de la webapp
+
+import json
+
+import src.event_bus as event_bus
+import src.round_manager as round_manager
+from src.round_manager import ROUND_STATUS_DRAWING, ROUND_STATUS_WAITING_TO_START, ROUND_TYPE_SCHEDULED
+from src.round_state_machine import transition
+from webapp.app import app
+
+
+def _drain(subscription) -> list[tuple]:
+    events = []
+    while (event := subscription.get(timeout=0)) is not None:
+        events.append((event['type'], event['data']))
+    return events
+
+
+def test_round_changes_are_published_as_deltas(temp_db):
+    subscription = event_bus.subscribe()
+    try:
+        round_id = round_manager.create_round(ROUND_TYPE_SCHEDULED)
+        round_manager.add_participant(round_id, '1001', 'ana')
+        round_manager.add_participant(round_id, '1002', 'bob', tickets=2)
+        round_manager.add_participant(round_id, '1001', 'ana') # Ya unida: no publica nada
+        assert transition(round_id, ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_DRAWING)
+
+        events = _drain(subscription)
+        assert [event_type for event_type, _ in events] == [
+            event_bus.EVENT_ROUND_CREATED, event_bus.EVENT_PARTICIPANT_JOINED,
+            event_bus.EVENT_PARTICIPANT_JOINED, event_bus.EVENT_ROUND_CLOSED]
+        assert events[0][1]['round']['id'] == round_id
+        assert events[2][1] == {'round_id': round_id, 'participants': 2, 'tickets': 3,
+                                'max_tickets': round_manager.MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW}
+        assert events[3][1] == {'round_id': round_id, 'status': ROUND_STATUS_DRAWING}
+    finally:
+        event_bus.unsubscribe(subscription)
+
+
+def test_reconnect_replays_missed_events_or_asks_for_resync(temp_db, monkeypatch):
+    last_seen = event_bus.publish('test', {'n': 0})['id']
+    for n in range(1, 4):
+        event_bus.publish('test', {'n': n})
+    replayed = event_bus.subscribe(last_seen)
+    assert [data['n'] for _, data in _drain(replayed)] == [1, 2, 3] and not replayed.needs_resync
+    event_bus.unsubscribe(replayed)
+
+    # Un id de otro proceso (posterior a todo lo publicado) o ya fuera del historial obliga a recargar
+    assert event_bus.subscribe(last_seen + 10_000).needs_resync
+    monkeypatch.setattr(event_bus, '_history', event_bus.deque(list(event_bus._history)[-2:], maxlen=2))
+    assert event_bus.subscribe(last_seen).needs_resync
+
+    # Un suscriptor que no consume se descarta sin bloquear a quien publica
+    monkeypatch.setattr(event_bus, 'SUBSCRIBER_QUEUE_SIZE', 2)
+    slow = event_bus.subscribe()
+    for n in range(5):
+        event_bus.publish('test', {'n': n})
+    assert slow.needs_resync and slow not in event_bus._subscribers
+
+
+def test_stream_sends_changes_after_the_listed_state(temp_db):
+    client = app.test_client()
+    subscribers_before = event_bus.get_bus_stats()['subscribers']
+    round_id = round_manager.create_round(ROUND_TYPE_SCHEDULED)
+    listing = client.get('/api/open_rounds')
+    assert [r['id'] for r in listing.get_json()] == [round_id]
+    last_event_id = listing.headers['X-Last-Event-ID']
+
+    # Cambios entre la lista y la conexión: el stream los entrega en orden
+    round_manager.add_participant(round_id, '1001', 'ana')
+    new_round_id = round_manager.create_round(ROUND_TYPE_SCHEDULED)
+    round_manager.mark_round_for_deletion(round_id)
+
+    response = client.get(f'/api/rounds/stream?last_event_id={last_event_id}', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = response.response
+    assert next(chunks).startswith(b'retry:')
+    messages = []
+    for _ in range(3):
+        lines = dict(line.split(': ', 1) for line in next(chunks).decode().strip().split('\n'))
+        messages.append((lines['event'], json.loads(lines['data'])))
+    response.close()
+
+    assert messages[0] == ('participant-joined', {'id': round_id, 'participants': f"1/{round_manager.MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW}"})
+    assert messages[1][0] == 'round-created' and messages[1][1]['id'] == new_round_id
+    assert messages[1][1]['participants'] == f"0/{round_manager.MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW}"
+    assert messages[2] == ('round-closed', {'id': round_id, 'status': 'deleted'})
+    assert event_bus.get_bus_stats()['subscribers'] == subscribers_before # Al cerrar la conexión se da de baja
@@ -0,0 +1,86 @@
+# Tests de liquidación atómica de rondas (resultados + comisiones + estado en una transacción)
+
+import asyncio
+
+import src.db as db
+from src.round_manager import ROUND_STATUS_DRAWING, ROUND_STATUS_FINISHED, ROUND_TYPE_USER_CREATED
+from src.round_state_machine import transition
+from src.simulation_engine import calculate_and_save_simulated_payouts
+
+
+def _drawing_round_with_participants(count: int, creator_id: str | None = None) -> int:
+    round_id = db.create_new_round(ROUND_TYPE_USER_CREATED, creator_id)
+    for number in range(1, count + 1):
+        db.get_or_create_user(str(1000 + number), f"user{number}", f"User {number}")
+        db.add_participant_to_round(round_id, str(1000 + number), number)
+    assert transition(round_id, 'waiting_to_start', ROUND_STATUS_DRAWING)
+    return round_id
+
+
+def _count_rows(table: str, round_id: int) -> int:
+    conn = db.get_db_connection()
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE round_id = ?", (round_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_settle_round_writes_everything_in_one_commit(temp_db):
+    round_id = _drawing_round_with_participants(3)
+    results = [{'drawn_number': 2, 'draw_order': 0, 'winner_telegram_id': '1002',
+                'prize_amount_simulated': "2.40 unidades", 'prize_amount_real': 2.4}]
+    commissions = [{'creator_type': 'gas_fee', 'creator_telegram_id': None, 'amount_simulated': "0.30 unidades", 'amount_real': 0.3},
+                   {'creator_type': 'bot', 'creator_telegram_id': None, 'amount_simulated': "0.30 unidades", 'amount_real': 0.3}]
+
+    assert db.settle_round(round_id, results, commissions) is True
+    assert db.get_round_by_id(round_id)['status'] == ROUND_STATUS_FINISHED
+    assert _count_rows('draw_results', round_id) == 1
+    assert _count_rows('creator_commission', round_id) == 2
+
+    # Una segunda liquidación (otra tarea) no gana el compare-and-swap y no escribe nada
+    assert db.settle_round(round_id, [], commissions) is False
+    assert _count_rows('creator_commission', round_id) == 2
+
+
+def test_failed_settlement_leaves_no_partial_rows(temp_db):
+    round_id = _drawing_round_with_participants(3)
+    results = [{'drawn_number': 1, 'draw_order': 0, 'winner_telegram_id': '1001',
+                'prize_amount_simulated': "2.40 unidades", 'prize_amount_real': 2.4}]
+    # Dos comisiones con la misma clave UNIQUE: la segunda inserción falla a mitad de la transacción
+    duplicated = {'creator_type': 'user', 'creator_telegram_id': '1001', 'amount_simulated': "0.15 unidades", 'amount_real': 0.15}
+
+    assert db.settle_round(round_id, results, [duplicated, dict(duplicated)]) is False
+    assert db.get_round_by_id(round_id)['status'] == ROUND_STATUS_DRAWING
+    assert _count_rows('draw_results', round_id) == 0
+    assert _count_rows('creator_commission', round_id) == 0
+
+
+def test_calculate_and_save_settles_the_round(temp_db):
+    round_id = _drawing_round_with_participants(4, creator_id='1001')
+    participants = db.get_participants_in_round(round_id)
+
+    winners_messages, commissions_messages, settled, _ = asyncio.run(calculate_and_save_simulated_payouts(
+        round_id, [3], participants, ROUND_TYPE_USER_CREATED, '1001'))
+
+    assert settled is True
+    assert winners_messages and commissions_messages
+    assert db.get_round_by_id(round_id)['status'] == ROUND_STATUS_FINISHED
+    assert _count_rows('draw_results', round_id) == 1
+    assert _count_rows('creator_commission', round_id) == 3  # gas, bot y creador
+
+
+def test_settlement_stores_exact_nano_amounts(temp_db):
+    round_id = _drawing_round_with_participants(3)
+    participants = db.get_participants_in_round(round_id)
+
+    _, _, settled, _ = asyncio.run(calculate_and_save_simulated_payouts(
+        round_id, [1], participants, 'scheduled', None, ticket_price_nano=333_333_333))
+    assert settled is True
+
+    conn = db.get_db_connection()
+    try:
+        prize = conn.execute("SELECT prize_amount_nano FROM draw_results WHERE round_id = ?", (round_id,)).fetchone()[0]
+        commissions = conn.execute("SELECT SUM(amount_nano) FROM creator_commission WHERE round_id = ?", (round_id,)).fetchone()[0]
+    finally:
+        conn.close()
+    assert prize + commissions == 3 * 333_333_333
@@ -0,0 +1,64 @@
+# Tests del ciclo de vida de rondas (transiciones compare-and-swap)
+
+import threading
+
+import src.db as db
+from src.round_manager import (
+    ROUND_STATUS_WAITING_TO_START,
+    ROUND_STATUS_WAITING_FOR_PAYMENTS,
+    ROUND_STATUS_DRAWING,
+    ROUND_STATUS_FINISHED,
+    ROUND_STATUS_CANCELLED,
+    ROUND_TYPE_SCHEDULED,
+)
+from src.round_state_machine import ALLOWED_TRANSITIONS, is_transition_allowed, transition
+
+
+def test_transition_table_terminal_states():
+    assert is_transition_allowed(ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_DRAWING)
+    assert is_transition_allowed(ROUND_STATUS_DRAWING, ROUND_STATUS_FINISHED)
+    assert not is_transition_allowed(ROUND_STATUS_FINISHED, ROUND_STATUS_DRAWING)
+    assert not is_transition_allowed(ROUND_STATUS_CANCELLED, ROUND_STATUS_WAITING_TO_START)
+    assert not is_transition_allowed(ROUND_STATUS_WAITING_FOR_PAYMENTS, ROUND_STATUS_FINISHED)
+    assert ALLOWED_TRANSITIONS[ROUND_STATUS_FINISHED] == frozenset()
+
+
+def test_transition_is_compare_and_swap(temp_db):
+    round_id = db.create_new_round(ROUND_TYPE_SCHEDULED, None)
+
+    assert transition(round_id, ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_DRAWING) is True
+    # El estado de origen ya no coincide: la segunda llamada pierde
+    assert transition(round_id, ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_DRAWING) is False
+    assert transition(round_id, ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_CANCELLED) is False
+    assert transition(round_id, ROUND_STATUS_DRAWING, ROUND_STATUS_FINISHED) is True
+
+    finished = db.get_round_by_id(round_id)
+    assert finished['status'] == ROUND_STATUS_FINISHED
+    assert finished['end_time'] is not None
+
+
+def test_disallowed_transition_does_not_touch_db(temp_db):
+    round_id = db.create_new_round(ROUND_TYPE_SCHEDULED, None)
+    assert transition(round_id, ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_FINISHED) is False
+    assert db.get_round_by_id(round_id)['status'] == ROUND_STATUS_WAITING_TO_START
+
+
+def test_concurrent_transitions_have_a_single_winner(temp_db):
+    round_id = db.create_new_round(ROUND_TYPE_SCHEDULED, None)
+    results = []
+    barrier = threading.Barrier(8)
+
+    def racer(target_status):
+        barrier.wait()
+        results.append((target_status, transition(round_id, ROUND_STATUS_WAITING_TO_START, target_status)))
+
+    # Cierre por tiempo y cancelación compitiendo por la misma ronda
+    threads = [threading.Thread(target=racer, args=(ROUND_STATUS_DRAWING if i % 2 else ROUND_STATUS_CANCELLED,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    winners = [status for status, won in results if won]
+    assert len(winners) == 1
+    assert db.get_round_by_id(round_id)['status'] == winners[0]
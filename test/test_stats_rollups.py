@@ -0,0 +1,84 @@
+# Tests de los rollups de estadísticas (stats_daily / stats_hourly) y del comando /estadisticas
+
+from datetime import datetime, timezone
+
+import src.db as db
+import src.handlers as handlers
+
+TON = 1_000_000_000
+
+
+def _play_some_rounds() -> None:
+    drawn = db.create_new_round('user_created', '1')
+    assert db.add_tickets_to_round(drawn, '1', 2, 10)['added']
+    assert db.add_tickets_to_round(drawn, '1', 1, 10)['added'] # Mismo participante, más boletos
+    assert db.add_tickets_to_round(drawn, '2', 3, 10)['added']
+    assert not db.add_tickets_to_round(drawn, '3', 5, 10)['added'] # No cabe: no cuenta
+    for n, value in enumerate((3 * TON, 3 * TON)):
+        assert db.add_ton_transaction(str(n + 1), f"EQw{n}", 'EQbot', f"hash{n}", value, 'c', drawn)
+    assert db.add_ton_transaction('9', 'EQw9', 'EQbot', 'hash9', TON // 2, None) # Pago sin ronda
+    assert db.add_ton_transaction('9', 'EQw9', 'EQbot', 'hash9', TON // 2, None) is None # Duplicado: no cuenta
+    assert db.transition_round_status(drawn, 'waiting_to_start', 'drawing')
+    assert db.settle_round(drawn, [{'drawn_number': 1, 'draw_order': 0, 'winner_telegram_id': '1', 'prize_amount_nano': 4 * TON}],
+                           [{'creator_type': 'bot', 'amount_nano': TON}, {'creator_type': 'user', 'creator_telegram_id': '1',
+                                                                          'amount_nano': TON}])
+
+    cancelled = db.create_new_round('scheduled', None)
+    assert db.transition_round_status(cancelled, 'waiting_to_start', 'cancelled')
+    assert not db.transition_round_status(cancelled, 'waiting_to_start', 'cancelled') # Perdida: no cuenta
+    assert db.update_round_status(cancelled, 'cancelled') # Mismo estado: no cuenta otra vez
+    db.create_new_round('scheduled', None)
+
+
+def _rollup_rows() -> dict:
+    conn = db.get_db_connection()
+    try:
+        return {table: [tuple(row) for row in conn.execute(f"SELECT * FROM {table} ORDER BY bucket, round_type")]
+                for table, _ in db.STATS_ROLLUP_TABLES.values()}
+    finally:
+        conn.close()
+
+
+def test_writes_update_daily_and_hourly_rollups_in_their_transaction(temp_db):
+    _play_some_rounds()
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    totals = db.get_stats_totals('day', today)
+
+    assert totals['user_created'] == {'rounds_created': 1, 'rounds_finished': 1, 'rounds_cancelled': 0, 'participants': 2,
+                                      'tickets_sold': 6, 'payments': 2, 'payments_nano': 6 * TON, 'prizes_nano': 4 * TON,
+                                      'commissions_nano': 2 * TON}
+    assert totals['scheduled']['rounds_created'] == 2 and totals['scheduled']['rounds_cancelled'] == 1
+    assert totals['']['payments'] == 1 and totals['']['payments_nano'] == TON // 2
+    assert db.get_stats_totals('hour') == db.get_stats_totals('day') # Los mismos contadores con otro grano
+    assert db.get_stats_totals('day', '2999-01-01') == {}
+
+
+def test_backfill_of_an_existing_database_matches_the_incremental_rollups(temp_db):
+    _play_some_rounds()
+    incremental = _rollup_rows()
+    conn = db.get_db_connection()
+    conn.execute("DROP TABLE stats_daily")
+    conn.execute("DROP TABLE stats_hourly")
+    conn.commit()
+    conn.close()
+
+    db.init_db() # Base anterior a los rollups: se llenan una vez desde las tablas del juego
+    assert _rollup_rows() == incremental
+    db.init_db()
+    assert _rollup_rows() == incremental # Y no se vuelven a sumar
+
+
+def test_stats_command_reads_a_primary_key_range(temp_db, monkeypatch):
+    _play_some_rounds()
+    conn = db.get_db_connection()
+    plan = ' '.join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN SELECT round_type, SUM(tickets_sold) FROM stats_daily "
+                                                   "WHERE bucket >= ? GROUP BY round_type", ('2026-01-01',)))
+    conn.close()
+    assert 'USING INDEX sqlite_autoindex_stats_daily_1 (bucket>?)' in plan
+
+    text = handlers.render_stats()
+    assert text.count('🎟️ 6 boletos · 👥 2 participantes') == 4 # Las cuatro ventanas
+    assert '💰 3 pagos · 6.50 TON' in text and '2 sorteadas' not in text
+    assert '🎲 3 rondas creadas · 1 sorteadas · 1 canceladas (50.0%)' in text
+    assert '<code>user_created</code>: 6 boletos, 6.00 TON cobrados, 0.0% canceladas' in text
+    assert '<code>sin ronda</code>: 0 boletos, 0.50 TON cobrados, — canceladas' in text
@@ -0,0 +1,113 @@
+# Tests de las trazas en proceso (spans por contexto, exportación JSONL y resúmenes)
+
+import asyncio
+import json
+
+import pytest
+
+import src.tracing as tracing
+from src.tracing import span, traced
+
+
+@pytest.fixture
+def traces(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    tracing.reset_span_stats()
+    tracing.configure_tracing(True, str(path))
+    yield path
+    tracing.configure_tracing(False)
+    tracing.reset_span_stats()
+
+
+@traced('test.db_write')
+def _db_write():
+    return tracing.current_span()['parent_id']
+
+
+@traced('test.ton_call')
+async def _ton_call():
+    await asyncio.sleep(0.01)
+    return await asyncio.to_thread(_db_write) # El hilo hereda el contexto: el span padre sigue siendo este
+
+
+@traced('test.failing')
+def _failing():
+    raise ValueError("boom")
+
+
+def _read(path):
+    tracing.stop_exporter()
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_spans_nest_across_awaits_and_threads(traces):
+    async def handler():
+        with span('handler.verify', user_id=7) as root:
+            parent_of_write = await _ton_call()
+            return root, parent_of_write
+
+    root, parent_of_write = asyncio.run(handler())
+    with pytest.raises(ValueError):
+        _failing()
+
+    records = {record['name']: record for record in _read(traces)}
+    ton_call = records['test.ton_call']
+    assert ton_call['parent_id'] == root['span_id'] and parent_of_write == ton_call['span_id']
+    assert records['test.db_write']['trace_id'] == root['trace_id'] == ton_call['trace_id']
+    assert records['handler.verify']['attributes'] == {'user_id': 7}
+    assert ton_call['duration_ms'] >= 10 and records['handler.verify']['duration_ms'] >= ton_call['duration_ms']
+    assert records['test.failing']['error'] == 'ValueError' and records['test.failing']['parent_id'] is None
+
+    stats = tracing.get_span_stats()
+    assert stats['test.failing']['errors'] == 1 and stats['test.ton_call']['count'] == 1
+    assert list(stats)[0] == 'handler.verify' # Del más lento al más rápido
+
+
+def test_trace_file_summary_breaks_down_the_slowest_traces(traces):
+    for delay in (0.0, 0.02):
+        with span('handler.verify'):
+            with span('ton_api.get_address_transactions'):
+                asyncio.run(asyncio.sleep(delay))
+            _db_write()
+    assert len(_read(traces)) == 6
+    summary = tracing.summarize_trace_file(str(traces), slowest=1)
+    assert summary['spans']['handler.verify']['count'] == 2
+    (slowest,) = summary['slowest_traces']
+    assert slowest['root'] == 'handler.verify' and list(slowest['spans_ms']) == ['ton_api.get_address_transactions', 'test.db_write']
+
+
+@traced()
+async def _plain_coroutine():
+    return 'ok'
+
+
+def test_disabled_tracing_records_nothing():
+    tracing.reset_span_stats()
+    with span('handler.verify') as record:
+        assert record is None and tracing.current_span() is None
+    assert asyncio.run(_plain_coroutine()) == 'ok'
+    assert tracing.get_span_stats() == {}
+
+
+def test_export_file_rotates_past_the_size_cap(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    tracing.configure_tracing(True, str(path), max_bytes=2_000)
+    try:
+        for batch in range(10):
+            for index in range(10):
+                with span('test.rotation', batch=batch, index=index):
+                    pass
+            tracing.stop_exporter() # Vacía la cola: cada lote se escribe y se comprueba el tamaño
+            tracing.configure_tracing(True, str(path), max_bytes=2_000)
+        rotated = tmp_path / 'traces.jsonl.1'
+        tracing.stop_exporter()
+        assert rotated.exists()
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['traces.jsonl', 'traces.jsonl.1']
+        assert rotated.stat().st_size < 2 * 2_000 # Como mucho un lote por encima del límite
+        last = [json.loads(line) for line in path.read_text().splitlines()] if path.read_text() else []
+        kept = [json.loads(line) for line in rotated.read_text().splitlines()]
+        assert all(record['name'] == 'test.rotation' for record in kept + last)
+        assert (last or kept)[-1]['attributes']['batch'] == 9
+    finally:
+        tracing.configure_tracing(False)
+        tracing.reset_span_stats()
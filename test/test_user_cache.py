@@ -0,0 +1,71 @@
+# Tests del upsert de usuarios con caché LRU (get_or_create_user)
+
+import src.db as db
+
+
+def _user_row(telegram_id):
+    conn = db.get_db_connection()
+    try:
+        row = conn.execute("SELECT username, first_name FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()
+        return tuple(row) if row else None
+    finally:
+        conn.close()
+
+
+def test_upsert_creates_updates_and_keeps_known_values(temp_db):
+    db.get_or_create_user('1001', 'ana', 'Ana')
+    assert _user_row('1001') == ('ana', 'Ana')
+    db.get_or_create_user('1001', 'ana_new', None)
+    # Un valor vacío no borra el nombre que ya había
+    assert _user_row('1001') == ('ana_new', 'Ana')
+    db.get_or_create_user('1001', None, 'Ana María')
+    assert _user_row('1001') == ('ana_new', 'Ana María')
+    db.get_or_create_user('1002', 'bob') # La webapp no envía first_name
+    assert _user_row('1002') == ('bob', '')
+
+
+def test_unchanged_user_costs_no_db_round_trip(temp_db, monkeypatch):
+    db.get_or_create_user('1001', 'ana', 'Ana')
+
+    def no_db(*args, **kwargs):
+        raise AssertionError("get_or_create_user fue a la DB con un usuario sin cambios")
+    monkeypatch.setattr(db, 'get_db_connection', no_db)
+    before = db.get_user_cache_stats()
+    for _ in range(1000):
+        db.get_or_create_user('1001', 'ana', 'Ana')
+    assert db.get_user_cache_stats()['hits'] - before['hits'] == 1000
+
+
+def test_user_cache_is_bounded_lru(temp_db, monkeypatch):
+    monkeypatch.setattr(db, 'USER_CACHE_MAX_SIZE', 3)
+    for n in range(5):
+        db.get_or_create_user(str(n), f"user{n}", None)
+    stats = db.get_user_cache_stats()
+    assert stats['size'] == 3
+    # Los más antiguos salieron de la caché y vuelven a escribirse sin errores
+    db.get_or_create_user('0', 'user0', None)
+    assert db.get_user_cache_stats()['misses'] == stats['misses'] + 1
+    assert _user_row('0') == ('user0', '')
+
+
+def test_renaming_back_to_a_previous_name_is_written(temp_db):
+    db.get_or_create_user('1001', 'ana', 'Ana')
+    db.get_or_create_user('1001', 'bea', 'Ana')
+    db.get_or_create_user('1001', 'ana', 'Ana') # A -> B -> A: "ana" ya no es lo último escrito
+    assert _user_row('1001') == ('ana', 'Ana')
+    db.get_or_create_user('1001', None, None) # Sin datos: no escribe nada y no pisa la caché
+    db.get_or_create_user('1001', 'ana', 'Ana')
+    assert db.get_user_cache_stats()['size'] == 1
+
+
+def test_cached_names_expire_so_other_replicas_renames_are_overwritten(temp_db, monkeypatch):
+    db.get_or_create_user('1001', 'ana', 'Ana')
+    conn = db.get_db_connection()
+    conn.execute("UPDATE users SET username = 'bea' WHERE telegram_id = '1001'") # Otra réplica
+    conn.commit()
+    conn.close()
+    db.get_or_create_user('1001', 'ana', 'Ana')
+    assert _user_row('1001') == ('bea', 'Ana') # Dentro del TTL la caché responde
+    monkeypatch.setattr(db, 'USER_CACHE_TTL_SECONDS', 0)
+    db.get_or_create_user('1001', 'ana', 'Ana')
+    assert _user_row('1001') == ('ana', 'Ana')
@@ -0,0 +1,105 @@
+# Tests de los ganadores de la webapp: buffer de recientes, ranking incremental y /api/winners
+
+import asyncio
+import random
+
+import pytest
+
+import src.db as db
+import src.leaderboard as leaderboard
+import src.round_manager as round_manager
+import src.simulation_engine as simulation_engine
+import webapp.app as webapp
+from src.round_manager import ROUND_STATUS_DRAWING, ROUND_STATUS_WAITING_TO_START, ROUND_TYPE_SCHEDULED
+from src.round_state_machine import transition
+
+
+@pytest.fixture
+def temp_db(temp_db):
+    webapp.clear_response_cache()
+    yield temp_db
+    webapp.clear_response_cache()
+
+
+def _settle_rounds(count: int, rng: random.Random) -> None:
+    for _ in range(count):
+        round_id = round_manager.create_round(ROUND_TYPE_SCHEDULED)
+        for n in rng.sample(range(12), rng.randint(3, 8)):
+            db.get_or_create_user(str(1000 + n), f"user{n}" if n % 3 else None, f"Nombre{n}")
+            round_manager.add_participant(round_id, str(1000 + n), f"user{n}")
+        assert transition(round_id, ROUND_STATUS_WAITING_TO_START, ROUND_STATUS_DRAWING)
+        asyncio.run(simulation_engine.draw_and_settle_round(round_id, ROUND_TYPE_SCHEDULED, None, rng=rng))
+
+
+def _query(sql: str) -> list[tuple]:
+    conn = db.get_db_connection()
+    try:
+        return [tuple(row) for row in conn.execute(sql)]
+    finally:
+        conn.close()
+
+
+def test_leaderboard_is_maintained_incrementally_at_settlement(temp_db):
+    _settle_rounds(15, random.Random(40))
+    aggregated = _query("""SELECT winner_telegram_id, COUNT(*), SUM(prize_amount_nano) FROM draw_results
+                           WHERE winner_telegram_id IS NOT NULL GROUP BY winner_telegram_id""")
+    stats = _query("SELECT telegram_id, wins, total_prize_nano FROM winner_stats")
+    assert sorted(stats) == sorted(aggregated) and stats
+
+    top = leaderboard.get_top_winners(3)
+    expected = sorted(aggregated, key=lambda r: (r[2], r[1], r[0]), reverse=True)[:3]
+    assert [(r['telegram_id'], r['wins'], r['total_prize_nano']) for r in top] == expected
+    # Página siguiente del ranking por cursor (total, premios, telegram_id)
+    last = top[-1]
+    following = leaderboard.get_top_winners(3, after=(last['total_prize_nano'], last['wins'], last['telegram_id']))
+    assert [r['telegram_id'] for r in following] == [r[0] for r in sorted(aggregated, key=lambda r: (r[2], r[1], r[0]), reverse=True)[3:6]]
+
+
+def test_existing_history_is_backfilled_once(temp_db):
+    _settle_rounds(4, random.Random(41))
+    expected = sorted(_query("SELECT telegram_id, wins, total_prize_nano FROM winner_stats"))
+    conn = db.get_db_connection()
+    conn.execute("DELETE FROM winner_stats") # Base anterior al ranking
+    conn.commit()
+    conn.close()
+    db.init_db()
+    assert sorted(_query("SELECT telegram_id, wins, total_prize_nano FROM winner_stats")) == expected
+
+
+def test_recent_winners_pages_cover_history_from_buffer_and_db(temp_db, monkeypatch):
+    monkeypatch.setattr(leaderboard, 'RECENT_WINNERS_BUFFER_SIZE', 5)
+    monkeypatch.setattr(leaderboard, '_recent_winners', leaderboard.deque(maxlen=5))
+    _settle_rounds(10, random.Random(42))
+    all_ids = [row[0] for row in _query("SELECT id FROM draw_results WHERE winner_telegram_id IS NOT NULL ORDER BY id DESC")]
+
+    seen, cursor = [], None
+    while True:
+        page = leaderboard.get_recent_winners(4, before_id=cursor)
+        if not page:
+            break
+        seen.extend(row['id'] for row in page)
+        cursor = page[-1]['id']
+    assert seen == all_ids
+
+    # Una ronda nueva entra al buffer leyendo solo sus filas (sin recargar el historial)
+    calls = []
+    real_page = db.get_draw_winners_page
+    monkeypatch.setattr(leaderboard, 'db_get_draw_winners_page', lambda *a, **kw: calls.append(kw) or real_page(*a, **kw))
+    _settle_rounds(1, random.Random(43))
+    assert calls and all('after_id' in kw for kw in calls)
+    assert [row['id'] for row in leaderboard.get_recent_winners(5)] == \
+        [row[0] for row in _query("SELECT id FROM draw_results WHERE winner_telegram_id IS NOT NULL ORDER BY id DESC LIMIT 5")]
+
+
+def test_winners_api_pages_and_top(temp_db):
+    _settle_rounds(6, random.Random(44))
+    client = webapp.app.test_client()
+    first = client.get('/api/winners?limit=3').get_json()
+    assert len(first) == 3 and all({'id', 'round_id', 'position', 'winner', 'prize'} <= set(w) for w in first)
+    second = client.get(f"/api/winners?limit=3&before={first[-1]['id']}").get_json()
+    assert second and second[0]['id'] < first[-1]['id']
+
+    top = client.get('/api/winners/top?limit=2').get_json()
+    assert [entry['rank'] for entry in top] == [1, 2]
+    assert top[0]['total_prize'].endswith('unidades')
+    assert client.get('/api/winners?limit=abc').status_code == 400
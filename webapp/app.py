@@ -1,8 +1,18 @@
 # botloteria/webapp/app.py
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, stream_with_context
+import argparse
+import hashlib
+import json
 import sys
 import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from werkzeug.http import http_date, parse_date, parse_etags
 
 # Añadir la ruta al directorio src para que Python pueda encontrar tus módulos
 # Esto asume que el script se ejecuta desde la raíz del proyecto o que la raíz del proyecto
@@ -14,20 +24,175 @@ import os
 # Asegúrate de importar explícitamente las funciones o clases que necesitas de src.db
 from src.db import ( # <-- Corregido: importación absoluta
     get_or_create_user,
+    get_data_version, # Versiones de rondas/ganadores para la caché HTTP
+    DATA_VERSION_ROUNDS,
+    DATA_VERSION_WINNERS,
     # Agrega aquí cualquier otra función que necesites de src.db
     # Por ejemplo, si implementaste get_finished_rounds_with_winners en db.py, impórtala aquí:
     # get_finished_rounds_with_winners,
 )
 import src.round_manager as round_manager # <-- Corregido: importación absoluta, usamos alias para mantener el código subsiguiente igual
 import src.payment_manager as payment_manager # <-- Corregido: importación absoluta, usamos alias si se necesita payment_manager
-
-# Importar constantes necesarias
-# Asumiendo que MIN_PARTICIPANTS está definido en round_manager.py y quieres importarlo directamente
-from src.round_manager import MIN_PARTICIPANTS # <-- Corregido: importación absoluta
+import src.event_bus as event_bus # Deltas de rondas en vivo (stream SSE)
+import src.leaderboard as leaderboard # Ganadores recientes (buffer) y ranking histórico
+from src.payout_ledger import format_nano
 
 
 app = Flask(__name__)
 
+# --- Stream SSE de rondas abiertas ---
+# Cada 15 s sin eventos se envía un comentario para que proxies y navegador no den la conexión por muerta
+SSE_HEARTBEAT_SECONDS = 15
+SSE_RETRY_MILLISECONDS = 3000 # Espera del navegador antes de reconectar (EventSource)
+
+
+def _share_url(round_id: int) -> str:
+    # URL para compartir la ronda (deep link). Reemplaza YOUR_BOT_USERNAME con el @ de tu bot.
+    return f"https://t.me/@TONLottoMasterBot?start=join_round_{round_id}" # <-- ¡¡¡REEMPLAZA YOUR_BOT_USERNAME!!!
+
+
+def _format_round(ronda: dict, tickets_count: int) -> dict:
+    """Ronda abierta tal como la consume el frontend (lista inicial y eventos round-created)."""
+    return {
+        'id': ronda['id'],
+        'type': ronda['round_type'].replace('_', ' ').title(),
+        'status': ronda['status'].replace('_', ' ').title(),
+        # El cupo de la ronda se cuenta en boletos
+        'participants': f"{tickets_count}/{round_manager.MAX_PARTICIPANTS_FOR_IMMEDIATE_DRAW}",
+        'start_time': ronda['start_time'], # Puedes formatear la fecha/hora si quieres
+        'simulated_contract_address': ronda.get('simulated_contract_address'),
+        'share_url': _share_url(ronda['id'])
+    }
+
+
+def _sse_payload(event: dict) -> dict:
+    """Delta que recibe el navegador para un evento del bus."""
+    data = event['data']
+    if event['type'] == event_bus.EVENT_ROUND_CREATED:
+        return _format_round(data['round'], 0)
+    if event['type'] == event_bus.EVENT_PARTICIPANT_JOINED:
+        return {'id': data['round_id'], 'participants': f"{data['tickets']}/{data['max_tickets']}"}
+    return {'id': data['round_id'], 'status': data['status']} # EVENT_ROUND_CLOSED
+
+
+def _format_sse(event_type: str, payload: dict, event_id: int | None = None) -> str:
+    lines = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{lines}event: {event_type}\ndata: {json.dumps(payload)}\n\n"
+
+
+def format_sse_event(event: dict) -> str:
+    """Mensaje SSE de un evento del bus (también lo usa el modo asíncrono, webapp/async_app.py)."""
+    return _format_sse(event['type'], _sse_payload(event), event['id'])
+
+
+def format_sse_resync() -> str:
+    return _format_sse('resync', {})
+
+
+def parse_last_event_id(header_value: str | None, query_value: str | None) -> int | None:
+    # El navegador reenvía Last-Event-ID al reconectar; la primera conexión lo pasa por query
+    value = header_value or query_value
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+# --- Caché HTTP de las lecturas (/api/open_rounds, /api/winners) ---
+# El JSON serializado se guarda en memoria junto con la versión de sus datos (db.get_data_version) y se
+# sirve sin tocar la DB mientras la versión no cambie. ETag (hash del cuerpo) y Last-Modified permiten al
+# navegador revalidar con un GET condicional y recibir 304 sin cuerpo. Las escrituras de otro proceso no
+# suben la versión de este, así que cada entrada caduca igual que la caché de rondas.
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_TTL_SECONDS = round_manager.ROUND_CACHE_TTL_SECONDS
+RESPONSE_CACHE_MAX_ENTRIES = 256 # Una entrada por recurso y parámetros (páginas de ganadores), en orden LRU
+
+_response_cache = OrderedDict() # clave -> {'version', 'body', 'etag', 'last_modified', 'headers', 'built_at'}
+_response_cache_lock = threading.Lock()
+
+
+def clear_response_cache() -> None:
+    with _response_cache_lock:
+        _response_cache.clear()
+
+
+def _is_fresh(entry: dict | None, version: int) -> bool:
+    return (entry is not None and entry['version'] == version
+            and time.monotonic() - entry['built_at'] <= RESPONSE_CACHE_TTL_SECONDS)
+
+
+def peek_cached_json(cache_key: str, version_key: str) -> dict | None:
+    """La entrada vigente de `cache_key` sin construir nada (None si falta, caducó o la caché está apagada)."""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    version = get_data_version(version_key)
+    with _response_cache_lock:
+        entry = _response_cache.get(cache_key)
+    return entry if _is_fresh(entry, version) else None
+
+
+def get_cached_json(cache_key: str, version_key: str, build) -> dict:
+    """
+    Cuerpo JSON de `build() -> (payload, cabeceras extra)`, cacheado por la versión `version_key`.
+    Retorna {'body', 'etag', 'last_modified', 'headers'} (sin etag ni fecha con la caché apagada).
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        payload, headers = build()
+        return {'body': json.dumps(payload).encode(), 'etag': None, 'last_modified': None, 'headers': headers}
+
+    version = get_data_version(version_key) # Antes de construir: una escritura concurrente invalida lo construido
+    with _response_cache_lock:
+        entry = _response_cache.get(cache_key)
+        if entry is not None:
+            _response_cache.move_to_end(cache_key)
+    if not _is_fresh(entry, version):
+        payload, headers = build()
+        body = json.dumps(payload).encode()
+        etag = hashlib.sha1(body).hexdigest()[:20]
+        if entry is not None and entry['etag'] == etag:
+            last_modified = entry['last_modified'] # Mismo cuerpo (p. ej. tras caducar): los clientes siguen al día
+        else:
+            # Last-Modified tiene resolución de segundos: dos cuerpos distintos nunca comparten fecha
+            last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+            if entry is not None and last_modified <= entry['last_modified']:
+                last_modified = entry['last_modified'] + timedelta(seconds=1)
+        entry = {'version': version, 'body': body, 'etag': etag, 'last_modified': last_modified,
+                 'headers': headers, 'built_at': time.monotonic()}
+        with _response_cache_lock:
+            _response_cache[cache_key] = entry
+            _response_cache.move_to_end(cache_key)
+            while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+                _response_cache.popitem(last=False)
+    return entry
+
+
+def is_not_modified(entry: dict, if_none_match: str | None, if_modified_since: str | None) -> bool:
+    """True si el cliente ya tiene este cuerpo: If-None-Match manda; si no viene, If-Modified-Since."""
+    if entry['etag'] is None:
+        return False
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(entry['etag'])
+    since = parse_date(if_modified_since) if if_modified_since else None
+    return since is not None and entry['last_modified'] <= since
+
+
+def cached_json_headers(entry: dict) -> dict:
+    headers = dict(entry['headers'])
+    if entry['etag'] is not None:
+        headers['ETag'] = f'"{entry["etag"]}"'
+        headers['Last-Modified'] = http_date(entry['last_modified'])
+        headers['Cache-Control'] = 'no-cache' # El navegador la guarda, pero revalida en cada uso
+    return headers
+
+
+def _json_response(cache_key: str, version_key: str, build) -> Response:
+    """Respuesta JSON cacheada (get_cached_json), con 304 si el cliente ya tiene ese cuerpo."""
+    entry = get_cached_json(cache_key, version_key, build)
+    headers = cached_json_headers(entry)
+    if is_not_modified(entry, request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')):
+        return Response(status=304, headers=headers)
+    return Response(entry['body'], mimetype='application/json', headers=headers)
+
 # --- Rutas para servir el frontend (HTML) ---
 
 @app.route('/')
@@ -38,86 +203,151 @@ def index():
 
 # --- Rutas API para que el frontend interactúe con la lógica del bot ---
 
+def _winner_display_name(row: dict) -> str:
+    if row.get('username'):
+        return f"@{row['username']}"
+    if row.get('first_name'):
+        return row['first_name']
+    telegram_id = str(row.get('telegram_id') or row.get('winner_telegram_id') or '')
+    return f"Usuario …{telegram_id[-4:]}" # Sin nombre: no se publica el telegram_id completo
+
+
+def _int_arg(args, name: str, default: int | None) -> int | None:
+    value = args.get(name)
+    return default if value in (None, '') else int(value) # ValueError -> 400 en la ruta
+
+
+def parse_winners_args(args) -> tuple[int, int | None]:
+    """(limit, before) de ?limit=N&before=<id>. Lanza ValueError si no son enteros."""
+    return max(1, min(_int_arg(args, 'limit', 20), leaderboard.MAX_WINNERS_PAGE_SIZE)), _int_arg(args, 'before', None)
+
+
+def parse_top_winners_args(args) -> int:
+    return max(1, min(_int_arg(args, 'limit', 10), leaderboard.MAX_WINNERS_PAGE_SIZE))
+
+
+def build_winners(limit: int, before_id: int | None) -> list[dict]:
+    # Premios más recientes (buffer en memoria de leaderboard; páginas antiguas por clave primaria)
+    return [{
+        'id': row['id'], # Cursor de la página siguiente: ?before=<id del último>
+        'round_id': row['round_id'],
+        'position': row['draw_order'] + 1,
+        'winner': _winner_display_name(row),
+        'prize': row['prize_amount_simulated'] or f"{format_nano(row['prize_amount_nano'] or 0)} unidades",
+    } for row in leaderboard.get_recent_winners(limit, before_id)]
+
+
+def build_top_winners(limit: int) -> list[dict]:
+    # Ranking histórico mantenido en la liquidación (winner_stats): nunca se agrega draw_results aquí
+    return [{
+        'rank': rank,
+        'winner': _winner_display_name(row),
+        'wins': row['wins'],
+        'total_prize': f"{format_nano(row['total_prize_nano'])} unidades",
+        'last_round_id': row['last_round_id'],
+    } for rank, row in enumerate(leaderboard.get_top_winners(limit), start=1)]
+
+
 @app.route('/api/winners', methods=['GET'])
 def get_winners():
-    """Retorna la lista de ganadores recientes."""
-    # --- Implementa la lógica real para obtener ganadores de tu base de datos ---
-    # Necesitas una función en src.db (o src.payment_manager) que consulte la tabla draw_results
-    # y users para obtener los ganadores recientes y sus premios simulados.
-    # Ejemplo (debes implementar get_finished_rounds_with_winners en src/db.py):
-    # try:
-    #     winners_list = get_finished_rounds_with_winners(limit=50) # Llama a tu función implementada en src/db.py
-    # except Exception as e:
-    #     app.logger.error(f"Error al obtener ganadores: {e}")
-    #     # Podrías retornar un error al frontend
-    #     return jsonify({"error": "Error al cargar ganadores"}), 500
-
-    # !!! TEMPORAL: Usando datos simulados si no has implementado la función get_finished_rounds_with_winners !!!
-    # Borra esto una vez que implementes la función real en src/db.py
-    winners_list = [
-        {'round_id': 5, 'winner': '@Usuario1', 'prize': '4 unidades'},
-        {'round_id': 5, 'winner': '@Usuario2', 'prize': '3 unidades'},
-        {'round_id': 6, 'winner': '@UsuarioA', 'prize': '1 unidad'},
-        # Agrega más datos simulados si quieres, o remueve esto al implementar la función real
-    ]
-    # !!! FIN TEMPORAL !!!
-
-
-    return jsonify(winners_list)
+    """Retorna los ganadores recientes, paginados: ?limit=N&before=<id del último ganador recibido>."""
+    try:
+        limit, before_id = parse_winners_args(request.args)
+    except ValueError:
+        return jsonify({"error": "Parámetros de paginación inválidos"}), 400
+    try:
+        return _json_response(f"winners:{limit}:{before_id}", DATA_VERSION_WINNERS,
+                              lambda: (build_winners(limit, before_id), {}))
+    except Exception as e:
+        app.logger.error(f"Error al obtener ganadores: {e}")
+        return jsonify({"error": "Error al cargar ganadores"}), 500
+
+
+@app.route('/api/winners/top', methods=['GET'])
+def get_top_winners():
+    """Retorna el top-N histórico de ganadores por monto total de premios: ?limit=N."""
+    try:
+        limit = parse_top_winners_args(request.args)
+    except ValueError:
+        return jsonify({"error": "Parámetro limit inválido"}), 400
+    try:
+        return _json_response(f"winners_top:{limit}", DATA_VERSION_WINNERS, lambda: (build_top_winners(limit), {}))
+    except Exception as e:
+        app.logger.error(f"Error al obtener ranking de ganadores: {e}")
+        return jsonify({"error": "Error al cargar ranking"}), 500
 
 
 @app.route('/api/open_rounds', methods=['GET'])
 def get_open_rounds():
     """Retorna la lista de rondas abiertas con count de participantes."""
-    # Llama a la función en round_manager.py
-    # get_available_rounds() retorna (id, start_time, status, round_type, simulated_contract_address)
     try:
-        open_rounds_data = round_manager.get_available_rounds() # Llama a tu función en src/round_manager.py
+        return _json_response('open_rounds', DATA_VERSION_ROUNDS, build_open_rounds)
     except Exception as e:
          app.logger.error(f"Error al obtener rondas abiertas: {e}")
          return jsonify({"error": "Error al cargar rondas"}), 500
 
 
-    formatted_rounds = []
-    for ronda in open_rounds_data:
-        if len(ronda) >= 5: # Asegurarse de que la tupla tiene el formato esperado
-             # Desempaquetamos los datos de la ronda
-             ronda_id, start_time, status, round_type, simulated_contract_address = ronda
-             try:
-                 # Llama a la función en round_manager.py para contar participantes
-                 participants_count = round_manager.count_round_participants(ronda_id) # Llama a tu función en src/round_manager.py
-
-                 formatted_rounds.append({
-                     'id': ronda_id,
-                     'type': round_type.replace('_', ' ').title(),
-                     'status': status.replace('_', ' ').title(),
-                     'participants': f"{participants_count}/{MIN_PARTICIPANTS}", # Usar la constante MIN_PARTICIPANTS
-                     'start_time': start_time, # Puedes formatear la fecha/hora si quieres
-                     'simulated_contract_address': simulated_contract_address,
-                     # URL para compartir la ronda (deep link). Reemplaza YOUR_BOT_USERNAME con el @ de tu bot.
-                     'share_url': f"https://t.me/@TONLottoMasterBot?start=join_round_{ronda_id}" # <-- ¡¡¡REEMPLAZA YOUR_BOT_USERNAME!!!
-                 })
-             except Exception as e:
-                 app.logger.error(f"Error al procesar ronda {ronda_id} para API: {e}")
-                 # Opcional: añadir un marcador de error para esta ronda en la lista
-                 formatted_rounds.append({'id': ronda_id, 'error': 'Error al cargar detalles'})
-
-
-        else:
-             app.logger.error(f"get_available_rounds devolvió tupla inesperada: {ronda}")
-             # Opcional: añadir un marcador de error para esta ronda en la lista
-             formatted_rounds.append({'id': ronda[0] if len(ronda)>0 else '?', 'error': 'Formato de datos inesperado'})
+def build_open_rounds() -> tuple[list[dict], dict]:
+    last_event_id = event_bus.get_bus_stats()['last_event_id'] # Antes de leer: un cambio concurrente llega por el stream
+    open_rounds_data = round_manager.get_available_rounds() # Llama a tu función en src/round_manager.py
 
-
-    return jsonify(formatted_rounds)
+    formatted_rounds = []
+    for ronda in open_rounds_data: # Cada ronda es un dict (ver db.get_open_rounds)
+        try:
+            # Conteo en vivo de boletos (caché de round_manager)
+            _, tickets_count = round_manager.get_round_entry_totals(ronda['id'])
+            formatted_rounds.append(_format_round(ronda, tickets_count))
+        except Exception as e:
+            app.logger.error(f"Error al procesar ronda {ronda.get('id')} para API: {e}")
+            # Opcional: añadir un marcador de error para esta ronda en la lista
+            formatted_rounds.append({'id': ronda.get('id', '?'), 'error': 'Error al cargar detalles'})
+
+    # La cabecera permite al frontend suscribirse al stream justo después de este estado (sin huecos)
+    return formatted_rounds, {'X-Last-Event-ID': str(last_event_id)}
+
+
+@app.route('/api/rounds/stream', methods=['GET'])
+def stream_rounds():
+    """
+    Server-Sent Events con los cambios de las rondas abiertas: round-created (la ronda formateada),
+    participant-joined ({id, participants}) y round-closed ({id, status}). Un evento 'resync' pide al
+    cliente recargar /api/open_rounds (se perdieron eventos). El navegador reconecta solo y envía
+    Last-Event-ID, con lo que recibe los eventos que se perdió mientras estuvo desconectado.
+    """
+    last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID'), request.args.get('last_event_id'))
+    subscription = event_bus.subscribe(last_event_id)
+
+    def generate():
+        try:
+            yield f"retry: {SSE_RETRY_MILLISECONDS}\n\n"
+            while True:
+                if subscription.needs_resync:
+                    yield format_sse_resync()
+                    return # El cliente recarga la lista y abre un stream nuevo
+                event = subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse_event(event)
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/join_round/<int:round_id>', methods=['POST'])
 def join_round(round_id):
     """Maneja la solicitud para unirse a una ronda."""
+    payload, status = join_round_result(round_id, request.get_json(silent=True))
+    return jsonify(payload), status
+
+
+def join_round_result(round_id: int, data: dict | None) -> tuple[dict, int]:
+    """Unión a una ronda desde la Web App. Retorna (JSON de respuesta, status HTTP)."""
     # Para unirse desde la Web App, necesitas obtener el telegram_id y username del usuario
     # de los datos pasados por Telegram Web App (Telegram.WebApp.initDataUnsafe o Telegram.WebApp.initData).
     # El frontend (index.html) debe enviar estos datos en el cuerpo de la solicitud POST.
-    data = request.get_json()
+    data = data or {}
     user_id_str = data.get('telegram_id') # Esperando 'telegram_id' en el JSON de la solicitud
     username = data.get('username') # Esperando 'username' en el JSON de la solicitud
 
@@ -134,7 +364,7 @@ def join_round(round_id):
     if not user_id_str or not username:
          # Si faltan datos necesarios del usuario en la solicitud del frontend
          app.logger.warning("Solicitud /api/join_round sin telegram_id o username en el JSON.")
-         return jsonify({'success': False, 'message': 'Error: Falta información del usuario.'}), 400
+         return {'success': False, 'message': 'Error: Falta información del usuario.'}, 400
 
     try:
         # Asegurarse de que el usuario existe en la DB (llama a tu función en src/db.py)
@@ -145,23 +375,29 @@ def join_round(round_id):
         success, message, assigned_number, current_participants_count = round_manager.add_participant(round_id, user_id_str, username) # Llama a tu función en src/round_manager.py
 
         # La respuesta de la API debe indicar éxito/fracaso y un mensaje para el frontend
-        return jsonify({
+        return {
             'success': success,
             'message': message, # Envía el mensaje generado por tu lógica existente (ej: "¡Te has unido!")
             'assigned_number': assigned_number,
             'current_participants_count': current_participants_count
-        })
+        }, 200
 
     except Exception as e:
         app.logger.error(f"Error inesperado en /api/join_round para user {user_id_str}, round {round_id}: {e}")
-        return jsonify({'success': False, 'message': 'Ocurrió un error interno al unirse a la ronda.'}), 500 # Internal Server Error
+        return {'success': False, 'message': 'Ocurrió un error interno al unirse a la ronda.'}, 500 # Internal Server Error
 
 
 @app.route('/api/create_round', methods=['POST'])
 def create_round_api(): # Renombrada para no confundir con la función create_round del módulo round_manager
     """Maneja la solicitud para crear una nueva ronda."""
+    payload, status = create_round_result(request.get_json(silent=True))
+    return jsonify(payload), status
+
+
+def create_round_result(data: dict | None) -> tuple[dict, int]:
+    """Creación de una ronda personal desde la Web App. Retorna (JSON de respuesta, status HTTP)."""
     # Similar a JOIN, necesitas obtener el user_id y username del creador desde la Web App.
-    data = request.get_json()
+    data = data or {}
     user_id_str = data.get('telegram_id') # Esperando 'telegram_id' en el JSON de la solicitud
     username = data.get('username') # Esperando 'username' en el JSON de la solicitud
 
@@ -170,7 +406,7 @@ def create_round_api(): # Renombrada para no confundir con la función create_ro
 
     if not user_id_str or not username:
          app.logger.warning("Solicitud /api/create_round sin telegram_id o username en el JSON.")
-         return jsonify({'success': False, 'message': 'Error: Falta información del usuario.'}), 400
+         return {'success': False, 'message': 'Error: Falta información del usuario.'}, 400
 
     try:
         get_or_create_user(user_id_str, username) # Asegurarse de que el usuario existe
@@ -183,50 +419,94 @@ def create_round_api(): # Renombrada para no confundir con la función create_ro
         if round_id:
             # Opcional: Obtener la dirección simulada de la ronda recién creada para la respuesta
             created_round_data = round_manager.get_round(round_id) # Llama a round_manager
-            simulated_contract_address = created_round_data[7] if created_round_data and len(created_round_data) >= 8 else None
+            simulated_contract_address = created_round_data.get('simulated_contract_address') if created_round_data else None
 
             # Generar la URL para compartir la ronda
-            # Reemplaza YOUR_BOT_USERNAME con el @ de tu bot
-            share_url = f"https://t.me/@TONLottoMasterBot?start=join_round_{round_id}" # <-- ¡¡¡REEMPLAZA YOUR_BOT_USERNAME!!!
+            share_url = _share_url(round_id)
 
 
             # Retornar éxito y detalles de la ronda creada
-            return jsonify({
+            return {
                 'success': True,
                 'round_id': round_id,
                 'simulated_contract_address': simulated_contract_address,
                 'share_url': share_url, # Incluir la URL de compartir en la respuesta
                 'message': f"Ronda personal creada con ID {round_id}." # Mensaje simple para el frontend
-            })
+            }, 200
         else:
             # Si create_round retornó None (falló la creación en DB)
-            return jsonify({
+            return {
                 'success': False,
                 'message': "Error al crear la ronda."
-            }), 500 # Internal Server Error
+            }, 500 # Internal Server Error
 
     except Exception as e:
          app.logger.error(f"Error inesperado en /api/create_round para user {user_id_str}: {e}")
-         return jsonify({'success': False, 'message': 'Ocurrió un error interno al crear la ronda.'}), 500 # Internal Server Error
+         return {'success': False, 'message': 'Ocurrió un error interno al crear la ronda.'}, 500 # Internal Server Error
+
+
+# --- Benchmark de las lecturas con y sin caché HTTP ---
+def benchmark_read_endpoints(requests_count: int = 2000, rounds: int = 20, participants_per_round: int = 5) -> dict:
+    """
+    Peticiones por segundo a /api/open_rounds y /api/winners (cliente de pruebas de Flask, sin red) en
+    tres modos: sin caché (cada petición reconstruye el JSON), con caché (200 con el cuerpo guardado) y
+    con GET condicional (If-None-Match -> 304). Usa una base de datos temporal.
+    """
+    global RESPONSE_CACHE_ENABLED
+    from src.db import init_db # Solo el benchmark crea su propia base de datos
+
+    previous_cwd, previous_enabled = os.getcwd(), RESPONSE_CACHE_ENABLED
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            init_db()
+            round_manager.invalidate_round_cache()
+            clear_response_cache()
+            for _ in range(rounds):
+                round_id = round_manager.create_round(round_type='scheduled')
+                for n in range(participants_per_round):
+                    round_manager.add_participant(round_id, str(100_000 + n), f"bench{n}")
+            client = app.test_client()
+
+            def measure(path: str, headers: dict | None = None) -> dict:
+                statuses = {}
+                started = time.perf_counter()
+                for _ in range(requests_count):
+                    status = client.get(path, headers=headers).status_code
+                    statuses[status] = statuses.get(status, 0) + 1
+                elapsed = time.perf_counter() - started
+                return {'requests_per_second': requests_count / elapsed if elapsed > 0 else None,
+                        'statuses': {str(code): count for code, count in statuses.items()}}
+
+            results = {}
+            for path in ('/api/open_rounds', '/api/winners'):
+                RESPONSE_CACHE_ENABLED = False
+                uncached = measure(path)
+                RESPONSE_CACHE_ENABLED = True
+                clear_response_cache()
+                etag = client.get(path).headers.get('ETag')
+                results[path] = {'uncached': uncached, 'cached': measure(path),
+                                 'conditional_304': measure(path, {'If-None-Match': etag})}
+            return {'requests': requests_count, 'rounds': rounds, 'participants_per_round': participants_per_round,
+                    'endpoints': results}
+        finally:
+            RESPONSE_CACHE_ENABLED = previous_enabled
+            clear_response_cache()
+            round_manager.invalidate_round_cache()
+            os.chdir(previous_cwd)
 
 
 # --- Cómo ejecutar la aplicación Flask (Solo para desarrollo/pruebas) ---
+# La app se sirve con 'flask run' (ver abajo); ejecutar este módulo corre el benchmark de lecturas:
+#   python -m webapp.app --requests 2000 --rounds 20
 if __name__ == '__main__':
-    # Asegúrate de que tu base de datos esté inicializada.
-    # Puedes llamarla aquí si la webapp se inicia independientemente del bot principal.
-    # Si el bot principal ya inicializa la DB y no se reinicia, es probable que ya exista.
-    # db.init_db() # Opcional: Llama a init_db si la webapp puede iniciar sin que el bot lo haga primero
-
-
-    # Para desarrollo, puedes usar el servidor de desarrollo de Flask.
-    # En producción, usarías un servidor WSGI más robusto como Gunicorn o uWSGI.
-    # app.run(debug=True, port=5000)
-
     # Para que flask run funcione correctamente, debes establecer la variable de entorno FLASK_APP
-    # y ejecutar 'flask run' desde el directorio raíz del proyecto.
-    # Las líneas de abajo solo se ejecutarían si corres este script directamente,
-    # lo cual NO es la forma recomendada de correr la app Flask dentro del paquete.
-    # La forma correcta es:
+    # y ejecutar 'flask run' desde el directorio raíz del proyecto:
     # export FLASK_APP=webapp.app  # o set FLASK_APP=webapp.app en Windows cmd
     # flask run --debug
-    pass # Eliminamos la llamada a app.run aquí ya que se ejecuta vía 'flask run'
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Benchmark de /api/open_rounds y /api/winners con y sin caché HTTP.")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--participants', type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(benchmark_read_endpoints(args.requests, args.rounds, args.participants), indent=2))
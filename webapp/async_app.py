@@ -0,0 +1,248 @@
+# botloteria/webapp/async_app.py
+# Modo asíncrono de la webapp: las mismas rutas que webapp/app.py servidas con aiohttp (ya instalado con
+# aiogram) dentro del proceso y el event loop del bot. Comparte con el bot la caché de rondas, el bus de
+# eventos, el buffer de ganadores y la caché HTTP, así que las escrituras del bot se ven al instante y el
+# stream SSE no necesita un hilo por cliente. Las lecturas a la DB (sqlite3 bloqueante) van a hilos con
+# asyncio.to_thread; las respuestas cacheadas se sirven directo desde el loop.
+# Se activa con WEBAPP_ASYNC_ENABLED en config.json (ver bot.main). La app Flask sigue disponible igual.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from aiohttp import web
+
+import src.event_bus as event_bus
+import src.round_manager as round_manager
+import webapp.app as flask_webapp # Lógica compartida (formato, caché HTTP, unión/creación de rondas)
+from src.db import DATA_VERSION_ROUNDS, DATA_VERSION_WINNERS
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = os.path.join(os.path.dirname(__file__), 'templates', 'index.html')
+SHUTDOWN_TIMEOUT_SECONDS = 5 # Los streams SSE abiertos se cortan al apagar el bot en lugar de esperarlos
+
+
+async def _cached_json(request: web.Request, cache_key: str, version_key: str, build) -> web.Response:
+    """Igual que flask_webapp._json_response: solo se sale del loop cuando hay que reconstruir el JSON."""
+    entry = flask_webapp.peek_cached_json(cache_key, version_key)
+    if entry is None:
+        entry = await asyncio.to_thread(flask_webapp.get_cached_json, cache_key, version_key, build)
+    headers = flask_webapp.cached_json_headers(entry)
+    if flask_webapp.is_not_modified(entry, request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=entry['body'], content_type='application/json', headers=headers)
+
+
+async def index(request: web.Request) -> web.FileResponse:
+    return web.FileResponse(INDEX_PATH) # index.html no usa Jinja: se sirve tal cual
+
+
+async def get_winners(request: web.Request) -> web.Response:
+    try:
+        limit, before_id = flask_webapp.parse_winners_args(request.query)
+    except ValueError:
+        return web.json_response({"error": "Parámetros de paginación inválidos"}, status=400)
+    try:
+        return await _cached_json(request, f"winners:{limit}:{before_id}", DATA_VERSION_WINNERS,
+                                  lambda: (flask_webapp.build_winners(limit, before_id), {}))
+    except Exception as e:
+        logger.error(f"ASYNC_WEBAPP: Error al obtener ganadores: {e}")
+        return web.json_response({"error": "Error al cargar ganadores"}, status=500)
+
+
+async def get_top_winners(request: web.Request) -> web.Response:
+    try:
+        limit = flask_webapp.parse_top_winners_args(request.query)
+    except ValueError:
+        return web.json_response({"error": "Parámetro limit inválido"}, status=400)
+    try:
+        return await _cached_json(request, f"winners_top:{limit}", DATA_VERSION_WINNERS,
+                                  lambda: (flask_webapp.build_top_winners(limit), {}))
+    except Exception as e:
+        logger.error(f"ASYNC_WEBAPP: Error al obtener ranking de ganadores: {e}")
+        return web.json_response({"error": "Error al cargar ranking"}, status=500)
+
+
+async def get_open_rounds(request: web.Request) -> web.Response:
+    try:
+        return await _cached_json(request, 'open_rounds', DATA_VERSION_ROUNDS, flask_webapp.build_open_rounds)
+    except Exception as e:
+        logger.error(f"ASYNC_WEBAPP: Error al obtener rondas abiertas: {e}")
+        return web.json_response({"error": "Error al cargar rondas"}, status=500)
+
+
+async def stream_rounds(request: web.Request) -> web.StreamResponse:
+    """Mismo protocolo que /api/rounds/stream de Flask, con una corrutina por cliente en lugar de un hilo."""
+    last_event_id = flask_webapp.parse_last_event_id(request.headers.get('Last-Event-ID'),
+                                                     request.query.get('last_event_id'))
+    subscription = event_bus.subscribe(last_event_id, loop=asyncio.get_running_loop())
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                                           'X-Accel-Buffering': 'no'})
+    try:
+        await response.prepare(request)
+        await response.write(f"retry: {flask_webapp.SSE_RETRY_MILLISECONDS}\n\n".encode())
+        while True:
+            if subscription.needs_resync:
+                await response.write(flask_webapp.format_sse_resync().encode())
+                break # El cliente recarga la lista y abre un stream nuevo
+            event = await subscription.get(timeout=flask_webapp.SSE_HEARTBEAT_SECONDS)
+            if event is None:
+                await response.write(b": keep-alive\n\n")
+                continue
+            await response.write(flask_webapp.format_sse_event(event).encode())
+    except ConnectionResetError:
+        pass # El cliente cerró la conexión
+    finally:
+        event_bus.unsubscribe(subscription)
+    return response
+
+
+async def _json_body(request: web.Request) -> dict | None:
+    try:
+        return await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+
+
+async def join_round(request: web.Request) -> web.Response:
+    try:
+        round_id = int(request.match_info['round_id'])
+    except ValueError:
+        raise web.HTTPNotFound()
+    payload, status = await asyncio.to_thread(flask_webapp.join_round_result, round_id, await _json_body(request))
+    return web.json_response(payload, status=status)
+
+
+async def create_round(request: web.Request) -> web.Response:
+    payload, status = await asyncio.to_thread(flask_webapp.create_round_result, await _json_body(request))
+    return web.json_response(payload, status=status)
+
+
+def create_async_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get('/', index)
+    app.router.add_get('/api/winners', get_winners)
+    app.router.add_get('/api/winners/top', get_top_winners)
+    app.router.add_get('/api/open_rounds', get_open_rounds)
+    app.router.add_get('/api/rounds/stream', stream_rounds)
+    app.router.add_post('/api/join_round/{round_id}', join_round)
+    app.router.add_post('/api/create_round', create_round)
+    return app
+
+
+async def start_async_webapp(host: str = '0.0.0.0', port: int = 8080) -> web.AppRunner:
+    """Levanta la webapp en el event loop actual. Retorna el runner: `await runner.cleanup()` la detiene."""
+    runner = web.AppRunner(create_async_app(), access_log=None, shutdown_timeout=SHUTDOWN_TIMEOUT_SECONDS)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"ASYNC_WEBAPP: Sirviendo la webapp en {runner.addresses}.")
+    return runner
+
+
+# --- Benchmark: Flask (hilos) frente al modo asíncrono, por HTTP real ---
+async def _drive(base_url: str, paths: list[str], requests_count: int, concurrency: int) -> dict:
+    import aiohttp # Cliente HTTP del benchmark (viene con aiogram)
+
+    latencies, statuses = [], {}
+    next_request = iter(range(requests_count))
+
+    async def worker(session):
+        for n in next_request:
+            started = time.perf_counter()
+            async with session.get(base_url + paths[n % len(paths)]) as response:
+                await response.read()
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3) if latencies else None
+
+    return {'requests_per_second': requests_count / elapsed if elapsed > 0 else None,
+            'p50_ms': percentile(0.50), 'p95_ms': percentile(0.95), 'p99_ms': percentile(0.99),
+            'statuses': {str(code): count for code, count in statuses.items()}}
+
+
+def benchmark_flask_vs_async(requests_count: int = 2000, concurrency: int = 20, rounds: int = 20,
+                             participants_per_round: int = 5) -> dict:
+    """
+    Peticiones por segundo y latencias (p50/p95/p99) de /api/open_rounds, /api/winners y /api/winners/top
+    con `concurrency` clientes simultáneos contra la app Flask (servidor de werkzeug con un hilo por
+    petición) y contra la app aiohttp (en su propio event loop, como dentro del bot). Ambos servidores
+    corren en hilos de este proceso sobre una base de datos temporal; el cliente corre en el hilo principal.
+    """
+    from werkzeug.serving import make_server
+    from src.db import init_db # Solo el benchmark crea su propia base de datos
+
+    paths = ['/api/open_rounds', '/api/winners', '/api/winners/top']
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            init_db()
+            round_manager.invalidate_round_cache()
+            flask_webapp.clear_response_cache()
+            for _ in range(rounds):
+                round_id = round_manager.create_round(round_type='scheduled')
+                for n in range(participants_per_round):
+                    round_manager.add_participant(round_id, str(100_000 + n), f"bench{n}")
+
+            results = {}
+            werkzeug_logger = logging.getLogger('werkzeug')
+            previous_level = werkzeug_logger.level
+            werkzeug_logger.setLevel(logging.WARNING) # Sin log de acceso en ninguno de los dos servidores
+            server = make_server('127.0.0.1', 0, flask_webapp.app, threaded=True)
+            server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+            server_thread.start()
+            try:
+                results['flask'] = asyncio.run(_drive(f"http://127.0.0.1:{server.server_port}", paths,
+                                                      requests_count, concurrency))
+            finally:
+                server.shutdown()
+                server_thread.join()
+                werkzeug_logger.setLevel(previous_level)
+
+            loop = asyncio.new_event_loop()
+            loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+            loop_thread.start()
+            runner = asyncio.run_coroutine_threadsafe(start_async_webapp('127.0.0.1', 0), loop).result()
+            try:
+                port = runner.addresses[0][1]
+                results['async'] = asyncio.run(_drive(f"http://127.0.0.1:{port}", paths, requests_count, concurrency))
+            finally:
+                asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+                loop.call_soon_threadsafe(loop.stop)
+                loop_thread.join()
+                loop.close()
+
+            flask_rps, async_rps = results['flask']['requests_per_second'], results['async']['requests_per_second']
+            return {'requests': requests_count, 'concurrency': concurrency, 'rounds': rounds,
+                    'participants_per_round': participants_per_round, 'paths': paths, 'servers': results,
+                    'async_speedup': async_rps / flask_rps if flask_rps and async_rps else None}
+        finally:
+            flask_webapp.clear_response_cache()
+            round_manager.invalidate_round_cache()
+            os.chdir(previous_cwd)
+
+
+# El bot levanta este modo por sí mismo (WEBAPP_ASYNC_ENABLED); ejecutar el módulo corre la comparación:
+#   python -m webapp.async_app --requests 2000 --concurrency 20
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Throughput de la webapp: Flask con hilos frente a aiohttp en el event loop.")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--participants', type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(benchmark_flask_vs_async(args.requests, args.concurrency, args.rounds, args.participants), indent=2))